@@ -0,0 +1,72 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===========================================================================
+"""
+Build the spectrogram cache of a manifest offline, and report the padding of the length buckets and the time
+to load the spectrograms with and without the cache.
+
+Usage: python build_spect_cache.py --mode train --cache_dir ./spect_cache --workers 16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from src.config import train_config, eval_config
+from src.dataset import ASRDataset, padding_report
+
+parser = argparse.ArgumentParser(description='DeepSpeech2 spectrogram cache')
+parser.add_argument('--mode', type=str, default='train', choices=('train', 'eval'),
+                    help='Use the manifest and spectrogram config of train_config or eval_config, Default: train')
+parser.add_argument('--manifest', type=str, default='', help='Manifest path, Default: the manifest of the config')
+parser.add_argument('--cache_dir', type=str, default='', help='Cache directory, Default: spect_cache_dir of config')
+parser.add_argument('--dtype', type=str, default='', help='Cache dtype, Default: spect_cache_dtype of config')
+parser.add_argument('--workers', type=int, default=0, help='Processes, Default: cache_workers of config')
+parser.add_argument('--bucket_boundaries', type=str, default='',
+                    help='Comma separated pad lengths for the padding report, Default: bucket_boundaries of config')
+parser.add_argument('--time_samples', type=int, default=100, help='Utterances timed with and without the cache')
+args = parser.parse_args()
+
+if __name__ == '__main__':
+    config = train_config if args.mode == 'train' else eval_config
+    data_config = config.DataConfig
+    manifest = args.manifest or (data_config.train_manifest if args.mode == 'train' else data_config.test_manifest)
+    cache_dir = args.cache_dir or data_config.spect_cache_dir or './spect_cache'
+    boundaries = [int(x) for x in args.bucket_boundaries.split(',') if x] if args.bucket_boundaries \
+        else data_config.bucket_boundaries
+    with open(data_config.labels_path) as label_file:
+        labels = json.load(label_file)
+
+    start = time.time()
+    dataset = ASRDataset(audio_conf=data_config.SpectConfig, manifest_filepath=manifest, labels=labels,
+                         normalize=True, batch_size=data_config.batch_size, is_training=args.mode == 'train',
+                         spect_cache_dir=cache_dir, spect_cache_dtype=args.dtype or data_config.spect_cache_dtype,
+                         cache_workers=args.workers or data_config.cache_workers, bucket_boundaries=boundaries)
+    cache = dataset.spect_cache
+    print('cache {}: {} utterances, {} frames, {:.1f}MB, ready in {:.1f}s'.format(
+        cache.cache_dir, len(cache), cache.spect.shape[0], cache.spect.nbytes / 1024 / 1024, time.time() - start))
+    print(padding_report(dataset, data_config.SpectConfig))
+
+    samples = np.random.RandomState(0).permutation(len(cache))[:args.time_samples]
+    start = time.time()
+    for i in samples:
+        dataset.parse_audio(dataset.ids[i][0])
+    stft_time = (time.time() - start) / len(samples)
+    start = time.time()
+    for i in samples:
+        dataset.normalize(cache[i])
+    cache_time = (time.time() - start) / len(samples)
+    print('spectrogram per utterance: stft {:.2f}ms, cache {:.2f}ms, per epoch: stft {:.1f}s, cache {:.1f}s'.format(
+        stft_time * 1000, cache_time * 1000, stft_time * len(cache), cache_time * len(cache)))
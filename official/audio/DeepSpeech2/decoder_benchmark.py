@@ -0,0 +1,90 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===========================================================================
+"""
+WER and decoding throughput of the greedy decoder and of the beam search decoder for several beam widths, with
+and without the language model, on the network outputs saved by eval.py (save_output in eval_config).
+
+Usage: python decoder_benchmark.py --output_file librispeech_val_output.bin --beam_widths 8,32,64,128
+"""
+import argparse
+import json
+import pickle
+import time
+
+import numpy as np
+
+from src.beamdecoder import MSBeamCTCDecoder
+from src.config import eval_config
+from src.greedydecoder import MSGreedyDecoder
+
+parser = argparse.ArgumentParser(description='DeepSpeech2 decoder benchmark')
+parser.add_argument('--output_file', type=str, default=eval_config.save_output + '.bin',
+                    help='Network outputs saved by eval.py')
+parser.add_argument('--beam_widths', type=str, default='8,32,64,128', help='Comma separated beam widths')
+parser.add_argument('--lm_path', type=str, default=eval_config.LMConfig.lm_path,
+                    help='ARPA language model, "" to only run without language model')
+parser.add_argument('--workers', type=int, default=eval_config.LMConfig.lm_workers, help='Decoding processes')
+args = parser.parse_args()
+
+
+def run(decoder, batches):
+    """WER, CER and seconds of decoding all batches"""
+    total_wer, total_cer, num_tokens, num_chars, elapsed = 0, 0, 0, 0, 0.
+    for out, output_sizes, target_strings in batches:
+        start = time.time()
+        decoded_output, _ = decoder.decode(out, output_sizes)
+        elapsed += time.time() - start
+        for doutput, toutput in zip(decoded_output, target_strings):
+            transcript, reference = doutput[0], toutput[0]
+            total_wer += decoder.wer(transcript, reference)
+            total_cer += decoder.cer(transcript, reference)
+            num_tokens += len(reference.split())
+            num_chars += len(reference.replace(' ', ''))
+    return float(total_wer) / num_tokens * 100, float(total_cer) / num_chars * 100, elapsed
+
+
+if __name__ == '__main__':
+    config = eval_config
+    with open(config.DataConfig.labels_path) as label_file:
+        labels = json.load(label_file)
+    blank_index = labels.index('_')
+    with open(args.output_file, 'rb') as f:
+        output_data = pickle.load(f)
+    # all utterances in one batch, so the process pool decodes all of them at once. The outputs of length
+    # buckets have different lengths and are padded to the longest
+    max_frames = max(x[0].shape[1] for x in output_data)
+    out = np.concatenate([np.pad(x[0], ((0, 0), (0, max_frames - x[0].shape[1]), (0, 0))) for x in output_data])
+    batches = [(out, np.concatenate([x[1] for x in output_data]), [s for x in output_data for s in x[2]])]
+    num_utterances = len(batches[0][2])
+    num_frames = int(batches[0][1].sum())
+    print('{} utterances, {} frames'.format(num_utterances, num_frames))
+    print('{:>8} {:>6} {:>4} {:>8} {:>8} {:>9} {:>13} {:>13}'.format(
+        'decoder', 'beam', 'lm', 'WER', 'CER', 'time(s)', 'utterances/s', 'frames/s'))
+
+    def report(name, beam_width, lm, result):
+        wer, cer, elapsed = result
+        print('{:>8} {:>6} {:>4} {:>8.3f} {:>8.3f} {:>9.2f} {:>13.1f} {:>13.0f}'.format(
+            name, beam_width, lm, wer, cer, elapsed, num_utterances / elapsed, num_frames / elapsed), flush=True)
+
+    greedy = MSGreedyDecoder(labels=labels, blank_index=blank_index)
+    report('greedy', '-', 'no', run(greedy, batches))
+    for lm_path in [''] + ([args.lm_path] if args.lm_path else []):
+        for beam_width in [int(x) for x in args.beam_widths.split(',')]:
+            decoder = MSBeamCTCDecoder(labels=labels, blank_index=blank_index, lm_path=lm_path,
+                                       alpha=config.LMConfig.alpha, beta=config.LMConfig.beta, beam_width=beam_width,
+                                       cutoff_top_n=config.LMConfig.cutoff_top_n,
+                                       cutoff_prob=config.LMConfig.cutoff_prob, num_workers=args.workers)
+            report('beam', beam_width, 'yes' if lm_path else 'no', run(decoder, batches))
+            decoder.close()
@@ -22,6 +22,7 @@ import pickle
 import numpy as np
 from src.config import eval_config
 from src.deepspeech2 import DeepSpeechModel, PredictWithSoftmax
+from src.beamdecoder import MSBeamCTCDecoder
 from src.dataset import create_dataset
 from src.greedydecoder import MSGreedyDecoder
 from mindspore import context
@@ -52,7 +53,11 @@ if __name__ == '__main__':
     ds_eval = create_dataset(audio_conf=config.DataConfig.SpectConfig,
                              manifest_filepath=config.DataConfig.test_manifest,
                              labels=labels, normalize=True, train_mode=False,
-                             batch_size=config.DataConfig.batch_size, rank=0, group_size=1)
+                             batch_size=config.DataConfig.batch_size, rank=0, group_size=1,
+                             spect_cache_dir=config.DataConfig.spect_cache_dir,
+                             spect_cache_dtype=config.DataConfig.spect_cache_dtype,
+                             cache_workers=config.DataConfig.cache_workers,
+                             bucket_boundaries=config.DataConfig.bucket_boundaries)
 
     param_dict = load_checkpoint(args.pretrain_ckpt)
     param_dict_new = {}
@@ -68,48 +73,59 @@ if __name__ == '__main__':
 
     if config.LMConfig.decoder_type == 'greedy':
         decoder = MSGreedyDecoder(labels=labels, blank_index=labels.index('_'))
+    elif config.LMConfig.decoder_type == 'beam':
+        decoder = MSBeamCTCDecoder(labels=labels, blank_index=labels.index('_'), lm_path=config.LMConfig.lm_path,
+                                   alpha=config.LMConfig.alpha, beta=config.LMConfig.beta,
+                                   beam_width=config.LMConfig.beam_width, cutoff_top_n=config.LMConfig.cutoff_top_n,
+                                   cutoff_prob=config.LMConfig.cutoff_prob, top_paths=config.LMConfig.top_paths,
+                                   num_workers=config.LMConfig.lm_workers)
     else:
-        raise NotImplementedError("Only greedy decoder is supported now")
+        raise NotImplementedError("Only greedy and beam decoders are supported now")
     target_decoder = MSGreedyDecoder(labels, blank_index=labels.index('_'))
 
     model.set_train(False)
     total_cer, total_wer, num_tokens, num_chars = 0, 0, 0, 0
     output_data = []
-    for data in ds_eval.create_dict_iterator():
-        inputs, input_length, target_indices, targets = data['inputs'], data['input_length'], data['target_indices'], \
-                                                        data['label_values']
+    try:
+        for data in ds_eval.create_dict_iterator():
+            inputs, input_length, target_indices, targets = data['inputs'], data['input_length'], \
+                                                            data['target_indices'], data['label_values']
 
-        split_targets = []
-        start, count, last_id = 0, 0, 0
-        target_indices, targets = target_indices.asnumpy(), targets.asnumpy()
-        for i in range(np.shape(targets)[0]):
-            if target_indices[i, 0] == last_id:
-                count += 1
-            else:
-                split_targets.append(list(targets[start:count]))
-                last_id += 1
-                start = count
-                count += 1
-        split_targets.append(list(targets[start:]))
-        out, output_sizes = model(inputs, input_length)
-        decoded_output, _ = decoder.decode(out, output_sizes)
-        target_strings = target_decoder.convert_to_strings(split_targets)
+            split_targets = []
+            start, count, last_id = 0, 0, 0
+            target_indices, targets = target_indices.asnumpy(), targets.asnumpy()
+            for i in range(np.shape(targets)[0]):
+                if target_indices[i, 0] == last_id:
+                    count += 1
+                else:
+                    split_targets.append(list(targets[start:count]))
+                    last_id += 1
+                    start = count
+                    count += 1
+            split_targets.append(list(targets[start:]))
+            out, output_sizes = model(inputs, input_length)
+            decoded_output, _ = decoder.decode(out, output_sizes)
+            target_strings = target_decoder.convert_to_strings(split_targets)
 
-        if config.save_output is not None:
-            output_data.append((out.asnumpy(), output_sizes.asnumpy(), target_strings))
-        for doutput, toutput in zip(decoded_output, target_strings):
-            transcript, reference = doutput[0], toutput[0]
-            wer_inst = decoder.wer(transcript, reference)
-            cer_inst = decoder.cer(transcript, reference)
-            total_wer += wer_inst
-            total_cer += cer_inst
-            num_tokens += len(reference.split())
-            num_chars += len(reference.replace(' ', ''))
-            if config.verbose:
-                print("Ref:", reference.lower())
-                print("Hyp:", transcript.lower())
-                print("WER:", float(wer_inst) / len(reference.split()),
-                      "CER:", float(cer_inst) / len(reference.replace(' ', '')), "\n")
+            if config.save_output is not None:
+                output_data.append((out.asnumpy(), output_sizes.asnumpy(), target_strings))
+            for doutput, toutput in zip(decoded_output, target_strings):
+                transcript, reference = doutput[0], toutput[0]
+                wer_inst = decoder.wer(transcript, reference)
+                cer_inst = decoder.cer(transcript, reference)
+                total_wer += wer_inst
+                total_cer += cer_inst
+                num_tokens += len(reference.split())
+                num_chars += len(reference.replace(' ', ''))
+                if config.verbose:
+                    print("Ref:", reference.lower())
+                    print("Hyp:", transcript.lower())
+                    print("WER:", float(wer_inst) / len(reference.split()),
+                          "CER:", float(cer_inst) / len(reference.replace(' ', '')), "\n")
+    finally:
+        # the beam decoder owns a pool of workers
+        if isinstance(decoder, MSBeamCTCDecoder):
+            decoder.close()
     wer = float(total_wer) / num_tokens
     cer = float(total_cer) / num_chars
 
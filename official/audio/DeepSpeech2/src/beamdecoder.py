@@ -0,0 +1,259 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===========================================================================
+"""
+CTC prefix beam search decoder with word n-gram language model shallow fusion
+"""
+import heapq
+import math
+from multiprocessing import Pool
+
+import numpy as np
+
+from src.greedydecoder import MSGreedyDecoder
+from src.ngram_lm import NgramLM
+
+NEG_INF = float('-inf')
+
+
+def _log_add(a, b):
+    if a < b:
+        a, b = b, a
+    if b == NEG_INF:
+        return a
+    return a + math.log1p(math.exp(b - a))
+
+
+class PrefixBeamSearch():
+    """
+    CTC prefix beam search over the output probabilities of one utterance
+
+    The prefixes are nodes of a prefix tree, so extending a prefix by a character is a dict lookup. With a
+    language model, every completed word adds alpha * ln p(word | previous words) + beta to the score of its
+    prefix, and the last word and the end of sentence are scored when the search ends.
+
+    Args:
+        labels (list): characters of the output classes.
+        blank_index (int): index of the CTC blank.
+        beam_width (int): prefixes kept after every frame.
+        cutoff_top_n (int): at most the cutoff_top_n most probable characters of a frame are extended.
+        cutoff_prob (float): only the most probable characters with a cumulative probability of cutoff_prob are
+            extended, a frame where the blank alone reaches it only extends the blank.
+        lm (NgramLM): language model, None for no language model (default=None).
+        alpha (float): weight of the language model (default=0).
+        beta (float): bonus of every word (default=0).
+    """
+
+    def __init__(self, labels, blank_index, beam_width, cutoff_top_n, cutoff_prob, lm=None, alpha=0., beta=0.):
+        self.labels = labels
+        self.blank = blank_index
+        self.space = labels.index(' ') if ' ' in labels else -1
+        self.beam_width = beam_width
+        self.cutoff_top_n = min(cutoff_top_n, len(labels))
+        self.cutoff_prob = cutoff_prob
+        self.lm = lm
+        self.alpha = alpha
+        self.beta = beta
+
+    def _new_tree(self):
+        # per node: parent, last character, frame of the last character, LM score, LM state
+        self.parents = [-1]
+        self.chars = [-1]
+        self.frames = [0]
+        self.lm_scores = [0.]
+        history = (self.lm.bos,) if self.lm is not None else ()
+        self.states = [(history, '')]
+        self.children = {}
+
+    def _child(self, node, char, frame):
+        """node of the prefix of node extended by char"""
+        child = self.children.get((node, char))
+        if child is not None:
+            return child
+        child = len(self.parents)
+        self.children[(node, char)] = child
+        self.parents.append(node)
+        self.chars.append(char)
+        self.frames.append(frame)
+        lm_score = self.lm_scores[node]
+        history, word = self.states[node]
+        if self.lm is not None:
+            if char == self.space:
+                if word:
+                    lm_score += self._word_score(history, word)
+                    history = history + (self.lm.word_id(word),)
+                    word = ''
+            else:
+                word = word + self.labels[char]
+        self.lm_scores.append(lm_score)
+        self.states.append((history, word))
+        return child
+
+    def _word_score(self, history, word):
+        return self.alpha * self.lm.score(history, self.lm.word_id(word)) + self.beta
+
+    def _end_score(self, node):
+        """LM score of the last word and the end of sentence"""
+        if self.lm is None:
+            return 0.
+        history, word = self.states[node]
+        score = 0.
+        if word:
+            score += self._word_score(history, word)
+            history = history + (self.lm.word_id(word),)
+        if self.lm.eos >= 0:
+            score += self.alpha * self.lm.score(history, self.lm.eos)
+        return score
+
+    def _candidates(self, log_probs):
+        """characters extended at every frame"""
+        order = np.argsort(-log_probs, axis=1, kind='stable')[:, :self.cutoff_top_n]
+        if self.cutoff_prob >= 1.0:
+            return order.tolist()
+        cumulative = np.cumsum(np.exp(np.take_along_axis(log_probs, order, axis=1)), axis=1)
+        num = np.minimum(np.sum(cumulative < self.cutoff_prob, axis=1) + 1, order.shape[1])
+        return [row[:n] for row, n in zip(order.tolist(), num.tolist())]
+
+    def decode(self, probs, top_paths=1):
+        """
+        Args:
+            probs (numpy.ndarray): output probabilities of shape (frames, classes).
+            top_paths (int): number of returned transcripts.
+
+        Returns:
+            list of (label sequence, frames of the labels, score) of the top_paths best prefixes.
+        """
+        self._new_tree()
+        log_probs = np.log(np.maximum(np.asarray(probs, np.float64), 1e-30))
+        blank = self.blank
+        # node -> [log probability ending in blank, log probability ending in a character]
+        beams = {0: [0., NEG_INF]}
+        blank_run = 0.
+        for t, candidates in enumerate(self._candidates(log_probs)):
+            frame = log_probs[t]
+            if candidates == [blank]:
+                # consecutive blank frames only move all the probability of every prefix to the blank
+                blank_run += frame[blank]
+                continue
+            if blank_run:
+                beams = {node: [_log_add(p_b, p_nb) + blank_run, NEG_INF] for node, (p_b, p_nb) in beams.items()}
+                blank_run = 0.
+            next_beams = {}
+            for node, (p_b, p_nb) in beams.items():
+                p_total = _log_add(p_b, p_nb)
+                last = self.chars[node]
+                for char in candidates:
+                    p = frame[char]
+                    if char == blank:
+                        entry = next_beams.setdefault(node, [NEG_INF, NEG_INF])
+                        entry[0] = _log_add(entry[0], p_total + p)
+                        continue
+                    child = self._child(node, char, t)
+                    entry = next_beams.setdefault(child, [NEG_INF, NEG_INF])
+                    if char == last:
+                        # a repeated character needs a blank in between, otherwise it collapses into the prefix
+                        entry[1] = _log_add(entry[1], p_b + p)
+                        same = next_beams.setdefault(node, [NEG_INF, NEG_INF])
+                        same[1] = _log_add(same[1], p_nb + p)
+                    else:
+                        entry[1] = _log_add(entry[1], p_total + p)
+            if len(next_beams) > self.beam_width:
+                lm_scores = self.lm_scores
+                next_beams = dict(heapq.nlargest(self.beam_width, next_beams.items(),
+                                                 key=lambda x: _log_add(*x[1]) + lm_scores[x[0]]))
+            beams = next_beams
+
+        results = []
+        for node, (p_b, p_nb) in beams.items():
+            score = _log_add(p_b, p_nb) + blank_run + self.lm_scores[node] + self._end_score(node)
+            results.append((score, node))
+        results.sort(reverse=True)
+        paths = []
+        for score, node in results[:top_paths]:
+            sequence, frames = [], []
+            while node > 0:
+                sequence.append(self.chars[node])
+                frames.append(self.frames[node])
+                node = self.parents[node]
+            paths.append((sequence[::-1], frames[::-1], score))
+        return paths
+
+
+# set in every process by _init_worker
+_search = None
+
+
+def _init_worker(labels, blank_index, beam_width, cutoff_top_n, cutoff_prob, lm_path, alpha, beta):
+    global _search
+    lm = NgramLM(lm_path) if lm_path else None
+    _search = PrefixBeamSearch(labels, blank_index, beam_width, cutoff_top_n, cutoff_prob, lm, alpha, beta)
+
+
+def _decode_worker(task):
+    probs, top_paths = task
+    return _search.decode(probs, top_paths)
+
+
+class MSBeamCTCDecoder(MSGreedyDecoder):
+    """
+    CTC prefix beam search decoder used for MindSpore, decoding the utterances of a batch in a process pool
+
+    Args:
+        labels (list): characters of the output classes.
+        blank_index (int): index of the CTC blank (default=0).
+        lm_path (str): ARPA language model, '' for no language model (default='').
+        alpha (float): weight of the language model (default=0).
+        beta (float): bonus of every word (default=0).
+        beam_width (int): prefixes kept after every frame (default=64).
+        cutoff_top_n (int): most probable characters extended at every frame (default=40).
+        cutoff_prob (float): cumulative probability of the characters extended at every frame (default=1.0).
+        top_paths (int): transcripts returned for every utterance (default=1).
+        num_workers (int): processes decoding the utterances, 1 to decode in the calling process (default=1).
+    """
+
+    def __init__(self, labels, blank_index=0, lm_path='', alpha=0., beta=0., beam_width=64, cutoff_top_n=40,
+                 cutoff_prob=1.0, top_paths=1, num_workers=1):
+        super(MSBeamCTCDecoder, self).__init__(labels, blank_index=blank_index)
+        self.top_paths = top_paths
+        self.num_workers = num_workers
+        init_args = (labels, blank_index, beam_width, cutoff_top_n, cutoff_prob, lm_path, alpha, beta)
+        # parse the ARPA file once, the workers load the saved trie
+        _init_worker(*init_args)
+        self.pool = Pool(num_workers, initializer=_init_worker, initargs=init_args) if num_workers > 1 else None
+
+    def decode(self, probs, sizes=None):
+        """
+        Returns:
+            the top_paths transcripts and the frames of their characters for every utterance.
+        """
+        probs = probs.asnumpy() if hasattr(probs, 'asnumpy') else np.asarray(probs)
+        if sizes is None:
+            sizes = np.full(probs.shape[0], probs.shape[1])
+        sizes = sizes.asnumpy() if hasattr(sizes, 'asnumpy') else np.asarray(sizes)
+        tasks = [(probs[i, :int(sizes[i])], self.top_paths) for i in range(probs.shape[0])]
+        if self.pool is not None:
+            results = self.pool.map(_decode_worker, tasks, chunksize=max(len(tasks) // (4 * self.num_workers), 1))
+        else:
+            results = [_decode_worker(task) for task in tasks]
+        strings, offsets = [], []
+        for paths in results:
+            strings.append([''.join(self.int_to_char[c] for c in sequence) for sequence, _, _ in paths])
+            offsets.append([frames for _, frames, _ in paths])
+        return strings, offsets
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
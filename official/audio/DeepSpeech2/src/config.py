@@ -28,6 +28,12 @@ train_config = ed({
         # "val_manifest": 'data/libri_val_manifest.csv',
         "batch_size": 20,
         "labels_path": "labels.json",
+        # memory-mapped spectrogram cache, '' to compute the spectrograms every epoch
+        "spect_cache_dir": '',
+        "spect_cache_dtype": 'float16',
+        "cache_workers": 8,
+        # pad lengths of the length buckets, e.g. [400, 600, 800, 1000], [] to pad every batch to 1250
+        "bucket_boundaries": [],
 
         "SpectConfig": {
             "sample_rate": 16000,
@@ -82,6 +88,12 @@ eval_config = ed({
         # "test_manifest": 'data/libri_val_manifest.csv',
         "batch_size": 20,
         "labels_path": "labels.json",
+        # memory-mapped spectrogram cache, '' to compute the spectrograms
+        "spect_cache_dir": '',
+        "spect_cache_dtype": 'float16',
+        "cache_workers": 8,
+        # pad lengths of the length buckets, e.g. [500, 1000, 1500, 2000], [] to pad every batch to 3500
+        "bucket_boundaries": [],
 
         "SpectConfig": {
             "sample_rate": 16000,
@@ -99,14 +111,15 @@ eval_config = ed({
     },
 
     "LMConfig": {
+        # 'greedy' or 'beam', a CTC prefix beam search with the ARPA language model lm_path ('' for no LM)
         "decoder_type": "greedy",
         "lm_path": './3-gram.pruned.3e-7.arpa',
         "top_paths": 1,
         "alpha": 1.818182,
         "beta": 0,
         "cutoff_top_n": 40,
-        "cutoff_prob": 1.0,
-        "beam_width": 1024,
+        "cutoff_prob": 0.99,
+        "beam_width": 64,
         "lm_workers": 4
     },
 
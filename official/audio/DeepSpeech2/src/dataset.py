@@ -15,7 +15,12 @@
 """
 Create train or eval dataset.
 """
+import hashlib
+import json
 import math
+import os
+import shutil
+from multiprocessing import Pool
 
 import numpy as np
 import mindspore.dataset.engine as de
@@ -80,6 +85,142 @@ class LoadAudioAndTranscript():
         transcript = list(filter(None, [self.labels.get(x) for x in list(transcript)]))
         return transcript
 
+    def normalize(self, mag):
+        """
+        standard mean and deviation normalization of a spectrogram read from the cache
+        """
+        if self.is_normalization:
+            mean = mag.mean()
+            std = mag.std()
+            mag = (mag - mean) / std
+        return mag
+
+
+def spectrogram_frames(audio_path, audio_conf):
+    """
+    frames of the spectrogram of an audio file, from the number of samples without decoding it
+    """
+    hop_length = int(audio_conf.sample_rate * audio_conf.window_stride)
+    # librosa.stft pads the audio by n_fft // 2 on both sides
+    return 1 + sf.info(audio_path).frames // hop_length
+
+
+_spect_parser = None
+
+
+def _init_spect_worker(audio_conf):
+    global _spect_parser
+    _spect_parser = LoadAudioAndTranscript(audio_conf, normalize=False)
+
+
+def _compute_spect(audio_path):
+    return _spect_parser.parse_audio(audio_path)
+
+
+class SpectrogramCache():
+    """
+    Memory-mapped cache of the log-magnitude spectrograms of the audio files of a manifest
+
+    The spectrograms are stored before normalization and concatenated along time in spect.npy, of shape
+    (total_frames, freq_size), and the spectrogram of the i-th file is spect[offsets[i]:offsets[i + 1]].T.
+    The cache directory is keyed by the audio paths, the spectrogram config and the dtype, and is only
+    renamed into place once complete, so it is built once and shared by all processes.
+
+    Args:
+        cache_dir (str): root directory of the cache.
+        audio_paths (list): audio file paths of the manifest.
+        audio_conf: Config containing the sample rate, window and the window length/stride in seconds
+        dtype (str): dtype of the stored spectrograms, float16 halves the cache size (default='float16').
+        workers (int): processes computing the spectrograms if the cache does not exist (default=1).
+    """
+
+    def __init__(self, cache_dir, audio_paths, audio_conf, dtype='float16', workers=1):
+        self.dtype = np.dtype(dtype)
+        key = {'audio_paths': hashlib.sha256('\n'.join(audio_paths).encode()).hexdigest(),
+               'num': len(audio_paths),
+               'sample_rate': audio_conf.sample_rate,
+               'window_size': audio_conf.window_size,
+               'window_stride': audio_conf.window_stride,
+               'window': audio_conf.window,
+               'dtype': self.dtype.name}
+        self.key = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, self.key)
+        if not os.path.exists(os.path.join(self.cache_dir, 'offsets.npy')):
+            self._build(key, audio_paths, audio_conf, workers)
+        self.offsets = np.load(os.path.join(self.cache_dir, 'offsets.npy'))
+        self.spect = np.load(os.path.join(self.cache_dir, 'spect.npy'), mmap_mode='r')
+        self.lengths = np.diff(self.offsets)
+
+    def _build(self, key, audio_paths, audio_conf, workers):
+        """compute the spectrograms into a temporary directory renamed to the cache directory"""
+        tmp_dir = '{}.tmp{}'.format(self.cache_dir, os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        lengths = np.array([spectrogram_frames(path, audio_conf) for path in audio_paths], np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        freq_size = int(audio_conf.sample_rate * audio_conf.window_size) // 2 + 1
+        spect = np.lib.format.open_memmap(os.path.join(tmp_dir, 'spect.npy'), mode='w+', dtype=self.dtype,
+                                          shape=(int(offsets[-1]), freq_size))
+        if workers > 1:
+            pool = Pool(workers, initializer=_init_spect_worker, initargs=(audio_conf,))
+            results = pool.imap(_compute_spect, audio_paths, chunksize=16)
+        else:
+            pool = None
+            _init_spect_worker(audio_conf)
+            results = map(_compute_spect, audio_paths)
+        for i, mag in enumerate(results):
+            if mag.shape != (freq_size, lengths[i]):
+                raise ValueError('spectrogram of {} has shape {}, expected {}'.format(
+                    audio_paths[i], mag.shape, (freq_size, lengths[i])))
+            spect[offsets[i]:offsets[i + 1]] = mag.T
+        if pool is not None:
+            pool.close()
+            pool.join()
+        spect.flush()
+        del spect
+        np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+        with open(os.path.join(tmp_dir, 'key.json'), 'w') as f:
+            json.dump(key, f, sort_keys=True, indent=2)
+        try:
+            os.rename(tmp_dir, self.cache_dir)
+        except OSError:
+            # built by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        return np.asarray(self.spect[self.offsets[index]:self.offsets[index + 1]].T, dtype=np.float32)
+
+
+def bucket_batches(lengths, pad_lengths, batch_size, seed=0):
+    """
+    Group utterances of similar length into batches
+
+    Every utterance goes into the bucket of the smallest pad length not below its length, the longer ones
+    into the last bucket. Every bucket is shuffled and split into batches padded to its pad length, and the
+    remainder is carried into the next bucket. The last incomplete batch is filled with random utterances.
+
+    Returns:
+        list of (pad_length, indices) of every batch.
+    """
+    rng = np.random.RandomState(seed)
+    pad_lengths = np.asarray(pad_lengths)
+    bucket = np.minimum(np.searchsorted(pad_lengths, lengths, side='left'), len(pad_lengths) - 1)
+    batches = []
+    carry = np.zeros(0, np.int64)
+    for b, pad_length in enumerate(pad_lengths):
+        members = np.concatenate((carry, rng.permutation(np.nonzero(bucket == b)[0])))
+        num_full = len(members) // batch_size * batch_size
+        for start in range(0, num_full, batch_size):
+            batches.append((int(pad_length), members[start:start + batch_size].tolist()))
+        carry = members[num_full:]
+    if carry.size:
+        others = np.setdiff1d(np.arange(len(lengths)), carry)
+        fill = rng.choice(others, min(batch_size - carry.size, others.size), replace=False)
+        batches.append((int(pad_lengths[-1]), np.concatenate((carry, fill)).tolist()))
+    return batches
+
 
 class ASRDataset(LoadAudioAndTranscript):
     """
@@ -91,6 +232,12 @@ class ASRDataset(LoadAudioAndTranscript):
             labels (list): List containing all the possible characters to map to
             normalize: Apply standard mean and deviation Normalization to audio tensor
             batch_size (int): Dataset batch size (default=32)
+            spect_cache_dir (str): Directory of the spectrogram cache, '' to compute the spectrograms of every
+                batch (default='')
+            spect_cache_dtype (str): dtype of the cached spectrograms (default='float16')
+            cache_workers (int): Processes building the spectrogram cache (default=1)
+            bucket_boundaries (list): Pad lengths of the length buckets, empty to batch in manifest order and pad
+                to the fixed input length (default=None)
         """
 
     def __init__(self, audio_conf=None,
@@ -98,7 +245,11 @@ class ASRDataset(LoadAudioAndTranscript):
                  labels=None,
                  normalize=False,
                  batch_size=32,
-                 is_training=True):
+                 is_training=True,
+                 spect_cache_dir='',
+                 spect_cache_dtype='float16',
+                 cache_workers=1,
+                 bucket_boundaries=None):
         # with open(manifest_filepath) as f:
         #     json_file = json.load(f)
         #
@@ -112,24 +263,51 @@ class ASRDataset(LoadAudioAndTranscript):
         self.is_training = is_training
         self.ids = ids
         self.blank_id = int(labels.index('_'))
-        self.bins = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
-        if len(self.ids) % batch_size != 0:
-            self.bins = self.bins[:-1]
-            self.bins.append(ids[-batch_size:])
+        self.input_pad_length = TRAIN_INPUT_PAD_LENGTH if is_training else TEST_INPUT_PAD_LENGTH
+        self.spect_cache = None
+        if spect_cache_dir:
+            self.spect_cache = SpectrogramCache(spect_cache_dir, [x[0] for x in ids], audio_conf,
+                                                spect_cache_dtype, cache_workers)
+        self.lengths = None
+        if bucket_boundaries:
+            pad_lengths = sorted(x for x in set(bucket_boundaries) if x < self.input_pad_length)
+            self.bins = bucket_batches(self.get_lengths(audio_conf), pad_lengths + [self.input_pad_length],
+                                       batch_size)
+        else:
+            indices = list(range(len(ids)))
+            self.bins = [indices[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+            if len(self.ids) % batch_size != 0:
+                self.bins = self.bins[:-1]
+                self.bins.append(indices[-batch_size:])
+            self.bins = [(self.input_pad_length, x) for x in self.bins]
         self.size = len(self.bins)
         self.batch_size = batch_size
         self.labels_map = {labels[i]: i for i in range(len(labels))}
         super(ASRDataset, self).__init__(audio_conf, normalize, self.labels_map)
 
+    def get_lengths(self, audio_conf):
+        """
+        spectrogram frames of every utterance
+        """
+        if self.lengths is None:
+            if self.spect_cache is not None:
+                self.lengths = self.spect_cache.lengths
+            else:
+                self.lengths = np.array([spectrogram_frames(x[0], audio_conf) for x in self.ids], np.int64)
+        return self.lengths
+
     def __getitem__(self, index):
-        batch_idx = self.bins[index]
+        input_pad_length, batch_idx = self.bins[index]
         batch_size = len(batch_idx)
         batch_spect, batch_script, target_indices = [], [], []
         input_length = np.zeros(batch_size, np.float32)
-        for data in batch_idx:
+        for i in batch_idx:
             # audio_path, transcript_path = os.path.join(self.root_path, data[0]), os.path.join(self.root_path, data[1])
-            audio_path, transcript_path = data[0], data[1]
-            spect = self.parse_audio(audio_path)
+            audio_path, transcript_path = self.ids[i][0], self.ids[i][1]
+            if self.spect_cache is not None:
+                spect = self.normalize(self.spect_cache[i])
+            else:
+                spect = self.parse_audio(audio_path)
             transcript = self.parse_transcript(transcript_path)
             batch_spect.append(spect)
             batch_script.append(transcript)
@@ -138,7 +316,8 @@ class ASRDataset(LoadAudioAndTranscript):
         if self.is_training:
             # 1501 is the max length in train dataset(LibriSpeech).
             # The length is fixed to this value because Mindspore does not support dynamic shape currently
-            inputs = np.zeros((batch_size, 1, freq_size, TRAIN_INPUT_PAD_LENGTH), dtype=np.float32)
+            # With length buckets, every bucket has its own fixed length
+            inputs = np.zeros((batch_size, 1, freq_size, input_pad_length), dtype=np.float32)
             # The target length is fixed to this value because Mindspore does not support dynamic shape currently
             # 350 may be greater than the max length of labels in train dataset(LibriSpeech).
             targets = np.ones((self.batch_size, TRAIN_LABEL_PAD_LENGTH), dtype=np.int32) * self.blank_id
@@ -150,17 +329,17 @@ class ASRDataset(LoadAudioAndTranscript):
                 targets[k, :script_length] = scripts_
                 for m in range(350):
                     target_indices.append([k, m])
-                if seq_length <= TRAIN_INPUT_PAD_LENGTH:
+                if seq_length <= input_pad_length:
                     input_length[k] = seq_length
                     inputs[k, 0, :, 0:seq_length] = spect_[:, :seq_length]
                 else:
-                    maxstart = seq_length - TRAIN_INPUT_PAD_LENGTH
+                    maxstart = seq_length - input_pad_length
                     start = np.random.randint(maxstart)
-                    input_length[k] = TRAIN_INPUT_PAD_LENGTH
-                    inputs[k, 0, :, 0:TRAIN_INPUT_PAD_LENGTH] = spect_[:, start:start + TRAIN_INPUT_PAD_LENGTH]
+                    input_length[k] = input_pad_length
+                    inputs[k, 0, :, 0:input_pad_length] = spect_[:, start:start + input_pad_length]
             targets = np.reshape(targets, (-1,))
         else:
-            inputs = np.zeros((batch_size, 1, freq_size, TEST_INPUT_PAD_LENGTH), dtype=np.float32)
+            inputs = np.zeros((batch_size, 1, freq_size, input_pad_length), dtype=np.float32)
             targets = []
             for k, spect_, scripts_ in zip(range(batch_size), batch_spect, batch_script):
                 seq_length = np.shape(spect_)[1]
@@ -176,6 +355,32 @@ class ASRDataset(LoadAudioAndTranscript):
         return self.size
 
 
+def padding_report(dataset, audio_conf):
+    """
+    Padded frames of every pad length of the batches, compared with batches in manifest order padded to the
+    fixed input length
+    """
+    lengths = dataset.get_lengths(audio_conf)
+    pad_lengths = sorted({pad_length for pad_length, _ in dataset.bins})
+    lines = ['{:>10} {:>8} {:>11} {:>14} {:>14} {:>8}'.format(
+        'pad_length', 'batches', 'utterances', 'frames', 'padded_frames', 'padding')]
+
+    def _line(name, bins):
+        frames = sum(int(np.minimum(lengths[batch_idx], pad_length).sum()) for pad_length, batch_idx in bins)
+        padded = sum(pad_length * len(batch_idx) for pad_length, batch_idx in bins)
+        return '{:>10} {:>8} {:>11} {:>14} {:>14} {:>7.1f}%'.format(
+            name, len(bins), sum(len(batch_idx) for _, batch_idx in bins), frames, padded,
+            100. * (1 - frames / max(padded, 1)))
+
+    for pad_length in pad_lengths:
+        lines.append(_line(pad_length, [x for x in dataset.bins if x[0] == pad_length]))
+    lines.append(_line('total', dataset.bins))
+    fixed_bins = [(dataset.input_pad_length, list(range(i, min(i + dataset.batch_size, len(lengths)))))
+                  for i in range(0, len(lengths), dataset.batch_size)]
+    lines.append(_line('fixed', fixed_bins))
+    return '\n'.join(lines)
+
+
 class DistributedSampler():
     """
     function to distribute and shuffle sample
@@ -208,7 +413,8 @@ class DistributedSampler():
 
 
 def create_dataset(audio_conf, manifest_filepath, labels, normalize, batch_size, train_mode=True,
-                   rank=None, group_size=None):
+                   rank=None, group_size=None, spect_cache_dir='', spect_cache_dtype='float16', cache_workers=1,
+                   bucket_boundaries=None):
     """
     create train dataset
 
@@ -221,13 +427,21 @@ def create_dataset(audio_conf, manifest_filepath, labels, normalize, batch_size,
         batch_size (int): Dataset batch size
         rank (int): The shard ID within num_shards (default=None).
         group_size (int): Number of shards that the dataset should be divided into (default=None).
+        spect_cache_dir (str): Directory of the spectrogram cache, '' to disable it (default='').
+        spect_cache_dtype (str): dtype of the cached spectrograms (default='float16').
+        cache_workers (int): Processes building the spectrogram cache (default=1).
+        bucket_boundaries (list): Pad lengths of the length buckets, empty to disable bucketing (default=None).
 
     Returns:
         Dataset.
     """
 
     dataset = ASRDataset(audio_conf=audio_conf, manifest_filepath=manifest_filepath, labels=labels, normalize=normalize,
-                         batch_size=batch_size, is_training=train_mode)
+                         batch_size=batch_size, is_training=train_mode, spect_cache_dir=spect_cache_dir,
+                         spect_cache_dtype=spect_cache_dtype, cache_workers=cache_workers,
+                         bucket_boundaries=bucket_boundaries)
+    if bucket_boundaries and not rank:
+        print(padding_report(dataset, audio_conf), flush=True)
 
     sampler = DistributedSampler(dataset, rank, group_size, shuffle=True)
 
@@ -24,6 +24,7 @@ from mindspore.train.callback import Callback
 from src.config import eval_config
 from src.dataset import create_dataset
 from src.deepspeech2 import PredictWithSoftmax, DeepSpeechModel
+from src.beamdecoder import MSBeamCTCDecoder
 from src.greedydecoder import MSGreedyDecoder
 
 
@@ -52,14 +53,25 @@ class SaveCallback(Callback):
         self.ds_eval = create_dataset(audio_conf=self.config.DataConfig.SpectConfig,
                                       manifest_filepath=self.config.DataConfig.test_manifest,
                                       labels=self.labels, normalize=True, train_mode=False,
-                                      batch_size=self.config.DataConfig.batch_size, rank=0, group_size=1)
+                                      batch_size=self.config.DataConfig.batch_size, rank=0, group_size=1,
+                                      spect_cache_dir=self.config.DataConfig.spect_cache_dir,
+                                      spect_cache_dtype=self.config.DataConfig.spect_cache_dtype,
+                                      cache_workers=self.config.DataConfig.cache_workers,
+                                      bucket_boundaries=self.config.DataConfig.bucket_boundaries)
         self.wer = float('inf')
         self.cer = float('inf')
-        if self.config.LMConfig.decoder_type == 'greedy':
+        lm_config = self.config.LMConfig
+        if lm_config.decoder_type == 'greedy':
             self.decoder = MSGreedyDecoder(
                 labels=self.labels, blank_index=self.labels.index('_'))
+        elif lm_config.decoder_type == 'beam':
+            self.decoder = MSBeamCTCDecoder(labels=self.labels, blank_index=self.labels.index('_'),
+                                            lm_path=lm_config.lm_path, alpha=lm_config.alpha, beta=lm_config.beta,
+                                            beam_width=lm_config.beam_width, cutoff_top_n=lm_config.cutoff_top_n,
+                                            cutoff_prob=lm_config.cutoff_prob, top_paths=lm_config.top_paths,
+                                            num_workers=lm_config.lm_workers)
         else:
-            raise NotImplementedError("Only greedy decoder is supported now")
+            raise NotImplementedError("Only greedy and beam decoders are supported now")
         self.target_decoder = MSGreedyDecoder(
             self.labels, blank_index=self.labels.index('_'))
         self.path = path
@@ -146,6 +158,13 @@ class SaveCallback(Callback):
                  {}".format(cur_epoch, self.wer, self.cer)
                 self.logger.info(message)
 
+    def end(self, run_context):
+        """
+        close the worker pool of the beam decoder after training
+        """
+        if isinstance(self.decoder, MSBeamCTCDecoder):
+            self.decoder.close()
+
     def init_logger(self):
         self.logger.setLevel(level=logging.INFO)
         handler = logging.FileHandler('eval_callback.log')
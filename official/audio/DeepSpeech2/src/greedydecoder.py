@@ -44,8 +44,8 @@ class MSGreedyDecoder(GreedyDecoder):
         return string, offsets
 
     def decode(self, probs, sizes=None):
-        probs = probs.asnumpy()
-        sizes = sizes.asnumpy()
+        probs = probs.asnumpy() if hasattr(probs, 'asnumpy') else probs
+        sizes = sizes.asnumpy() if hasattr(sizes, 'asnumpy') else sizes
 
         max_probs = np.argmax(probs, axis=-1)
         strings, offsets = self.convert_to_strings(max_probs, sizes, remove_repetitions=True, return_offsets=True)
@@ -0,0 +1,159 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===========================================================================
+"""
+word n-gram language model loaded from an ARPA file
+
+The n-grams are stored as a trie in flat arrays, one level per order. A node of level k is an n-gram of k words
+and is identified by the sorted key parent * vocab_size + word, where parent is the node of its first k - 1
+words in level k - 1, and the nodes of level 1 are the word ids. The trie is saved next to the ARPA file as
+.npz, so it is only parsed once.
+"""
+import bisect
+import math
+import os
+
+import numpy as np
+
+LOG10_TO_LN = math.log(10)
+
+
+class NgramLM():
+    """
+    NgramLM
+
+    Args:
+        arpa_path (str): ARPA file of the language model, the trie is read from arpa_path + '.npz' if it exists.
+        unk_score (float): log10 probability of the words out of the vocabulary if there is no <unk>
+            (default=-10.0).
+    """
+
+    def __init__(self, arpa_path, unk_score=-10.0):
+        cache_path = arpa_path + '.npz'
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(arpa_path):
+            arrays = np.load(cache_path)
+        else:
+            arrays = self._parse_arpa(arpa_path)
+            try:
+                np.savez(cache_path + '.tmp.npz', **arrays)
+                os.replace(cache_path + '.tmp.npz', cache_path)
+            except OSError:
+                # read-only directory, the ARPA file is parsed every time
+                pass
+        self.order = int(arrays['order'])
+        self.vocab = {word: i for i, word in enumerate(arrays['vocab'].tolist())}
+        self.vocab_size = len(self.vocab)
+        self.keys = [None] + [arrays['keys_{}'.format(k)].tolist() for k in range(2, self.order + 1)]
+        self.probs = [arrays['probs_{}'.format(k)] for k in range(1, self.order + 1)]
+        self.backoffs = [arrays['backoffs_{}'.format(k)] for k in range(1, self.order)]
+        self.unk = self.vocab.get('<unk>', -1)
+        self.unk_score = float(self.probs[0][self.unk]) if self.unk >= 0 else unk_score
+        self.bos = self.vocab.get('<s>', -1)
+        self.eos = self.vocab.get('</s>', -1)
+        self.cache = {}
+
+    @staticmethod
+    def _parse_arpa(arpa_path):
+        """read the n-grams of every order into the arrays of the trie"""
+        grams = {}
+        order = 0
+        with open(arpa_path, 'r', encoding='utf8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('ngram '):
+                    continue
+                if line.startswith('\\'):
+                    order = int(line[1:line.index('-')]) if line.endswith('-grams:') else 0
+                    if order:
+                        grams[order] = []
+                    continue
+                if order:
+                    fields = line.split()
+                    backoff = float(fields[order + 1]) if len(fields) > order + 1 else 0.
+                    grams[order].append((fields[1:order + 1], float(fields[0]), backoff))
+
+        max_order = max(grams)
+        vocab = [gram[0][0] for gram in grams[1]]
+        vocab_ids = {word: i for i, word in enumerate(vocab)}
+        vocab_size = len(vocab)
+        arrays = {'order': np.array(max_order), 'vocab': np.array(vocab),
+                  'probs_1': np.array([gram[1] for gram in grams[1]], np.float32),
+                  'backoffs_1': np.array([gram[2] for gram in grams[1]], np.float32)}
+        keys = {}
+        for k in range(2, max_order + 1):
+            ids = np.array([[vocab_ids.get(word, -1) for word in gram[0]] for gram in grams[k]],
+                           np.int64).reshape(-1, k)
+            valid = np.all(ids >= 0, axis=1)
+            # the node of the first k - 1 words, n-grams without it cannot be reached and are dropped
+            node = ids[:, 0]
+            for j in range(1, k - 1):
+                if not keys[j + 1].size:
+                    valid[:] = False
+                    break
+                key = node * vocab_size + ids[:, j]
+                node = np.minimum(np.searchsorted(keys[j + 1], key), len(keys[j + 1]) - 1)
+                valid &= keys[j + 1][node] == key
+            key = node * vocab_size + ids[:, k - 1]
+            order_index = np.nonzero(valid)[0]
+            order_index = order_index[np.argsort(key[order_index], kind='stable')]
+            keys[k] = key[order_index]
+            arrays['keys_{}'.format(k)] = keys[k]
+            arrays['probs_{}'.format(k)] = np.array([grams[k][i][1] for i in order_index], np.float32)
+            if k < max_order:
+                arrays['backoffs_{}'.format(k)] = np.array([grams[k][i][2] for i in order_index], np.float32)
+        return arrays
+
+    def _find(self, ids):
+        """node of the n-gram ids in the level of its order, None if it is not in the model"""
+        # a word out of the vocabulary (id -1) is in no n-gram, and its key could alias another node
+        if min(ids) < 0:
+            return None
+        node = ids[0]
+        for k in range(2, len(ids) + 1):
+            key = node * self.vocab_size + ids[k - 1]
+            keys = self.keys[k - 1]
+            node = bisect.bisect_left(keys, key)
+            if node == len(keys) or keys[node] != key:
+                return None
+        return node
+
+    def word_id(self, word):
+        """id of the word, the id of <unk> or -1 if the word is out of the vocabulary"""
+        return self.vocab.get(word, self.unk)
+
+    def score(self, context, word_id):
+        """
+        natural log probability of a word given the ids of the previous words, with backoff to shorter contexts
+        """
+        context = context[len(context) - self.order + 1:] if len(context) >= self.order else context
+        cache_key = (context, word_id)
+        result = self.cache.get(cache_key)
+        if result is not None:
+            return result
+        if word_id < 0:
+            result = self.unk_score
+        else:
+            result = 0.
+            for start in range(len(context) + 1):
+                history = context[start:]
+                node = self._find(history + (word_id,))
+                if node is not None:
+                    result += float(self.probs[len(history)][node])
+                    break
+                node = self._find(history) if history else None
+                if node is not None:
+                    result += float(self.backoffs[len(history) - 1][node])
+        result *= LOG10_TO_LN
+        self.cache[cache_key] = result
+        return result
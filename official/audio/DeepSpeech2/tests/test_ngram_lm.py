@@ -0,0 +1,71 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""scores of src/ngram_lm.py with words out of the vocabulary in the history"""
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ngram_lm import NgramLM  # pylint: disable=wrong-import-position
+
+ARPA = """
+\\data\\
+ngram 1={num_unigrams}
+ngram 2=1
+
+\\1-grams:
+{unk}-0.8\ta\t-0.3
+-0.9\tb\t-0.4
+
+\\2-grams:
+-0.2\ta b
+
+\\end\\
+"""
+
+
+def load(tmp_path, unk_line=''):
+    arpa_path = str(tmp_path / 'lm.arpa')
+    with open(arpa_path, 'w', encoding='utf8') as f:
+        f.write(ARPA.format(num_unigrams=3 if unk_line else 2, unk=unk_line))
+    return NgramLM(arpa_path)
+
+
+def log10(score):
+    return score / math.log(10)
+
+
+def test_oov_history_without_unk(tmp_path):
+    lm = load(tmp_path)
+    oov = lm.word_id('c')
+    assert oov == -1
+    a, b = lm.word_id('a'), lm.word_id('b')
+    # no backoff weight for a history out of the vocabulary
+    assert math.isclose(log10(lm.score((oov,), a)), -0.8, abs_tol=1e-6)
+    assert math.isclose(log10(lm.score((b, oov), a)), -0.8, abs_tol=1e-6)
+    assert math.isclose(log10(lm.score((oov,), oov)), -10.0, abs_tol=1e-6)
+    assert math.isclose(log10(lm.score((a,), b)), -0.2, abs_tol=1e-6)
+    assert math.isclose(log10(lm.score((b,), a)), -0.4 - 0.8, abs_tol=1e-6)
+
+
+def test_oov_history_with_unk(tmp_path):
+    lm = load(tmp_path, '-1.5\t<unk>\t-0.1\n')
+    oov = lm.word_id('c')
+    assert oov == lm.word_id('<unk>') >= 0
+    a = lm.word_id('a')
+    # the history is <unk>, with its backoff weight
+    assert math.isclose(log10(lm.score((oov,), a)), -0.1 - 0.8, abs_tol=1e-6)
+    assert math.isclose(log10(lm.score((a,), oov)), -0.3 - 1.5, abs_tol=1e-6)
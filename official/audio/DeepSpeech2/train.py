@@ -64,8 +64,15 @@ if __name__ == '__main__':
     ds_train = create_dataset(audio_conf=config.DataConfig.SpectConfig,
                               manifest_filepath=config.DataConfig.train_manifest,
                               labels=labels, normalize=True, train_mode=True,
-                              batch_size=config.DataConfig.batch_size, rank=rank_id, group_size=group_size)
+                              batch_size=config.DataConfig.batch_size, rank=rank_id, group_size=group_size,
+                              spect_cache_dir=config.DataConfig.spect_cache_dir,
+                              spect_cache_dtype=config.DataConfig.spect_cache_dtype,
+                              cache_workers=config.DataConfig.cache_workers,
+                              bucket_boundaries=config.DataConfig.bucket_boundaries)
     steps_size = ds_train.get_dataset_size()
+    if config.DataConfig.bucket_boundaries:
+        # every bucket has its own input shape, which dataset sink mode does not support
+        data_sink = False
 
     lr = get_lr(lr_init=config.OptimConfig.learning_rate, total_epochs=config.TrainingConfig.epochs,
                 steps_per_epoch=steps_size)
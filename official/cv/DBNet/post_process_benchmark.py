@@ -0,0 +1,126 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Throughput of the DBNet post-processing on the ICDAR2015 test set, images/s of the per contour scoring against
+the label map scoring of the outermost contours with 1 to --workers threads.
+
+The probability maps are rendered from the ground truth: the shrunk text polygons, blurred, with speckles of
+noise which make contours to reject, so no checkpoint is needed. The precision, recall and f-measure of every
+setting against the ground truth show that the boxes agree.
+
+Usage: python post_process_benchmark.py --gt_dir ~/ICDAR2015/Challenge4_Test_Task1_GT --workers 8
+"""
+import argparse
+import collections
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import pyclipper
+
+from src.utils.metric import QuadMetric
+from src.utils.post_process import SegDetectorRepresenter
+
+parser = argparse.ArgumentParser(description='DBNet post-processing benchmark')
+parser.add_argument('--gt_dir', type=str, default='~/ICDAR2015/Challenge4_Test_Task1_GT', help='ICDAR2015 gt dir')
+parser.add_argument('--eval_size', type=int, nargs=2, default=[736, 1280], help='Size [h, w] of the maps')
+parser.add_argument('--images', type=int, default=500, help='Images used, 0 for all')
+parser.add_argument('--workers', type=int, default=8, help='Max threads')
+parser.add_argument('--noise', type=float, default=0.002, help='Fraction of the pixels seeding a speckle')
+parser.add_argument('--thresh', type=float, default=0.3, help='Binarization threshold')
+parser.add_argument('--box_thresh', type=float, default=0.6, help='Score threshold of the boxes')
+parser.add_argument('--max_candidates', type=int, default=1000, help='Max contours of an image')
+args = parser.parse_args()
+
+
+def load_gt(gt_path):
+    """(K, 4, 2) polygons and (K,) dontcare flags of an ICDAR2015 gt file"""
+    polys = []
+    dontcare = []
+    with open(gt_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            gt = line.replace('\ufeff', '').strip().split(',')
+            if len(gt) < 9:
+                continue
+            polys.append([int(x) for x in gt[:8]])
+            dontcare.append('###' in gt[-1])
+    return np.array(polys, np.float32).reshape((-1, 4, 2)), np.array(dontcare, bool)
+
+
+def render(polys, seed):
+    """probability map of the shrunk polygons, as the DBNet shrink map, with noise"""
+    rng = np.random.RandomState(seed)
+    height, width = args.eval_size
+    prob = np.zeros((height, width), np.float32)
+    for poly in polys:
+        area = abs(cv2.contourArea(poly))
+        length = cv2.arcLength(poly.reshape((-1, 1, 2)), True)
+        if length == 0:
+            continue
+        offset = pyclipper.PyclipperOffset()
+        offset.AddPath(poly.astype(np.int64).tolist(), pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+        shrunk = offset.Execute(-area * (1 - 0.4 ** 2) / length)
+        if shrunk:
+            cv2.fillPoly(prob, [np.array(shrunk[0], np.int32)], float(rng.uniform(0.75, 0.98)))
+    seeds = rng.rand(height, width) < args.noise
+    speckles = cv2.dilate(seeds.astype(np.uint8), np.ones((3, 3), np.uint8)).astype(np.float32)
+    prob = np.maximum(prob, speckles * rng.uniform(0.3, 0.6, (height, width)).astype(np.float32))
+    return cv2.GaussianBlur(prob, (5, 5), 0)
+
+
+def run(post_process, samples):
+    """images/s and raw metrics of the samples, the images fed one by one as the eval loop"""
+    metric = QuadMetric()
+    raw_metrics = []
+    pending = collections.deque()
+    start = time.time()
+    for prob, polys, dontcare in samples:
+        pending.append((polys, dontcare, post_process.submit({'binary': prob[None, None]})))
+        while len(pending) >= post_process.num_workers:
+            polys, dontcare, result = pending.popleft()
+            raw_metrics.append((polys, dontcare, result.result()))
+    while pending:
+        polys, dontcare, result = pending.popleft()
+        raw_metrics.append((polys, dontcare, result.result()))
+    elapsed = time.time() - start
+    raw_metrics = [metric.validate_measure({'polys': polys[None], 'dontcare': dontcare[None]}, output)
+                   for polys, dontcare, output in raw_metrics]
+    return len(samples) / elapsed, metric.gather_measure(raw_metrics)
+
+
+if __name__ == '__main__':
+    gt_paths = sorted(glob.glob(os.path.join(os.path.expanduser(args.gt_dir), 'gt_*.txt')))
+    if args.images:
+        gt_paths = gt_paths[:args.images]
+    samples = []
+    for index, gt_path in enumerate(gt_paths):
+        polys, dontcare = load_gt(gt_path)
+        samples.append((render(polys, index), polys, dontcare))
+    print(f'{len(samples)} images of {args.gt_dir}, maps of {args.eval_size[0]}x{args.eval_size[1]}')
+    print(f'{"scoring":>10} {"workers":>8} {"images/s":>10} {"speedup":>8} {"precision":>10} {"recall":>8} '
+          f'{"fmeasure":>9}')
+    settings = [(False, 1)] + [(True, workers) for workers in sorted({1, 2, 4, args.workers}) if
+                               workers <= args.workers]
+    base = None
+    for component_score, workers in settings:
+        post_process = SegDetectorRepresenter(args.thresh, args.box_thresh, args.max_candidates,
+                                              component_score=component_score, num_workers=workers)
+        throughput, metrics = run(post_process, samples)
+        base = base or throughput
+        print(f'{"component" if component_score else "contour":>10} {workers:>8} {throughput:>10.1f} '
+              f'{throughput / base:>7.2f}x {metrics["precision"].avg:>10.4f} {metrics["recall"].avg:>8.4f} '
+              f'{metrics["fmeasure"].avg:>9.4f}')
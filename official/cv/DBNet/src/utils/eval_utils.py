@@ -17,6 +17,8 @@
 
 import os
 import time
+import collections
+from concurrent.futures import Future
 import numpy as np
 import cv2
 from tqdm.auto import tqdm
@@ -26,126 +28,126 @@ import mindspore as ms
 from .metric import QuadMetric
 from .post_process import SegDetectorRepresenter
 
-class WithEval:
-    def __init__(self, model, config):
-        super(WithEval, self).__init__()
-        self.model = model
+class EvalBase:
+    """
+    Eval loop of the batches. When config.eval.post_process_workers > 1, the post-processing and the metric of
+    the images run in the threads of the post-processing while the next batches are inferred.
+    """
+    def __init__(self, config):
+        super(EvalBase, self).__init__()
         self.config = config
         self.metric = QuadMetric(config.eval.polygon)
         self.post_process = SegDetectorRepresenter(config.eval.thresh, config.eval.box_thresh,
                                                    config.eval.max_candidates,
                                                    config.eval.unclip_ratio,
                                                    config.eval.polygon,
-                                                   config.eval.dest)
-    def once_eval(self, batch):
-        start = time.time()
-        img = ms.Tensor(batch['img'])
-        preds = self.model(img)
-        boxes, scores = self.post_process({'binary': preds})
-        cur_time = time.time() - start
-        raw_metric = self.metric.validate_measure(batch, (boxes, scores))
+                                                   config.eval.dest,
+                                                   config.eval.component_score,
+                                                   config.eval.post_process_workers)
 
-        cur_frame = img.shape[0]
+    def infer(self, batch):
+        """prediction of the batch, given to the post-processing"""
+        raise NotImplementedError
 
-        return raw_metric, (cur_frame, cur_time)
+    def once_eval(self, batch, preds):
+        """raw metric of the batch and the time of the metric"""
+        boxes, scores = self.post_process.represent(preds)
+        start = time.time()
+        raw_metric = self.metric.validate_measure(batch, (boxes, scores))
+        return raw_metric, time.time() - start
 
-    def eval(self, dataset, show_imgs=True):
+    def eval_batches(self, batches, show_imgs):
         total_frame = 0.0
-        total_time = 0.0
         raw_metrics = []
         count = 0
+        pool = self.post_process.pool
+        # (batch, future of its raw metric) not gathered yet
+        pending = collections.deque()
+        start = time.time()
 
-        for batch in tqdm(dataset):
-            raw_metric, (cur_frame, cur_time) = self.once_eval(batch)
+        def gather():
+            nonlocal start
+            batch, result = pending.popleft()
+            raw_metric, metric_time = result.result()
             raw_metrics.append(raw_metric)
+            if pool is None and len(raw_metrics) > 1:
+                # the time of the metric is not counted when it does not overlap the inference
+                start += metric_time
+            if show_imgs:
+                show_start = time.time()
+                self.save_image(batch, raw_metric, len(raw_metrics))
+                start += time.time() - show_start
+
+        for batch in tqdm(batches):
+            preds = self.infer(batch)
+            if pool is None:
+                result = Future()
+                result.set_result(self.once_eval(batch, preds))
+            else:
+                result = pool.submit(self.once_eval, batch, preds)
+            pending.append((batch, result))
             if count:
-                total_frame += cur_frame
-                total_time += cur_time
-
+                total_frame += batch['img'].shape[0]
+            else:
+                # the first batch compiles the network
+                start = time.time()
             count += 1
-            if show_imgs:
-                img = batch['original'].squeeze().astype('uint8')
-                # gt
-                for idx, poly in enumerate(raw_metric['gt_polys']):
-                    poly = np.expand_dims(poly, -2).astype(np.int32)
-                    if idx in raw_metric['gt_dont_care']:
-                        cv2.polylines(img, [poly], True, (255, 160, 160), 4)
-                    else:
-                        cv2.polylines(img, [poly], True, (255, 0, 0), 4)
-                # pred
-                for idx, poly in enumerate(raw_metric['det_polys']):
-                    poly = np.expand_dims(poly, -2).astype(np.int32)
-                    if idx in raw_metric['det_dont_care']:
-                        cv2.polylines(img, [poly], True, (200, 255, 200), 4)
-                    else:
-                        cv2.polylines(img, [poly], True, (0, 255, 0), 4)
-                if not os.path.exists(self.config.eval.image_dir):
-                    os.makedirs(self.config.eval.image_dir)
-                cv2.imwrite(self.config.eval.image_dir + f'eval_{count}.jpg', img)
+            while len(pending) >= self.post_process.num_workers:
+                gather()
+        while pending:
+            gather()
+        total_time = time.time() - start
 
         metrics = self.metric.gather_measure(raw_metrics)
         fps = total_frame / total_time
         return metrics, fps
 
+    def save_image(self, batch, raw_metric, count):
+        img = batch['original'].squeeze().astype('uint8')
+        # gt
+        for idx, poly in enumerate(raw_metric['gt_polys']):
+            poly = np.expand_dims(poly, -2).astype(np.int32)
+            if idx in raw_metric['gt_dont_care']:
+                cv2.polylines(img, [poly], True, (255, 160, 160), 4)
+            else:
+                cv2.polylines(img, [poly], True, (255, 0, 0), 4)
+        # pred
+        for idx, poly in enumerate(raw_metric['det_polys']):
+            poly = np.expand_dims(poly, -2).astype(np.int32)
+            if idx in raw_metric['det_dont_care']:
+                cv2.polylines(img, [poly], True, (200, 255, 200), 4)
+            else:
+                cv2.polylines(img, [poly], True, (0, 255, 0), 4)
+        if not os.path.exists(self.config.eval.image_dir):
+            os.makedirs(self.config.eval.image_dir)
+        cv2.imwrite(self.config.eval.image_dir + f'eval_{count}.jpg', img)
+
+
+class WithEval(EvalBase):
+    def __init__(self, model, config):
+        super(WithEval, self).__init__(config)
+        self.model = model
+
+    def infer(self, batch):
+        img = ms.Tensor(batch['img'])
+        preds = self.model(img)
+        return {'binary': preds.asnumpy()}
+
+    def eval(self, dataset, show_imgs=True):
+        return self.eval_batches(dataset, show_imgs)
+
 
-class Evaluate310:
+class Evaluate310(EvalBase):
     def __init__(self, config):
-        super(Evaluate310, self).__init__()
-        self.config = config
-        self.metric = QuadMetric(config.eval.polygon)
-        self.post_process = SegDetectorRepresenter(config.eval.thresh, config.eval.box_thresh,
-                                                   config.eval.max_candidates,
-                                                   config.eval.unclip_ratio,
-                                                   config.eval.polygon,
-                                                   config.eval.dest)
+        super(Evaluate310, self).__init__(config)
         self.gt_path = config.output_dir
         self.pred_path = os.path.join(config.output_dir, "eval_result_bin")
 
-    def once_eval(self, batch):
-        start = time.time()
-        preds = batch['pred']
-        boxes, scores = self.post_process(preds)
-        cur_time = time.time() - start
-        raw_metric = self.metric.validate_measure(batch, (boxes, scores))
-        cur_frame = batch['img'].shape[0]
-        return raw_metric, (cur_frame, cur_time)
+    def infer(self, batch):
+        return batch['pred']
 
     def eval(self, show_imgs=False):
-        total_frame = 0.0
-        total_time = 0.0
-        raw_metrics = []
-        count = 0
-
-        for batch in tqdm(self.get_batch()):
-            raw_metric, (cur_frame, cur_time) = self.once_eval(batch)
-            raw_metrics.append(raw_metric)
-            if count:
-                total_frame += cur_frame
-                total_time += cur_time
-            count += 1
-            if show_imgs:
-                img = batch['original'].squeeze().astype('uint8')
-                # gt
-                for idx, poly in enumerate(raw_metric['gt_polys']):
-                    poly = np.expand_dims(poly, -2).astype(np.int32)
-                    if idx in raw_metric['gt_dont_care']:
-                        cv2.polylines(img, [poly], True, (255, 160, 160), 4)
-                    else:
-                        cv2.polylines(img, [poly], True, (255, 0, 0), 4)
-                # pred
-                for idx, poly in enumerate(raw_metric['det_polys']):
-                    poly = np.expand_dims(poly, -2).astype(np.int32)
-                    if idx in raw_metric['det_dont_care']:
-                        cv2.polylines(img, [poly], True, (200, 255, 200), 4)
-                    else:
-                        cv2.polylines(img, [poly], True, (0, 255, 0), 4)
-                if not os.path.exists(self.config.eval.image_dir):
-                    os.makedirs(self.config.eval.image_dir)
-                cv2.imwrite(self.config.eval.image_dir + f'eval_{count}.jpg', img)
-
-        metrics = self.metric.gather_measure(raw_metrics)
-        fps = total_frame / total_time
-        return metrics, fps
+        return self.eval_batches(self.get_batch(), show_imgs)
 
     def get_shape(self, x):
         x = x.strip()[1:-1].split(", ")
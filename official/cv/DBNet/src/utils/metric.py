@@ -44,15 +44,12 @@ class DetectionIoUEvaluator:
         self.area_precision_constraint = area_precision_constraint
 
     def evaluate_image(self, gt, pred):
-        def get_union(pD, pG):
-            return Polygon(pD).union(Polygon(pG)).area
-
-        def get_intersection(pD, pG):
-            return Polygon(pD).intersection(Polygon(pG)).area
-
-        def get_intersection_over_union(pD, pG):
-            return get_intersection(pD, pG) / get_union(pD, pG)
+        """
+        Match the predictions of an image with its gts.
 
+        Every polygon is built once, and only the pairs whose bounding boxes overlap are intersected, the others
+        have no intersection. With polygons, the pairs of axis-aligned rectangles are intersected in closed form.
+        """
         # num of 'pred' & 'gt' matching
         det_match = 0
         pairs = []
@@ -74,74 +71,74 @@ class DetectionIoUEvaluator:
         evaluation_log = ""
 
         ## gt
-        for i in range(len(gt)):
-            poly = gt[i]['polys']
-            dontcare = gt[i]['dontcare']
-            if not Polygon(poly).is_valid or not Polygon(poly).is_simple:
+        gt_shapes = []
+        for item in gt:
+            poly = item['polys']
+            dontcare = item['dontcare']
+            shape = Polygon(poly)
+            if not shape.is_valid or not shape.is_simple:
                 continue
             gt_polys.append(poly)
+            gt_shapes.append(shape)
             if dontcare:
                 gt_polys_dontcare.append(len(gt_polys) - 1)
 
         evaluation_log += f"GT polygons: {str(len(gt_polys))}" + \
         (f" ({len(gt_polys_dontcare)} don't care)\n" if gt_polys_dontcare else "\n")
 
-        for i in range(len(pred)):
-            poly = pred[i]
-            if not Polygon(poly).is_valid or not Polygon(poly).is_simple:
+        det_shapes = []
+        for poly in pred:
+            shape = Polygon(poly)
+            if not shape.is_valid or not shape.is_simple:
                 continue
             det_polys.append(poly)
-
-            # For dontcare gt
-            if gt_polys_dontcare:
-                for idx in gt_polys_dontcare:
-                    dontcare_poly = gt_polys[idx]
-                    intersected_area = get_intersection(dontcare_poly, poly)
-                    poly_area = Polygon(poly).area
+            det_shapes.append(shape)
+
+        # For dontcare gt
+        if gt_polys_dontcare and det_polys:
+            gt_bounds = np.array([gt_shapes[idx].bounds for idx in gt_polys_dontcare])
+            det_bounds = np.array([shape.bounds for shape in det_shapes])
+            overlaps = self.bounds_overlap(gt_bounds, det_bounds)
+            gt_aligned = np.array([self.is_aligned(gt_polys[idx]) for idx in gt_polys_dontcare])
+            for det_idx in np.flatnonzero(overlaps.any(axis=0)):
+                poly_area = det_shapes[det_idx].area
+                det_aligned = self.is_aligned(det_polys[det_idx])
+                for dontcare_idx in np.flatnonzero(overlaps[:, det_idx]):
+                    if gt_aligned[dontcare_idx] and det_aligned:
+                        intersected_area = self.bounds_intersection(gt_bounds[dontcare_idx], det_bounds[det_idx])
+                    else:
+                        intersected_area = gt_shapes[gt_polys_dontcare[dontcare_idx]].intersection(
+                            det_shapes[det_idx]).area
                     precision = 0 if poly_area == 0 else intersected_area / poly_area
                     # If precision enough, append as dontcare det.
                     if precision > self.area_precision_constraint:
-                        det_polys_dontcare.append(len(det_polys) - 1)
+                        det_polys_dontcare.append(det_idx)
                         break
 
         evaluation_log += f"DET polygons: {len(det_polys)}" + \
         (f" ({len(det_polys_dontcare)} don't care)\n" if det_polys_dontcare else "\n")
 
         if gt_polys and det_polys:
-            # visit arrays
-            iou_mat = np.empty([len(gt_polys), len(det_polys)])
-            gt_rect_mat = np.zeros(len(gt_polys), np.int8)
-            det_rect_mat = np.zeros(len(det_polys), np.int8)
-
             # IoU
             if self.is_output_polygon:
-                # polygon
-                for gt_idx in range(len(gt_polys)):
-                    for det_idx in range(len(det_polys)):
-                        pG = gt_polys[gt_idx]
-                        pD = det_polys[det_idx]
-                        iou_mat[gt_idx, det_idx] = get_intersection_over_union(pD, pG)
+                iou_mat = self.polygon_iou_matrix(gt_polys, gt_shapes, det_polys, det_shapes)
             else:
-                # rectangle
-                for gt_idx in range(len(gt_polys)):
-                    for det_idx in range(len(det_polys)):
-                        pG = np.float32(gt_polys[gt_idx])
-                        pD = np.float32(det_polys[det_idx])
-                        iou_mat[gt_idx, det_idx] = self.iou_rotate(pD, pG)
-
-            for gt_idx in range(len(gt_polys)):
-                for det_idx in range(len(det_polys)):
-                    # If IoU == 0 and care
-                    if gt_rect_mat[gt_idx] == 0 and det_rect_mat[det_idx] == 0 \
-                    and (gt_idx not in gt_polys_dontcare) and (det_idx not in det_polys_dontcare):
-                        # If IoU enough
-                        if iou_mat[gt_idx, det_idx] > self.iou_constraint:
-                            # Mark the visit arrays
-                            gt_rect_mat[gt_idx] = 1
-                            det_rect_mat[det_idx] = 1
-                            det_match += 1
-                            pairs.append({'gt': gt_idx, 'det': det_idx})
-                            evaluation_log += f"Match GT #{gt_idx} with Det #{det_idx}\n"
+                iou_mat = self.rect_iou_matrix(gt_polys, det_polys)
+
+            # the first cared det of every cared gt, in order, with IoU enough and not matched yet
+            gt_care = np.ones(len(gt_polys), bool)
+            gt_care[gt_polys_dontcare] = False
+            det_care = np.ones(len(det_polys), bool)
+            det_care[det_polys_dontcare] = False
+            candidates = (iou_mat > self.iou_constraint) & gt_care[:, None] & det_care[None, :]
+            for gt_idx in np.flatnonzero(candidates.any(axis=1)):
+                det_indices = np.flatnonzero(candidates[gt_idx])
+                if det_indices.size:
+                    det_idx = int(det_indices[0])
+                    candidates[:, det_idx] = False
+                    det_match += 1
+                    pairs.append({'gt': int(gt_idx), 'det': det_idx})
+                    evaluation_log += f"Match GT #{gt_idx} with Det #{det_idx}\n"
 
         ## summary
         num_gt_care += (len(gt_polys) - len(gt_polys_dontcare))
@@ -174,6 +171,60 @@ class DetectionIoUEvaluator:
         }
         return metric
 
+    @staticmethod
+    def is_aligned(poly):
+        """Whether the poly is a rectangle with sides parallel to the axes."""
+        poly = np.asarray(poly)
+        if poly.shape != (4, 2):
+            return False
+        xs, ys = np.unique(poly[:, 0]), np.unique(poly[:, 1])
+        if xs.size != 2 or ys.size != 2:
+            return False
+        # the 4 corners, each once
+        return np.unique(poly, axis=0).shape[0] == 4
+
+    @staticmethod
+    def bounds_overlap(bounds_a, bounds_b):
+        """(A, B) mask of the pairs of (xmin, ymin, xmax, ymax) bounds which overlap or touch."""
+        return (bounds_a[:, None, 0] <= bounds_b[None, :, 2]) & (bounds_b[None, :, 0] <= bounds_a[:, None, 2]) & \
+               (bounds_a[:, None, 1] <= bounds_b[None, :, 3]) & (bounds_b[None, :, 1] <= bounds_a[:, None, 3])
+
+    @staticmethod
+    def bounds_intersection(bounds_a, bounds_b):
+        """Area of the intersection of (..., 4) bounds."""
+        width = np.minimum(bounds_a[..., 2], bounds_b[..., 2]) - np.maximum(bounds_a[..., 0], bounds_b[..., 0])
+        height = np.minimum(bounds_a[..., 3], bounds_b[..., 3]) - np.maximum(bounds_a[..., 1], bounds_b[..., 1])
+        return np.maximum(width, 0) * np.maximum(height, 0)
+
+    def polygon_iou_matrix(self, gt_polys, gt_shapes, det_polys, det_shapes):
+        gt_bounds = np.array([shape.bounds for shape in gt_shapes])
+        det_bounds = np.array([shape.bounds for shape in det_shapes])
+        gt_areas = np.array([shape.area for shape in gt_shapes])
+        det_areas = np.array([shape.area for shape in det_shapes])
+        overlaps = self.bounds_overlap(gt_bounds, det_bounds)
+        aligned = np.array([self.is_aligned(poly) for poly in gt_polys])[:, None] & \
+                  np.array([self.is_aligned(poly) for poly in det_polys])[None, :]
+        inter = self.bounds_intersection(gt_bounds[:, None], det_bounds[None, :]) * (overlaps & aligned)
+        for gt_idx, det_idx in zip(*np.nonzero(overlaps & ~aligned)):
+            inter[gt_idx, det_idx] = det_shapes[det_idx].intersection(gt_shapes[gt_idx]).area
+        union = gt_areas[:, None] + det_areas[None, :] - inter
+        iou_mat = np.zeros([len(gt_polys), len(det_polys)])
+        np.divide(inter, union, out=iou_mat, where=union > 0)
+        return iou_mat
+
+    def rect_iou_matrix(self, gt_polys, det_polys):
+        """iou_rotate of every (det, gt) pair, only the pairs whose minimum area rects overlap are intersected."""
+        def bounds(polys):
+            corners = np.array([cv2.boxPoints(cv2.minAreaRect(poly)) for poly in polys]).reshape((-1, 4, 2))
+            return np.concatenate((corners.min(axis=1), corners.max(axis=1)), axis=1)
+
+        gt_polys = [np.float32(poly) for poly in gt_polys]
+        det_polys = [np.float32(poly) for poly in det_polys]
+        iou_mat = np.zeros([len(gt_polys), len(det_polys)])
+        for gt_idx, det_idx in zip(*np.nonzero(self.bounds_overlap(bounds(gt_polys), bounds(det_polys)))):
+            iou_mat[gt_idx, det_idx] = self.iou_rotate(det_polys[det_idx], gt_polys[gt_idx])
+        return iou_mat
+
     def combine_results(self, results):
         num_global_care_gt = 0
         num_global_care_det = 0
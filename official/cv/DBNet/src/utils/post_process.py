@@ -14,9 +14,10 @@
 # ============================================================================
 # This file refers to the project https://github.com/MhLiao/DB.git
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import cv2
 import numpy as np
-from shapely.geometry import Polygon
 import pyclipper
 
 import mindspore as ms
@@ -24,8 +25,16 @@ import mindspore.ops as ops
 
 
 class SegDetectorRepresenter:
+    """
+    Boxes or polygons of the text regions of the probability maps.
+
+    With component_score, the outermost contours of an image are scored all at once from a label map, and only
+    the contours passing box_thresh are fitted and unclipped. Otherwise every contour is scored by filling its
+    polygon, as the original DB.
+    The images of a batch are processed by num_workers threads.
+    """
     def __init__(self, thresh=0.3, box_thresh=0.7, max_candidates=1000, unclip_ratio=1.5,
-                 is_output_polygon=False, dest='binary'):
+                 is_output_polygon=False, dest='binary', component_score=True, num_workers=1):
         self.min_size = 3
         self.thresh = thresh
         self.box_thresh = box_thresh
@@ -33,6 +42,9 @@ class SegDetectorRepresenter:
         self.unclip_ratio = unclip_ratio
         self.is_output_polygon = is_output_polygon
         self.dest = dest
+        self.component_score = component_score
+        self.num_workers = num_workers
+        self.pool = ThreadPoolExecutor(num_workers) if num_workers > 1 else None
 
     def __call__(self, pred):
         '''
@@ -46,6 +58,17 @@ class SegDetectorRepresenter:
             thresh: [if exists] thresh hold prediction with shape (N, H, W)
             thresh_binary: [if exists] binarized with threshold, (N, H, W)
         '''
+        return self.represent(pred, self.pool)
+
+    def submit(self, pred):
+        """Future of the boxes and scores of pred, computed by the pool if any."""
+        if self.pool is None:
+            future = Future()
+            future.set_result(self.represent(pred))
+            return future
+        return self.pool.submit(self.represent, pred)
+
+    def represent(self, pred, pool=None):
         if isinstance(pred, dict):
             pred = pred[self.dest][:, 0, :, :]
         else:
@@ -55,45 +78,78 @@ class SegDetectorRepresenter:
         if isinstance(pred, ms.Tensor):
             pred = pred.asnumpy()
         segmentation = self.binarize(pred)
-        boxes_batch = []
-        scores_batch = []
-        for batch_index in range(pred.shape[0]):
-            height, width = pred.shape[1:]
-            if self.is_output_polygon:
-                boxes, scores = self.polygons_from_bitmap(pred[batch_index], segmentation[batch_index], width, height)
-            else:
-                boxes, scores = self.boxes_from_bitmap(pred[batch_index], segmentation[batch_index], width, height)
-            boxes_batch.append(boxes)
-            scores_batch.append(scores)
+        height, width = pred.shape[1:]
+        from_bitmap = self.polygons_from_bitmap if self.is_output_polygon else self.boxes_from_bitmap
+
+        def represent_image(batch_index):
+            return from_bitmap(pred[batch_index], segmentation[batch_index], width, height)
+
+        if pool is None or pred.shape[0] == 1:
+            results = [represent_image(batch_index) for batch_index in range(pred.shape[0])]
+        else:
+            results = list(pool.map(represent_image, range(pred.shape[0])))
+        boxes_batch = [boxes for boxes, _ in results]
+        scores_batch = [scores for _, scores in results]
         return boxes_batch, scores_batch
 
     def binarize(self, pred):
         return pred > self.thresh
 
+    def contours_and_scores(self, pred, bitmap):
+        '''
+        Candidate contours of the bitmap and their scores.
+
+        A contour scores the mean of pred over its filled polygon, as box_score_fast. With component_score, the
+        outermost contours, whose filled polygons never overlap, are filled into one label map and scored by one
+        bincount. The holes and the contours inside them, whose polygons overlap the ones around them or share
+        pixels with each other, are scored by box_score_fast.
+        '''
+        bitmap = bitmap.astype(np.uint8)
+        if not self.component_score:
+            contours, _ = cv2.findContours(bitmap * 255, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            contours = contours[:self.max_candidates]
+            return contours, [self.box_score_fast(pred, contour.squeeze(1)) for contour in contours]
+        contours, hierarchy = cv2.findContours(bitmap, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        contours = contours[:self.max_candidates]
+        if not contours:
+            return [], np.zeros((0,), np.float32)
+        parents = hierarchy[0, :len(contours), 3]
+        labels = np.zeros(bitmap.shape, np.int32)
+        outermost = np.flatnonzero(parents < 0)
+        for index in outermost:
+            cv2.drawContours(labels, contours, index, int(index) + 1, thickness=-1)
+        # sums over the filled pixels only, a few percent of the map
+        filled = labels > 0
+        filled_labels = labels[filled]
+        sums = np.bincount(filled_labels, weights=pred[filled], minlength=len(contours) + 1)[1:]
+        counts = np.bincount(filled_labels, minlength=len(contours) + 1)[1:]
+        scores = (sums / np.maximum(counts, 1)).astype(np.float32)
+        for index in np.flatnonzero(parents >= 0):
+            scores[index] = self.box_score_fast(pred, contours[index].squeeze(1))
+        return contours, scores
+
     def polygons_from_bitmap(self, pred, _bitmap, dest_width, dest_height):
         '''
         _bitmap: single map with shape (H, W), whose values are binarized as {0, 1}
         '''
 
         assert len(_bitmap.shape) == 2
-        bitmap = _bitmap.asnumpy()  # The first channel
+        bitmap = _bitmap if isinstance(_bitmap, np.ndarray) else _bitmap.asnumpy()  # The first channel
         height, width = bitmap.shape
         boxes = []
         scores = []
 
-        contours, _ = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        contours, contour_scores = self.contours_and_scores(pred, bitmap)
 
-        for contour in contours[:self.max_candidates]:
+        for contour, score in zip(contours, contour_scores):
+            if self.box_thresh > score:
+                continue
             epsilon = 0.005 * cv2.arcLength(contour, True)
             approx = cv2.approxPolyDP(contour, epsilon, True)
             points = approx.reshape((-1, 2))
             if points.shape[0] < 4:
                 continue
 
-            score = self.box_score_fast(pred, contour.squeeze(1))
-            if self.box_thresh > score:
-                continue
-
             if points.shape[0] > 2:
                 box = self.unclip(points, unclip_ratio=self.unclip_ratio)
                 if len(box) > 1:
@@ -132,20 +188,16 @@ class SegDetectorRepresenter:
 
         # Contour & Constraint
         height, width = bitmap.shape
-        contours, _ = cv2.findContours((bitmap * 255).astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        num_contours = min(len(contours), self.max_candidates)
-
-        # Init
-        boxes = np.zeros((num_contours, 4, 2), dtype=np.int16)
-        scores = np.zeros((num_contours,), dtype=np.float32)
+        contours, contour_scores = self.contours_and_scores(pred, bitmap)
+        # only the contours passing the score are fitted and unclipped
+        candidates = [index for index, score in enumerate(contour_scores) if score >= self.box_thresh]
 
-        for index in range(num_contours):
+        boxes = []
+        scores = []
+        for index in candidates:
             # (4, 1, 2) -> (4, 2)
             contour = contours[index].squeeze(1)
-            # Score
-            score = self.box_score_fast(pred, contour)
-            if self.box_thresh > score:
-                continue
+            score = contour_scores[index]
             # Box's points
             points, sside = self.get_mini_boxes(contour)
             if sside < self.min_size:
@@ -164,13 +216,13 @@ class SegDetectorRepresenter:
             # clip
             box[:, 0] = np.clip(np.round(box[:, 0] / width * dest_width), 0, dest_width)
             box[:, 1] = np.clip(np.round(box[:, 1] / height * dest_height), 0, dest_height)
-            boxes[index, :, :] = box.astype(np.int16)
-            scores[index] = score
-        return boxes, scores
+            boxes.append(box.astype(np.int16))
+            scores.append(score)
+        return np.array(boxes, np.int16).reshape((-1, 4, 2)), np.array(scores, np.float32)
 
     def unclip(self, box, unclip_ratio=1.5):
-        poly = Polygon(box)
-        distance = poly.area * unclip_ratio / poly.length
+        contour = np.asarray(box, np.float32).reshape((-1, 1, 2))
+        distance = abs(cv2.contourArea(contour)) * unclip_ratio / cv2.arcLength(contour, True)
         offset = pyclipper.PyclipperOffset()
         offset.AddPath(box, pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
         expanded = np.array(offset.Execute(distance))
@@ -29,6 +29,8 @@ from mindspore.train.serialization import load_checkpoint, load_param_into_net
 
 from src.backbone.resnet import get_backbone
 from src.my_logging import get_logger
+from src.similarity_search import blocked_topk, create_embedding_file
+from src.embedding_cache import EmbeddingCache
 
 from model_utils.config import config
 from model_utils.moxing_adapter import moxing_wrapper
@@ -65,15 +67,17 @@ class TxtDataset():
         return self.labels
 
 class DistributedSampler():
-    '''DistributedSampler'''
-    def __init__(self, dataset):
+    '''DistributedSampler, over the given indices of the dataset if not None'''
+    def __init__(self, dataset, indices=None):
         self.dataset = dataset
+        self.indices = indices
         self.num_replicas = 1
         self.rank = 0
-        self.num_samples = int(math.ceil(len(self.dataset) * 1.0 / self.num_replicas))
+        num = len(self.dataset) if indices is None else len(indices)
+        self.num_samples = int(math.ceil(num * 1.0 / self.num_replicas))
 
     def __iter__(self):
-        indices = list(range(len(self.dataset)))
+        indices = list(range(len(self.dataset))) if self.indices is None else list(self.indices)
         indices = indices[self.rank::self.num_replicas]
         return iter(indices)
 
@@ -82,13 +86,15 @@ class DistributedSampler():
 
 def get_dataloader(img_predix_all, img_list_all, batch_size, img_transforms):
     dataset = TxtDataset(img_predix_all, img_list_all)
-    sampler = DistributedSampler(dataset)
+    return create_dataloader(dataset, batch_size, img_transforms), len(dataset), dataset.get_all_labels()
+
+def create_dataloader(dataset, batch_size, img_transforms, indices=None):
+    sampler = DistributedSampler(dataset, indices)
     dataset_column_names = ["image", "index"]
     ds = de.GeneratorDataset(dataset, column_names=dataset_column_names, sampler=sampler)
     ds = ds.map(input_columns=["image"], operations=img_transforms)
     ds = ds.batch(batch_size, num_parallel_workers=8, drop_remainder=False)
-
-    return ds, len(dataset), dataset.get_all_labels()
+    return ds
 
 def generate_test_pair(jk_list, zj_list):
     '''generate_test_pair'''
@@ -146,51 +152,17 @@ def get_model(args):
     net.set_train(False)
     return net
 
-def topk(matrix, k, axis=1):
-    '''topk'''
-    if axis == 0:
-        row_index = np.arange(matrix.shape[1 - axis])
-        topk_index = np.argpartition(-matrix, k, axis=axis)[0:k, :]
-        topk_data = matrix[topk_index, row_index]
-        topk_index_sort = np.argsort(-topk_data, axis=axis)
-        topk_data_sort = topk_data[topk_index_sort, row_index]
-        topk_index_sort = topk_index[0:k, :][topk_index_sort, row_index]
-    else:
-        column_index = np.arange(matrix.shape[1 - axis])[:, None]
-        topk_index = np.argpartition(-matrix, k, axis=axis)[:, 0:k]
-        topk_data = matrix[column_index, topk_index]
-        topk_index_sort = np.argsort(-topk_data, axis=axis)
-        topk_data_sort = topk_data[column_index, topk_index_sort]
-        topk_index_sort = topk_index[:, 0:k][column_index, topk_index_sort]
-    return topk_data_sort, topk_index_sort
-
-def cal_topk(args, idx, zj2jk_pairs, test_embedding_tot, dis_embedding_tot):
-    '''cal_topk'''
-    args.logger.info('start idx:{} subprocess...'.format(idx))
+def cal_topk(zj2jk_pairs, test_index, test_embedding, dis_top1):
+    '''cal_topk, with the top1 similarity of every test embedding to the dis embeddings'''
     correct = np.array([0] * 2)
     tot = np.array([0])
-
-    zj, jk_all = zj2jk_pairs[idx]
-    zj_embedding = test_embedding_tot[zj]
-    jk_all_embedding = np.concatenate([np.expand_dims(test_embedding_tot[jk], axis=0) for jk in jk_all], axis=0)
-    args.logger.info('INFO, calculate top1 acc index:{}, zj_embedding shape:{}'.format(idx, zj_embedding.shape))
-    args.logger.info('INFO, calculate top1 acc index:{}, jk_all_embedding shape:{}'.format(idx, jk_all_embedding.shape))
-
-    test_time = time.time()
-    mm = np.matmul(np.expand_dims(zj_embedding, axis=0), dis_embedding_tot)
-    top100_jk2zj = np.squeeze(topk(mm, 100)[0], axis=0)
-    top100_zj2jk = topk(np.matmul(jk_all_embedding, dis_embedding_tot), 100)[0]
-    test_time_used = time.time() - test_time
-    args.logger.info('INFO, calculate top1 acc index:{}, np.matmul().top(100) time used:{:.2f}s'.format(
-        idx, test_time_used))
-    tot[0] = len(jk_all)
-    for i, jk in enumerate(jk_all):
-        jk_embedding = test_embedding_tot[jk]
-        similarity = np.dot(jk_embedding, zj_embedding)
-        if similarity > top100_jk2zj[0]:
-            correct[0] += 1
-        if similarity > top100_zj2jk[i, 0]:
-            correct[1] += 1
+    for zj, jk_all in zj2jk_pairs:
+        zj_index = test_index[zj]
+        jk_index = [test_index[jk] for jk in jk_all]
+        similarity = np.matmul(test_embedding[jk_index], test_embedding[zj_index])
+        correct[0] += np.sum(similarity > dis_top1[zj_index])
+        correct[1] += np.sum(similarity > dis_top1[jk_index])
+        tot[0] += len(jk_all)
     return correct, tot
 
 def l2normalize(features):
@@ -265,8 +237,8 @@ def run_eval(args):
     args.logger.info('INFO, graph compile finished, time used:{:.2f}s, start calculate img embedding'.
                      format(compile_time_used))
 
-    img_transforms = transforms.Compose([vision.ToTensor(),
-                                         vision.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5), is_hwc=False)])
+    mean, std = (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)
+    img_transforms = transforms.Compose([vision.ToTensor(), vision.Normalize(mean, std, is_hwc=False)])
 
     #for test images
     args.logger.info('INFO, start step1, calculate test img embedding, weight file = {}'.format(args.weight))
@@ -289,9 +261,9 @@ def run_eval(args):
     except ValueError:
         return 0
 
-    test_embedding_tot = {}
+    test_index = {}
     for idx, label in enumerate(test_img_labels):
-        test_embedding_tot[label] = test_embedding_tot_np[idx]
+        test_index[label] = idx
 
     step2_start_time = time.time()
     step1_time_used = step2_start_time - step1_start_time
@@ -299,31 +271,52 @@ def run_eval(args):
                      format(step1_time_used))
 
     # for dis images
-    ds_dis, img_tot, _ = get_dataloader(args.dis_img_predix, args.dis_img_list, args.dis_batch_size, img_transforms)
-    dis_embedding_tot_np = np.zeros((img_tot, args.emb_size))
-    total_batch = ds_dis.get_dataset_size()
+    dis_dataset = TxtDataset(args.dis_img_predix, args.dis_img_list)
+    img_tot = len(dis_dataset)
+    dis_embedding_file = os.path.join(args.ckpt_path, 'dis_embedding.npy')
+    dis_embedding_tot_np = create_embedding_file(dis_embedding_file, img_tot, args.emb_size, args.dis_embedding_dtype)
+    todo_indices = None
+    cache = None
+    if args.embedding_cache_dir:
+        # everything changing the embeddings besides the checkpoint
+        cache_config = {'transforms': ['ToTensor', 'Normalize'], 'mean': mean, 'std': std,
+                        'backbone': args.backbone, 'use_se': args.use_se, 'act_type': args.act_type,
+                        'pre_bn': args.pre_bn, 'inference': args.inference, 'use_drop': args.use_drop,
+                        'fp32': args.device_target == 'GPU'}
+        cache = EmbeddingCache(args.embedding_cache_dir, args.weight, cache_config, args.emb_size,
+                               args.dis_embedding_dtype, args.embedding_cache_shard_size)
+        todo_indices = cache.fill(dis_dataset.imgs, dis_embedding_tot_np).tolist()
+        args.logger.info('INFO, embedding cache {}: {} embeddings, {}/{} dis img cached'.format(
+            cache.cache_dir, len(cache), img_tot - len(todo_indices), img_tot))
+    total_batch = 0
+    data_loader = []
+    if todo_indices is None or todo_indices:
+        ds_dis = create_dataloader(dis_dataset, args.dis_batch_size, img_transforms, todo_indices)
+        total_batch = ds_dis.get_dataset_size()
+        data_loader = ds_dis.create_dict_iterator(output_numpy=True, num_epochs=1)
     args.logger.info('INFO, dataloader total dis img:{}, total dis batch:{}'.format(img_tot, total_batch))
     start_time = time.time()
-    img_per_gpu = int(math.ceil(1.0 * img_tot / args.world_size))
-    delta_num = img_per_gpu * args.world_size - img_tot
-    start_idx = img_per_gpu * args.local_rank - max(0, args.local_rank - (args.world_size - delta_num))
-    data_loader = ds_dis.create_dict_iterator(output_numpy=True, num_epochs=1)
     for idx, data in enumerate(data_loader):
-        img = data["image"]
+        img, idxs = data["image"], data["index"]
         out = net(Tensor(img)).asnumpy().astype(np.float32)
         embeddings = l2normalize(out)
-        dis_embedding_tot_np[start_idx:(start_idx + embeddings.shape[0])] = embeddings
-        start_idx += embeddings.shape[0]
+        try:
+            check_minmax(args, np.linalg.norm(embeddings, ord=2, axis=1))
+        except ValueError:
+            return 0
+        dis_embedding_tot_np[idxs] = embeddings
+        if cache is not None:
+            cache.put([dis_dataset.imgs[i] for i in idxs], embeddings)
         if args.local_rank % 8 == 0 and idx % args.log_interval == 0 and idx > 0:
             speed = 1.0 * (args.dis_batch_size * args.log_interval * args.world_size) / (time.time() - start_time)
             time_left = (total_batch - idx - 1) * args.dis_batch_size *args.world_size / speed
             args.logger.info('INFO, processed [{}/{}], speed: {:.2f} img/s, left:{:.2f}s'.
                              format(idx, total_batch, speed, time_left))
             start_time = time.time()
-    try:
-        check_minmax(args, np.linalg.norm(dis_embedding_tot_np, ord=2, axis=1))
-    except ValueError:
-        return 0
+    if cache is not None:
+        cache.flush()
+    dis_embedding_tot_np.flush()
+    dis_embedding_tot_np = None
 
     step3_start_time = time.time()
     step2_time_used = step3_start_time - step2_start_time
@@ -334,8 +327,10 @@ def run_eval(args):
     img = None
     net = None
 
-    dis_embedding_tot_np = np.transpose(dis_embedding_tot_np, (1, 0))
-    args.logger.info('INFO, calculate top1 acc dis_embedding_tot_np shape:{}'.format(dis_embedding_tot_np.shape))
+    args.logger.info('INFO, calculate top1 acc, test embedding shape:{}, dis embedding file:{}'.format(
+        test_embedding_tot_np.shape, dis_embedding_file))
+    dis_top1 = blocked_topk(test_embedding_tot_np, dis_embedding_file, k=1, query_tile=args.search_query_tile,
+                            dis_tile=args.search_dis_tile, workers=args.search_workers, logger=args.logger)[0][:, 0]
 
     # find best match
     assert len(args.test_img_list) % 2 == 0
@@ -349,11 +344,10 @@ def run_eval(args):
         zj2jk_pairs = sorted(generate_test_pair(jk_list, zj_list))
         sampler = DistributedSampler(zj2jk_pairs)
         args.logger.info('INFO, calculate top1 acc sampler len:{}'.format(len(sampler)))
-        for idx in sampler:
-            out1, out2 = cal_topk(args, idx, zj2jk_pairs, test_embedding_tot, dis_embedding_tot_np)
-            correct[2 * i] += out1[0]
-            correct[2 * i + 1] += out1[1]
-            tot[i] += out2[0]
+        out1, out2 = cal_topk([zj2jk_pairs[idx] for idx in sampler], test_index, test_embedding_tot_np, dis_top1)
+        correct[2 * i] += out1[0]
+        correct[2 * i + 1] += out1[1]
+        tot[i] += out2[0]
 
     args.logger.info('local_rank={},tot={},correct={}'.format(args.local_rank, tot, correct))
 
@@ -0,0 +1,118 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+On-disk embedding cache.
+
+The embeddings of a model are stored under cache_dir/<key>, where key is a hash of the checkpoint content
+and of the model and transform config, so a new checkpoint or transform never reads stale embeddings.
+Inside, embeddings are keyed by image path and stored in shards: shard_<n>.npy holds the embeddings and
+shard_<n>.txt the image paths of its rows. A shard is only used once its .txt file exists, and shards are
+never modified, so an interrupted run loses at most the shard being written.
+"""
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    '''sha256 of the content of a file'''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class EmbeddingCache():
+    '''
+    EmbeddingCache
+
+    Args:
+        cache_dir (str): root directory of the cache.
+        weight_file (str): checkpoint file of the model.
+        config (dict): model and transform config, every value changing the embeddings.
+        emb_size (int): embedding size.
+        dtype (str): dtype of the stored embeddings. Default: 'float32'.
+        shard_size (int): embeddings of a shard. Default: 16384.
+    '''
+    def __init__(self, cache_dir, weight_file, config, emb_size, dtype='float32', shard_size=16384):
+        key = {'checkpoint': file_sha256(weight_file), 'config': config, 'emb_size': emb_size,
+               'dtype': np.dtype(dtype).name}
+        self.key = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, self.key)
+        self.emb_size = emb_size
+        self.dtype = np.dtype(dtype)
+        self.shard_size = shard_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        key_file = os.path.join(self.cache_dir, 'key.json')
+        if not os.path.exists(key_file):
+            with open(key_file, 'w') as f:
+                json.dump(key, f, sort_keys=True, indent=2)
+
+        # image path -> (shard, row)
+        self.index = {}
+        self.shards = []
+        self.next_shard = 0
+        for paths_file in sorted(glob.glob(os.path.join(self.cache_dir, 'shard_*[0-9].txt'))):
+            self.next_shard = int(os.path.basename(paths_file)[6:-4]) + 1
+            shard = len(self.shards)
+            with open(paths_file, 'r') as f:
+                for row, line in enumerate(f):
+                    self.index[line.rstrip('\n')] = (shard, row)
+            self.shards.append(np.load(paths_file[:-4] + '.npy', mmap_mode='r'))
+        self.pending_paths = []
+        self.pending_embeddings = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def fill(self, paths, out):
+        '''copy the cached embeddings of paths into the rows of out, returns the indices of the missing paths'''
+        location = np.array([self.index.get(path, (-1, -1)) for path in paths], np.int64).reshape(-1, 2)
+        for shard, embeddings in enumerate(self.shards):
+            selected = np.nonzero(location[:, 0] == shard)[0]
+            if selected.size:
+                out[selected] = embeddings[location[selected, 1]]
+        return np.nonzero(location[:, 0] < 0)[0]
+
+    def put(self, paths, embeddings):
+        '''add embeddings, written as a new shard every shard_size embeddings'''
+        self.pending_paths.extend(paths)
+        self.pending_embeddings.append(np.asarray(embeddings, self.dtype))
+        if len(self.pending_paths) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        '''write the added embeddings as a new shard'''
+        if not self.pending_paths:
+            return
+        name = os.path.join(self.cache_dir, 'shard_{:05d}'.format(self.next_shard))
+        embeddings = np.concatenate(self.pending_embeddings, axis=0)
+        np.save(name + '.tmp.npy', embeddings)
+        os.replace(name + '.tmp.npy', name + '.npy')
+        with open(name + '.tmp.txt', 'w') as f:
+            f.write(''.join(path + '\n' for path in self.pending_paths))
+        os.replace(name + '.tmp.txt', name + '.txt')
+
+        shard = len(self.shards)
+        for row, path in enumerate(self.pending_paths):
+            self.index[path] = (shard, row)
+        self.shards.append(np.load(name + '.npy', mmap_mode='r'))
+        self.next_shard += 1
+        self.pending_paths = []
+        self.pending_embeddings = []
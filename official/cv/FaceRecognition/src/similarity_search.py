@@ -0,0 +1,140 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Blocked top-k similarity search of query embeddings against memory-mapped dis embeddings.
+
+The dis embeddings are an (N, emb_size) float16, float32 or float64 .npy file. It is split into tiles of
+dis_tile rows, every tile is multiplied with the queries in tiles of query_tile rows, and the top-k of the
+tiles are merged into a running top-k. The tiles are spread across a process pool, which opens the file
+memory-mapped, so only one tile per process is in memory.
+"""
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+# set in every process by _init_worker
+_queries = None
+_dis_embedding = None
+_query_tile = None
+_k = None
+
+
+def create_embedding_file(path, num, emb_size, dtype='float32'):
+    '''create a memory-mapped .npy file of num embeddings to be filled'''
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.dtype(dtype), shape=(num, emb_size))
+
+
+def open_embedding_file(path):
+    '''open a .npy embedding file memory-mapped'''
+    return np.load(path, mmap_mode='r')
+
+
+def _compute_dtype(dtype):
+    '''float16 tiles are multiplied in float32'''
+    return np.promote_types(dtype, np.float32)
+
+
+def tile_topk(scores, k):
+    '''top-k values and indices of every row, unsorted'''
+    if k == 1:
+        index = np.argmax(scores, axis=1)[:, None]
+    else:
+        index = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(scores, index, axis=1), index
+
+
+def merge_topk(values, indices, new_values, new_indices, k):
+    '''merge two top-k of the same rows'''
+    k = min(k, values.shape[1] + new_values.shape[1])
+    values = np.concatenate((values, new_values), axis=1)
+    indices = np.concatenate((indices, new_indices), axis=1)
+    top_values, top = tile_topk(values, k)
+    return top_values, np.take_along_axis(indices, top, axis=1)
+
+
+def _init_worker(queries, dis_file, query_tile, k):
+    global _queries, _dis_embedding, _query_tile, _k
+    _dis_embedding = open_embedding_file(dis_file)
+    _queries = queries.astype(_compute_dtype(_dis_embedding.dtype), copy=False)
+    _query_tile = query_tile
+    _k = k
+
+
+def _search_tile(tile):
+    '''top-k of all queries against dis rows [start, end)'''
+    start, end = tile
+    start_time = time.time()
+    dis_tile = np.asarray(_dis_embedding[start:end], dtype=_queries.dtype)
+    k = min(_k, end - start)
+    values = np.empty((_queries.shape[0], k), _queries.dtype)
+    indices = np.empty((_queries.shape[0], k), np.int64)
+    for q_start in range(0, _queries.shape[0], _query_tile):
+        q_end = q_start + _query_tile
+        scores = np.matmul(_queries[q_start:q_end], dis_tile.T)
+        values[q_start:q_end], indices[q_start:q_end] = tile_topk(scores, k)
+    return start, end, values, indices + start, time.time() - start_time
+
+
+def blocked_topk(queries, dis_file, k=1, query_tile=1024, dis_tile=16384, workers=1, logger=None):
+    """
+    Top-k similarity of every query against the dis embeddings.
+
+    Args:
+        queries (numpy.ndarray): query embeddings of shape (Q, emb_size).
+        dis_file (str): .npy file of the dis embeddings of shape (N, emb_size).
+        k (int): number of the most similar dis embeddings. Default: 1.
+        query_tile (int): rows of the query tiles. Default: 1024.
+        dis_tile (int): rows of the dis tiles. Default: 16384.
+        workers (int): number of processes, 1 to search in the calling process. Default: 1.
+        logger: logs the throughput of every tile if not None. Default: None.
+
+    Returns:
+        values and indices of shape (Q, k), sorted by descending similarity.
+    """
+    num = open_embedding_file(dis_file).shape[0]
+    k = min(k, num)
+    tiles = [(start, min(start + dis_tile, num)) for start in range(0, num, dis_tile)]
+    values = np.full((queries.shape[0], 0), -np.inf)
+    indices = np.zeros((queries.shape[0], 0), np.int64)
+    start_time = time.time()
+
+    def _merge(done, result):
+        nonlocal values, indices
+        start, end, tile_values, tile_indices, tile_time = result
+        values, indices = merge_topk(values, indices, tile_values, tile_indices, k)
+        if logger is not None:
+            speed = queries.shape[0] * (end - start) / max(tile_time, 1e-6) / 1e6
+            logger.info('INFO, search tile [{}/{}], dis [{}, {}), time used:{:.2f}s, {:.2f}M pairs/s'.format(
+                done, len(tiles), start, end, tile_time, speed))
+
+    if workers <= 1:
+        _init_worker(queries, dis_file, query_tile, k)
+        for i, tile in enumerate(tiles):
+            _merge(i + 1, _search_tile(tile))
+    else:
+        with Pool(min(workers, len(tiles)), initializer=_init_worker,
+                  initargs=(queries, dis_file, query_tile, k)) as pool:
+            for i, result in enumerate(pool.imap_unordered(_search_tile, tiles)):
+                _merge(i + 1, result)
+
+    order = np.argsort(-values, axis=1, kind='stable')
+    values = np.take_along_axis(values, order, axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+    if logger is not None:
+        elapsed = time.time() - start_time
+        logger.info('INFO, search finished, {} queries x {} dis, time used:{:.2f}s, {:.2f}M pairs/s'.format(
+            queries.shape[0], num, elapsed, queries.shape[0] * num / max(elapsed, 1e-6) / 1e6))
+    return values, indices
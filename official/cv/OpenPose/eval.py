@@ -13,8 +13,10 @@
 # limitations under the License.
 # ============================================================================
 
+import collections
 import json
 import os
+import time
 import warnings
 import sys
 import numpy as np
@@ -126,69 +128,56 @@ def compute_optimal_size(orig_img, img_size, stride=8):
 
 
 def compute_peaks_from_heatmaps(heatmaps):
-
-    heatmaps = heatmaps[:-1]
-
-    all_peaks = []
-    peak_counter = 0
-    for i, heatmap in enumerate(heatmaps):
-        heatmap = gaussian_filter(heatmap, sigma=config.gaussian_sigma)
-
-        map_left = np.zeros(heatmap.shape)
-        map_right = np.zeros(heatmap.shape)
-        map_top = np.zeros(heatmap.shape)
-        map_bottom = np.zeros(heatmap.shape)
-
-        map_left[1:, :] = heatmap[:-1, :]
-        map_right[:-1, :] = heatmap[1:, :]
-        map_top[:, 1:] = heatmap[:, :-1]
-        map_bottom[:, :-1] = heatmap[:, 1:]
-
-        peaks_binary = np.logical_and.reduce((
-            heatmap > config.heatmap_peak_thresh,
-            heatmap > map_left,
-            heatmap > map_right,
-            heatmap > map_top,
-            heatmap > map_bottom,
-        ))
-
-        peaks = zip(np.nonzero(peaks_binary)[1], np.nonzero(peaks_binary)[0])
-
-        peaks_with_score = [(i,) + peak_pos + (heatmap[peak_pos[1], peak_pos[0]],) for peak_pos in peaks]
-
-        peaks_id = range(peak_counter, peak_counter + len(peaks_with_score))
-        peaks_with_score_and_id = [peaks_with_score[i] + (peaks_id[i],) for i in range(len(peaks_id))]
-
-        peak_counter += len(peaks_with_score_and_id)
-        all_peaks.append(peaks_with_score_and_id)
-    all_peaks = np.array([peak for peaks_each_category in all_peaks for peak in peaks_each_category])
-
-    return all_peaks
+    """
+    (N, 5) peaks [joint type, x, y, score, id] of the heatmaps but the background one, all the heatmaps
+    smoothed and compared with their 4 neighbours at once
+    """
+    sigma = config.gaussian_sigma
+    heatmaps = gaussian_filter(heatmaps[:-1], sigma=(0, sigma, sigma))
+    padded = np.pad(heatmaps, ((0, 0), (1, 1), (1, 1)))
+
+    peaks_binary = np.logical_and.reduce((
+        heatmaps > config.heatmap_peak_thresh,
+        heatmaps > padded[:, :-2, 1:-1],
+        heatmaps > padded[:, 2:, 1:-1],
+        heatmaps > padded[:, 1:-1, :-2],
+        heatmaps > padded[:, 1:-1, 2:],
+    ))
+
+    joints, ys, xs = np.nonzero(peaks_binary)
+    all_peaks = np.stack([joints, xs, ys, heatmaps[joints, ys, xs], np.arange(len(joints))], axis=1)
+    return all_peaks.astype(np.float64)
 
 
 def compute_candidate_connections(paf, cand_a, cand_b, img_len, params_):
-    candidate_connections = []
-    for joint_a in cand_a:
-        for joint_b in cand_b:
-            vector = joint_b[:2] - joint_a[:2]
-            norm = np.linalg.norm(vector)
-            if norm == 0:
-                continue
-            ys = np.linspace(joint_a[1], joint_b[1], num=params_.n_integ_points)
-            xs = np.linspace(joint_a[0], joint_b[0], num=params_.n_integ_points)
-            integ_points = np.stack([ys, xs]).T.round().astype('i')
-
-            paf_in_edge = np.hstack([paf[0][np.hsplit(integ_points, 2)], paf[1][np.hsplit(integ_points, 2)]])
-            unit_vector = vector / norm
-            inner_products = np.dot(paf_in_edge, unit_vector)
-            integ_value = inner_products.sum() / len(inner_products)
-            integ_value_with_dist_prior = integ_value + min(params_.limb_length_ratio * img_len / norm -
-                                                            params_.length_penalty_value, 0)
-            n_valid_points = sum(inner_products > params_.inner_product_thresh)
-            if n_valid_points > params_.n_integ_points_thresh and integ_value_with_dist_prior > 0:
-                candidate_connections.append([int(joint_a[3]), int(joint_b[3]), integ_value_with_dist_prior])
-    candidate_connections = sorted(candidate_connections, key=lambda x: x[2], reverse=True)
-    return candidate_connections
+    """
+    indices in cand_a and cand_b and scores of the candidate connections, by descending score. The PAF is
+    sampled along the segments of all the (a, b) pairs at once.
+    """
+    n_points = params_.n_integ_points
+    starts = cand_a[:, None, :2]
+    vectors = cand_b[None, :, :2] - starts  # (Na, Nb, 2) [x, y]
+    norms = np.linalg.norm(vectors, axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unit_vectors = vectors / norms[:, :, None]
+        # the samples of np.linspace, start + i * step with the end point exact
+        points = np.arange(n_points)[:, None] * (vectors / (n_points - 1))[:, :, None, :] + starts[:, :, None, :]
+    points[:, :, -1] = cand_b[None, :, :2]
+    points = points.round().astype('i')
+    xs, ys = points[..., 0], points[..., 1]
+
+    inner_products = paf[0][ys, xs] * unit_vectors[:, :, 0, None] + paf[1][ys, xs] * unit_vectors[:, :, 1, None]
+    integ_values = inner_products.sum(axis=2) / n_points
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist_priors = np.minimum(params_.limb_length_ratio * img_len / norms - params_.length_penalty_value, 0)
+    integ_values_with_dist_prior = integ_values + dist_priors
+    n_valid_points = np.sum(inner_products > params_.inner_product_thresh, axis=2)
+
+    valid = (norms != 0) & (n_valid_points > params_.n_integ_points_thresh) & (integ_values_with_dist_prior > 0)
+    index_a, index_b = np.nonzero(valid)
+    scores = integ_values_with_dist_prior[index_a, index_b]
+    order = np.argsort(-scores, kind='stable')
+    return index_a[order], index_b[order], scores[order]
 
 
 def compute_connections(pafs, all_peaks, img_len, params_):
@@ -201,83 +190,95 @@ def compute_connections(pafs, all_peaks, img_len, params_):
         cand_b = all_peaks[all_peaks[:, 0] == limb_point[1]][:, 1:]
 
         if cand_a.shape[0] > 0 and cand_b.shape[0] > 0:
-            candidate_connections = compute_candidate_connections(paf, cand_a, cand_b, img_len, params_)
-
-            connections = np.zeros((0, 3))
-
-            for index_a, index_b, score in candidate_connections:
-                if index_a not in connections[:, 0] and index_b not in connections[:, 1]:
-                    connections = np.vstack([connections, [index_a, index_b, score]])
-                    if len(connections) >= min(len(cand_a), len(cand_b)):
+            index_a, index_b, scores = compute_candidate_connections(paf, cand_a, cand_b, img_len, params_)
+
+            # greedy matching, every joint in one connection at most
+            used_a = [False] * len(cand_a)
+            used_b = [False] * len(cand_b)
+            max_connections = min(len(cand_a), len(cand_b))
+            connections = []
+            for a, b, score in zip(index_a.tolist(), index_b.tolist(), scores.tolist()):
+                if not used_a[a] and not used_b[b]:
+                    used_a[a] = used_b[b] = True
+                    connections.append([cand_a[a, 3], cand_b[b, 3], score])
+                    if len(connections) >= max_connections:
                         break
-            all_connections.append(connections)
+            all_connections.append(np.array(connections).reshape((-1, 3)))
         else:
             all_connections.append(np.zeros((0, 3)))
     return all_connections
 
+
 def grouping_key_points(all_connections, candidate_peaks, params_):
-    subsets = -1 * np.ones((0, 20))
+    """
+    subsets of the peaks of every person, rows of 18 peak ids (-1 if missing), the score and the number of
+    joints. owners maps a peak id to the subsets holding it, so a connection only looks at the subsets of its
+    two peaks, and merged subsets are dropped at the end instead of deleted.
+    """
+    max_subsets = sum(len(connections) for connections in all_connections)
+    subsets = -1 * np.ones((max_subsets, 20))
+    alive = np.zeros(max_subsets, bool)
+    owners = [[] for _ in range(len(candidate_peaks))]
+    num_subsets = 0
+
+    def set_joint(subset_ind, joint, ind, score):
+        old = int(subsets[subset_ind, joint])
+        if old >= 0:
+            owners[old].remove(subset_ind)
+        owners[ind].append(subset_ind)
+        subsets[subset_ind, joint] = ind
+        subsets[subset_ind, -1] += 1  # increment joint count
+        subsets[subset_ind, -2] += candidate_peaks[ind, 3] + score
+
+    def join_subsets(subset_inds, joints, inds, score):
+        """merge the two subsets of a connection when no joint is in both, else add its missing joint to each"""
+        subset_ind_1, subset_ind_2 = subset_inds
+        found_subset_1 = subsets[subset_ind_1]
+        found_subset_2 = subsets[subset_ind_2]
+
+        membership = ((found_subset_1 >= 0).astype(int) + (found_subset_2 >= 0).astype(int))[:-2]
+        if not np.any(membership == 2):  # merge two subsets when no duplication
+            for ind in found_subset_2[:-2][found_subset_2[:-2] >= 0].astype(int):
+                owners[ind].remove(subset_ind_2)
+                owners[ind].append(subset_ind_1)
+            found_subset_1[:-2] += found_subset_2[:-2] + 1  # default is -1
+            found_subset_1[-2:] += found_subset_2[-2:]
+            found_subset_1[-2] += score
+            alive[subset_ind_2] = False
+            return
+        for subset_ind in subset_inds:
+            for joint, ind in zip(joints, inds):
+                if subsets[subset_ind, joint] == -1:
+                    set_joint(subset_ind, joint, ind, score)
+                    break
 
     for l, connections in enumerate(all_connections):
         joint_a, joint_b = params_.limbs_point[l]
         for ind_a, ind_b, score in connections[:, :3]:
             ind_a, ind_b = int(ind_a), int(ind_b)
-            joint_found_cnt = 0
-            joint_found_subset_index = [-1, -1]
-            for subset_ind, subset in enumerate(subsets):
-
-                if subset[joint_a] == ind_a or subset[joint_b] == ind_b:
-                    joint_found_subset_index[joint_found_cnt] = subset_ind
-                    joint_found_cnt += 1
+            joint_found_subset_index = sorted(set(owners[ind_a] + owners[ind_b]))
+            joint_found_cnt = len(joint_found_subset_index)
 
             if joint_found_cnt == 1:
-
-                found_subset = subsets[joint_found_subset_index[0]]
-                if found_subset[joint_b] != ind_b:
-                    found_subset[joint_b] = ind_b
-                    found_subset[-1] += 1  # increment joint count
-                    found_subset[-2] += candidate_peaks[ind_b, 3] + score
-
+                subset_ind = joint_found_subset_index[0]
+                if subsets[subset_ind, joint_b] != ind_b:
+                    set_joint(subset_ind, joint_b, ind_b, score)
 
             elif joint_found_cnt == 2:
-
-                found_subset_1 = subsets[joint_found_subset_index[0]]
-                found_subset_2 = subsets[joint_found_subset_index[1]]
-
-                membership = ((found_subset_1 >= 0).astype(int) + (found_subset_2 >= 0).astype(int))[:-2]
-                if not np.any(membership == 2):  # merge two subsets when no duplication
-                    found_subset_1[:-2] += found_subset_2[:-2] + 1  # default is -1
-                    found_subset_1[-2:] += found_subset_2[-2:]
-                    found_subset_1[-2] += score
-                    subsets = np.delete(subsets, joint_found_subset_index[1], axis=0)
-                else:
-                    if found_subset_1[joint_a] == -1:
-                        found_subset_1[joint_a] = ind_a
-                        found_subset_1[-1] += 1
-                        found_subset_1[-2] += candidate_peaks[ind_a, 3] + score
-                    elif found_subset_1[joint_b] == -1:
-                        found_subset_1[joint_b] = ind_b
-                        found_subset_1[-1] += 1
-                        found_subset_1[-2] += candidate_peaks[ind_b, 3] + score
-                    if found_subset_2[joint_a] == -1:
-                        found_subset_2[joint_a] = ind_a
-                        found_subset_2[-1] += 1
-                        found_subset_2[-2] += candidate_peaks[ind_a, 3] + score
-                    elif found_subset_2[joint_b] == -1:
-                        found_subset_2[joint_b] = ind_b
-                        found_subset_2[-1] += 1
-                        found_subset_2[-2] += candidate_peaks[ind_b, 3] + score
+                join_subsets(joint_found_subset_index, (joint_a, joint_b), (ind_a, ind_b), score)
 
             elif joint_found_cnt == 0 and l != 9 and l != 13:
-                row = -1 * np.ones(20)
+                row = subsets[num_subsets]
                 row[joint_a] = ind_a
                 row[joint_b] = ind_b
                 row[-1] = 2
                 row[-2] = sum(candidate_peaks[[ind_a, ind_b], 3]) + score
-                subsets = np.vstack([subsets, row])
-            elif joint_found_cnt >= 3:
-                pass
+                owners[ind_a].append(num_subsets)
+                owners[ind_b].append(num_subsets)
+                alive[num_subsets] = True
+                num_subsets += 1
 
+    subsets = subsets[alive]
     # delete low score subsets
     keep = np.logical_and(subsets[:, -1] >= params_.n_subset_limbs_thresh,
                           subsets[:, -2] / subsets[:, -1] >= params_.subset_score_thresh)
@@ -286,21 +287,23 @@ def grouping_key_points(all_connections, candidate_peaks, params_):
 
 
 def subsets_to_pose_array(subsets, all_peaks):
-    person_pose_array = []
-    for subset in subsets:
-        joints = []
-        for joint_index in subset[:18].astype('i'):
-            if joint_index >= 0:
-                joint = all_peaks[joint_index][1:3].tolist()
-                joint.append(2)
-                joints.append(joint)
-            else:
-                joints.append([0, 0, 0])
-        person_pose_array.append(np.array(joints))
-    person_pose_array = np.array(person_pose_array)
+    joint_indices = subsets[:, :18].astype('i')
+    found = joint_indices >= 0
+    person_pose_array = np.zeros(joint_indices.shape + (3,))
+    person_pose_array[found, :2] = all_peaks[joint_indices[found], 1:3]
+    person_pose_array[found, 2] = 2
     return person_pose_array
 
-def detect(img, network):
+def add_stage_time(stage_times, stage, start):
+    now = time.time()
+    stage_times[stage] += now - start
+    return now
+
+
+def detect(img, network, stage_times=None):
+    """poses and scores of the persons of img, the seconds of every stage added to stage_times if given"""
+    stage_times = collections.defaultdict(float) if stage_times is None else stage_times
+    start = time.time()
     orig_img = img.copy()
     orig_img_h, orig_img_w, _ = orig_img.shape
 
@@ -316,6 +319,7 @@ def detect(img, network):
 
     logit_pafs = logit_pafs[-1].asnumpy()[0]
     logit_heatmap = logit_heatmap[-1].asnumpy()[0]
+    start = add_stage_time(stage_times, 'inference', start)
 
     pafs = np.zeros((logit_pafs.shape[0], map_h, map_w))
     for i in range(logit_pafs.shape[0]):
@@ -330,16 +334,20 @@ def detect(img, network):
         if show_gt:
             save_path = "./test_output/" + str(i) + "heatmap.png"
             cv2.imwrite(save_path, heatmaps[i]*255)
+    start = add_stage_time(stage_times, 'resize', start)
 
     all_peaks = compute_peaks_from_heatmaps(heatmaps)
+    start = add_stage_time(stage_times, 'peaks', start)
     if all_peaks.shape[0] == 0:
         return np.empty((0, len(JointType), 3)), np.empty(0)
     all_connections = compute_connections(pafs, all_peaks, map_w, config)
+    start = add_stage_time(stage_times, 'connections', start)
     subsets = grouping_key_points(all_connections, all_peaks, config)
     all_peaks[:, 1] *= orig_img_w / map_w
     all_peaks[:, 2] *= orig_img_h / map_h
     poses = subsets_to_pose_array(subsets, all_peaks)
     scores = subsets[:, -2]
+    add_stage_time(stage_times, 'grouping', start)
 
     return poses, scores
 
@@ -411,10 +419,11 @@ def val():
 
     print("eval dataset size: ", dataset_size)
     kpt_json = []
+    stage_times = collections.defaultdict(float)
     for _, (img, img_id) in tqdm(enumerate(de_dataset), total=dataset_size):
         img = img.asnumpy()
         img_id = int((img_id.asnumpy())[0])
-        poses, scores = detect(img, network)
+        poses, scores = detect(img, network, stage_times)
 
         if poses.shape[0] > 0:
             for index, pose in enumerate(poses):
@@ -441,6 +450,8 @@ def val():
         json.dump(kpt_json, fid)
     res = evaluate_mAP(os.path.join(config.output_img_path, result_json), ann_file=config.ann)
     print('result: ', res)
+    print('time per image: ' + ', '.join(f'{stage} {stage_time * 1000 / max(dataset_size, 1):.2f}ms'
+                                         for stage, stage_time in stage_times.items()))
 
 
 if __name__ == "__main__":
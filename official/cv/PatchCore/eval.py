@@ -16,6 +16,7 @@
 import sys
 import json
 import os
+import time
 from pathlib import Path
 
 import cv2
@@ -28,10 +29,11 @@ from sklearn.metrics import roc_auc_score
 
 from src.config import cfg, merge_from_cli_list
 from src.dataset import createDataset
+from src.memory_bank import index_nbytes, set_search_params
 from src.model import wide_resnet50_2
 from src.oneStep import OneStepCell
-from src.operator import (embedding_concat, normalize, prep_dirs,
-                          reshape_embedding, save_anomaly_map)
+from src.operator import (SampleWriter, normalize, patch_embedding,
+                          patch_scores, prep_dirs)
 
 opts = sys.argv[1:]
 merge_from_cli_list(opts)
@@ -45,7 +47,7 @@ if __name__ == '__main__':
     # dataset
     mean = cfg.mean
     std = cfg.std
-    _, test_dataset, _, test_json_path = createDataset(cfg.dataset_path, cfg.category)
+    _, test_dataset, _, test_json_path = createDataset(cfg.dataset_path, cfg.category, cfg.eval_batch_size)
     json_path = Path(test_json_path)
     with json_path.open('r') as label_file:
         label = json.load(label_file)
@@ -54,6 +56,7 @@ if __name__ == '__main__':
 
     embedding_dir_path, sample_path = prep_dirs(current_path, cfg.category)
     index = faiss.read_index(os.path.join(embedding_dir_path, 'index.faiss'))
+    set_search_params(index, cfg.ivf_nprobe)
 
     # network
     network = wide_resnet50_2()
@@ -70,39 +73,53 @@ if __name__ == '__main__':
     pred_list_px_lvl = []
     gt_list_img_lvl = []
     pred_list_img_lvl = []
-    img_path_list = []
-    for step, data in enumerate(data_iter):
-        step_label = label['{}'.format(data['idx'][0])]
-        file_name = step_label['name']
-        x_type = step_label['img_type']
-
+    search_time = 0.
+    num_images = 0
+    sample_writer = SampleWriter(sample_path) if cfg.save_sample else None
+    for data in data_iter:
         features = model(data['img'])
-        embedding = embedding_concat(features[0].asnumpy(), features[1].asnumpy())
-        embedding_test = reshape_embedding(embedding)
+        feature_one = features[0].asnumpy()
+        batch_size = feature_one.shape[0]
+        img_size = data['img'].shape[-2:]
 
-        embedding_test = np.array(embedding_test, dtype=np.float32)
+        # all patches of the batch are scored with one index search
+        embedding_test = patch_embedding(feature_one, features[1].asnumpy())
+        search_start = time.time()
         score_patches, _ = index.search(embedding_test, k=9)
-
-        anomaly_map = score_patches[:, 0].reshape((28, 28))
-        N_b = score_patches[np.argmax(score_patches[:, 0])]
-        w = (1 - (np.max(np.exp(N_b)) / np.sum(np.exp(N_b))))
-        score = w * max(score_patches[:, 0])
-        gt_np = data['gt'].asnumpy()[0, 0].astype(int)
-        anomaly_map_resized = cv2.resize(anomaly_map, (224, 224))
-        anomaly_map_resized_blur = gaussian_filter(anomaly_map_resized, sigma=4)
-
-        gt_list_px_lvl.extend(gt_np.ravel())
-        pred_list_px_lvl.extend(anomaly_map_resized_blur.ravel())
-        gt_list_img_lvl.append(data['label'].asnumpy()[0])
-        pred_list_img_lvl.append(score)
-        img_path_list.extend(file_name)
-        img = normalize(data['img'], mean, std)
-        input_img = cv2.cvtColor(np.transpose(img, (0, 2, 3, 1))[0] * 255, cv2.COLOR_BGR2RGB)
-        save_anomaly_map(sample_path, anomaly_map_resized_blur, input_img, gt_np * 255, file_name, x_type)
-
+        search_time += time.time() - search_start
+        num_images += batch_size
+        anomaly_maps, scores = patch_scores(score_patches, batch_size, feature_one.shape[2:])
+
+        anomaly_maps_resized = np.stack([cv2.resize(anomaly_map, (img_size[1], img_size[0]))
+                                         for anomaly_map in anomaly_maps])
+        anomaly_maps_resized_blur = gaussian_filter(anomaly_maps_resized, sigma=(0, 4, 4))
+        gt_np = data['gt'].asnumpy()[:, 0].astype(int)
+
+        gt_list_px_lvl.append(gt_np.ravel())
+        pred_list_px_lvl.append(anomaly_maps_resized_blur.ravel())
+        gt_list_img_lvl.append(data['label'].asnumpy())
+        pred_list_img_lvl.append(scores)
+
+        if sample_writer is not None:
+            img = np.transpose(normalize(data['img'], mean, std), (0, 2, 3, 1))
+            for i, idx in enumerate(data['idx'].asnumpy()):
+                step_label = label['{}'.format(idx)]
+                input_img = cv2.cvtColor(img[i] * 255, cv2.COLOR_BGR2RGB)
+                sample_writer.put(anomaly_maps_resized_blur[i], input_img, gt_np[i] * 255,
+                                  step_label['name'], step_label['img_type'])
+
+    if sample_writer is not None:
+        sample_writer.close()
+
+    gt_list_px_lvl = np.concatenate(gt_list_px_lvl)
+    pred_list_px_lvl = np.concatenate(pred_list_px_lvl)
+    gt_list_img_lvl = np.concatenate(gt_list_img_lvl)
+    pred_list_img_lvl = np.concatenate(pred_list_img_lvl)
     pixel_auc = roc_auc_score(gt_list_px_lvl, pred_list_px_lvl)
     img_auc = roc_auc_score(gt_list_img_lvl, pred_list_img_lvl)
 
     print('\ntest_epoch_end')
     print('category is {}'.format(cfg.category))
+    print("memory bank: {}, {} vectors, {:.2f} MB, search: {:.2f} ms/img".format(
+        type(index).__name__, index.ntotal, index_nbytes(index) / 2**20, search_time / max(num_images, 1) * 1000))
     print("img_auc: {}, pixel_auc: {}".format(img_auc, pixel_auc))
@@ -24,12 +24,11 @@ import numpy as np
 from mindspore.common import set_seed
 from scipy.ndimage import gaussian_filter
 from sklearn.metrics import roc_auc_score
-from sklearn.random_projection import SparseRandomProjection
 
 from src.config import cfg
-from src.operator import (embedding_concat, prep_dirs, reshape_embedding,
-                          save_anomaly_map)
-from src.sampling_methods.kcenter_greedy import kCenterGreedy
+from src.memory_bank import build_index, coreset_subsampling, set_search_params
+from src.operator import (SampleWriter, patch_embedding, patch_scores,
+                          prep_dirs)
 
 set_seed(1)
 
@@ -40,6 +39,10 @@ parser.add_argument('--img_dir', type=str, default='')
 parser.add_argument('--label_dir', type=str, default='')
 parser.add_argument('--category', type=str, default='screw')
 parser.add_argument('--coreset_sampling_ratio', type=float, default=0.01)
+parser.add_argument('--index_type', type=str, default='Flat', choices=['Flat', 'IVFFlat', 'IVFPQ', 'PQ'])
+parser.add_argument('--ivf_nlist', type=int, default=256)
+parser.add_argument('--ivf_nprobe', type=int, default=8)
+parser.add_argument('--pq_m', type=int, default=64)
 
 args = parser.parse_args()
 
@@ -83,28 +86,18 @@ if __name__ == '__main__':
         features_one = np.fromfile(features_one_path, dtype=np.float32).reshape(1, 512, 28, 28)
         features_two = np.fromfile(features_two_path, dtype=np.float32).reshape(1, 1024, 14, 14)
 
-        embedding = embedding_concat(features_one, features_two)
-        embedding_list.extend(reshape_embedding(embedding))
+        embedding_list.append(patch_embedding(features_one, features_two))
 
-    total_embeddings = np.array(embedding_list, dtype=np.float32)
-
-    # Random projection
-    randomprojector = SparseRandomProjection(n_components='auto', eps=0.9)
-    randomprojector.fit(total_embeddings)
+    total_embeddings = np.concatenate(embedding_list)
 
     # Coreset Subsampling
-    selector = kCenterGreedy(total_embeddings, 0, 0)
-    selected_idx = selector.select_batch(model=randomprojector,
-                                         already_selected=[],
-                                         N=int(total_embeddings.shape[0] * args.coreset_sampling_ratio))
-    embedding_coreset = total_embeddings[selected_idx]
+    embedding_coreset = coreset_subsampling(total_embeddings, args.coreset_sampling_ratio)
 
-    print('initial embedding size : {}'.format(total_embeddings.shape))
-    print('final embedding size : {}'.format(embedding_coreset.shape))
+    print('initial embedding size : {}, {:.2f} MB'.format(total_embeddings.shape, total_embeddings.nbytes / 2**20))
+    print('final embedding size : {}, {:.2f} MB'.format(embedding_coreset.shape, embedding_coreset.nbytes / 2**20))
 
     # faiss
-    index = faiss.IndexFlatL2(embedding_coreset.shape[1])
-    index.add(embedding_coreset)
+    index = build_index(embedding_coreset, args.index_type, args.ivf_nlist, args.pq_m, args.ivf_nprobe)
     faiss.write_index(index, os.path.join(embedding_dir_path, 'index.faiss'))
 
     # eval
@@ -112,8 +105,9 @@ if __name__ == '__main__':
     pred_list_px_lvl = []
     gt_list_img_lvl = []
     pred_list_img_lvl = []
-    img_path_list = []
     index = faiss.read_index(os.path.join(embedding_dir_path, 'index.faiss'))
+    set_search_params(index, args.ivf_nprobe)
+    sample_writer = SampleWriter(sample_path)
     for i in range(int(len(os.listdir(test_result_path)) / 2)):
         test_single_label = test_label['{}'.format(i)]
         gt = test_single_label['gt']
@@ -131,29 +125,27 @@ if __name__ == '__main__':
         features_one = np.fromfile(features_one_path, dtype=np.float32).reshape(1, 512, 28, 28)
         features_two = np.fromfile(features_two_path, dtype=np.float32).reshape(1, 1024, 14, 14)
 
-        embedding = embedding_concat(features_one, features_two)
-        embedding_test = reshape_embedding(embedding)
-
-        embedding_test = np.array(embedding_test, dtype=np.float32)
+        embedding_test = patch_embedding(features_one, features_two)
         score_patches, _ = index.search(embedding_test, k=9)
 
-        anomaly_map = score_patches[:, 0].reshape((28, 28))
-        N_b = score_patches[np.argmax(score_patches[:, 0])]
-        w = (1 - (np.max(np.exp(N_b)) / np.sum(np.exp(N_b))))
-        score = w * max(score_patches[:, 0])
+        anomaly_maps, scores = patch_scores(score_patches, 1, features_one.shape[2:])
+        anomaly_map = anomaly_maps[0]
+        score = scores[0]
         gt_np = np.array(gt)[0, 0].astype(int)
         anomaly_map_resized = cv2.resize(anomaly_map, (224, 224))
         anomaly_map_resized_blur = gaussian_filter(anomaly_map_resized, sigma=4)
 
-        gt_list_px_lvl.extend(gt_np.ravel())
-        pred_list_px_lvl.extend(anomaly_map_resized_blur.ravel())
+        gt_list_px_lvl.append(gt_np.ravel())
+        pred_list_px_lvl.append(anomaly_map_resized_blur.ravel())
         gt_list_img_lvl.append(label[0])
         pred_list_img_lvl.append(score)
-        img_path_list.extend(file_name)
         img = normalize(img, mean, std)
         input_img = cv2.cvtColor(np.transpose(img, (0, 2, 3, 1))[0] * 255, cv2.COLOR_BGR2RGB)
-        save_anomaly_map(sample_path, anomaly_map_resized_blur, input_img, gt_np * 255, file_name, x_type)
+        sample_writer.put(anomaly_map_resized_blur, input_img, gt_np * 255, file_name, x_type)
+    sample_writer.close()
 
+    gt_list_px_lvl = np.concatenate(gt_list_px_lvl)
+    pred_list_px_lvl = np.concatenate(pred_list_px_lvl)
     pixel_acc = roc_auc_score(gt_list_px_lvl, pred_list_px_lvl)
     img_acc = roc_auc_score(gt_list_img_lvl, pred_list_img_lvl)
 
@@ -31,10 +31,16 @@ _C.isModelArts = False
 
 _C.category = "screw"
 _C.coreset_sampling_ratio = 0.01
+_C.index_type = "Flat" #faiss memory bank index: Flat, IVFFlat, IVFPQ or PQ
+_C.ivf_nlist = 256 #IVF lists, reduced for small memory banks
+_C.ivf_nprobe = 8 #IVF lists visited by a search
+_C.pq_m = 64 #PQ sub-quantizers, must divide the embedding dimension
 _C.num_epochs = 1
 _C.device_id = 0
 _C.dataset_path = ""
 _C.pre_ckpt_path = "" #Pretrain checkpoint file path
+_C.eval_batch_size = 8 #Images scored with one index search
+_C.save_sample = True #Save anomaly map samples in a background thread
 
 _C.platform = "Ascend"
 
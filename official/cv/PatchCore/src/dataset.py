@@ -80,7 +80,7 @@ class MVTecDataset():
         img = self.transform(img)[0]
 
         if gt == 0:
-            gt = np.zeros((1, np.array(img).shape[-2], np.array(img).shape[-2])).tolist()
+            gt = np.zeros((1, np.array(img).shape[-2], np.array(img).shape[-2]), dtype=np.float32)
         else:
             gt = Image.open(gt)
             gt = self.gt_transform(gt)[0]
@@ -131,7 +131,7 @@ def createDatasetJson(dataset_path, category, data_transforms, gt_transforms):
 
     return train_json_path, test_json_path
 
-def createDataset(dataset_path, category):
+def createDataset(dataset_path, category, test_batch_size=1):
     """createDataset"""
     # Computed from random subset of ImageNet training images
     mean = [0.485, 0.456, 0.406]
@@ -166,6 +166,6 @@ def createDataset(dataset_path, category):
     test_dataset = test_dataset.map(operations=type_cast_float32_op, input_columns="img")
 
     train_dataset = train_dataset.batch(32, drop_remainder=False)
-    test_dataset = test_dataset.batch(1, drop_remainder=False)
+    test_dataset = test_dataset.batch(test_batch_size, drop_remainder=False)
 
     return train_dataset, test_dataset, train_json_path, test_json_path
@@ -0,0 +1,99 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""memory bank"""
+import math
+
+import faiss
+import numpy as np
+from sklearn.random_projection import SparseRandomProjection
+
+from src.sampling_methods.kcenter_greedy import kCenterGreedy
+
+INDEX_TYPES = ('Flat', 'IVFFlat', 'IVFPQ', 'PQ')
+
+# faiss wants about 39 training points per IVF centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def coreset_subsampling(total_embeddings, ratio, eps=0.9):
+    """
+    coreset_subsampling function
+    greedy k-center selection of ratio * N patches on a sparse random projection of the embeddings
+    """
+    if ratio >= 1:
+        return total_embeddings
+    randomprojector = SparseRandomProjection(n_components='auto', eps=eps)
+    randomprojector.fit(total_embeddings)
+    selector = kCenterGreedy(total_embeddings, 0, 0)
+    selected_idx = selector.select_batch(model=randomprojector,
+                                         already_selected=[],
+                                         N=max(int(total_embeddings.shape[0] * ratio), 1))
+    return total_embeddings[selected_idx]
+
+
+def _index_factory_string(index_type, num, dim, nlist, pq_m):
+    """
+    faiss factory string of index_type, nlist and the PQ code size are reduced when there are too few vectors
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError("Invalid index_type '{}'. Support {}.".format(index_type, ', '.join(INDEX_TYPES)))
+    if index_type == 'Flat':
+        return 'Flat'
+    nlist = max(min(nlist, num // MIN_POINTS_PER_CENTROID), 1)
+    if index_type == 'IVFFlat':
+        return 'IVF{},Flat'.format(nlist)
+    if dim % pq_m != 0:
+        raise ValueError("pq_m {} must divide the embedding dimension {}.".format(pq_m, dim))
+    # every sub-quantizer needs at least 2^nbits training points
+    nbits = max(min(8, int(math.log2(max(num, 2)))), 1)
+    pq = 'PQ{}x{}'.format(pq_m, nbits)
+    if index_type == 'IVFPQ':
+        return 'IVF{},{}'.format(nlist, pq)
+    return pq
+
+
+def build_index(embeddings, index_type='Flat', nlist=256, pq_m=64, nprobe=8):
+    """
+    build_index function
+    input: memory bank embeddings of shape (N, C)
+    output: faiss index of the given type, trained and filled with the embeddings
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    factory_string = _index_factory_string(index_type, embeddings.shape[0], embeddings.shape[1], nlist, pq_m)
+    index = faiss.index_factory(embeddings.shape[1], factory_string, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    set_search_params(index, nprobe)
+    print('faiss index : {}, {} vectors, {:.2f} MB'.format(factory_string, index.ntotal, index_nbytes(index) / 2**20))
+    return index
+
+
+def set_search_params(index, nprobe):
+    """
+    set_search_params function
+    set the number of IVF lists visited by a search, no-op for the other index types
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+
+
+def index_nbytes(index):
+    """
+    index_nbytes function
+    size of the serialized index, i.e. of index.faiss
+    """
+    return faiss.serialize_index(index).nbytes
@@ -14,84 +14,65 @@
 # ============================================================================
 """operator"""
 import os
+import queue
+import threading
 import cv2
 import mindspore
 import mindspore.ops as ops
 import numpy as np
 
-def unfold(img, kernel_size, stride=1, pad=0, dilation=1):
+def _upsample_nearest(y, scale):
     """
-    unfold function
+    nearest upsample of a (B, C, H, W) array by an integer scale, as a broadcast view without copying
     """
-    batch_num, channel, height, width = img.shape
-    out_h = (height + pad + pad - kernel_size - (kernel_size - 1) * (dilation - 1)) // stride + 1
-    out_w = (width + pad + pad - kernel_size - (kernel_size - 1) * (dilation - 1)) // stride + 1
-
-    img = np.pad(img, [(0, 0), (0, 0), (pad, pad), (pad, pad)], 'constant')
-    col = np.zeros((batch_num, channel, kernel_size, kernel_size, out_h, out_w)).astype(img.dtype)
-
-    for y in range(kernel_size):
-        y_max = y + stride * out_h
-        for x in range(kernel_size):
-            x_max = x + stride * out_w
-            col[:, :, y, x, :, :] = img[:, :, y:y_max:stride, x:x_max:stride]
-
-    col = np.reshape(col, (batch_num, channel*kernel_size*kernel_size, out_h*out_w))
-
-    return col
-
-def fold(col, input_shape, kernel_size, stride=1, pad=0):
-    """
-    fold function
-    """
-    batch_num, channel, height, width = input_shape
-    out_h = (height + pad + pad - kernel_size) // stride + 1
-    out_w = (width + pad + pad - kernel_size) // stride + 1
-
-    col = col.reshape(batch_num, channel, kernel_size, kernel_size, out_h, out_w)
-    img = np.zeros((batch_num,
-                    channel,
-                    height + pad + pad + stride - 1,
-                    width + pad + pad + stride - 1)) \
-        .astype(col.dtype)
-    for y in range(kernel_size):
-        y_max = y + stride * out_h
-        for x in range(kernel_size):
-            x_max = x + stride * out_w
-            img[:, :, y:y_max:stride, x:x_max:stride] += col[:, :, y, x, :, :]
-
-    return img[:, :, pad:height + pad, pad:width + pad]
+    B, C, H, W = y.shape
+    y = np.broadcast_to(y[:, :, :, None, :, None], (B, C, H, scale, W, scale))
+    return y.reshape((B, C, H * scale, W * scale))
 
 def embedding_concat(x, y):
     """
     embedding_concat function
+    concatenate x with y upsampled to the resolution of x, output: (B, C1 + C2, H1, W1)
     """
-    B, C1, H1, W1 = x.shape
-    _, C2, H2, W2 = y.shape
-    s = int(H1 / H2)
-    x = unfold(x, s, stride=s)
-    x = np.reshape(x, (B, C1, -1, H2, W2))
-    z = np.zeros((B, C1 + C2, x.shape[2], H2, W2))
-
-    for i in range(x.shape[2]):
-        z[:, :, i, :, :] = np.concatenate((x[:, :, i, :, :], y), axis=1)
-
-    z = np.reshape(z, (B, -1, H2*W2))
-    z = fold(z, (z.shape[0], int(z.shape[1] / (s * s)), H1, W1), s, stride=s)
-
-    return z
+    s = x.shape[2] // y.shape[2]
+    return np.concatenate((x, _upsample_nearest(y, s)), axis=1)
 
 def reshape_embedding(embedding):
     """
     reshape_embedding function
+    (B, C, H, W) -> (B * H * W, C), one row per pixel
     """
-    embedding_list = []
-    for k in range(embedding.shape[0]):
-        for i in range(embedding.shape[2]):
-            for j in range(embedding.shape[3]):
-                embedding_list.append(embedding[k, :, i, j])
+    return np.transpose(embedding, (0, 2, 3, 1)).reshape((-1, embedding.shape[1]))
 
-    return embedding_list
+def patch_embedding(x, y, dtype=np.float32):
+    """
+    patch_embedding function
+    same as reshape_embedding(embedding_concat(x, y)), but written once into a channels-last array
+    input: features of shape (B, C1, H1, W1) and (B, C2, H2, W2)
+    output: (B * H1 * W1, C1 + C2)
+    """
+    B, C1, H1, W1 = x.shape
+    _, C2, H2, _ = y.shape
+    s = H1 // H2
+    out = np.empty((B, H1, W1, C1 + C2), dtype=dtype)
+    out[..., :C1] = np.transpose(x, (0, 2, 3, 1))
+    out[..., C1:] = np.transpose(_upsample_nearest(y, s), (0, 2, 3, 1))
+    return out.reshape((-1, C1 + C2))
+
+def patch_scores(score_patches, batch_size, feature_size):
+    """
+    patch_scores function
+    input: kNN distances of shape (B * H * W, k) returned by the index search of patch_embedding rows
+    output: anomaly maps of shape (B, H, W) and image scores of shape (B,)
+    """
+    score_patches = score_patches.reshape((batch_size, -1, score_patches.shape[-1]))
+    anomaly_maps = score_patches[:, :, 0].reshape((batch_size,) + tuple(feature_size))
+    max_idx = np.argmax(score_patches[:, :, 0], axis=1)
+    N_b = score_patches[np.arange(batch_size), max_idx]
+    exp_n_b = np.exp(N_b)
+    w = 1 - np.max(exp_n_b, axis=1) / np.sum(exp_n_b, axis=1)
+    scores = w * N_b[:, 0]
+    return anomaly_maps, scores
 
 def prep_dirs(path, category):
     """
@@ -168,3 +149,39 @@ def save_anomaly_map(sample_path, anomaly_map, input_img, gt_img, file_name, x_t
     cv2.imwrite(os.path.join(sample_path, f'{x_type}_{file_name}_amap.jpg'), anomaly_map_norm_hm)
     cv2.imwrite(os.path.join(sample_path, f'{x_type}_{file_name}_amap_on_img.jpg'), hm_on_img)
     cv2.imwrite(os.path.join(sample_path, f'{x_type}_{file_name}_gt.jpg'), gt_img)
+
+class SampleWriter:
+    """
+    SampleWriter
+    save anomaly maps in a background thread, so that the eval loop does not wait for jpeg encoding
+    """
+    def __init__(self, sample_path, max_pending=32):
+        self.sample_path = sample_path
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:
+                try:
+                    save_anomaly_map(self.sample_path, *item)
+                except Exception as e:  # pylint: disable=broad-except
+                    self.error = e
+
+    def put(self, anomaly_map, input_img, gt_img, file_name, x_type):
+        """put one sample, blocks only when max_pending samples are waiting"""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((anomaly_map, input_img, gt_img, file_name, x_type))
+
+    def close(self):
+        """wait for all samples to be written"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
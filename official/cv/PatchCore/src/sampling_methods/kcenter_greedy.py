@@ -42,17 +42,17 @@ class kCenterGreedy(SamplingMethod):
         if reset_dist:
             self.min_distances = None
         if only_new:
-            cluster_centers = [d for d in cluster_centers
-                               if d not in self.already_selected]
+            selected = set(self.already_selected)
+            cluster_centers = [d for d in cluster_centers if d not in selected]
         if cluster_centers:
             # Update min_distances for all examples given new cluster center.
             x = self.features[cluster_centers]
-            dist = pairwise_distances(self.features, x, metric=self.metric)
+            dist = np.min(pairwise_distances(self.features, x, metric=self.metric), axis=1).reshape(-1, 1)
 
             if self.min_distances is None:
-                self.min_distances = np.min(dist, axis=1).reshape(-1, 1)
+                self.min_distances = dist
             else:
-                self.min_distances = np.minimum(self.min_distances, dist)
+                np.minimum(self.min_distances, dist, out=self.min_distances)
 
     def select_batch_(self, model, already_selected, N, **kwargs):
         """
@@ -72,7 +72,7 @@ class kCenterGreedy(SamplingMethod):
         # Assumes that the transform function takes in original data and not
         # flattened data.
         print('Getting transformed features...')
-        self.features = model.transform(self.X)
+        self.features = model.transform(self.X).astype(np.float32)
         print('Calculating distances...')
         self.update_distances(already_selected, only_new=False, reset_dist=True)
 
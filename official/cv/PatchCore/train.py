@@ -23,13 +23,12 @@ import numpy as np
 from mindspore import context
 from mindspore.common import set_seed
 from mindspore.train.serialization import load_checkpoint, load_param_into_net
-from sklearn.random_projection import SparseRandomProjection
 
 from src.dataset import createDataset
+from src.memory_bank import build_index, coreset_subsampling
 from src.model import wide_resnet50_2
 from src.oneStep import OneStepCell
-from src.operator import embedding_concat, prep_dirs, reshape_embedding
-from src.sampling_methods.kcenter_greedy import kCenterGreedy
+from src.operator import patch_embedding, prep_dirs
 
 from src.config import cfg, merge_from_cli_list
 
@@ -89,28 +88,18 @@ if __name__ == '__main__':
             step_time = (end - start).microseconds / 1000.0
             print("step: {}, time: {}ms".format(step, step_time))
 
-            embedding = embedding_concat(features[0].asnumpy(), features[1].asnumpy())
-            embedding_list.extend(reshape_embedding(embedding))
+            embedding_list.append(patch_embedding(features[0].asnumpy(), features[1].asnumpy()))
 
-        total_embeddings = np.array(embedding_list, dtype=np.float32)
-
-        # Random projection
-        randomprojector = SparseRandomProjection(n_components='auto', eps=0.9)
-        randomprojector.fit(total_embeddings)
+        total_embeddings = np.concatenate(embedding_list)
 
         # Coreset Subsampling
-        selector = kCenterGreedy(total_embeddings, 0, 0)
-        selected_idx = selector.select_batch(model=randomprojector,
-                                             already_selected=[],
-                                             N=int(total_embeddings.shape[0] * cfg.coreset_sampling_ratio))
-        embedding_coreset = total_embeddings[selected_idx]
+        embedding_coreset = coreset_subsampling(total_embeddings, cfg.coreset_sampling_ratio)
 
-        print('initial embedding size : {}'.format(total_embeddings.shape))
-        print('final embedding size : {}'.format(embedding_coreset.shape))
+        print('initial embedding size : {}, {:.2f} MB'.format(total_embeddings.shape, total_embeddings.nbytes / 2**20))
+        print('final embedding size : {}, {:.2f} MB'.format(embedding_coreset.shape, embedding_coreset.nbytes / 2**20))
 
         # faiss
-        index = faiss.IndexFlatL2(embedding_coreset.shape[1])
-        index.add(embedding_coreset)
+        index = build_index(embedding_coreset, cfg.index_type, cfg.ivf_nlist, cfg.pq_m, cfg.ivf_nprobe)
         faiss.write_index(index, os.path.join(embedding_dir_path, 'index.faiss'))
 
     if cfg.isModelArts:
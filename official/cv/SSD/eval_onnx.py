@@ -15,7 +15,6 @@
 """Run evaluation for a model exported to ONNX"""
 
 import os
-import numpy as np
 import onnxruntime as ort
 from mindspore import context
 
@@ -62,18 +61,11 @@ def ssd_eval(dataset_path, onnx_path, anno_json):
 
     for batch in ds.create_dict_iterator(output_numpy=True, num_epochs=1):
         img_id = batch['img_id']
-        img_np = batch['image']
         image_shape = batch['image_shape']
 
         output = session.run(None, {input_name: batch['image']})
 
-        for batch_idx in range(img_np.shape[0]):
-            pred = {"boxes": output[0][batch_idx],
-                    "box_scores": output[1][batch_idx],
-                    "img_id": int(np.squeeze(img_id[batch_idx])),
-                    "image_shape": image_shape[batch_idx]
-                    }
-            metrics.update(pred)
+        metrics.update_batch(output[0], output[1], img_id, image_shape)
     print(f"mAP: {metrics.get_metrics()}")
 
 
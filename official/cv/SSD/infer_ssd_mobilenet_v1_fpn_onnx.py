@@ -15,7 +15,6 @@
 """Run evaluation for a model exported to ONNX"""
 
 import os
-import numpy as np
 import onnxruntime as ort
 from mindspore import context
 
@@ -48,18 +47,11 @@ def apply_eval(coco_json, dataset, onnx_session):
                                min_score=config.min_score)
     for batch in dataset.create_dict_iterator(output_numpy=True, num_epochs=1):
         img_id = batch['img_id']
-        img_np = batch['image']
         image_shape = batch['image_shape']
 
         output = onnx_session.run(None, {onnx_session.get_inputs()[0].name: batch['image']})
 
-        for batch_idx in range(img_np.shape[0]):
-            pred = {"boxes": output[0][batch_idx],
-                    "box_scores": output[1][batch_idx],
-                    "img_id": int(np.squeeze(img_id[batch_idx])),
-                    "image_shape": image_shape[batch_idx]
-                    }
-            coco_metrics.update(pred)
+        coco_metrics.update_batch(output[0], output[1], img_id, image_shape)
     eval_metrics = coco_metrics.get_metrics()
     return eval_metrics
 
@@ -66,13 +66,52 @@ if hasattr(config, 'use_anchor_generator') and config.use_anchor_generator:
     generator = GridAnchorGenerator(config.img_shape, 4, 2, [1.0, 2.0, 0.5])
     default_boxes, default_boxes_tlbr = generator.generate_multi_levels(config.steps)
 else:
-    default_boxes_tlbr = GeneratDefaultBoxes().default_boxes_tlbr
-    default_boxes = GeneratDefaultBoxes().default_boxes
-y1, x1, y2, x2 = np.split(default_boxes_tlbr[:, :4], 4, axis=-1)
+    # the table is generated once per process and shared by every call of the encoder
+    _generated_boxes = GeneratDefaultBoxes()
+    default_boxes_tlbr = _generated_boxes.default_boxes_tlbr
+    default_boxes = _generated_boxes.default_boxes
+y1, x1, y2, x2 = default_boxes_tlbr[:, :4].T
 vol_anchors = (x2 - x1) * (y2 - y1)
 matching_threshold = config.match_threshold
 
 
+def jaccard_with_anchors(boxes):
+    """Compute jaccard score of the boxes [N, 4+] in [y1, x1, y2, x2] and the anchors, with shape [N, num_anchors]."""
+    # Intersection bbox and volume, in place to keep the temporaries of the [N, num_anchors] matrix few.
+    ymin = np.maximum(y1, boxes[:, 0:1])
+    h = np.minimum(y2, boxes[:, 2:3])
+    h -= ymin
+    np.maximum(h, 0., out=h)
+    xmin = np.maximum(x1, boxes[:, 1:2], out=ymin)
+    w = np.minimum(x2, boxes[:, 3:4])
+    w -= xmin
+    np.maximum(w, 0., out=w)
+
+    # Volumes.
+    inter_vol = np.multiply(h, w, out=h)
+    union_vol = np.add(vol_anchors, ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))[:, None], out=w)
+    union_vol -= inter_vol
+    return np.divide(inter_vol, union_vol, out=inter_vol)
+
+
+def match_anchors(boxes):
+    """
+    Index of the ground truth matched by every anchor, -1 for the background.
+
+    Every ground truth takes its best anchor, then every anchor takes the ground truth of highest IoU above
+    match_threshold, the first one on ties, as a loop over the ground truths which keeps the strictly better ones.
+    """
+    matches = np.full(len(default_boxes), -1, dtype=np.int64)
+    if not boxes.shape[0]:
+        return matches
+    scores = jaccard_with_anchors(boxes)
+    scores[np.arange(boxes.shape[0]), np.argmax(scores, axis=1)] = 2.0
+    best = np.argmax(scores, axis=0)
+    matched = scores[best, np.arange(scores.shape[1])] > matching_threshold
+    matches[matched] = best[matched]
+    return matches
+
+
 def ssd_bboxes_encode(boxes):
     """
     Labels anchors with ground truth inputs.
@@ -85,42 +124,17 @@ def ssd_bboxes_encode(boxes):
         gt_label: class ground truth with shape [num_anchors, 1].
         num_matched_boxes: number of positives in an image.
     """
-
-    def jaccard_with_anchors(bbox):
-        """Compute jaccard score a box and the anchors."""
-        # Intersection bbox and volume.
-        ymin = np.maximum(y1, bbox[0])
-        xmin = np.maximum(x1, bbox[1])
-        ymax = np.minimum(y2, bbox[2])
-        xmax = np.minimum(x2, bbox[3])
-        w = np.maximum(xmax - xmin, 0.)
-        h = np.maximum(ymax - ymin, 0.)
-
-        # Volumes.
-        inter_vol = h * w
-        union_vol = vol_anchors + (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) - inter_vol
-        jaccard = inter_vol / union_vol
-        return np.squeeze(jaccard)
-
-    pre_scores = np.zeros((config.num_ssd_boxes), dtype=np.float32)
-    t_boxes = np.zeros((config.num_ssd_boxes, 4), dtype=np.float32)
-    t_label = np.zeros((config.num_ssd_boxes), dtype=np.int64)
-    for bbox in boxes:
-        label = int(bbox[4])
-        scores = jaccard_with_anchors(bbox)
-        idx = np.argmax(scores)
-        scores[idx] = 2.0
-        mask = (scores > matching_threshold)
-        mask = mask & (scores > pre_scores)
-        pre_scores = np.maximum(pre_scores, scores * mask)
-        t_label = mask * label + (1 - mask) * t_label
-        for i in range(4):
-            t_boxes[:, i] = mask * bbox[i] + (1 - mask) * t_boxes[:, i]
+    matches = match_anchors(boxes)
+    matched = matches >= 0
+    t_boxes = np.zeros((len(default_boxes), 4), dtype=np.float32)
+    t_label = np.zeros((len(default_boxes)), dtype=np.int64)
+    t_boxes[matched] = boxes[matches[matched], :4]
+    t_label[matched] = boxes[matches[matched], 4]
 
     index = np.nonzero(t_label)
 
     # Transform to tlbr.
-    bboxes = np.zeros((config.num_ssd_boxes, 4), dtype=np.float32)
+    bboxes = np.zeros((len(default_boxes), 4), dtype=np.float32)
     bboxes[:, [0, 1]] = (t_boxes[:, [0, 1]] + t_boxes[:, [2, 3]]) / 2
     bboxes[:, [2, 3]] = t_boxes[:, [2, 3]] - t_boxes[:, [0, 1]]
 
@@ -132,7 +146,7 @@ def ssd_bboxes_encode(boxes):
     bboxes_t[:, 2:4] = np.log(tmp) / config.prior_scaling[1]
     bboxes[index] = bboxes_t
 
-    num_match = np.array([len(np.nonzero(t_label)[0])], dtype=np.int32)
+    num_match = np.array([len(index[0])], dtype=np.int32)
     return bboxes, t_label.astype(np.int32), num_match
 
 
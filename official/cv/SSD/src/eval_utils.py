@@ -14,7 +14,6 @@
 # ============================================================================
 """Coco metrics utils"""
 
-import json
 import numpy as np
 from mindspore import Tensor
 from pycocotools.coco import COCO
@@ -41,51 +40,70 @@ def apply_eval(eval_param_dict):
 
         output = net(Tensor(img_np))
 
-        for batch_idx in range(img_np.shape[0]):
-            pred_batch = {
-                "boxes": output[0].asnumpy()[batch_idx],
-                "box_scores": output[1].asnumpy()[batch_idx],
-                "img_id": int(np.squeeze(img_id[batch_idx])),
-                "image_shape": image_shape[batch_idx]
-            }
-            coco_metrics.update(pred_batch)
+        coco_metrics.update_batch(output[0].asnumpy(), output[1].asnumpy(), img_id, image_shape)
     eval_metrics = coco_metrics.get_metrics()
     return eval_metrics
 
 
-def apply_nms(all_boxes, all_scores, thres, max_boxes):
-    """Apply NMS to bboxes."""
-    y1 = all_boxes[:, 0]
-    x1 = all_boxes[:, 1]
-    y2 = all_boxes[:, 2]
-    x2 = all_boxes[:, 3]
+def apply_multiclass_nms(all_boxes, all_scores, groups, thres, max_boxes):
+    """
+    Apply NMS to the bboxes of every group, e.g. every (image, class) pair of a batch, at once.
+
+    The groups advance together: every round keeps the best remaining box of every group and drops the boxes of
+    its group overlapping it by more than thres, so there are as many rounds as boxes kept by the largest group.
+    The boxes kept are those of a greedy NMS run on every group alone, at most max_boxes per group.
+
+    Returns:
+        indices of the kept boxes, ordered by group and then by descending score.
+    """
+    if not all_scores.size:
+        return np.zeros(0, np.int64)
+    # descending score within a group, ties broken by the highest index first
+    order = np.lexsort((-np.arange(len(all_scores)), -all_scores, groups))
+    boxes = all_boxes[order]
+    y1 = boxes[:, 0]
+    x1 = boxes[:, 1]
+    y2 = boxes[:, 2]
+    x2 = boxes[:, 3]
     areas = (x2 - x1 + 1) * (y2 - y1 + 1)
 
-    order = all_scores.argsort()[::-1]
-    keep = []
-
-    while order.size > 0:
-        i = order[0]
-        keep.append(i)
-
-        if len(keep) >= max_boxes:
+    sorted_groups = groups[order]
+    group_index = np.cumsum(np.r_[0, sorted_groups[1:] != sorted_groups[:-1]])
+    num_groups = group_index[-1] + 1
+    num_kept = np.zeros(num_groups, np.int64)
+    group_head = np.zeros(num_groups, np.int64)
+    alive = np.ones(len(order), bool)
+    keep = np.zeros(len(order), bool)
+
+    while True:
+        alive_index = np.flatnonzero(alive)
+        if alive_index.size == 0:
             break
-
-        xx1 = np.maximum(x1[i], x1[order[1:]])
-        yy1 = np.maximum(y1[i], y1[order[1:]])
-        xx2 = np.minimum(x2[i], x2[order[1:]])
-        yy2 = np.minimum(y2[i], y2[order[1:]])
+        alive_groups = group_index[alive_index]
+        is_head = np.r_[True, alive_groups[1:] != alive_groups[:-1]]
+        heads = alive_index[is_head]
+        keep[heads] = True
+        alive[heads] = False
+        num_kept[alive_groups[is_head]] += 1
+        group_head[alive_groups[is_head]] = heads
+
+        others = alive_index[~is_head]
+        others_groups = alive_groups[~is_head]
+        i = group_head[others_groups]
+
+        xx1 = np.maximum(x1[i], x1[others])
+        yy1 = np.maximum(y1[i], y1[others])
+        xx2 = np.minimum(x2[i], x2[others])
+        yy2 = np.minimum(y2[i], y2[others])
 
         w = np.maximum(0.0, xx2 - xx1 + 1)
         h = np.maximum(0.0, yy2 - yy1 + 1)
         inter = w * h
 
-        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        ovr = inter / (areas[i] + areas[others] - inter)
 
-        inds = np.where(ovr <= thres)[0]
-
-        order = order[inds + 1]
-    return keep
+        alive[others] = (ovr <= thres) & (num_kept[others_groups] < max_boxes)
+    return order[keep]
 
 
 class COCOMetrics:
@@ -103,48 +121,59 @@ class COCOMetrics:
         cat_ids = self.coco_gt.loadCats(self.coco_gt.getCatIds())
         self.class_dict = {cat['name']: cat['id'] for cat in cat_ids}
 
-        self.predictions = []
+        # coco category id of every class, the background excluded
+        self.category_ids = np.zeros(num_classes, np.int64)
+        for c in range(1, num_classes):
+            self.category_ids[c] = self.class_dict[self.val_cls_dict[c]]
+
+        # detections in rows of [image_id, x, y, w, h, score, category_id], as loadRes takes an ndarray
+        self.predictions = np.empty((1024, 7))
+        self.num_predictions = 0
         self.img_ids = []
 
     def update(self, batch):
-        pred_boxes = batch['boxes']
-        box_scores = batch['box_scores']
-        img_id = batch['img_id']
-        h, w = batch['image_shape']
-
-        final_boxes = []
-        final_label = []
-        final_score = []
-        self.img_ids.append(img_id)
-
-        for c in range(1, self.num_classes):
-            class_box_scores = box_scores[:, c]
-            score_mask = class_box_scores > self.min_score
-            class_box_scores = class_box_scores[score_mask]
-            class_boxes = pred_boxes[score_mask] * [h, w, h, w]
-
-            if score_mask.any():
-                nms_index = apply_nms(class_boxes, class_box_scores, self.nms_threshold, self.max_boxes)
-                class_boxes = class_boxes[nms_index]
-                class_box_scores = class_box_scores[nms_index]
-
-                final_boxes += class_boxes.tolist()
-                final_score += class_box_scores.tolist()
-                final_label += [self.class_dict[self.val_cls_dict[c]]] * len(class_box_scores)
-
-        for loc, label, score in zip(final_boxes, final_label, final_score):
-            res = {}
-            res['image_id'] = img_id
-            res['bbox'] = [loc[1], loc[0], loc[3] - loc[1], loc[2] - loc[0]]
-            res['score'] = score
-            res['category_id'] = label
-            self.predictions.append(res)
+        self.update_batch(batch['boxes'][None], batch['box_scores'][None], [batch['img_id']],
+                          [batch['image_shape']])
+
+    def update_batch(self, boxes, box_scores, img_ids, image_shapes):
+        """
+        Add the detections of a batch, NMS applied to all its images and classes at once.
+
+        Args:
+            boxes (numpy.ndarray): boxes [y1, x1, y2, x2] in [0, 1], with shape [batch_size, num_anchors, 4].
+            box_scores (numpy.ndarray): scores with shape [batch_size, num_anchors, num_classes].
+            img_ids (numpy.ndarray): image ids with batch_size elements.
+            image_shapes (numpy.ndarray): [h, w] of the images with shape [batch_size, 2].
+        """
+        img_ids = np.asarray(img_ids).reshape(-1)
+        self.img_ids += [int(img_id) for img_id in img_ids]
+
+        img_index, anchor_index, class_index = np.nonzero(box_scores[:, :, 1:] > self.min_score)
+        class_index += 1
+        scores = box_scores[img_index, anchor_index, class_index]
+        scales = np.asarray(image_shapes)[:, [0, 1, 0, 1]]
+        pred_boxes = boxes[img_index, anchor_index] * scales[img_index]
+
+        keep = apply_multiclass_nms(pred_boxes, scores, img_index * self.num_classes + class_index,
+                                    self.nms_threshold, self.max_boxes)
+        loc = pred_boxes[keep].astype(np.float64)
+        num = self.num_predictions + keep.size
+        if num > self.predictions.shape[0]:
+            predictions = np.empty((max(num, 2 * self.predictions.shape[0]), 7))
+            predictions[:self.num_predictions] = self.predictions[:self.num_predictions]
+            self.predictions = predictions
+        rows = self.predictions[self.num_predictions:num]
+        rows[:, 0] = img_ids[img_index[keep]]
+        rows[:, 1] = loc[:, 1]
+        rows[:, 2] = loc[:, 0]
+        rows[:, 3] = loc[:, 3] - loc[:, 1]
+        rows[:, 4] = loc[:, 2] - loc[:, 0]
+        rows[:, 5] = scores[keep]
+        rows[:, 6] = self.category_ids[class_index[keep]]
+        self.num_predictions = num
 
     def get_metrics(self):
-        with open('predictions.json', 'w') as f:
-            json.dump(self.predictions, f)
-
-        coco_dt = self.coco_gt.loadRes('predictions.json')
+        coco_dt = self.coco_gt.loadRes(self.predictions[:self.num_predictions])
         E = COCOeval(self.coco_gt, coco_dt, iouType='bbox')
         E.params.imgIds = self.img_ids
         E.evaluate()
@@ -0,0 +1,127 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Benchmark batched NMS against the per image, per class greedy loop."""
+import argparse
+import time
+
+import numpy as np
+
+from src.nms import batched_nms
+
+
+def loop_diou_nms(dets, thresh=0.5):
+    """Reference per-group DIoU NMS, dets is (N, 5) of [x1, y1, x2, y2, score]."""
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort(kind='stable')[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        center_x1 = (x1[i] + x2[i]) / 2
+        center_x2 = (x1[order[1:]] + x2[order[1:]]) / 2
+        center_y1 = (y1[i] + y2[i]) / 2
+        center_y2 = (y1[order[1:]] + y2[order[1:]]) / 2
+        inter_diag = (center_x2 - center_x1) ** 2 + (center_y2 - center_y1) ** 2
+        out_max_x = np.maximum(x2[i], x2[order[1:]])
+        out_max_y = np.maximum(y2[i], y2[order[1:]])
+        out_min_x = np.minimum(x1[i], x1[order[1:]])
+        out_min_y = np.minimum(y1[i], y1[order[1:]])
+        outer_diag = (out_max_x - out_min_x) ** 2 + (out_max_y - out_min_y) ** 2
+        diou = ovr - inter_diag / outer_diag
+        diou = np.clip(diou, -1, 1)
+        inds = np.where(diou <= thresh)[0]
+        order = order[inds + 1]
+    return keep
+
+
+def make_boxes(rng, num_images, num_classes, boxes_per_image, img_size=640):
+    """Boxes jittered around a few objects per image, like the multi-label candidates of YOLOv5."""
+    num_boxes = num_images * boxes_per_image
+    image_id = np.repeat(np.arange(num_images), boxes_per_image)
+    num_objects = 20
+    centers = rng.uniform(0, img_size, (num_images, num_objects, 2))
+    sizes = rng.uniform(16, img_size / 3, (num_images, num_objects, 2))
+    obj = rng.integers(0, num_objects, num_boxes)
+    center = centers[image_id, obj] + rng.normal(0, 8, (num_boxes, 2))
+    size = sizes[image_id, obj] * rng.uniform(0.8, 1.2, (num_boxes, 2))
+    boxes = np.concatenate((center - size / 2, center + size / 2), axis=1).astype(np.float32)
+    scores = rng.random(num_boxes).astype(np.float32)
+    category = rng.integers(0, num_classes, num_boxes)
+    return boxes, scores, image_id * num_classes + category
+
+
+def run_loop(boxes, scores, groups, thresh):
+    order = np.lexsort((groups,))
+    groups_sorted = groups[order]
+    bounds = np.flatnonzero(np.diff(groups_sorted)) + 1
+    bounds = np.concatenate(([0], bounds, [groups_sorted.size]))
+    dets = np.concatenate((boxes, scores[:, None]), axis=1)[order]
+    keep = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        keep.extend(order[start + np.asarray(loop_diou_nms(dets[start:end], thresh), dtype=np.int64)])
+    return np.asarray(keep)
+
+
+def timeit(func, repeat):
+    func()
+    start = time.time()
+    for _ in range(repeat):
+        result = func()
+    return (time.time() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched NMS benchmark")
+    parser.add_argument("--num_images", type=int, default=32, help="Images per batch. Default: 32")
+    parser.add_argument("--num_classes", type=int, default=80, help="Number of classes. Default: 80")
+    parser.add_argument("--boxes_per_image", type=str, default="500,2000,8000",
+                        help="Comma separated candidate boxes per image. Default: 500,2000,8000")
+    parser.add_argument("--nms_thresh", type=float, default=0.6, help="NMS threshold. Default: 0.6")
+    parser.add_argument("--num_workers", type=int, default=4, help="Threads for the threaded run. Default: 4")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repeats. Default: 3")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("{:>10} {:>10} {:>10} {:>12} {:>14} {:>8}".format(
+        "boxes/img", "kept", "loop(s)", "batched(s)", "batched x{}(s)".format(args.num_workers), "match"))
+    for boxes_per_image in [int(x) for x in args.boxes_per_image.split(",")]:
+        boxes, scores, groups = make_boxes(rng, args.num_images, args.num_classes, boxes_per_image)
+        loop_time, loop_keep = timeit(lambda: run_loop(boxes, scores, groups, args.nms_thresh), args.repeat)
+        batched_time, keep = timeit(
+            lambda: batched_nms(boxes, scores, groups, args.nms_thresh, method='diou'), args.repeat)
+        threaded_time, _ = timeit(
+            lambda: batched_nms(boxes, scores, groups, args.nms_thresh, method='diou',
+                                num_workers=args.num_workers), args.repeat)
+        match = np.array_equal(np.sort(loop_keep), np.sort(keep))
+        print("{:>10} {:>10} {:>10.4f} {:>12.4f} {:>14.4f} {:>8}".format(
+            boxes_per_image, keep.size, loop_time, batched_time, threaded_time, str(match)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""Batched class-aware NMS on CPU.
+
+All boxes of a batch are processed in one call. Boxes carry a group id (usually
+image and class combined) and are only compared with boxes of the same group.
+Instead of running a greedy loop per group, every iteration selects the best
+remaining box of all groups at once and suppresses against it, so the number of
+Python iterations is the largest number of boxes kept in a single group.
+Boxes are [x1, y1, x2, y2] and areas use the "+1" pixel convention of the
+original eval code.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _overlap(boxes, head, cand, method):
+    """IoU (or DIoU) between boxes[head] and boxes[cand], element-wise."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    xx1 = np.maximum(x1[head], x1[cand])
+    yy1 = np.maximum(y1[head], y1[cand])
+    xx2 = np.minimum(x2[head], x2[cand])
+    yy2 = np.minimum(y2[head], y2[cand])
+    w = np.maximum(0.0, xx2 - xx1 + 1)
+    h = np.maximum(0.0, yy2 - yy1 + 1)
+    inter = w * h
+    ovr = inter / (areas[head] + areas[cand] - inter)
+    if method == 'diou':
+        center_x1 = (x1[head] + x2[head]) / 2
+        center_x2 = (x1[cand] + x2[cand]) / 2
+        center_y1 = (y1[head] + y2[head]) / 2
+        center_y2 = (y1[cand] + y2[cand]) / 2
+        inter_diag = (center_x2 - center_x1) ** 2 + (center_y2 - center_y1) ** 2
+        out_max_x = np.maximum(x2[head], x2[cand])
+        out_max_y = np.maximum(y2[head], y2[cand])
+        out_min_x = np.minimum(x1[head], x1[cand])
+        out_min_y = np.minimum(y1[head], y1[cand])
+        outer_diag = (out_max_x - out_min_x) ** 2 + (out_max_y - out_min_y) ** 2
+        ovr = np.clip(ovr - inter_diag / outer_diag, -1, 1)
+    return ovr
+
+
+def _group_heads(groups):
+    """Mask of the first element of every run of equal values in a sorted group array."""
+    is_head = np.ones(groups.shape[0], dtype=np.bool_)
+    is_head[1:] = groups[1:] != groups[:-1]
+    return is_head
+
+
+def _sort_by_group(scores, idxs, pre_top_k):
+    """Order boxes by (group, descending score), optionally keeping the pre_top_k best of every group."""
+    order = np.lexsort((-scores, idxs))
+    if pre_top_k > 0 and order.size:
+        groups = idxs[order]
+        starts = np.flatnonzero(_group_heads(groups))
+        run_length = np.diff(np.append(starts, groups.size))
+        rank = np.arange(groups.size) - np.repeat(starts, run_length)
+        order = order[rank < pre_top_k]
+    return order
+
+
+def _greedy_nms(boxes, groups, iou_thresh, method):
+    """Greedy NMS of every group at once. Boxes must be sorted by (group, descending score)."""
+    alive = np.arange(boxes.shape[0])
+    keep = []
+    while alive.size:
+        is_head = _group_heads(groups[alive])
+        heads = alive[is_head]
+        keep.append(heads)
+        # the head each remaining box is compared with
+        head_of = heads[np.cumsum(is_head) - 1]
+        rest = ~is_head
+        cand = alive[rest]
+        ovr = _overlap(boxes, head_of[rest], cand, method)
+        alive = cand[ovr <= iou_thresh]
+    if not keep:
+        return np.zeros(0, dtype=np.int64)
+    return np.sort(np.concatenate(keep))
+
+
+def _greedy_soft_nms(boxes, scores, groups, iou_thresh, sigma, score_thresh, method):
+    """Soft-NMS of every group at once, returning kept positions and their decayed scores."""
+    scores = scores.copy()
+    alive = np.arange(boxes.shape[0])
+    keep = []
+    while alive.size:
+        # decayed scores change the ranking, so re-sort the survivors on each round
+        alive = alive[np.lexsort((-scores[alive], groups[alive]))]
+        is_head = _group_heads(groups[alive])
+        heads = alive[is_head]
+        keep.append(heads)
+        head_of = heads[np.cumsum(is_head) - 1]
+        rest = ~is_head
+        cand = alive[rest]
+        ovr = _overlap(boxes, head_of[rest], cand, 'iou')
+        if method == 'gaussian':
+            weight = np.exp(-(ovr * ovr) / sigma)
+        else:
+            weight = np.where(ovr > iou_thresh, 1 - ovr, 1.0)
+        scores[cand] *= weight
+        alive = cand[scores[cand] >= score_thresh]
+    if not keep:
+        return np.zeros(0, dtype=np.int64), scores[:0]
+    keep = np.concatenate(keep)
+    return keep, scores[keep]
+
+
+def _split_groups(groups, num_parts):
+    """Split a group-sorted array into at most num_parts slices on group boundaries."""
+    starts = np.flatnonzero(_group_heads(groups))
+    cuts = starts[np.linspace(0, starts.size, num_parts, endpoint=False).astype(np.int64)]
+    bounds = np.unique(np.append(cuts, groups.size))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def batched_nms(boxes, scores, idxs, iou_thresh, method='nms', pre_top_k=-1, num_workers=1):
+    """
+    Class-aware NMS over all boxes of a batch.
+
+    Args:
+        boxes (numpy.ndarray): Boxes of shape (N, 4) in [x1, y1, x2, y2].
+        scores (numpy.ndarray): Scores of shape (N,).
+        idxs (numpy.ndarray): Integer group id of shape (N,), boxes of different groups never suppress each other.
+        iou_thresh (float): Boxes whose overlap with a kept box is above this value are removed.
+        method (str): 'nms' for IoU or 'diou' for DIoU overlap. Default: 'nms'.
+        pre_top_k (int): Only the pre_top_k highest scored boxes of every group enter NMS, -1 keeps all. Default: -1.
+        num_workers (int): Threads to spread the groups over. Default: 1.
+
+    Returns:
+        numpy.ndarray, indices of kept boxes sorted by group id and then by descending score.
+    """
+    if method not in ('nms', 'diou'):
+        raise ValueError("Invalid NMS method '{}'. Support 'nms' or 'diou'.".format(method))
+    idxs = np.asarray(idxs)
+    order = _sort_by_group(scores, idxs, pre_top_k)
+    if order.size == 0:
+        return order
+    boxes = boxes[order]
+    groups = idxs[order]
+    if num_workers <= 1:
+        return order[_greedy_nms(boxes, groups, iou_thresh, method)]
+
+    def run(part):
+        start, end = part
+        return start + _greedy_nms(boxes[start:end], groups[start:end], iou_thresh, method)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        keep = list(pool.map(run, _split_groups(groups, num_workers)))
+    return order[np.concatenate(keep)]
+
+
+def batched_soft_nms(boxes, scores, idxs, iou_thresh=0.3, method='gaussian', sigma=0.5, score_thresh=0.001,
+                     pre_top_k=-1, num_workers=1):
+    """
+    Class-aware Soft-NMS over all boxes of a batch.
+
+    Args:
+        boxes (numpy.ndarray): Boxes of shape (N, 4) in [x1, y1, x2, y2].
+        scores (numpy.ndarray): Scores of shape (N,).
+        idxs (numpy.ndarray): Integer group id of shape (N,).
+        iou_thresh (float): Overlap above which scores are decayed by the 'linear' method. Default: 0.3.
+        method (str): 'gaussian' or 'linear' score decay. Default: 'gaussian'.
+        sigma (float): Width of the gaussian decay. Default: 0.5.
+        score_thresh (float): Boxes whose decayed score drops below this value are removed. Default: 0.001.
+        pre_top_k (int): Only the pre_top_k highest scored boxes of every group enter NMS, -1 keeps all. Default: -1.
+        num_workers (int): Threads to spread the groups over. Default: 1.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray), indices of kept boxes and their decayed scores.
+    """
+    if method not in ('gaussian', 'linear'):
+        raise ValueError("Invalid Soft-NMS method '{}'. Support 'gaussian' or 'linear'.".format(method))
+    idxs = np.asarray(idxs)
+    order = _sort_by_group(scores, idxs, pre_top_k)
+    if order.size == 0:
+        return order, scores[:0]
+    boxes = boxes[order]
+    scores = scores[order]
+    groups = idxs[order]
+    parts = _split_groups(groups, max(num_workers, 1))
+
+    def run(part):
+        start, end = part
+        keep, kept_scores = _greedy_soft_nms(boxes[start:end], scores[start:end], groups[start:end],
+                                             iou_thresh, sigma, score_thresh, method)
+        return start + keep, kept_scores
+
+    if num_workers <= 1:
+        results = [run(part) for part in parts]
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            results = list(pool.map(run, parts))
+    keep = np.concatenate([res[0] for res in results])
+    kept_scores = np.concatenate([res[1] for res in results])
+    return order[keep], kept_scores
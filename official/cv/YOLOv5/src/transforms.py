@@ -14,7 +14,6 @@
 # ============================================================================
 """Preprocess dataset."""
 import random
-import threading
 import copy
 
 import numpy as np
@@ -515,55 +514,116 @@ class MultiScaleTrans:
         return img, anno, np.array(img.shape[0:2])
 
 
-def thread_batch_preprocess_true_box(annos, config, input_shape, result_index, batch_bbox_true_1, batch_bbox_true_2,
-                                     batch_bbox_true_3, batch_gt_box1, batch_gt_box2, batch_gt_box3):
-    """Preprocess true box for multi-thread."""
-    i = 0
-    for anno in annos:
-        bbox_true_1, bbox_true_2, bbox_true_3, gt_box1, gt_box2, gt_box3 = \
-            _preprocess_true_boxes(true_boxes=anno, anchors=config.anchor_scales, in_shape=input_shape,
-                                   num_classes=config.num_classes, max_boxes=config.max_box,
-                                   label_smooth=config.label_smooth, label_smooth_factor=config.label_smooth_factor)
-        batch_bbox_true_1[result_index + i] = bbox_true_1
-        batch_bbox_true_2[result_index + i] = bbox_true_2
-        batch_bbox_true_3[result_index + i] = bbox_true_3
-        batch_gt_box1[result_index + i] = gt_box1
-        batch_gt_box2[result_index + i] = gt_box2
-        batch_gt_box3[result_index + i] = gt_box3
-        i = i + 1
+def _scatter_true_boxes(y_true, cell, boxes, cls, label_smooth, label_smooth_factor):
+    """Write boxes into the flattened cells of y_true, later boxes overwrite earlier ones in the same cell."""
+    num_classes = y_true.shape[-1] - 5
+    y_true = y_true.reshape(-1, 5 + num_classes)
+    _, last = np.unique(cell[::-1], return_index=True)
+    win = cell.size - 1 - last
+    y_true[cell[win], 0:4] = boxes[win]
+    y_true[cell[win], 4] = 1.
+    # lable-smooth
+    if label_smooth:
+        sigma = label_smooth_factor / (num_classes - 1)
+        y_true[cell[win], 5:] = sigma
+        y_true[cell[win], 5 + cls[win]] = 1 - label_smooth_factor
+    else:
+        # without label smooth every box keeps its class bit in a shared cell
+        y_true[cell, 5 + cls] = 1.
 
 
-def batch_preprocess_true_box(annos, config, input_shape):
-    """Preprocess true box with multi-thread."""
-    batch_bbox_true_1 = []
-    batch_bbox_true_2 = []
-    batch_bbox_true_3 = []
-    batch_gt_box1 = []
-    batch_gt_box2 = []
-    batch_gt_box3 = []
-    threads = []
-
-    step = 4
-    for index in range(0, len(annos), step):
-        for _ in range(step):
-            batch_bbox_true_1.append(None)
-            batch_bbox_true_2.append(None)
-            batch_bbox_true_3.append(None)
-            batch_gt_box1.append(None)
-            batch_gt_box2.append(None)
-            batch_gt_box3.append(None)
-        step_anno = annos[index: index + step]
-        t = threading.Thread(target=thread_batch_preprocess_true_box,
-                             args=(step_anno, config, input_shape, index, batch_bbox_true_1, batch_bbox_true_2,
-                                   batch_bbox_true_3, batch_gt_box1, batch_gt_box2, batch_gt_box3))
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()
+def _pad_gt_boxes(y_true, max_boxes):
+    """Gather the boxes of all object cells of every image, in cell order, padded to max_boxes."""
+    batch_size = y_true.shape[0]
+    mask = y_true[..., 4].reshape(batch_size, -1) == 1
+    gt_box = y_true[..., 0:4].reshape(batch_size, -1, 4)
+    rank = np.cumsum(mask, axis=1) - 1
+    bi, ci = np.nonzero(mask & (rank < max_boxes))
+    pad_gt_box = np.zeros(shape=[batch_size, max_boxes, 4], dtype=np.float32)
+    pad_gt_box[bi, rank[bi, ci]] = gt_box[bi, ci]
+    return pad_gt_box
 
-    return np.array(batch_bbox_true_1), np.array(batch_bbox_true_2), np.array(batch_bbox_true_3), \
-           np.array(batch_gt_box1), np.array(batch_gt_box2), np.array(batch_gt_box3)
+
+def batch_preprocess_true_box(annos, config, input_shape, iou_threshold=0.213):
+    """
+    Preprocess true boxes of a whole batch at once.
+
+    Gives the same targets as calling _preprocess_true_boxes on every anno, with all anchor assignments and
+    target writes done as array operations over the batch.
+    """
+    anchors = np.array(config.anchor_scales)
+    anchor_mask = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]
+    num_classes = config.num_classes
+    batch_size = len(annos)
+    num_boxes = max(len(anno) for anno in annos)
+    true_boxes = np.zeros((batch_size, num_boxes, 5), dtype='float32')
+    for b, anno in enumerate(annos):
+        true_boxes[b, :len(anno)] = anno
+    input_shape = np.array(input_shape, dtype='int32')
+    boxes_xy = (true_boxes[..., 0:2] + true_boxes[..., 2:4]) // 2.
+    boxes_wh = true_boxes[..., 2:4] - true_boxes[..., 0:2]
+    # input_shape is [h, w], boxes_xywh = normalized [x, y, w, h]
+    boxes_xywh = np.zeros(boxes_xy.shape[:-1] + (4,), dtype='float32')
+    boxes_xywh[..., 0:2] = boxes_xy / input_shape[::-1]
+    boxes_xywh[..., 2:4] = boxes_wh / input_shape[::-1]
+    cls = true_boxes[..., 4].astype('int32')
+    grid_shapes = [input_shape // 32, input_shape // 16, input_shape // 8]
+    y_true = [np.zeros((batch_size, grid_shape[0], grid_shape[1], len(mask), 5 + num_classes), dtype='float32')
+              for grid_shape, mask in zip(grid_shapes, anchor_mask)]
+
+    # iou of every box with every anchor, both centered at the origin, shape [batch, boxes, anchors]
+    wh = np.expand_dims(boxes_wh, -2)
+    boxes_max = wh / 2.
+    anchors_max = anchors / 2.
+    intersect_min = np.maximum(-boxes_max, -anchors_max)
+    intersect_max = np.minimum(boxes_max, anchors_max)
+    intersect_wh = np.maximum(intersect_max - intersect_min, 0.)
+    intersect_area = intersect_wh[..., 0] * intersect_wh[..., 1]
+    box_area = wh[..., 0] * wh[..., 1]
+    anchor_area = anchors[..., 0] * anchors[..., 1]
+    iou = intersect_area / (box_area + anchor_area - intersect_area)
+    valid_mask = boxes_wh[..., 0] > 0
+
+    # topk iou, selected by the same rule as _preprocess_true_boxes
+    topk = 4
+    topk_flag = iou.argsort(axis=-1)
+    topk_flag = (topk_flag >= topk_flag.shape[-1] - topk) & (iou >= iou_threshold) & valid_mask[..., None]
+    b_topk, t_topk, n_topk = topk_flag.nonzero()
+    # best anchor for gt, written after the topk anchors
+    b_best, t_best = valid_mask.nonzero()
+    n_best = np.argmax(iou, axis=-1)[b_best, t_best]
+    b_all = np.concatenate((b_topk, b_best))
+    t_all = np.concatenate((t_topk, t_best))
+    n_all = np.concatenate((n_topk, n_best))
+
+    pad_gt_boxes = []
+    for l, mask in enumerate(anchor_mask):
+        sel = np.isin(n_all, mask)
+        b, t = b_all[sel], t_all[sel]
+        k = np.searchsorted(mask, n_all[sel])
+        grid_h, grid_w = grid_shapes[l]
+        i = np.floor(boxes_xywh[b, t, 0].astype(np.float64) * grid_w).astype('int32')  # grid_y
+        j = np.floor(boxes_xywh[b, t, 1].astype(np.float64) * grid_h).astype('int32')  # grid_x
+        cell = ((b * grid_h + j) * grid_w + i) * len(mask) + k
+        _scatter_true_boxes(y_true[l], cell, boxes_xywh[b, t], cls[b, t],
+                            config.label_smooth, config.label_smooth_factor)
+        # pad_gt_boxes for avoiding dynamic shape
+        pad_gt_boxes.append(_pad_gt_boxes(y_true[l], config.max_box))
+    return y_true[0], y_true[1], y_true[2], pad_gt_boxes[0], pad_gt_boxes[1], pad_gt_boxes[2]
+
+
+class BatchPreprocessTrueBox:
+    """Preprocess true boxes in the per_batch_map of dataset.batch."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def __call__(self, annos, input_shapes, batch_info):
+        # all images of a batch share the input shape
+        bbox_true_1, bbox_true_2, bbox_true_3, gt_box1, gt_box2, gt_box3 = \
+            batch_preprocess_true_box(annos, self.config, input_shapes[0])
+        return annos, list(bbox_true_1), list(bbox_true_2), list(bbox_true_3), \
+               list(gt_box1), list(gt_box2), list(gt_box3)
 
 
 def batch_preprocess_true_box_single(annos, config, input_shape):
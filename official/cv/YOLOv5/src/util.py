@@ -15,10 +15,8 @@
 """Util class or function."""
 import os
 import sys
-from collections import defaultdict
 import datetime
 import copy
-import json
 from typing import Union, List
 import numpy as np
 from pycocotools.coco import COCO
@@ -29,6 +27,7 @@ import mindspore.nn as nn
 from mindspore import Tensor, ops
 
 from .yolo import YoloLossBlock
+from .nms import batched_nms
 
 
 class AverageMeter:
@@ -171,6 +170,48 @@ def cpu_affinity(rank_id, device_num):
     print(f"==== {rank_id}/{device_num} ==== bind cpu: {used_cpu_list}")
 
 
+# One row per decoded box, bbox is [x_top_left, y_top_left, w, h] in original image coordinates.
+DETECTION_DTYPE = np.dtype([('image_id', np.int64),
+                            ('category_id', np.int32),
+                            ('bbox', np.float32, (4,)),
+                            ('score', np.float32)])
+
+
+class DetectionShardWriter:
+    """Append-only binary file of DETECTION_DTYPE records, one per rank."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.num_records = 0
+        self._file = None
+
+    def append(self, dets):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            self._file = open(self.file_path, 'wb')
+        dets.tofile(self._file)
+        self.num_records += dets.size
+
+    def close(self, file_path):
+        """Close the shard and move it to file_path."""
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            self._file = open(self.file_path, 'wb')
+        self._file.close()
+        self._file = None
+        os.replace(self.file_path, file_path)
+        num_records = self.num_records
+        self.num_records = 0
+        return num_records
+
+
+def read_detection_shard(file_path):
+    """Map a shard written by DetectionShardWriter without parsing it."""
+    if os.path.getsize(file_path) == 0:
+        return np.zeros(0, dtype=DETECTION_DTYPE)
+    return np.memmap(file_path, dtype=DETECTION_DTYPE, mode='r')
+
+
 class COCOEvaluator:
     def __init__(self, detection_config) -> None:
         self.coco_gt = COCO(detection_config.val_ann_file)
@@ -187,52 +228,49 @@ class COCOEvaluator:
             return self.get_mAP_multiple_file(coco_dt_ann_file)
         raise ValueError("Invalid 'coco_dt_ann_file' type. Support str or List[str].")
 
-    def merge_result_files(self, file_path: List[str]) -> List:
+    def merge_result_files(self, file_path: List[str]) -> np.ndarray:
+        """Concatenate the shards of all ranks, keeping every image from the first shard that holds it."""
         dt_list = []
-        dt_ids_set = set([])
-        self.logger.info(f"Total {len(file_path)} json files")
+        dt_ids = np.zeros(0, dtype=np.int64)
+        self.logger.info(f"Total {len(file_path)} result files")
         self.logger.info(f"File list: {file_path}")
 
         for path in file_path:
-            ann_list = []
-            try:
-                with open(path, 'r') as f:
-                    ann_list = json.load(f)
-            except json.decoder.JSONDecodeError:
-                pass    # json file is empty
-            else:
-                ann_ids = set(ann['image_id'] for ann in ann_list)
-                diff_ids = ann_ids - dt_ids_set
-                ann_list = [ann for ann in ann_list if ann['image_id'] in diff_ids]
-                dt_ids_set = dt_ids_set | diff_ids
-                dt_list.extend(ann_list)
-        return dt_list
-
-    def get_coco_from_dt_list(self, dt_list) -> COCO:
-        cocoDt = COCO()
-        cocoDt.dataset = {}
-        cocoDt.dataset['images'] = [img for img in self.coco_gt.dataset['images']]
-        cocoDt.dataset['categories'] = copy.deepcopy(self.coco_gt.dataset['categories'])
-        self.logger.info(f"Number of dt boxes: {len(dt_list)}")
-        for idx, ann in enumerate(dt_list):
-            bb = ann['bbox']
-            x1, x2, y1, y2 = [bb[0], bb[0] + bb[2], bb[1], bb[1] + bb[3]]
-            if 'segmentation' not in ann:
-                ann['segmentation'] = [[x1, y1, x1, y2, x2, y2, x2, y1]]
-            ann['area'] = bb[2] * bb[3]
-            ann['id'] = idx + 1
-            ann['iscrowd'] = 0
-        cocoDt.dataset['annotations'] = dt_list
-        cocoDt.createIndex()
-        return cocoDt
+            dets = read_detection_shard(path)
+            ann_ids = np.unique(dets['image_id'])
+            diff_ids = np.setdiff1d(ann_ids, dt_ids, assume_unique=True)
+            if diff_ids.size < ann_ids.size:
+                dets = dets[np.isin(dets['image_id'], diff_ids)]
+            dt_ids = np.union1d(dt_ids, diff_ids)
+            dt_list.append(np.asarray(dets))
+        if not dt_list:
+            return np.zeros(0, dtype=DETECTION_DTYPE)
+        return np.concatenate(dt_list)
+
+    def get_coco_from_dets(self, dets: np.ndarray) -> COCO:
+        self.logger.info(f"Number of dt boxes: {dets.size}")
+        if dets.size == 0:
+            coco_dt = COCO()
+            coco_dt.dataset['images'] = [img for img in self.coco_gt.dataset['images']]
+            coco_dt.dataset['categories'] = copy.deepcopy(self.coco_gt.dataset['categories'])
+            coco_dt.dataset['annotations'] = []
+            coco_dt.createIndex()
+            return coco_dt
+        # [image_id, x, y, w, h, score, category_id] rows, as accepted by COCO.loadRes
+        res = np.empty((dets.size, 7), dtype=np.float64)
+        res[:, 0] = dets['image_id']
+        res[:, 1:5] = dets['bbox']
+        res[:, 5] = dets['score']
+        res[:, 6] = dets['category_id']
+        return self.coco_gt.loadRes(res)
 
     def get_mAP_multiple_file(self, coco_dt_ann_file: List[str]) -> str:
-        dt_list = self.merge_result_files(coco_dt_ann_file)
-        coco_dt = self.get_coco_from_dt_list(dt_list)
+        dets = self.merge_result_files(coco_dt_ann_file)
+        coco_dt = self.get_coco_from_dets(dets)
         return self.compute_coco_mAP(coco_dt)
 
     def get_mAP_single_file(self, coco_dt_ann_file: str) -> str:
-        coco_dt = self.coco_gt.loadRes(coco_dt_ann_file)
+        coco_dt = self.get_coco_from_dets(np.asarray(read_detection_shard(coco_dt_ann_file)))
         return self.compute_coco_mAP(coco_dt)
 
     def compute_coco_mAP(self, coco_dt: COCO) -> str:
@@ -255,12 +293,12 @@ class DetectionEngine:
         self.ignore_threshold = threshold
         self.labels = args_detection.labels
         self.num_classes = len(self.labels)
-        self.results = {}
+        self.det_chunks = []
         self.file_path = ''
         self.save_prefix = args_detection.output_dir
         self.ann_file = args_detection.val_ann_file
-        self.det_boxes = []
         self.nms_thresh = args_detection.eval_nms_thresh
+        self.nms_workers = args_detection.eval_nms_workers
         self.multi_label = args_detection.multi_label
         self.multi_label_thresh = args_detection.multi_label_thresh
 
@@ -270,94 +308,26 @@ class DetectionEngine:
             self.save_prefix = args_detection.save_prefix
         self.rank_id = args_detection.rank
         self.dir_path = ''
+        self.shard_writer = DetectionShardWriter(os.path.join(self.save_prefix, f"predict-rank{self.rank_id}.pending"))
+        self._seen_img_ids = set()
         self.coco_evaluator = COCOEvaluator(args_detection)
         self.coco_catids = self.coco_evaluator.coco_gt.getCatIds()
         self.coco_catIds = args_detection.coco_ids
         self._img_ids = list(sorted(self.coco_evaluator.coco_gt.imgs.keys()))
 
     def do_nms_for_results(self):
-        """Get result boxes."""
-        for img_id in self.results:
-            for clsi in self.results[img_id]:
-                dets = self.results[img_id][clsi]
-                dets = np.array(dets)
-                keep_index = self._diou_nms(dets, thresh=self.nms_thresh)
-
-                keep_box = [{'image_id': int(img_id), 'category_id': int(clsi),
-                             'bbox': list(dets[i][:4].astype(float)),
-                             'score': dets[i][4].astype(float)} for i in keep_index]
-                self.det_boxes.extend(keep_box)
-
-    def _nms(self, predicts, threshold):
-        """Calculate NMS."""
+        """Run NMS over the pending candidates and append the kept boxes to the result shard."""
+        if not self.det_chunks:
+            return
+        dets = np.concatenate(self.det_chunks)
+        self.det_chunks.clear()
         # convert xywh -> xmin ymin xmax ymax
-        x1 = predicts[:, 0]
-        y1 = predicts[:, 1]
-        x2 = x1 + predicts[:, 2]
-        y2 = y1 + predicts[:, 3]
-        scores = predicts[:, 4]
-
-        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-        order = scores.argsort()[::-1]
-
-        reserved_boxes = []
-        while order.size > 0:
-            i = order[0]
-            reserved_boxes.append(i)
-            max_x1 = np.maximum(x1[i], x1[order[1:]])
-            max_y1 = np.maximum(y1[i], y1[order[1:]])
-            min_x2 = np.minimum(x2[i], x2[order[1:]])
-            min_y2 = np.minimum(y2[i], y2[order[1:]])
-
-            intersect_w = np.maximum(0.0, min_x2 - max_x1 + 1)
-            intersect_h = np.maximum(0.0, min_y2 - max_y1 + 1)
-            intersect_area = intersect_w * intersect_h
-            ovr = intersect_area / \
-                (areas[i] + areas[order[1:]] - intersect_area)
-
-            indexes = np.where(ovr <= threshold)[0]
-            order = order[indexes + 1]
-        return reserved_boxes
-
-    def _diou_nms(self, dets, thresh=0.5):
-        """
-        convert xywh -> xmin ymin xmax ymax
-        """
-        x1 = dets[:, 0]
-        y1 = dets[:, 1]
-        x2 = x1 + dets[:, 2]
-        y2 = y1 + dets[:, 3]
-        scores = dets[:, 4]
-        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-        order = scores.argsort()[::-1]
-        keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(i)
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(0.0, xx2 - xx1 + 1)
-            h = np.maximum(0.0, yy2 - yy1 + 1)
-            inter = w * h
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-            center_x1 = (x1[i] + x2[i]) / 2
-            center_x2 = (x1[order[1:]] + x2[order[1:]]) / 2
-            center_y1 = (y1[i] + y2[i]) / 2
-            center_y2 = (y1[order[1:]] + y2[order[1:]]) / 2
-            inter_diag = (center_x2 - center_x1) ** 2 + (center_y2 - center_y1) ** 2
-            out_max_x = np.maximum(x2[i], x2[order[1:]])
-            out_max_y = np.maximum(y2[i], y2[order[1:]])
-            out_min_x = np.minimum(x1[i], x1[order[1:]])
-            out_min_y = np.minimum(y1[i], y1[order[1:]])
-            outer_diag = (out_max_x - out_min_x) ** 2 + (out_max_y - out_min_y) ** 2
-            diou = ovr - inter_diag / outer_diag
-            diou = np.core.umath.clip(diou, -1, 1)
-            inds = np.where(diou <= thresh)[0]
-            order = order[inds + 1]
-        return keep
+        boxes = dets['bbox'].copy()
+        boxes[:, 2:] += boxes[:, :2]
+        groups = dets['image_id'] * (int(dets['category_id'].max()) + 1) + dets['category_id']
+        keep_index = batched_nms(boxes, dets['score'], groups, self.nms_thresh, method='diou',
+                                 num_workers=self.nms_workers)
+        self.shard_writer.append(dets[keep_index])
 
     def write_result(self, cur_epoch=0, cur_step=0):
         """Save result to file."""
@@ -367,24 +337,24 @@ class DetectionEngine:
             self.dir_path = os.path.join(self.save_prefix, f"eval_epoch{cur_epoch}-step{cur_step}")
             if not os.path.exists(self.dir_path):
                 os.makedirs(self.dir_path, exist_ok=True)
-            file_name = f"epoch{cur_epoch}-step{cur_step}-rank{rank_id}.json"
+            file_name = f"epoch{cur_epoch}-step{cur_step}-rank{rank_id}.bin"
             self.file_path = os.path.join(self.dir_path, file_name)
         else:
             t = datetime.datetime.now().strftime('_%Y_%m_%d_%H_%M_%S')
-            self.file_path = self.save_prefix + '/predict' + t + '.json'
+            self.file_path = self.save_prefix + '/predict' + t + '.bin'
         try:
-            with open(self.file_path, 'w') as f:
-                json.dump(self.det_boxes, f)
+            num_boxes = self.shard_writer.close(self.file_path)
         except IOError as e:
-            raise RuntimeError("Unable to open json file to dump. What(): {}".format(str(e)))
+            raise RuntimeError("Unable to write result file. What(): {}".format(str(e)))
         else:
-            self.logger.info(f'Result file path: {self.file_path}')
-            self.det_boxes.clear()
+            self.logger.info(f'Result file path: {self.file_path}, {num_boxes} boxes')
+            self._seen_img_ids.clear()
 
     def get_eval_result(self):
         """Get eval result."""
         if self.eval_parallel:
-            file_paths = [os.path.join(self.dir_path, path) for path in os.listdir(self.dir_path)]
+            file_paths = [os.path.join(self.dir_path, path) for path in os.listdir(self.dir_path)
+                          if path.endswith('.bin')]
             eval_results = self.coco_evaluator.get_mAP(file_paths)
         else:
             eval_results = self.coco_evaluator.get_mAP(self.file_path)
@@ -392,54 +362,64 @@ class DetectionEngine:
         return eval_results, mAP
 
     def detect(self, outputs, batch, image_shape, image_id):
-        """Detect boxes."""
+        """Detect boxes of a whole batch at once."""
         # output [|32, 52, 52, 3, 85| ]
-        for batch_id in range(batch):
-            for out_item in outputs:
-                # 52, 52, 3, 85
-                out_item_single = out_item[batch_id, :]
-                ori_w, ori_h = image_shape[batch_id]
-                img_id = int(image_id[batch_id])
-                if img_id not in self.results:
-                    self.results[img_id] = defaultdict(list)
-                x = ori_w * out_item_single[..., 0].reshape(-1)
-                y = ori_h * out_item_single[..., 1].reshape(-1)
-                w = ori_w * out_item_single[..., 2].reshape(-1)
-                h = ori_h * out_item_single[..., 3].reshape(-1)
-                conf = out_item_single[..., 4:5]
-                cls_emb = out_item_single[..., 5:]
-                x_top_left = x - w / 2.
-                y_top_left = y - h / 2.
-                cls_emb = cls_emb.reshape(-1, self.num_classes)
-                if self.multi_label:
-                    conf = conf.reshape(-1, 1)
-                    confidence = conf * cls_emb
-                    # create all False
-                    flag = (cls_emb > self.multi_label_thresh) & (confidence >= self.ignore_threshold)
-                    i, j = flag.nonzero()
-                    x_left, y_left = np.maximum(0, x_top_left[i]), np.maximum(0, y_top_left[i])
-                    w, h = np.minimum(ori_w, w[i]), np.minimum(ori_h, h[i])
-                    cls_id = np.array(self.coco_catIds)[j]
-                    conf = confidence[i, j]
-                    for (x_i, y_i, w_i, h_i, conf_i, cls_id_i) in zip(x_left, y_left, w, h, conf, cls_id):
-                        self.results[img_id][cls_id_i].append([x_i, y_i, w_i, h_i, conf_i])
-                else:
-                    cls_argmax = np.argmax(cls_emb, axis=-1)
-                    # create all False
-                    flag = np.random.random(cls_emb.shape) > sys.maxsize
-                    for i in range(flag.shape[0]):
-                        c = cls_argmax[i]
-                        flag[i, c] = True
-                    confidence = conf.reshape(-1) * cls_emb[flag]
-                    for x_lefti, y_lefti, wi, hi, confi, clsi in zip(x_top_left, y_top_left,
-                                                                     w, h, confidence, cls_argmax):
-                        if confi < self.ignore_threshold:
-                            continue
-                        x_lefti, y_lefti = max(0, x_lefti), max(0, y_lefti)
-                        wi, hi = min(wi, ori_w), min(hi, ori_h)
-                        # transform catId to match coco
-                        coco_clsi = self.coco_catids[clsi]
-                        self.results[img_id][coco_clsi].append([x_lefti, y_lefti, wi, hi, confi])
+        image_shape = np.asarray(image_shape)[:batch]
+        img_ids = np.asarray(image_id)[:batch].astype(np.int64)
+        # images repeated by the sampler were already decoded, drop them so NMS can run batch by batch
+        rows = []
+        for row, img_id in enumerate(img_ids.tolist()):
+            if img_id not in self._seen_img_ids:
+                self._seen_img_ids.add(img_id)
+                rows.append(row)
+        if not rows:
+            return
+        if len(rows) < batch:
+            outputs = [out_item[rows] for out_item in outputs]
+            image_shape, img_ids = image_shape[rows], img_ids[rows]
+            batch = len(rows)
+        for out_item in outputs:
+            dets = self._decode_output(out_item[:batch], image_shape, img_ids)
+            if dets.size:
+                self.det_chunks.append(dets)
+
+    def _decode_output(self, out_item, image_shape, img_ids):
+        """Threshold, argmax and clip one output scale of a batch into a DETECTION_DTYPE array."""
+        batch = out_item.shape[0]
+        # 32, 52 * 52 * 3, 85
+        out_item = out_item.reshape(batch, -1, 5 + self.num_classes)
+        ori_w = image_shape[:, 0:1].astype(out_item.dtype)
+        ori_h = image_shape[:, 1:2].astype(out_item.dtype)
+        w = ori_w * out_item[..., 2]
+        h = ori_h * out_item[..., 3]
+        x_top_left = ori_w * out_item[..., 0] - w / 2.
+        y_top_left = ori_h * out_item[..., 1] - h / 2.
+        conf = out_item[..., 4:5]
+        cls_emb = out_item[..., 5:]
+        if self.multi_label:
+            confidence = conf * cls_emb
+            flag = (cls_emb > self.multi_label_thresh) & (confidence >= self.ignore_threshold)
+            b, i, j = flag.nonzero()
+            score = confidence[b, i, j]
+            # transform catId to match coco
+            cls_id = np.asarray(self.coco_catIds)[j]
+        else:
+            cls_argmax = np.argmax(cls_emb, axis=-1)
+            confidence = conf[..., 0] * np.take_along_axis(cls_emb, cls_argmax[..., None], axis=-1)[..., 0]
+            b, i = (confidence >= self.ignore_threshold).nonzero()
+            score = confidence[b, i]
+            # transform catId to match coco
+            cls_id = np.asarray(self.coco_catids)[cls_argmax[b, i]]
+
+        dets = np.empty(b.size, dtype=DETECTION_DTYPE)
+        dets['image_id'] = img_ids[b]
+        dets['category_id'] = cls_id
+        dets['bbox'][:, 0] = np.maximum(0, x_top_left[b, i])
+        dets['bbox'][:, 1] = np.maximum(0, y_top_left[b, i])
+        dets['bbox'][:, 2] = np.minimum(w[b, i], ori_w[b, 0])
+        dets['bbox'][:, 3] = np.minimum(h[b, i], ori_h[b, 0])
+        dets['score'] = score
+        return dets
 
 
 class AllReduce(nn.Cell):
@@ -485,6 +465,8 @@ class EvalWrapper:
             output_me = output_me.asnumpy()
             output_small = output_small.asnumpy()
             self.engine.detect([output_small, output_me, output_big], self.per_batch_size, image_shape_, image_id_)
+            # every image is complete within its batch, so boxes can leave memory right away
+            self.engine.do_nms_for_results()
 
             if index % 50 == 0:
                 self.logger.info('Processing... {:.2f}% '.format(index / self.dataset.get_dataset_size() * 100))
@@ -22,7 +22,7 @@ from PIL import Image
 from pycocotools.coco import COCO
 import mindspore.dataset as ds
 from src.distributed_sampler import DistributedSampler
-from src.transforms import reshape_fn, MultiScaleTrans, PreprocessTrueBox
+from src.transforms import reshape_fn, MultiScaleTrans, BatchPreprocessTrueBox
 
 
 min_keypoints_per_image = 10
@@ -261,11 +261,10 @@ def create_yolo_dataset(image_dir, anno_path, batch_size, device_num, rank,
         dataset = dataset.map(operations=multi_scale_trans, input_columns=dataset_column_names,
                               output_columns=map1_out_column_names,
                               num_parallel_workers=min(12, num_parallel_workers), python_multiprocessing=True)
-        dataset = dataset.map(operations=PreprocessTrueBox(config), input_columns=map2_in_column_names,
-                              output_columns=map2_out_column_names,
-                              num_parallel_workers=min(4, num_parallel_workers), python_multiprocessing=False)
+        dataset = dataset.batch(batch_size, per_batch_map=BatchPreprocessTrueBox(config),
+                                input_columns=map2_in_column_names, output_columns=map2_out_column_names,
+                                num_parallel_workers=min(4, num_parallel_workers), drop_remainder=True)
         dataset = dataset.project(output_column_names)
-        dataset = dataset.batch(batch_size, num_parallel_workers=min(4, num_parallel_workers), drop_remainder=True)
     else:
         dataset = ds.GeneratorDataset(yolo_dataset, column_names=["image", "img_id"],
                                       sampler=distributed_sampler)
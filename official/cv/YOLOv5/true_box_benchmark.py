@@ -0,0 +1,65 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Benchmark the batched true box preprocessing against the per image loop.
+
+Usage: python true_box_benchmark.py --per_batch_size 32
+"""
+import time
+
+import numpy as np
+
+from src.transforms import batch_preprocess_true_box, batch_preprocess_true_box_single
+from model_utils.config import config
+
+
+def make_annos(rng, batch_size, max_boxes, boxes_per_image, num_classes, input_shape):
+    """Random valid boxes at the front of every anno, zero padded to max_boxes like _data_aug does."""
+    input_h, input_w = input_shape
+    annos = []
+    for _ in range(batch_size):
+        num = min(boxes_per_image, max_boxes)
+        anno = np.zeros((max_boxes, 5))
+        xy = rng.uniform(0, [input_w - 4, input_h - 4], (num, 2))
+        wh = rng.uniform(2, [input_w / 2, input_h / 2], (num, 2))
+        anno[:num, 0:2] = xy
+        anno[:num, 2:4] = np.minimum(xy + wh, [input_w - 1, input_h - 1])
+        anno[:num, 4] = rng.integers(0, num_classes, num)
+        annos.append(anno)
+    return annos
+
+
+def main():
+    rng = np.random.default_rng(0)
+    input_shape = (640, 640)
+    print("{:>10} {:>12} {:>12} {:>8}".format("boxes/img", "loop(ms)", "batched(ms)", "match"))
+    repeat = 5
+    for boxes_per_image in (5, 20, 100):
+        annos = make_annos(rng, config.per_batch_size, config.max_box, boxes_per_image, config.num_classes, input_shape)
+        loop_time = batched_time = 0.
+        for _ in range(repeat):
+            start = time.time()
+            expected = batch_preprocess_true_box_single(annos, config, input_shape)
+            loop_time += time.time() - start
+            start = time.time()
+            result = batch_preprocess_true_box(annos, config, input_shape)
+            batched_time += time.time() - start
+        match = all(np.array_equal(a, b) for a, b in zip(expected, result))
+        print("{:>10} {:>12.2f} {:>12.2f} {:>8}".format(
+            boxes_per_image, loop_time / repeat * 1000, batched_time / repeat * 1000, str(match)))
+
+
+if __name__ == "__main__":
+    main()
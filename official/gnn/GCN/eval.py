@@ -18,6 +18,7 @@ GCN eval script.
 """
 
 import argparse
+import ast
 import numpy as np
 import mindspore.nn as nn
 import mindspore.dataset as ds
@@ -27,7 +28,7 @@ from mindspore import Tensor
 from mindspore import Model, context
 
 from src.config import ConfigGCN
-from src.dataset import get_adj_features_labels, get_mask
+from src.dataset import get_adj_features_labels, get_mask, adj_to_tensor
 from src.metrics import Loss_Gpu
 from src.gcn import GCN_GPU
 
@@ -40,25 +41,27 @@ def run_gcn_infer():
     parser.add_argument('--test_nodes_num', type=int, default=1000, help='Nodes numbers for test')
     parser.add_argument("--model_ckpt", type=str, required=True,
                         help="existed checkpoint address.")
-    parser.add_argument('--device_target', type=str, default="Ascend", choices=['Ascend', 'GPU'],
+    parser.add_argument('--device_target', type=str, default="Ascend", choices=['Ascend', 'GPU', 'CPU'],
                         help='device where the code will be implemented (default: Ascend)')
+    parser.add_argument('--sparse_adj', type=ast.literal_eval, default=False,
+                        help='Use a sparse adjacency matrix instead of a dense one (default: False)')
     args_opt = parser.parse_args()
 
     context.set_context(mode=context.GRAPH_MODE,
                         device_target=args_opt.device_target, save_graphs=False)
     config = ConfigGCN()
-    adj, feature, label_onehot, _ = get_adj_features_labels(args_opt.data_dir)
+    adj, feature, label_onehot, _ = get_adj_features_labels(args_opt.data_dir, args_opt.sparse_adj)
     feature_d = np.expand_dims(feature, axis=0)
     label_onehot_d = np.expand_dims(label_onehot, axis=0)
     data = {"feature": feature_d, "label": label_onehot_d}
     dataset = ds.NumpySlicesDataset(data=data)
-    adj = Tensor(adj, dtype=mstype.float32)
+    adj, adj_shape = adj_to_tensor(adj, mstype.float32)
     feature = Tensor(feature)
     nodes_num = label_onehot.shape[0]
     test_mask = get_mask(nodes_num, nodes_num - args_opt.test_nodes_num, nodes_num)
     class_num = label_onehot.shape[1]
     input_dim = feature.shape[1]
-    gcn_net_test = GCN_GPU(config, input_dim, class_num, adj)
+    gcn_net_test = GCN_GPU(config, input_dim, class_num, adj, adj_shape)
     load_checkpoint(args_opt.model_ckpt, net=gcn_net_test)
     eval_metrics = {'Acc': nn.Accuracy()}
     criterion = Loss_Gpu(test_mask, config.weight_decay, gcn_net_test.trainable_params()[0])
@@ -0,0 +1,117 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Scaling benchmark of the sparse adjacency path on synthetic graphs, from the size of cora up to 1M nodes.
+
+For every node count, the adjacency matrix is built from a random neighbor table, and the full-batch train
+step of GCN is timed with the sparse adjacency matrix. Up to --max_dense_nodes nodes, the dense adjacency
+matrix is timed as well and the outputs of both are compared.
+
+Usage: python sparse_benchmark.py --nodes_list 2708,20000,100000,1000000 --device_target CPU
+"""
+import argparse
+import time
+
+import numpy as np
+from mindspore import Tensor, context
+
+from src.config import ConfigGCN
+from src.dataset import build_adj, adj_to_tensor, get_mask
+from src.gcn import GCN
+from src.metrics import TrainNetWrapper
+
+MB = 1024 * 1024
+
+
+def make_graph(rng, nodes_num, avg_degree, max_degree):
+    """Random node ids and neighbor table padded with -1, like GraphData.get_all_neighbors."""
+    nodes = rng.permutation(nodes_num * 2)[:nodes_num]
+    degree = np.minimum(rng.poisson(avg_degree, nodes_num), max_degree)
+    neighbor = np.full((nodes_num, max_degree + 1), -1, np.int64)
+    neighbor[:, 0] = nodes
+    valid = np.arange(max_degree) < degree[:, None]
+    neighbor[:, 1:][valid] = nodes[rng.integers(0, nodes_num, int(degree.sum()))]
+    return nodes, neighbor
+
+
+def time_train(config, adj, feature, label_onehot, train_mask, epochs):
+    """Seconds per full-batch train step, after the graph is compiled by the first step."""
+    adj, adj_shape = adj_to_tensor(adj)
+    np.random.seed(1)
+    net = GCN(config, feature.shape[1], label_onehot.shape[1], adj_shape)
+    train_net = TrainNetWrapper(net, label_onehot, train_mask, config)
+    train_net.set_train()
+    feature = Tensor(feature)
+    train_net(adj, feature)
+    start = time.time()
+    for _ in range(epochs):
+        loss = train_net(adj, feature)[0].asnumpy()
+    return (time.time() - start) / epochs, loss
+
+
+def forward(config, adj, feature, class_num):
+    adj, adj_shape = adj_to_tensor(adj)
+    np.random.seed(1)
+    net = GCN(config, feature.shape[1], class_num, adj_shape)
+    net.set_train(False)
+    return net(adj, Tensor(feature)).asnumpy().astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GCN sparse adjacency scaling benchmark")
+    parser.add_argument("--nodes_list", type=str, default="2708,20000,100000,1000000",
+                        help="Comma separated node counts. Default: 2708,20000,100000,1000000")
+    parser.add_argument("--avg_degree", type=float, default=4, help="Average out degree. Default: 4")
+    parser.add_argument("--max_degree", type=int, default=32, help="Width of the neighbor table. Default: 32")
+    parser.add_argument("--feature_dim", type=int, default=64, help="Node feature dimension. Default: 64")
+    parser.add_argument("--class_num", type=int, default=7, help="Default: 7")
+    parser.add_argument("--epochs", type=int, default=5, help="Timed train steps. Default: 5")
+    parser.add_argument("--max_dense_nodes", type=int, default=20000,
+                        help="Largest node count also run with the dense adjacency matrix. Default: 20000")
+    parser.add_argument("--device_target", type=str, default="CPU", choices=["CPU", "GPU"],
+                        help="Default: CPU")
+    args = parser.parse_args()
+
+    context.set_context(mode=context.GRAPH_MODE, device_target=args.device_target)
+    config = ConfigGCN()
+    rng = np.random.default_rng(0)
+    print("{:>9} {:>10} {:>9} {:>11} {:>11} {:>11} {:>11} {:>7}".format(
+        "nodes", "nnz", "build(s)", "sparse(MB)", "dense(MB)", "sparse(ms)", "dense(ms)", "match"))
+    for nodes_num in [int(n) for n in args.nodes_list.split(",")]:
+        nodes, neighbor = make_graph(rng, nodes_num, args.avg_degree, args.max_degree)
+        start = time.time()
+        adj = build_adj(nodes, neighbor)
+        build_time = time.time() - start
+
+        feature = rng.random((nodes_num, args.feature_dim), dtype=np.float32)
+        labels = rng.integers(0, args.class_num, nodes_num)
+        label_onehot = np.eye(args.class_num, dtype=np.float32)[labels]
+        train_mask = get_mask(nodes_num, 0, nodes_num // 10)
+
+        sparse_time, _ = time_train(config, adj, feature, label_onehot, train_mask, args.epochs)
+        dense_time, match = float("nan"), "-"
+        if nodes_num <= args.max_dense_nodes:
+            dense_adj = adj.toarray().astype(np.float32)
+            dense_time, _ = time_train(config, dense_adj, feature, label_onehot, train_mask, args.epochs)
+            match = str(np.allclose(forward(config, adj, feature, args.class_num),
+                                    forward(config, dense_adj, feature, args.class_num), rtol=1e-4, atol=1e-5))
+        # int64 coordinates and float32 values of the sparse input, float32 for the dense matrix
+        print("{:>9} {:>10} {:>9.2f} {:>11.1f} {:>11.1f} {:>11.2f} {:>11.2f} {:>7}".format(
+            nodes_num, adj.nnz, build_time, adj.nnz * 20 / MB, nodes_num ** 2 * 4 / MB,
+            sparse_time * 1000, dense_time * 1000, match), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,3 +33,7 @@ class ConfigGCN():
     eval_start_epoch = 100
     save_best_ckpt = True
     eval_interval = 1
+    # mini-batch training
+    batch_size = 64
+    fanouts = [10, 10]
+    sampler_workers = 4
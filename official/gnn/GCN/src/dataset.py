@@ -27,43 +27,113 @@ In this example, we use dataset splits provided by https://github.com/kimiyoung/
 import numpy as np
 import scipy.sparse as sp
 import mindspore.dataset as ds
+from mindspore import Tensor
 
 
 def normalize_adj(adj):
     """Symmetrically normalize adjacency matrix."""
+    adj = sp.coo_matrix(adj)
     rowsum = np.array(adj.sum(1))
-    d_inv_sqrt = np.power(rowsum, -0.5).flatten()
+    with np.errstate(divide='ignore'):
+        d_inv_sqrt = np.power(rowsum, -0.5).flatten()
     d_inv_sqrt[np.isinf(d_inv_sqrt)] = 0.
-    d_mat_inv_sqrt = sp.diags(d_inv_sqrt)
-    return adj.dot(d_mat_inv_sqrt).transpose().dot(d_mat_inv_sqrt).tocoo()
+    # D^-1/2 * adj^T * D^-1/2, scaling the nonzeros in place of two sparse products
+    return sp.coo_matrix((adj.data * d_inv_sqrt[adj.col] * d_inv_sqrt[adj.row], (adj.col, adj.row)), shape=adj.shape)
+
+
+class NodeIndex():
+    """Map node ids to their indices in nodes, by a lookup table unless the ids are too sparse for one."""
+
+    def __init__(self, nodes):
+        nodes_num = nodes.shape[0]
+        self.table = None
+        if nodes.max() < 4 * nodes_num:
+            self.table = np.zeros(nodes.max() + 1, np.int64)
+            self.table[nodes] = np.arange(nodes_num)
+        else:
+            self.sorter = np.argsort(nodes)
+            self.sorted_nodes = nodes[self.sorter]
+
+    def __call__(self, ids):
+        if self.table is not None:
+            return self.table[ids]
+        return self.sorter[np.searchsorted(self.sorted_nodes, ids)]
+
+
+def build_adj(nodes, neighbor):
+    """
+    Build the normalized adjacency matrix with self loops in sparse format.
 
+    Args:
+        nodes (numpy.ndarray): Node ids of shape :math:`(N,)`.
+        neighbor (numpy.ndarray): Neighbor table of shape :math:`(N, K + 1)`, the first column is the node id,
+            the other columns are its neighbors padded with -1.
 
-def get_adj_features_labels(data_dir):
-    """Get adjacency matrix, node features and labels from dataset."""
-    g = ds.GraphData(data_dir)
+    Returns:
+        scipy.sparse.coo_matrix, symmetrically normalized adjacency matrix of shape :math:`(N, N)`.
+    """
+    nodes_num = nodes.shape[0]
+    mask = neighbor[:, 1:] >= 0
+    node_index = NodeIndex(nodes)
+    row = node_index(np.broadcast_to(neighbor[:, :1], mask.shape)[mask])
+    col = node_index(neighbor[:, 1:][mask])
+    adj = sp.csr_matrix((np.ones(row.shape[0], np.float32), (row, col)), shape=(nodes_num, nodes_num))
+    # repeated neighbors are one edge
+    adj.data[:] = 1
+    adj = adj.maximum(adj.T) + sp.eye(nodes_num, format='csr')
+    return normalize_adj(adj)
+
+
+def sparse_to_tuple(adj):
+    """
+    Convert a sparse matrix into the row-major coordinates of shape :math:`(nnz, 2)`, the values of
+    shape :math:`(nnz,)` and the dense shape, the inputs of the sparse graph convolution.
+    """
+    adj = adj.tocsr()
+    adj.sort_indices()
+    row = np.repeat(np.arange(adj.shape[0], dtype=np.int64), np.diff(adj.indptr))
+    indices = np.stack([row, adj.indices.astype(np.int64)], axis=1)
+    return indices, adj.data.astype(np.float32), adj.shape
+
+
+def adj_to_tensor(adj, dtype=None):
+    """
+    Convert the adjacency matrix into the adj input of GCN and its adj_shape, which is None for a dense
+    adjacency matrix.
+    """
+    if sp.issparse(adj):
+        indices, values, shape = sparse_to_tuple(adj)
+        return (Tensor(indices), Tensor(values)), shape
+    return Tensor(adj, dtype=dtype), None
+
+
+def load_graph(data_dir, num_parallel_workers=None):
+    """Get the graph, node ids, node features, one-hot labels and labels from dataset."""
+    g = ds.GraphData(data_dir, num_parallel_workers=num_parallel_workers)
     nodes = g.get_all_nodes(0)
-    nodes_list = nodes.tolist()
-    row_tensor = g.get_node_feature(nodes_list, [1, 2])
+    row_tensor = g.get_node_feature(nodes.tolist(), [1, 2])
     features = row_tensor[0]
     labels = row_tensor[1]
 
     nodes_num = labels.shape[0]
     class_num = labels.max() + 1
     labels_onehot = np.eye(nodes_num, class_num)[labels].astype(np.float32)
+    return g, nodes, features, labels_onehot, labels
 
-    neighbor = g.get_all_neighbors(nodes_list, 0)
-    node_map = {node_id: index for index, node_id in enumerate(nodes_list)}
-    adj = np.zeros([nodes_num, nodes_num], dtype=np.float32)
-    for index, value in np.ndenumerate(neighbor):
-        # The first column of neighbor is node_id, second column to last column are neighbors of the first column.
-        # So we only care index[1] > 1.
-        # If the node does not have that many neighbors, -1 is padded. So if value < 0, we will not deal with it.
-        if value >= 0 and index[1] > 0:
-            adj[node_map[neighbor[index[0], 0]], node_map[value]] = 1
-    adj = sp.coo_matrix(adj)
-    adj = adj + adj.T.multiply(adj.T > adj) + sp.eye(nodes_num)
-    nor_adj = normalize_adj(adj)
-    nor_adj = np.array(nor_adj.todense())
+
+def get_adj_features_labels(data_dir, sparse=False):
+    """
+    Get adjacency matrix, node features and labels from dataset.
+    The adjacency matrix is a dense numpy.ndarray, or a scipy.sparse.coo_matrix if sparse is True.
+    """
+    g, nodes, features, labels_onehot, labels = load_graph(data_dir)
+
+    # The first column of neighbor is node_id, second column to last column are neighbors of the first column.
+    # If the node does not have that many neighbors, -1 is padded.
+    neighbor = g.get_all_neighbors(nodes.tolist(), 0)
+    nor_adj = build_adj(nodes, neighbor)
+    if not sparse:
+        nor_adj = nor_adj.toarray()
     return nor_adj, features, labels_onehot, labels
 
 
@@ -72,3 +142,77 @@ def get_mask(total, begin, end):
     mask = np.zeros([total]).astype(np.float32)
     mask[begin:end] = 1
     return mask
+
+
+class BatchedNodeSampler(ds.Sampler):
+    """Batches of node indices, shuffled every epoch if shuffle is True, the last batch is padded with -1"""
+
+    def __init__(self, node_index, batch_size, shuffle=True):
+        super().__init__()
+        self.node_index = np.asarray(node_index, np.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        node_index = np.random.permutation(self.node_index) if self.shuffle else self.node_index
+        for i in range(0, node_index.shape[0], self.batch_size):
+            batch = np.full(self.batch_size, -1, np.int64)
+            batch_index = node_index[i: i + self.batch_size]
+            batch[:batch_index.shape[0]] = batch_index
+            yield batch.tolist()
+
+
+class SampledNodeDataset():
+    """
+    Sample the neighborhoods of batches of nodes on the graph, and gather their features from the features
+    loaded once, so a step only holds the features of one batch of neighborhoods.
+
+    Args:
+        graph (GraphData): The graph.
+        nodes (numpy.ndarray): Node ids, the nodes of the batches are indices into nodes.
+        features (numpy.ndarray): Node features of shape :math:`(N, C)`.
+        labels_onehot (numpy.ndarray): One-hot labels of shape :math:`(N, class_num)`.
+        mask (numpy.ndarray): Mask of the labeled nodes of shape :math:`(N,)`.
+        fanouts (list): Number of neighbors sampled at every hop.
+        batch_size (int): Number of nodes of a batch.
+    """
+
+    def __init__(self, graph, nodes, features, labels_onehot, mask, fanouts, batch_size):
+        self.g = graph
+        self.nodes = nodes
+        self.node_index = NodeIndex(nodes)
+        self.features = features
+        self.labels_onehot = labels_onehot
+        self.mask = mask
+        self.fanouts = list(fanouts)
+        self.batch_num = -(-int(np.count_nonzero(mask)) // batch_size)
+
+    def __len__(self):
+        return self.batch_num
+
+    def __getitem__(self, index):
+        """
+        Features of the nodes and of their sampled neighbors, neighbor mask, labels and label mask of a batch,
+        the padded nodes of the batch have a label mask of 0
+        """
+        index = np.asarray(index)
+        valid = index >= 0
+        index = np.where(valid, index, 0)
+        sampled = self.g.get_sampled_neighbors(node_list=self.nodes[index], neighbor_nums=self.fanouts,
+                                               neighbor_types=[0] * len(self.fanouts))
+        # nodes without neighbors are padded with -1
+        neighbor_mask = sampled >= 0
+        feature = self.features[self.node_index(np.where(neighbor_mask, sampled, self.nodes[0]))]
+        feature[~neighbor_mask] = 0
+        label_mask = self.mask[index] * valid
+        return feature.astype(np.float32), neighbor_mask.astype(np.float32), self.labels_onehot[index], \
+               label_mask.astype(np.float32)
+
+
+def create_sampled_dataset(graph, nodes, features, labels_onehot, mask, fanouts, batch_size, shuffle=True,
+                           num_parallel_workers=1):
+    """Mini-batch dataset of the sampled neighborhoods of the nodes in mask"""
+    source = SampledNodeDataset(graph, nodes, features, labels_onehot, mask, fanouts, batch_size)
+    sampler = BatchedNodeSampler(np.nonzero(mask)[0], batch_size, shuffle)
+    return ds.GeneratorDataset(source=source, column_names=["feature", "neighbor_mask", "label", "label_mask"],
+                               sampler=sampler, num_parallel_workers=num_parallel_workers)
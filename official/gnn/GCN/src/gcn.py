@@ -17,6 +17,7 @@ import numpy as np
 from mindspore import nn
 from mindspore.ops import operations as P
 from mindspore import Tensor
+from mindspore.common import dtype as mstype
 from mindspore.nn.layer.activation import get_activation
 
 
@@ -35,9 +36,11 @@ class GraphConvolution(nn.Cell):
         feature_out_dim (int): The output feature dimension.
         dropout_ratio (float): Dropout ratio for the dropout layer. Default: None.
         activation (str): Activation function applied to the output of the layer, eg. 'relu'. Default: None.
+        adj_shape (tuple): Shape :math:`(N, N)` of a sparse adjacency matrix, None for a dense one. Default: None.
 
     Inputs:
-        - **adj** (Tensor) - Tensor of shape :math:`(N, N)`.
+        - **adj** (Union[Tensor, tuple]) - Tensor of shape :math:`(N, N)`, or if adj_shape is set, a tuple of
+          the coordinates of shape :math:`(nnz, 2)` and the values of shape :math:`(nnz,)` of the nonzeros.
         - **input_feature** (Tensor) - Tensor of shape :math:`(N, C)`.
 
     Outputs:
@@ -48,7 +51,8 @@ class GraphConvolution(nn.Cell):
                  feature_in_dim,
                  feature_out_dim,
                  dropout_ratio=None,
-                 activation=None):
+                 activation=None,
+                 adj_shape=None):
         super(GraphConvolution, self).__init__()
         self.in_dim = feature_in_dim
         self.out_dim = feature_out_dim
@@ -63,7 +67,13 @@ class GraphConvolution(nn.Cell):
         self.dropout_flag = self.dropout_ratio is not None
         self.activation = get_activation(activation)
         self.activation_flag = self.activation is not None
-        self.matmul = P.MatMul()
+        self.sparse = adj_shape is not None
+        if self.sparse:
+            self.adj_shape = tuple(adj_shape)
+            self.matmul = P.SparseTensorDenseMatmul()
+            self.cast = P.Cast()
+        else:
+            self.matmul = P.MatMul()
 
     def construct(self, adj, input_feature):
         """
@@ -74,7 +84,11 @@ class GraphConvolution(nn.Cell):
             dropout = self.dropout(dropout)
 
         fc = self.fc(dropout)
-        output_feature = self.matmul(adj, fc)
+        if self.sparse:
+            output_feature = self.matmul(adj[0], self.cast(adj[1], mstype.float32), self.adj_shape,
+                                         self.cast(fc, mstype.float32))
+        else:
+            output_feature = self.matmul(adj, fc)
 
         if self.activation_flag:
             output_feature = self.activation(output_feature)
@@ -90,12 +104,14 @@ class GCN(nn.Cell):
         adj (numpy.ndarray): Numbers of block in different layers.
         feature (numpy.ndarray): Input channel in each layer.
         output_dim (int): The number of output channels, equal to classes num.
+        adj_shape (tuple): Shape of the sparse adjacency matrix, None if the adjacency matrix is dense. Default: None.
     """
 
-    def __init__(self, config, input_dim, output_dim):
+    def __init__(self, config, input_dim, output_dim, adj_shape=None):
         super(GCN, self).__init__()
-        self.layer0 = GraphConvolution(input_dim, config.hidden1, activation="relu", dropout_ratio=config.dropout)
-        self.layer1 = GraphConvolution(config.hidden1, output_dim, dropout_ratio=None)
+        self.layer0 = GraphConvolution(input_dim, config.hidden1, activation="relu", dropout_ratio=config.dropout,
+                                       adj_shape=adj_shape)
+        self.layer1 = GraphConvolution(config.hidden1, output_dim, dropout_ratio=None, adj_shape=adj_shape)
 
     def construct(self, adj, feature):
         output0 = self.layer0(adj, feature)
@@ -111,15 +127,119 @@ class GCN_GPU(nn.Cell):
         adj (numpy.ndarray): Numbers of block in different layers.
         feature (numpy.ndarray): Input channel in each layer.
         output_dim (int): The number of output channels, equal to classes num.
+        adj_shape (tuple): Shape of the sparse adjacency matrix, None if the adjacency matrix is dense. Default: None.
     """
 
-    def __init__(self, config, input_dim, output_dim, adj):
+    def __init__(self, config, input_dim, output_dim, adj, adj_shape=None):
         super(GCN_GPU, self).__init__()
-        self.layer0 = GraphConvolution(input_dim, config.hidden1, activation="relu", dropout_ratio=config.dropout)
-        self.layer1 = GraphConvolution(config.hidden1, output_dim, dropout_ratio=None)
+        self.layer0 = GraphConvolution(input_dim, config.hidden1, activation="relu", dropout_ratio=config.dropout,
+                                       adj_shape=adj_shape)
+        self.layer1 = GraphConvolution(config.hidden1, output_dim, dropout_ratio=None, adj_shape=adj_shape)
         self.adj = adj
     def construct(self, feature):
         output0 = self.layer0(self.adj, feature)
         output1 = self.layer1(self.adj, output0)
         return output1
-        
\ No newline at end of file
+        
+
+class SampledGraphConvolution(nn.Cell):
+    """
+    GCN graph convolution layer on sampled neighborhoods, the features of every node are averaged with the
+    features of its sampled neighbors. The parameters are the same as those of GraphConvolution.
+
+    Args:
+        feature_in_dim (int): The input feature dimension.
+        feature_out_dim (int): The output feature dimension.
+        dropout_ratio (float): Dropout ratio for the dropout layer. Default: None.
+        activation (str): Activation function applied to the output of the layer, eg. 'relu'. Default: None.
+
+    Inputs:
+        - **self_feature** (Tensor) - Tensor of shape :math:`(B, M, C)`.
+        - **neighbor_feature** (Tensor) - Tensor of shape :math:`(B, M, K, C)`, K sampled neighbors of every node.
+        - **neighbor_mask** (Tensor) - Tensor of shape :math:`(B, M, K)`, 0 for the padded neighbors.
+
+    Outputs:
+        Tensor of shape :math:`(B, M, feature_out_dim)`.
+    """
+
+    def __init__(self,
+                 feature_in_dim,
+                 feature_out_dim,
+                 dropout_ratio=None,
+                 activation=None):
+        super(SampledGraphConvolution, self).__init__()
+        self.in_dim = feature_in_dim
+        self.out_dim = feature_out_dim
+        self.weight_init = glorot([self.out_dim, self.in_dim])
+        self.fc = nn.Dense(self.in_dim,
+                           self.out_dim,
+                           weight_init=self.weight_init,
+                           has_bias=False)
+        self.dropout_ratio = dropout_ratio
+        if self.dropout_ratio is not None:
+            self.dropout = nn.Dropout(p=self.dropout_ratio)
+        self.dropout_flag = self.dropout_ratio is not None
+        self.activation = get_activation(activation)
+        self.activation_flag = self.activation is not None
+        self.reduce_sum = P.ReduceSum()
+        self.expand_dims = P.ExpandDims()
+
+    def construct(self, self_feature, neighbor_feature, neighbor_mask):
+        """
+        GCN graph convolution layer on sampled neighborhoods.
+        """
+        neighbor_sum = self.reduce_sum(neighbor_feature * self.expand_dims(neighbor_mask, -1), 2)
+        degree = self.reduce_sum(neighbor_mask, 2) + 1
+        aggregated = (self_feature + neighbor_sum) / self.expand_dims(degree, -1)
+        if self.dropout_flag:
+            aggregated = self.dropout(aggregated)
+
+        output_feature = self.fc(aggregated)
+        if self.activation_flag:
+            output_feature = self.activation(output_feature)
+        return output_feature
+
+
+class SampledGCN(nn.Cell):
+    """
+    GCN architecture on the two-hop sampled neighborhoods of a batch of nodes, for mini-batch training.
+    The parameters are the same as those of GCN, so checkpoints can be loaded into either.
+
+    Args:
+        config (ConfigGCN): Configuration for GCN.
+        input_dim (int): The number of input channels.
+        output_dim (int): The number of output channels, equal to classes num.
+
+    Inputs:
+        - **feature** (Tensor) - Tensor of shape :math:`(B, 1 + K1 + K1 * K2, C)`, the features of the nodes,
+          of their K1 sampled neighbors and of K2 sampled neighbors of each of those, K1, K2 are config.fanouts.
+        - **mask** (Tensor) - Tensor of shape :math:`(B, 1 + K1 + K1 * K2)`, 0 for the padded neighbors.
+
+    Outputs:
+        Tensor of shape :math:`(B, output_dim)`.
+    """
+
+    def __init__(self, config, input_dim, output_dim):
+        super(SampledGCN, self).__init__()
+        self.fanout1, self.fanout2 = config.fanouts
+        self.layer0 = SampledGraphConvolution(input_dim, config.hidden1, activation="relu",
+                                              dropout_ratio=config.dropout)
+        self.layer1 = SampledGraphConvolution(config.hidden1, output_dim, dropout_ratio=None)
+        self.reshape = P.Reshape()
+        self.expand_dims = P.ExpandDims()
+        self.squeeze = P.Squeeze(1)
+        self.shape = P.Shape()
+
+    def construct(self, feature, mask):
+        batch_size, _, channel = self.shape(feature)
+        hop1_end = 1 + self.fanout1
+        node = feature[:, :1]
+        hop1 = feature[:, 1:hop1_end]
+        hop2 = self.reshape(feature[:, hop1_end:], (batch_size, self.fanout1, self.fanout2, channel))
+        hop1_mask = self.expand_dims(mask[:, 1:hop1_end], 1)
+        hop2_mask = self.reshape(mask[:, hop1_end:], (batch_size, self.fanout1, self.fanout2))
+
+        node0 = self.layer0(node, self.expand_dims(hop1, 1), hop1_mask)
+        hop1_0 = self.layer0(hop1, hop2, hop2_mask)
+        output1 = self.layer1(node0, self.expand_dims(hop1_0, 1), hop1_mask)
+        return self.squeeze(output1)
@@ -214,3 +214,53 @@ class Loss_Gpu(nn.Cell):
         loss = loss * mask
         loss = self.mean(loss)
         return loss
+
+
+class SampledLossAccuracyWrapper(nn.Cell):
+    """
+    Wraps the sampled GCN model with the softmax cross-entropy loss and the number of correct predictions
+    of a batch, averaged and counted over the nodes whose label mask is 1.
+
+    Args:
+        network (Cell): SampledGCN network.
+        weight_decay (float): Weight decay parameter for weight of the first convolution layer.
+    """
+
+    def __init__(self, network, weight_decay):
+        super(SampledLossAccuracyWrapper, self).__init__(auto_prefix=False)
+        self.network = network
+        self.param = network.trainable_params()[0]
+        self.weight_decay = weight_decay
+        self.loss = P.SoftmaxCrossEntropyWithLogits()
+        self.l2_loss = P.L2Loss()
+        self.reduce_sum = P.ReduceSum()
+        self.maximum = P.Maximum()
+        self.equal = P.Equal()
+        self.argmax = P.Argmax()
+        self.cast = P.Cast()
+        self.one = Tensor(1.0, mstype.float32)
+
+    def construct(self, feature, neighbor_mask, label, label_mask):
+        preds = self.cast(self.network(feature, neighbor_mask), mstype.float32)
+        label_num = self.reduce_sum(label_mask)
+        loss = self.reduce_sum(self.loss(preds, label)[0] * label_mask) / self.maximum(label_num, self.one)
+        loss = loss + self.weight_decay * self.l2_loss(self.param)
+        correct_prediction = self.cast(self.equal(self.argmax(preds), self.argmax(label)), mstype.float32)
+        return loss, self.reduce_sum(correct_prediction * label_mask), label_num
+
+
+class SampledLossWrapper(nn.Cell):
+    """
+    Wraps the sampled GCN model with the softmax cross-entropy loss of a batch.
+
+    Args:
+        network (Cell): SampledGCN network.
+        weight_decay (float): Weight decay parameter for weight of the first convolution layer.
+    """
+
+    def __init__(self, network, weight_decay):
+        super(SampledLossWrapper, self).__init__(auto_prefix=False)
+        self.loss_accuracy = SampledLossAccuracyWrapper(network, weight_decay)
+
+    def construct(self, feature, neighbor_mask, label, label_mask):
+        return self.loss_accuracy(feature, neighbor_mask, label, label_mask)[0]
@@ -31,10 +31,10 @@ from mindspore.train.serialization import save_checkpoint, load_checkpoint
 from mindspore.train.callback import ModelCheckpoint, CheckpointConfig, TimeMonitor, LossMonitor
 from mindspore import Model, context
 
-from src.gcn import GCN, GCN_GPU
-from src.metrics import LossAccuracyWrapper, TrainNetWrapper, Loss_Gpu
+from src.gcn import GCN, GCN_GPU, SampledGCN
+from src.metrics import LossAccuracyWrapper, TrainNetWrapper, Loss_Gpu, SampledLossAccuracyWrapper, SampledLossWrapper
 from src.config import ConfigGCN
-from src.dataset import get_adj_features_labels, get_mask
+from src.dataset import get_adj_features_labels, get_mask, adj_to_tensor, load_graph, create_sampled_dataset
 
 from model_utils.config import config as default_args
 from model_utils.moxing_adapter import moxing_wrapper
@@ -119,7 +119,7 @@ def run_gpu_train():
     config = ConfigGCN()
     if not os.path.exists(config.ckpt_dir):
         os.mkdir(config.ckpt_dir)
-    adj, feature, label_onehot, _ = get_adj_features_labels(default_args.data_dir)
+    adj, feature, label_onehot, _ = get_adj_features_labels(default_args.data_dir, default_args.sparse_adj)
     feature_d = np.expand_dims(feature, axis=0)
     label_onehot_d = np.expand_dims(label_onehot, axis=0)
     data = {"feature": feature_d, "label": label_onehot_d}
@@ -129,13 +129,13 @@ def run_gpu_train():
                          default_args.train_nodes_num + default_args.eval_nodes_num)
     class_num = label_onehot.shape[1]
     input_dim = feature.shape[1]
-    adj = Tensor(adj, dtype=mstype.float32)
+    adj, adj_shape = adj_to_tensor(adj, mstype.float32)
     ckpt_config = CheckpointConfig(save_checkpoint_steps=config.save_ckpt_steps,
                                    keep_checkpoint_max=config.keep_ckpt_max)
     ckpoint_cb = ModelCheckpoint(prefix='ckpt_gcn',
                                  directory=config.ckpt_dir,
                                  config=ckpt_config)
-    gcn_net = GCN_GPU(config, input_dim, class_num, adj)
+    gcn_net = GCN_GPU(config, input_dim, class_num, adj, adj_shape)
     cb = [TimeMonitor(), LossMonitor(), ckpoint_cb]
     opt = nn.Adam(gcn_net.trainable_params(), learning_rate=config.learning_rate)
     criterion = Loss_Gpu(eval_mask, config.weight_decay, gcn_net.trainable_params()[0])
@@ -157,7 +157,8 @@ def run_train():
     context.set_context(mode=context.GRAPH_MODE,
                         device_target=default_args.device_target, save_graphs=False)
     config = ConfigGCN()
-    adj, feature, label_onehot, label = get_adj_features_labels(default_args.data_dir)
+    adj, feature, label_onehot, label = get_adj_features_labels(default_args.data_dir, default_args.sparse_adj)
+    adj, adj_shape = adj_to_tensor(adj)
 
     nodes_num = label_onehot.shape[0]
     train_mask = get_mask(nodes_num, 0, default_args.train_nodes_num)
@@ -167,10 +168,9 @@ def run_train():
 
     class_num = label_onehot.shape[1]
     input_dim = feature.shape[1]
-    gcn_net = GCN(config, input_dim, class_num)
+    gcn_net = GCN(config, input_dim, class_num, adj_shape)
     gcn_net.add_flags_recursive(fp16=True)
 
-    adj = Tensor(adj)
     feature = Tensor(feature)
 
     eval_net = LossAccuracyWrapper(gcn_net, label_onehot, eval_mask, config.weight_decay)
@@ -217,7 +217,7 @@ def run_train():
         os.makedirs(default_args.save_ckptpath)
     ckpt_path = os.path.join(default_args.save_ckptpath, "gcn.ckpt")
     save_checkpoint(gcn_net, ckpt_path)
-    gcn_net_test = GCN(config, input_dim, class_num)
+    gcn_net_test = GCN(config, input_dim, class_num, adj_shape)
     load_checkpoint(ckpt_path, net=gcn_net_test)
     gcn_net_test.add_flags_recursive(fp16=True)
 
@@ -235,8 +235,78 @@ def run_train():
         ani.save('t-SNE_visualization.gif', writer='imagemagick')
 
 
+def eval_sampled(eval_net, iterator):
+    """Loss and accuracy over the labeled nodes of one epoch of sampled batches."""
+    eval_net.set_train(False)
+    loss, correct, label_num = 0., 0., 0.
+    for data in iterator:
+        batch_loss, batch_correct, batch_label_num = [x.asnumpy() for x in eval_net(*data)]
+        loss += batch_loss * batch_label_num
+        correct += batch_correct
+        label_num += batch_label_num
+    label_num = max(label_num, 1.)
+    return loss / label_num, correct / label_num
+
+
+@moxing_wrapper(pre_process=modelarts_pre_process)
+def run_minibatch_train():
+    """Train model on mini-batches of sampled neighborhoods."""
+    context.set_context(mode=context.GRAPH_MODE,
+                        device_target=default_args.device_target, save_graphs=False)
+    config = ConfigGCN()
+    g, nodes, feature, label_onehot, _ = load_graph(default_args.data_dir, config.sampler_workers)
+
+    nodes_num = label_onehot.shape[0]
+    train_mask = get_mask(nodes_num, 0, default_args.train_nodes_num)
+    eval_mask = get_mask(nodes_num, default_args.train_nodes_num,
+                         default_args.train_nodes_num + default_args.eval_nodes_num)
+    test_mask = get_mask(nodes_num, nodes_num - default_args.test_nodes_num, nodes_num)
+
+    def sampled_dataset(mask, shuffle):
+        return create_sampled_dataset(g, nodes, feature, label_onehot, mask, config.fanouts, config.batch_size,
+                                      shuffle, config.sampler_workers)
+
+    class_num = label_onehot.shape[1]
+    input_dim = feature.shape[1]
+    gcn_net = SampledGCN(config, input_dim, class_num)
+    optimizer = nn.Adam(gcn_net.trainable_params(), learning_rate=config.learning_rate)
+    train_net = nn.TrainOneStepCell(SampledLossWrapper(gcn_net, config.weight_decay), optimizer)
+    eval_net = SampledLossAccuracyWrapper(gcn_net, config.weight_decay)
+    train_iterator = sampled_dataset(train_mask, True).create_tuple_iterator(num_epochs=config.epochs)
+    eval_iterator = sampled_dataset(eval_mask, False).create_tuple_iterator(num_epochs=config.epochs)
+
+    loss_list = []
+    for epoch in range(config.epochs):
+        t = time.time()
+
+        train_net.set_train()
+        train_loss = np.mean([train_net(*data).asnumpy() for data in train_iterator])
+        eval_loss, eval_accuracy = eval_sampled(eval_net, eval_iterator)
+
+        loss_list.append(eval_loss)
+        print("Epoch:", '%04d' % (epoch + 1), "train_loss=", "{:.5f}".format(train_loss),
+              "val_loss=", "{:.5f}".format(eval_loss),
+              "val_acc=", "{:.5f}".format(eval_accuracy), "time=", "{:.5f}".format(time.time() - t))
+
+        if epoch > config.early_stopping and loss_list[-1] > np.mean(loss_list[-(config.early_stopping+1):-1]):
+            print("Early stopping...")
+            break
+    if not os.path.isdir(default_args.save_ckptpath):
+        os.makedirs(default_args.save_ckptpath)
+    # the parameters are those of GCN, the checkpoint can be evaluated on the whole graph as well
+    save_checkpoint(gcn_net, os.path.join(default_args.save_ckptpath, "gcn.ckpt"))
+
+    t_test = time.time()
+    test_iterator = sampled_dataset(test_mask, False).create_tuple_iterator(num_epochs=1)
+    test_loss, test_accuracy = eval_sampled(eval_net, test_iterator)
+    print("Test set results:", "loss=", "{:.5f}".format(test_loss),
+          "accuracy=", "{:.5f}".format(test_accuracy), "time=", "{:.5f}".format(time.time() - t_test))
+
+
 if __name__ == '__main__':
-    if default_args.device_target == "GPU":
+    if default_args.mini_batch:
+        run_minibatch_train()
+    elif default_args.device_target == "GPU":
         run_gpu_train()
     else:
         run_train()
@@ -106,9 +106,9 @@ def load_model(args_opt):
 
     per_batch_size = args_opt.per_batch_size
     batch_size = per_batch_size * data_parallel_num
-    # Now only support single batch_size for predict
+    # All prompts of a predict batch are decoded together
     if args_opt.run_type == "predict":
-        batch_size = 1
+        batch_size = args_opt.predict_batch_size
     config = PanguAlphaConfig(
         batch_size=batch_size,
         seq_length=args_opt.seq_length,
@@ -141,7 +141,7 @@ def load_model(args_opt):
     model_predict = Model(eval_net)
     # Compile network and obtain tensor layout for loading ckpt
     inputs_np = Tensor(np.ones(shape=(config.batch_size, config.seq_length)), mstype.int32)
-    current_index = Tensor(np.array([0]), mstype.int32)
+    current_index = Tensor(np.zeros(config.batch_size), mstype.int32)
 
     if args_opt.distribute == "false":
         predict_layout = None
@@ -149,7 +149,7 @@ def load_model(args_opt):
         # Compiling only needs the shape
         predict_layout = model_predict.infer_predict_layout(inputs_np, inputs_np)
     elif config.use_past:
-        batch_valid_length = Tensor(np.array([0]), mstype.int32)
+        batch_valid_length = Tensor(np.zeros(config.batch_size), mstype.int32)
         init_true = Tensor([True], mstype.bool_)
         inputs_np_1 = Tensor(np.ones(shape=(config.batch_size, 1)), mstype.int32)
         model_predict.predict_network.add_flags_recursive(is_first_iteration=True)
@@ -180,9 +180,9 @@ def export_mindir(model_predict, config, export_eval_loss=False):
         export(model_predict.predict_network, inputs_np, inputs_np,
                file_name='pangu_alpha_1024_eval_loss', file_format='MINDIR')
     else:
-        current_index = Tensor(np.array([0]), mstype.int32)
+        current_index = Tensor(np.zeros(config.batch_size), mstype.int32)
 
-        batch_valid_length = Tensor(np.array([0]), mstype.int32)
+        batch_valid_length = Tensor(np.zeros(config.batch_size), mstype.int32)
         init_true = Tensor([True], mstype.bool_)
         inputs_np_1 = Tensor(np.ones(shape=(config.batch_size, 1)), mstype.int32)
 
@@ -197,21 +197,28 @@ def export_mindir(model_predict, config, export_eval_loss=False):
 
 def run_predict(model_predict, config, args_opt):
     """run predict"""
-    from src.generate import generate, generate_increment
+    from src.generate import generate_batch, generate_increment_batch, pad_batch_inputs
     # Define tokenizer
     tokenizer = JIEBATokenizer(os.path.join(args_opt.tokenizer_path, 'vocab.model'))
 
-    # Tokenize input sentence to ids
-    sample = "今天是一个好天气"
-    tokenized_token = tokenizer.tokenize(sample)
-    start_sentence = tokenizer.convert_tokens_to_ids(tokenized_token)
-    input_ids = np.array(start_sentence).reshape(1, -1)
+    # Tokenize input sentences to ids, every row of the batch continues the same sample
+    samples = ["今天是一个好天气"] * config.batch_size
+    start_sentences = [tokenizer.convert_tokens_to_ids(tokenizer.tokenize(sample)) for sample in samples]
+    input_ids, valid_lengths = pad_batch_inputs(start_sentences)
     # Call inference
-    generate_func = generate_increment if config.use_past else generate
-    output_ids = generate_func(model_predict, input_ids, args_opt)
+    generate_func = generate_increment_batch if config.use_past else generate_batch
+    point = TimePoint()
+    point.set_start()
+    output_ids = generate_func(model_predict, input_ids, args_opt, valid_lengths=valid_lengths,
+                               batch_size=config.batch_size)
+    point.set_end()
     # Decode output ids to sentence
-    output_samples = tokenizer.decode(output_ids.tolist())
-    print('Output is:', output_samples, flush=True)
+    for ids in output_ids:
+        output_samples = tokenizer.decode(ids.tolist())
+        print('Output is:', output_samples, flush=True)
+    num_tokens = int(sum(ids.size for ids in output_ids) - np.sum(valid_lengths))
+    print(f"Generated {num_tokens} tokens for {len(output_ids)} prompts in {point.get_spend_time()} seconds",
+          flush=True)
 
 
 def run_eval(model_predict, config, args_opt):
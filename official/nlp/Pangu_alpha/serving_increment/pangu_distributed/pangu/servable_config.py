@@ -15,7 +15,7 @@
 """servable config for pangu alpha"""
 
 import os
-import time
+import sys
 from easydict import EasyDict
 import numpy as np
 from mindspore_serving.server import register
@@ -23,6 +23,10 @@ from mindspore_serving.server import distributed
 
 from pangu.tokenization_jieba import JIEBATokenizer
 
+# the scheduler of the model directory, three levels above the servable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../.."))
+from src.batch_scheduler import ContinuousBatchScheduler  # pylint: disable=wrong-import-position
+
 cur_dir = os.path.abspath(os.path.dirname(__file__))
 tokenizer_path = os.path.join(cur_dir, "tokenizer")
 tokenizer = JIEBATokenizer(os.path.join(tokenizer_path, "vocab.model"))
@@ -37,45 +41,45 @@ config = EasyDict({
     'end_token': 9,
     'seq_length': 1024,
     'vocab_size': 40000,
+    # the batch size the mindir files were exported with, see --predict_batch_size
+    'batch_size': 1,
+    # free slots needed before new requests are admitted into the running batch
+    'min_admit': 1,
 })
 
 
-def topk_fun(logits, topk=5):
-    """Get topk"""
-    target_column = logits[0].tolist()
-    sorted_array = [(k, v) for k, v in enumerate(target_column)]
-    sorted_array.sort(key=lambda x: x[1], reverse=True)
-    topk_array = sorted_array[:topk]
-    index, value = zip(*topk_array)
-    index = np.array([index])
-    value = np.array([value])
-    return value, index
-
-
 model = distributed.declare_servable(rank_size=8, stage_size=1, with_batch_dim=False)
 
 
-def predict_stage(input_sentence, max_generate_length, return_scores):
-    """generate sentence with given input_sentence"""
+def model_call(input_ids, current_index, init, batch_valid_length, subgraph):
+    logits, _ = model.call(input_ids, current_index, init, batch_valid_length, subgraph=subgraph)
+    return logits
 
-    print(f"----------------------------- begin {input_sentence} ---------", flush=True)
-    time_start = time.time()
 
-    tokens = tokenizer.tokenize(input_sentence)
-    input_ids = tokenizer.convert_tokens_to_ids(tokens)
+scheduler = ContinuousBatchScheduler(model_call, config, config.batch_size, config.min_admit)
 
-    outputs = generate_increment(input_ids, max_generate_length, return_scores)
 
-    if return_scores:
-        return outputs
+def predict_stage(instances):
+    """generate sentences for a batch of instances, their requests join the running batch of the scheduler"""
+    results = [None] * len(instances)
+    requests = []
+    for i, (input_sentence, max_generate_length, return_scores) in enumerate(instances):
+        print(f"----------------------------- begin {input_sentence} ---------", flush=True)
+        tokens = tokenizer.tokenize(input_sentence)
+        input_ids = tokenizer.convert_tokens_to_ids(tokens)
+        if return_scores:
+            results[i] = get_scores(input_ids)
+            continue
+        requests.append((i, input_sentence, scheduler.submit(input_ids, max_generate_length)))
 
-    return_tokens = tokenizer.convert_ids_to_tokens(outputs)
-    reply = "".join(return_tokens)
-
-    print(f"time cost {(time.time() - time_start) * 1000}ms, request '{input_sentence}' get reply '{reply}'",
-          flush=True)
-
-    return reply
+    scheduler.wait([request for _, _, request in requests])
+    for i, input_sentence, request in requests:
+        return_tokens = tokenizer.convert_ids_to_tokens(request.output_ids)
+        reply = "".join(return_tokens)
+        print(f"time cost {request.latency * 1000}ms, request '{input_sentence}' get reply '{reply}'", flush=True)
+        results[i] = reply
+    print(scheduler.report([request for _, _, request in requests], reset=True), flush=True)
+    return results
 
 
 def gather(data, index):
@@ -93,128 +97,34 @@ def compute_loss(logits, labels):
     return loss
 
 
-def generate_increment(origin_inputs, max_generate_length, return_scrores):
+def get_scores(origin_inputs):
     """
-    Text generation for incremental inference
+    Score the original inputs with the first graph, as the first row of the batch
 
     Inputs:
-        origin_inputs: the original inputs based on which the model will continue writing
-        return_scrores: whether return the model score
+        origin_inputs: the original inputs to score
 
     Returns:
-        outputs: the ids for the generated text or the loss value
+        the loss value
     """
-    # Get configurations for inference
-    frequency_penalty = config.frequency_penalty
-    presence_penalty = config.presence_penalty
-    top_p = config.top_p
-    top_k_num = config.top_k_num
-    max_generate_length = max_generate_length or config.max_generate_length
-    print("HHHHH max generate length:", max_generate_length)
     seq_length = config.seq_length
-    vocab_size = config.vocab_size
-
-    # Init outputs with original inputs
-    outputs = origin_inputs
-    origin_inputs = np.array([origin_inputs])
-    _, valid_length = origin_inputs.shape
-    # If target length exceeds seq_length, use seq_length instead
-    target_length = valid_length + max_generate_length
-    target_length = seq_length if target_length > seq_length else target_length
-
-    # A list of the frequency of each token
-    frequency_list = np.array([[0 for _ in range(vocab_size)]])
-    ori_length = origin_inputs.shape[-1]
-    pad_length = seq_length - origin_inputs.shape[-1]
-    # Pad original inputs to seq_length
-    input_ids = np.pad(origin_inputs, ((0, 0), (0, pad_length)), 'constant', constant_values=(0, 0))
-
-    # Indicate the exact token position
-    current_index = valid_length - 1 if valid_length - 1 > 0 else 0
-    current_index = np.array([current_index], np.int32)
-    batch_valid_length = np.array([current_index], np.int32)
-    # For first graph, not_init should be false
-    init_true = True
-    init_false = False
-    init = init_false
-    # Call a single inference with input size of (bs, seq_length)
-    logits, total_logits = model.call(np.array(input_ids, np.int32),
-                                      current_index, init, batch_valid_length, subgraph=0)
-    # Claim the second graph and set not_init to true
-    init = init_true
-
-    if return_scrores:
-        log_probs = total_logits.reshape(seq_length, vocab_size)
-        labels = np.concatenate((input_ids[:, 1:], np.zeros((input_ids[0], 1))), axis=-1)
-        loss = compute_loss(log_probs[:ori_length, :], labels[:, :ori_length])
-        return loss
-
-    # A single loop generates one token, loop until reaching target seq_length or generating eod token
-    while valid_length < target_length:
-        # Reshape the output logits
-        log_probs = logits.reshape(1, vocab_size)
-        if return_scrores:
-            score = log_probs[0, 0, input_ids[current_index -1]]
-            return score
-
-        # Get the revised log_probs considering frequency and presence penalty to eliminate duplicate in generated results
-        log_probs = log_probs.reshape(1, vocab_size)
-        log_probs_revised = log_probs - frequency_list * frequency_penalty - (frequency_list > 0) * presence_penalty
-
-        # Convert the log_probs to probability
-        logits = np.power(10, np.array(log_probs_revised, np.float32))
-
-        # If top_p is less than 1.0, use top_p sampling
-        if top_p < 1.0:
-            # Only consider the 5000 largest logits to reduce computation
-            sorted_logits, index = topk_fun(logits, 5000)
-            cumsum_logits = np.cumsum(sorted_logits, 1)
-            cumsum_logits = cumsum_logits[0]
-            index = index[0]
-            sorted_logits = sorted_logits[0]
-            top_p_num = sum(cumsum_logits > top_p)
-            # In case the probability is smooth, the sum of 5000 largest probabilities are not large enough
-            if top_p_num == 0:
-                top_p_num = 5000
-            # Get the corresponding probs and indices
-            probs = sorted_logits[:top_p_num]
-            p_args = index[:top_p_num]
-            p = probs / sum(probs)
-        # if top_p is set to 1.0, use top_k sampling
-        else:
-            # Get the corresponding probs and indices
-            probs, p_args = topk_fun(logits, top_k_num)
-            probs = probs[0]
-            p_args = p_args[0]
-            # Avoid rounding error
-            if sum(probs) == 0:
-                probs = np.array([1 / top_k_num for _ in range(top_k_num)])
-            p = probs / sum(probs)
-
-        # Random select a token as final output for this round
-        target_index = np.random.choice(len(p), p=p)
-        # Stop judgment
-        if p_args[target_index] == end_token or valid_length == target_length - 1:
-            break
-
-        # Update frequency list
-        target = p_args[target_index]
-        frequency_list[0][target] = frequency_list[0][target] + 1
-        valid_length += 1
-
-        batch_valid_length = np.array([valid_length - 1], np.int32)
-        current_index = np.array([0], np.int32)
-        input_id = np.array([[target]], np.int32)
-        # Update outputs with current generated token
-        outputs.append(int(target))
-
-        # Call a single inference with input size of (bs, 1)
-        logits, total_logits = model.call(input_id, current_index, init, batch_valid_length, subgraph=1)
-    # Return valid outputs out of padded outputs
-    return outputs
+    batch_size = config.batch_size
+    ori_length = min(len(origin_inputs), seq_length)
+    input_ids = np.zeros((batch_size, seq_length), np.int32)
+    input_ids[0, :ori_length] = origin_inputs[:ori_length]
+    batch_valid_length = np.zeros(batch_size, np.int32)
+    batch_valid_length[0] = max(ori_length - 1, 0)
+    current_index = (np.arange(batch_size) * seq_length + batch_valid_length).astype(np.int32)
+    # scoring runs the first graph, which resets the saved states of the running batch
+    with scheduler.exclusive():
+        _, total_logits = model.call(input_ids, current_index, False, batch_valid_length, subgraph=0)
+    log_probs = total_logits.reshape(batch_size, seq_length, -1)[0]
+    labels = np.append(input_ids[0, 1:], 0)
+    return compute_loss(log_probs[:ori_length, :], labels[:ori_length])
 
 
 @register.register_method(output_names=["output_sentence"])
 def predict(input_sentence, max_generate_length, return_scores):
-    reply = register.add_stage(predict_stage, input_sentence, max_generate_length, return_scores, outputs_count=1)
+    reply = register.add_stage(predict_stage, input_sentence, max_generate_length, return_scores, outputs_count=1,
+                               batch_size=config.batch_size)
     return reply
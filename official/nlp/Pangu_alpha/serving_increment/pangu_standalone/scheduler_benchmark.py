@@ -0,0 +1,156 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Load generator for the continuous batching scheduler.
+
+Without --server, the scheduler runs locally on a simulated model whose first and second graph calls take
+--prefill_ms and --decode_ms, and one request at a time (batch size 1) is compared with continuous batching.
+With --server, the requests are sent to a running pangu serving server, e.g. localhost:5500.
+
+Usage: python scheduler_benchmark.py --batch_size 8 --num_requests 200 --request_rate 20
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from easydict import EasyDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+from src.batch_scheduler import ContinuousBatchScheduler  # pylint: disable=wrong-import-position
+
+
+class SimulatedModel:
+    """Random logits, with the latency of the first and second graph"""
+    def __init__(self, vocab_size, prefill_ms, decode_ms, seed=1):
+        self.vocab_size = vocab_size
+        self.prefill_s = prefill_ms / 1000
+        self.decode_s = decode_ms / 1000
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, input_ids, current_index, init, batch_valid_length, subgraph):
+        time.sleep(self.prefill_s if subgraph == 0 else self.decode_s)
+        logits = self.rng.normal(size=(input_ids.shape[0], 1, self.vocab_size)).astype(np.float32)
+        return logits - np.log(np.sum(np.exp(logits), axis=-1, keepdims=True))
+
+
+def make_requests(args, rng):
+    """Prompt ids, generate lengths and Poisson arrival times"""
+    prompt_lengths = rng.integers(args.min_prompt_length, args.max_prompt_length + 1, args.num_requests)
+    prompts = [rng.integers(10, args.vocab_size, length).tolist() for length in prompt_lengths]
+    generate_lengths = rng.integers(args.min_generate_length, args.max_generate_length + 1, args.num_requests)
+    arrivals = np.cumsum(rng.exponential(1 / args.request_rate, args.num_requests))
+    return prompts, generate_lengths.tolist(), arrivals
+
+
+def run_local(args, batch_size, prompts, generate_lengths, arrivals):
+    """Submit the requests at their arrival times and drive the scheduler until all are finished"""
+    config = EasyDict({
+        'frequency_penalty': 1.5,
+        'presence_penalty': 0.3,
+        'max_generate_length': args.max_generate_length,
+        'top_k_num': 3,
+        'top_p': 1.0,
+        # no end token, every request generates its generate length
+        'end_token': -1,
+        'seq_length': args.seq_length,
+        'vocab_size': args.vocab_size,
+    })
+    model = SimulatedModel(args.vocab_size, args.prefill_ms, args.decode_ms)
+    scheduler = ContinuousBatchScheduler(model, config, batch_size, args.min_admit)
+    requests = []
+    all_submitted = threading.Event()
+
+    def load_generator():
+        start = time.time()
+        for prompt, generate_length, arrival in zip(prompts, generate_lengths, arrivals):
+            time.sleep(max(arrival - (time.time() - start), 0))
+            requests.append(scheduler.submit(prompt, generate_length))
+        all_submitted.set()
+
+    generator = threading.Thread(target=load_generator, daemon=True)
+    generator.start()
+    while not all_submitted.is_set() or scheduler.waiting or scheduler.num_running:
+        if not scheduler.step():
+            time.sleep(0.0005)
+    generator.join()
+    return scheduler.report()
+
+
+def run_server(args, sentences, arrivals):
+    """Send the requests at their arrival times to a running serving server, each from its own thread"""
+    from mindspore_serving.client import Client
+
+    latency = [None] * len(sentences)
+    replies = [None] * len(sentences)
+
+    def send(i, sentence):
+        client = Client(args.server, "pangu", "predict")
+        start = time.time()
+        result = client.infer({"input_sentence": sentence, "prompt": "", "return_scores": False})
+        latency[i] = time.time() - start
+        replies[i] = result[0]["output_sentence"]
+
+    threads = []
+    start = time.time()
+    for i, (sentence, arrival) in enumerate(zip(sentences, arrivals)):
+        time.sleep(max(arrival - (time.time() - start), 0))
+        thread = threading.Thread(target=send, args=(i, sentence), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latency = np.array(latency) * 1000
+    num_chars = sum(len(reply) - len(sentence) for reply, sentence in zip(replies, sentences))
+    return "requests: {}, {:.1f} requests/s, {:.1f} generated chars/s, latency p50 {:.1f}ms p99 {:.1f}ms".format(
+        len(sentences), len(sentences) / elapsed, num_chars / elapsed,
+        np.percentile(latency, 50), np.percentile(latency, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuous batching load generator")
+    parser.add_argument("--batch_size", type=int, default=8, help="Slots of the running batch. Default: 8")
+    parser.add_argument("--min_admit", type=int, default=1, help="Free slots needed to admit requests. Default: 1")
+    parser.add_argument("--num_requests", type=int, default=200, help="Number of requests. Default: 200")
+    parser.add_argument("--request_rate", type=float, default=20, help="Poisson arrivals per second. Default: 20")
+    parser.add_argument("--min_prompt_length", type=int, default=8, help="Default: 8")
+    parser.add_argument("--max_prompt_length", type=int, default=64, help="Default: 64")
+    parser.add_argument("--min_generate_length", type=int, default=16, help="Default: 16")
+    parser.add_argument("--max_generate_length", type=int, default=128, help="Default: 128")
+    parser.add_argument("--seq_length", type=int, default=1024, help="Default: 1024")
+    parser.add_argument("--vocab_size", type=int, default=40000, help="Default: 40000")
+    parser.add_argument("--prefill_ms", type=float, default=60, help="Simulated first graph latency. Default: 60")
+    parser.add_argument("--decode_ms", type=float, default=15, help="Simulated second graph latency. Default: 15")
+    parser.add_argument("--server", type=str, default="",
+                        help="Address of a running serving server, e.g. localhost:5500. Default: simulate locally")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    prompts, generate_lengths, arrivals = make_requests(args, rng)
+    if args.server:
+        sentences = ["今天是一个好天气"[:1 + i % 8] for i in range(args.num_requests)]
+        print("server {}: {}".format(args.server, run_server(args, sentences, arrivals)))
+        return
+    for batch_size in sorted({1, args.batch_size}):
+        print("batch_size {}: {}".format(batch_size, run_local(args, batch_size, prompts, generate_lengths, arrivals)),
+              flush=True)
+
+
+if __name__ == "__main__":
+    main()
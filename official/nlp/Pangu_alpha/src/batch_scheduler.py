@@ -0,0 +1,259 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Continuous batching scheduler for pangu alpha incremental inference.
+
+The incremental graphs are exported with a fixed batch size. Every row of the batch is a slot holding
+one request. New requests are admitted into free slots of the running batch, and finished requests are
+evicted at once, so the batch never has to drain before new requests are served.
+
+The first graph (input size (bs, seq_length)) resets the saved key/value states of all rows. Admitting
+a request therefore runs the first graph over the whole batch, with every running slot fed its prompt and
+the tokens generated so far. This rebuilds the same states for the running slots and returns the logits of
+their next token, so it replaces a decode step for them. Otherwise the second graph (input size (bs, 1))
+decodes one token for every slot.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from src.generate import batch_sampler, sample_tokens
+
+
+class Request:
+    """A generation request and its timing"""
+    def __init__(self, input_ids, max_generate_length, frequency_penalty, presence_penalty):
+        self.input_ids = list(input_ids)
+        self.max_generate_length = max_generate_length
+        self.frequency_penalty = frequency_penalty
+        self.presence_penalty = presence_penalty
+        self.output_ids = None
+        self.submit_time = time.time()
+        self.first_token_time = None
+        self.finish_time = None
+        self.done = threading.Event()
+
+    @property
+    def num_generated(self):
+        return len(self.output_ids) - len(self.input_ids) if self.output_ids is not None else 0
+
+    @property
+    def latency(self):
+        return self.finish_time - self.submit_time
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous batching over the slots of a fixed-size incremental inference batch
+
+    Args:
+        model_call: function(input_ids, current_index, init, batch_valid_length, subgraph) returning the
+            (bs, 1, vocab_size) logits of the current token of every row.
+        config: inference configurations, frequency_penalty, presence_penalty, max_generate_length, top_k_num,
+            top_p, end_token, seq_length and vocab_size.
+        batch_size: the batch size the graphs were exported with.
+        min_admit: free slots needed before waiting requests are admitted while other slots are running,
+            a larger value runs the first graph less often. Default: 1.
+
+    Requests are added with submit() from any thread. The batch advances one step per call of step(), and
+    wait() drives the steps from the calling thread until the given requests are finished, so concurrent
+    callers share the batch.
+    """
+    def __init__(self, model_call, config, batch_size, min_admit=1):
+        self.model_call = model_call
+        self.config = config
+        self.batch_size = batch_size
+        self.seq_length = config.seq_length
+        self.min_admit = max(min(min_admit, batch_size), 1)
+
+        # per slot state
+        self.slots = [None] * batch_size
+        self.input_ids = np.zeros((batch_size, self.seq_length), np.int32)
+        self.valid_lengths = np.zeros(batch_size, np.int32)
+        self.target_lengths = np.zeros(batch_size, np.int32)
+        self.frequency_list = np.zeros((batch_size, config.vocab_size), np.int32)
+        self.frequency_penalty = np.zeros((batch_size, 1), np.float32)
+        self.presence_penalty = np.zeros((batch_size, 1), np.float32)
+        # the saved key/value states have to be rebuilt by the first graph
+        self.states_dirty = True
+
+        self.waiting = deque()
+        self.waiting_lock = threading.Lock()
+        self.step_lock = threading.RLock()
+
+        self.finished = []
+        self.num_prefill = 0
+        self.num_decode = 0
+
+    def submit(self, input_ids, max_generate_length=None, frequency_penalty=None, presence_penalty=None):
+        """Queue a request, returns the Request to wait for"""
+        config = self.config
+        request = Request(input_ids,
+                          max_generate_length or config.max_generate_length,
+                          config.frequency_penalty if frequency_penalty is None else frequency_penalty,
+                          config.presence_penalty if presence_penalty is None else presence_penalty)
+        with self.waiting_lock:
+            self.waiting.append(request)
+        return request
+
+    def wait(self, requests, timeout=0.001):
+        """Drive the batch from the calling thread until all requests are finished"""
+        for request in requests:
+            while not request.done.is_set():
+                if self.step_lock.acquire(timeout=timeout):
+                    try:
+                        if not request.done.is_set() and not self.step():
+                            # nothing to run, the request is being finished by another thread
+                            request.done.wait(timeout)
+                    finally:
+                        self.step_lock.release()
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Lock the batch for another call of the model, e.g. scoring with the first graph. The saved states of
+        the running slots are rebuilt on the next step.
+        """
+        with self.step_lock:
+            self.states_dirty = True
+            yield
+
+    @property
+    def num_running(self):
+        return sum(request is not None for request in self.slots)
+
+    def _free_slot(self, slot):
+        self.slots[slot] = None
+        self.input_ids[slot] = 0
+        self.valid_lengths[slot] = 0
+        self.target_lengths[slot] = 0
+        self.frequency_list[slot] = 0
+
+    def _finish(self, slot):
+        request = self.slots[slot]
+        request.output_ids = self.input_ids[slot, :self.valid_lengths[slot]].tolist()
+        request.finish_time = time.time()
+        if request.first_token_time is None:
+            request.first_token_time = request.finish_time
+        self.finished.append(request)
+        self._free_slot(slot)
+        request.done.set()
+
+    def _admit(self):
+        """Move waiting requests into free slots, returns the number of admitted requests"""
+        free_slots = [slot for slot, request in enumerate(self.slots) if request is None]
+        if not free_slots or (len(free_slots) < self.min_admit and len(free_slots) < self.batch_size):
+            return 0
+        admitted = 0
+        with self.waiting_lock:
+            while free_slots and self.waiting:
+                request = self.waiting.popleft()
+                slot = free_slots.pop(0)
+                length = min(len(request.input_ids), self.seq_length)
+                self.slots[slot] = request
+                self.input_ids[slot, :length] = request.input_ids[:length]
+                self.valid_lengths[slot] = length
+                # If target length exceeds seq_length, use seq_length instead
+                self.target_lengths[slot] = min(length + request.max_generate_length, self.seq_length)
+                self.frequency_penalty[slot] = request.frequency_penalty
+                self.presence_penalty[slot] = request.presence_penalty
+                if length >= self.target_lengths[slot]:
+                    self._finish(slot)
+                    free_slots.insert(0, slot)
+                    continue
+                admitted += 1
+        return admitted
+
+    def _forward(self, prefill):
+        """Run the first graph over the whole batch if prefill, otherwise decode one token for every slot"""
+        batch_valid_length = np.maximum(self.valid_lengths - 1, 0).astype(np.int32)
+        if prefill:
+            current_index = (np.arange(self.batch_size) * self.seq_length + batch_valid_length).astype(np.int32)
+            logits = self.model_call(self.input_ids, current_index, False, batch_valid_length, subgraph=0)
+            self.states_dirty = False
+            self.num_prefill += 1
+        else:
+            current_index = np.arange(self.batch_size, dtype=np.int32)
+            input_id = self.input_ids[np.arange(self.batch_size), batch_valid_length].reshape(-1, 1)
+            logits = self.model_call(input_id, current_index, True, batch_valid_length, subgraph=1)
+            self.num_decode += 1
+        return np.asarray(logits).reshape(self.batch_size, -1)
+
+    def step(self):
+        """Run one inference of the batch, returns False if there was nothing to run"""
+        with self.step_lock:
+            admitted = self._admit()
+            rows = np.array([slot for slot, request in enumerate(self.slots) if request is not None], np.int64)
+            if rows.size == 0:
+                return False
+            log_probs = self._forward(prefill=admitted > 0 or self.states_dirty)[rows]
+
+            # Get the revised log_probs considering frequency and presence penalty to eliminate duplicate in results
+            frequency_list = self.frequency_list[rows]
+            log_probs_revised = log_probs - frequency_list * self.frequency_penalty[rows] - \
+                (frequency_list > 0) * self.presence_penalty[rows]
+            p, p_args = batch_sampler(log_probs_revised, self.config.top_p, self.config.top_k_num)
+            targets = sample_tokens(p, p_args)
+
+            now = time.time()
+            for slot in rows:
+                if self.slots[slot].first_token_time is None:
+                    self.slots[slot].first_token_time = now
+            # Stop judgment, the end token or the last position is not appended
+            stop = (targets == self.config.end_token) | (self.valid_lengths[rows] == self.target_lengths[rows] - 1)
+            for slot in rows[stop]:
+                self._finish(slot)
+            rows = rows[~stop]
+            targets = targets[~stop]
+            # Update frequency list and input_ids with newly generated tokens
+            self.frequency_list[rows, targets] += 1
+            self.input_ids[rows, self.valid_lengths[rows]] = targets
+            self.valid_lengths[rows] += 1
+            return True
+
+    def report(self, requests=None, reset=False):
+        """
+        Throughput and latency of the finished requests, of all callers or only the given requests
+
+        With reset, the reported requests are dropped from the finished requests, and the graph calls are cleared
+        if all of them were reported, so every caller reporting its own requests keeps the statistics bounded.
+        """
+        with self.step_lock:
+            if requests is None:
+                finished = self.finished
+            else:
+                finished = [request for request in requests if request.done.is_set()]
+            if reset:
+                reported = set(map(id, finished))
+                self.finished = [request for request in self.finished if id(request) not in reported]
+            num_prefill, num_decode = self.num_prefill, self.num_decode
+            if reset and requests is None:
+                self.num_prefill = 0
+                self.num_decode = 0
+        if not finished:
+            return "no finished request"
+        elapsed = max(request.finish_time for request in finished) - min(request.submit_time for request in finished)
+        num_tokens = sum(request.num_generated for request in finished)
+        latency = np.array([request.latency for request in finished]) * 1000
+        first_token = np.array([request.first_token_time - request.submit_time for request in finished]) * 1000
+        return "requests: {}, tokens: {}, {:.1f} tokens/s, latency p50 {:.1f}ms p99 {:.1f}ms, " \
+               "first token p50 {:.1f}ms p99 {:.1f}ms, first graph calls: {}, second graph calls: {}".format(
+                   len(finished), num_tokens, num_tokens / elapsed if elapsed > 0 else 0.,
+                   np.percentile(latency, 50), np.percentile(latency, 99),
+                   np.percentile(first_token, 50), np.percentile(first_token, 99),
+                   num_prefill, num_decode)
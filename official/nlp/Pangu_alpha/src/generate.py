@@ -65,213 +65,248 @@ def get_scores(model_predict, item, tokenizer, pad_length=1024):
 
 
 def topk_fun(logits, topk=5):
-    """Get topk"""
-    target_column = logits[0].tolist()
-    sorted_array = [(k, v) for k, v in enumerate(target_column)]
-    sorted_array.sort(key=lambda x: x[1], reverse=True)
-    topk_array = sorted_array[:topk]
-    index, value = zip(*topk_array)
-    index = np.array([index])
-    value = np.array([value])
+    """Get topk of every row, sorted in descending order"""
+    logits = np.asarray(logits)
+    topk = min(topk, logits.shape[-1])
+    index = np.argpartition(-logits, topk - 1, axis=-1)[:, :topk]
+    value = np.take_along_axis(logits, index, axis=-1)
+    # sort the k candidates by descending value, ties by ascending token id
+    order = np.lexsort((index, -value), axis=-1)
+    index = np.take_along_axis(index, order, axis=-1)
+    value = np.take_along_axis(value, order, axis=-1)
     return value, index
 
 
-def sampler(log_probs_revised, top_p, top_k_num, use_pynative=False):
-    """Convert the log_probs to probability"""
+def batch_sampler(log_probs_revised, top_p, top_k_num, use_pynative=False):
+    """
+    Convert the log_probs of every row to the probability of its candidate tokens
+
+    Returns:
+        p: (batch_size, num_candidates) probabilities, zero for the candidates cut by top_p
+        p_args: (batch_size, num_candidates) the token ids of the candidates
+    """
+    # exp is monotonic, so the candidates are selected on the log_probs and only they are exponentiated
+    # If top_p is less than 1.0, use top_p sampling and only consider the 5000 largest logits
+    num_candidates = 5000 if top_p < 1.0 else top_k_num
     if use_pynative:
-        logits = P.Pow()(np.e, Tensor(log_probs_revised, mstype.float32))
+        log_probs, p_args = P.TopK(sorted=True)(Tensor(log_probs_revised, mstype.float32), num_candidates)
+        log_probs = log_probs.asnumpy()
+        p_args = p_args.asnumpy()
     else:
-        logits = np.power(np.e, np.array(log_probs_revised, np.float32))
+        log_probs, p_args = topk_fun(np.asarray(log_probs_revised, np.float32), num_candidates)
+    probs = np.exp(log_probs)
 
-        # If top_p is less than 1.0, use top_p sampling
     if top_p < 1.0:
-        # Only consider the 5000 largest logits to reduce computation
-        if use_pynative:
-            sorted_logits, index = P.TopK(sorted=True)(logits, 5000)
-            cumsum_logits = P.CumSum()(sorted_logits, 1)
-            cumsum_logits = cumsum_logits.asnumpy()
-            index = index.asnumpy()
-            sorted_logits = sorted_logits.asnumpy()
-        else:
-            sorted_logits, index = topk_fun(logits, 5000)
-            cumsum_logits = np.cumsum(sorted_logits, 1)
-        cumsum_logits = cumsum_logits[0]
-        index = index[0]
-        sorted_logits = sorted_logits[0]
-        top_p_num = sum(cumsum_logits < top_p) + 1
-        # In case the probability is smooth, the sum of 5000 largest probabilities are not large enough
-        if top_p_num == 0:
-            top_p_num = 5000
-        # Get the corresponding probs and indices
-        probs = sorted_logits[:top_p_num]
-        p_args = index[:top_p_num]
-        p = probs / sum(probs)
-        # if top_p is set to 1.0, use top_k sampling
+        cumsum_probs = np.cumsum(probs, axis=-1)
+        top_p_num = np.sum(cumsum_probs < top_p, axis=-1, keepdims=True) + 1
+        probs = np.where(np.arange(probs.shape[-1]) < top_p_num, probs, 0)
     else:
-        # Get the corresponding probs and indices
-        if use_pynative:
-            probs, p_args = P.TopK(sorted=True)(logits, top_k_num)
-            probs = probs.asnumpy()
-            p_args = p_args.asnumpy()
-        else:
-            probs, p_args = topk_fun(logits, top_k_num)
-        probs = probs[0]
-        p_args = p_args[0]
         # Avoid rounding error
-        if sum(probs) == 0:
-            probs = np.array([1 / top_k_num for _ in range(top_k_num)])
-        p = probs / sum(probs)
+        probs = np.where(np.sum(probs, axis=-1, keepdims=True) == 0, 1 / probs.shape[-1], probs)
+    p = probs / np.sum(probs, axis=-1, keepdims=True)
     return p, p_args
 
 
-def generate(model, origin_inputs, config):
+def sampler(log_probs_revised, top_p, top_k_num, use_pynative=False):
+    """Convert the log_probs to probability"""
+    p, p_args = batch_sampler(log_probs_revised, top_p, top_k_num, use_pynative)
+    num = np.count_nonzero(p[0]) if top_p < 1.0 else p.shape[-1]
+    return p[0][:num], p_args[0][:num]
+
+
+def sample_tokens(p, p_args):
+    """Random select a token of every row, like np.random.choice(len(p), p=p) on each row"""
+    cdf = np.cumsum(p, axis=-1)
+    uniform = np.random.random_sample((p.shape[0], 1)) * cdf[:, -1:]
+    target_index = np.minimum(np.sum(cdf <= uniform, axis=-1), p.shape[-1] - 1)
+    return p_args[np.arange(p.shape[0]), target_index]
+
+
+def pad_batch_inputs(batch_ids, pad=0):
     """
-    Text generation
+    Right-pad token id sequences of different lengths into one batch
+
+    Returns:
+        input_ids: (batch_size, max_length) padded token ids
+        valid_lengths: (batch_size,) number of valid tokens of every row
+    """
+    valid_lengths = np.array([len(ids) for ids in batch_ids], np.int32)
+    input_ids = np.full((len(batch_ids), max(valid_lengths.max(initial=0), 1)), pad, np.int32)
+    for row, ids in enumerate(batch_ids):
+        input_ids[row, :len(ids)] = ids
+    return input_ids, valid_lengths
+
+
+class _BatchState:
+    """
+    Per-row state shared by generate_batch and generate_increment_batch
+
+    Rows added to fill the compiled batch size start finished and are dropped from the outputs.
+    """
+    def __init__(self, origin_inputs, valid_lengths, config, batch_size):
+        origin_inputs = np.asarray(origin_inputs)
+        if origin_inputs.ndim == 1:
+            origin_inputs = origin_inputs.reshape(1, -1)
+        num_rows = origin_inputs.shape[0]
+        if valid_lengths is None:
+            valid_lengths = np.full(num_rows, origin_inputs.shape[-1])
+        batch_size = num_rows if batch_size is None else batch_size
+        if batch_size < num_rows:
+            raise ValueError("The batch of {} inputs exceeds the batch_size {}.".format(num_rows, batch_size))
+        self.num_rows = num_rows
+        self.batch_size = batch_size
+        self.seq_length = config.seq_length
+        self.end_token = config.end_token
+        self.frequency_penalty = np.zeros((batch_size, 1), np.float32)
+        self.frequency_penalty[:num_rows, 0] = config.frequency_penalty
+        self.presence_penalty = np.zeros((batch_size, 1), np.float32)
+        self.presence_penalty[:num_rows, 0] = config.presence_penalty
+        self.top_p = config.top_p
+        self.top_k_num = config.top_k_num
+        self.use_pynative = config.use_pynative_op
+
+        width = min(origin_inputs.shape[-1], self.seq_length)
+        # Pad original inputs to seq_length
+        self.input_ids = np.zeros((batch_size, self.seq_length), np.int32)
+        self.input_ids[:num_rows, :width] = origin_inputs[:, :width]
+        self.valid_lengths = np.zeros(batch_size, np.int32)
+        self.valid_lengths[:num_rows] = np.minimum(valid_lengths, self.seq_length)
+        # If target length exceeds seq_length, use seq_length instead
+        self.target_lengths = np.minimum(self.valid_lengths + config.max_generate_length, self.seq_length)
+        self.active = np.arange(batch_size) < num_rows
+        self.active &= self.valid_lengths < self.target_lengths
+        # The frequency of each token of every row
+        self.frequency_list = np.zeros((batch_size, config.vocab_size), np.int32)
+
+    def current_index(self):
+        """The exact token position of every row, as an index into the flattened (batch_size * seq_length) logits"""
+        position = np.maximum(self.valid_lengths - 1, 0)
+        return np.arange(self.batch_size, dtype=np.int32) * self.seq_length + position
+
+    def step(self, log_probs):
+        """Sample one token for every active row, returns the rows that appended a token and the tokens"""
+        rows = np.flatnonzero(self.active)
+        log_probs = log_probs.reshape(self.batch_size, -1)[rows]
+        frequency_list = self.frequency_list[rows]
+        # Get the revised log_probs considering frequency and presence penalty to eliminate duplicate in results
+        log_probs_revised = log_probs - frequency_list * self.frequency_penalty[rows] - \
+            (frequency_list > 0) * self.presence_penalty[rows]
+        p, p_args = batch_sampler(log_probs_revised, self.top_p, self.top_k_num, self.use_pynative)
+        targets = sample_tokens(p, p_args)
+        # Stop judgment, the end token or the last position is not appended
+        stop = (targets == self.end_token) | (self.valid_lengths[rows] == self.target_lengths[rows] - 1)
+        self.active[rows[stop]] = False
+        rows = rows[~stop]
+        targets = targets[~stop]
+        # Update frequency list and input_ids with newly generated tokens
+        self.frequency_list[rows, targets] += 1
+        self.input_ids[rows, self.valid_lengths[rows]] = targets
+        self.valid_lengths[rows] += 1
+        return rows, targets
+
+    def outputs(self):
+        """Return valid outputs out of padded outputs"""
+        return [self.input_ids[row, :self.valid_lengths[row]].copy() for row in range(self.num_rows)]
+
+
+def generate_batch(model, origin_inputs, config, valid_lengths=None, batch_size=None):
+    """
+    Text generation for a batch of inputs
 
     Inputs:
         model: the model for inferencing
-        origin_inputs: the original inputs based on which the model will continue writing
-        config: inference configurations
-        return_scores: return the score on the given sentence rather than generating the words. Default False.
+        origin_inputs: (num_inputs, length) original inputs, right-padded, see pad_batch_inputs
+        config: inference configurations, frequency_penalty and presence_penalty can be given per input
+        valid_lengths: the number of valid tokens of every input, all tokens are valid if None
+        batch_size: the batch size the model was compiled with, extra rows are padded. Default: num_inputs
 
     Returns:
-        outputs: the ids for the generated text
+        outputs: a list of the ids of every input followed by its generated text
     """
-    # Get configurations for inference
-    frequency_penalty = config.frequency_penalty
-    presence_penalty = config.presence_penalty
-    top_p = config.top_p
-    top_k_num = config.top_k_num
-    max_generate_length = config.max_generate_length
-    seq_length = config.seq_length
-    end_token = config.end_token
-    use_pynative = config.use_pynative_op
-
-    _, valid_length = origin_inputs.shape
-    # If target length exceeds seq_length, use seq_length instead
-    target_length = valid_length + max_generate_length
-    target_length = seq_length if target_length > seq_length else target_length
-
-    # A list of the frequency of each token
-    frequency_list = np.array([[0 for _ in range(config.vocab_size)]])
-    pad_length = seq_length - origin_inputs.shape[-1]
-    # Pad original inputs to seq_length
-    input_ids = np.pad(origin_inputs, ((0, 0), (0, pad_length)), 'constant', constant_values=(0, 0))
-    print("input_ids is ", input_ids)
-
-    # A single loop generates one token, loop until reaching target seq_length or generating eod token
-    while valid_length < target_length:
-        inputs = Tensor(input_ids, mstype.int32)
-        # Indicate the exact token position
-        current_index = valid_length - 1 if valid_length - 1 > 0 else 0
-        current_index = Tensor([current_index], mstype.int32)
+    state = _BatchState(origin_inputs, valid_lengths, config, batch_size)
+
+    # A single loop generates one token for every row, until every row reached its target length or eod token
+    while state.active.any():
+        inputs = Tensor(state.input_ids, mstype.int32)
+        current_index = Tensor(state.current_index(), mstype.int32)
         # Call a single inference
         log_probs = model.predict(inputs, current_index)
-        # Get the revised log_probs considering frequency and presence penalty to eliminate duplicate in generated results
-        log_probs = log_probs.asnumpy().reshape(1, config.vocab_size)
-        log_probs_revised = log_probs - frequency_list * frequency_penalty - (frequency_list > 0) * presence_penalty
-
-        p, p_args = sampler(log_probs_revised, top_p, top_k_num, use_pynative)
-        # Random select a token as final output for this round
-        target_index = np.random.choice(len(p), p=p)
-        # Stop judgment
-        if p_args[target_index] == end_token or valid_length == target_length - 1:
-            outputs = input_ids
-            break
+        state.step(log_probs.asnumpy())
+    return state.outputs()
 
-        # update frequency list
-        target = p_args[target_index]
-        frequency_list[0][target] = frequency_list[0][target] + 1
-        # Modify input_ids with newly generated token
-        input_ids[0][valid_length] = p_args[target_index]
-        valid_length += 1
-    # Return valid outputs out of padded outputs
-    length = np.sum(outputs != 0)
-    outputs = outputs[0][:length]
-    return outputs
 
-
-def generate_increment(model, origin_inputs, config):
+def generate_increment_batch(model, origin_inputs, config, valid_lengths=None, batch_size=None):
     """
-    Text generation for incremental inference
+    Text generation for incremental inference of a batch of inputs
 
     Inputs:
         model: the model for inferencing
-        origin_inputs: the original inputs based on which the model will continue writing
-        config: inference configurations
+        origin_inputs: (num_inputs, length) original inputs, right-padded, see pad_batch_inputs
+        config: inference configurations, frequency_penalty and presence_penalty can be given per input
+        valid_lengths: the number of valid tokens of every input, all tokens are valid if None
+        batch_size: the batch size the model was compiled with, extra rows are padded. Default: num_inputs
 
     Returns:
-        outputs: the ids for the generated text
+        outputs: a list of the ids of every input followed by its generated text
     """
-    # Get configurations for inference
-    frequency_penalty = config.frequency_penalty
-    presence_penalty = config.presence_penalty
-    top_p = config.top_p
-    top_k_num = config.top_k_num
-    max_generate_length = config.max_generate_length
-    seq_length = config.seq_length
-    end_token = config.end_token
-    use_pynative = config.use_pynative_op
-
-    _, valid_length = origin_inputs.shape
-    # Init outputs with original inputs
-    outputs = [origin_inputs[0][i] for i in range(valid_length)]
-    # If target length exceeds seq_length, use seq_length instead
-    target_length = valid_length + max_generate_length
-    target_length = seq_length if target_length > seq_length else target_length
-
-    # A list of the frequency of each token
-    frequency_list = np.array([[0 for _ in range(config.vocab_size)]])
-    pad_length = seq_length - origin_inputs.shape[-1]
-    # Pad original inputs to seq_length
-    input_ids = np.pad(origin_inputs, ((0, 0), (0, pad_length)), 'constant', constant_values=(0, 0))
-    print("input_ids is ", input_ids)
-
-    # Indicate the exact token position
-    current_index = valid_length - 1 if valid_length - 1 > 0 else 0
-    batch_valid_length = Tensor(np.array([current_index]), mstype.int32)
-    current_index = Tensor(np.array([current_index]), mstype.int32)
+    state = _BatchState(origin_inputs, valid_lengths, config, batch_size)
+
+    # The state of every row is saved at its own valid length
+    batch_valid_length = Tensor(np.maximum(state.valid_lengths - 1, 0), mstype.int32)
+    current_index = Tensor(state.current_index(), mstype.int32)
     # For first graph, not_init should be false
     init_true = Tensor([True], mstype.bool_)
     init_false = Tensor([False], mstype.bool_)
-    init = init_false
     # Claim the first graph
     model.predict_network.add_flags_recursive(is_first_iteration=True)
     # Call a single inference with input size of (bs, seq_length)
-    logits = model.predict(Tensor(input_ids, mstype.int32), current_index, init, batch_valid_length)
+    logits = model.predict(Tensor(state.input_ids, mstype.int32), current_index, init_false, batch_valid_length)
 
     # Claim the second graph and set not_init to true
-    init = init_true
     model.predict_network.add_flags_recursive(is_first_iteration=False)
+    # With input size of (bs, 1), the logits of row i is at index i
+    current_index = Tensor(np.arange(state.batch_size), mstype.int32)
+    input_id = np.zeros((state.batch_size, 1), np.int32)
+
+    # A single loop generates one token for every row, until every row reached its target length or eod token
+    while state.active.any():
+        rows, targets = state.step(logits.asnumpy())
+        if not state.active.any():
+            break
+        # Finished rows keep feeding their last token at their last position, their outputs are ignored
+        input_id[rows, 0] = targets
+        batch_valid_length = Tensor(np.maximum(state.valid_lengths - 1, 0), mstype.int32)
 
-    # A single loop generates one token, loop until reaching target seq_length or generating eod token
-    while valid_length < target_length:
-        # Reshape the output logits
-        logits = logits.asnumpy()
-        log_probs = logits.reshape(1, config.vocab_size)
+        # Call a single inference with input size of (bs, 1)
+        logits = model.predict(Tensor(input_id, mstype.int32), current_index, init_true, batch_valid_length)
+    return state.outputs()
 
-        # Get the revised log_probs considering frequency and presence penalty to eliminate duplicate in generated results
-        log_probs_revised = log_probs - frequency_list * frequency_penalty - (frequency_list > 0) * presence_penalty
 
-        p, p_args = sampler(log_probs_revised, top_p, top_k_num, use_pynative)
-        # Random select a token as final output for this round
-        target_index = np.random.choice(len(p), p=p)
-        # Stop judgment
-        if p_args[target_index] == end_token or valid_length == target_length - 1:
-            break
+def generate(model, origin_inputs, config):
+    """
+    Text generation
 
-        # Update frequency list
-        target = p_args[target_index]
-        frequency_list[0][target] = frequency_list[0][target] + 1
-        valid_length += 1
+    Inputs:
+        model: the model for inferencing
+        origin_inputs: the original inputs based on which the model will continue writing
+        config: inference configurations
 
-        batch_valid_length = Tensor(np.array([valid_length - 1]), mstype.int32)
-        current_index = Tensor(np.array([0]), mstype.int32)
-        input_id = Tensor([[target]], mstype.int32)
-        # Update outputs with current generated token
-        outputs.append(int(target))
+    Returns:
+        outputs: the ids for the generated text
+    """
+    return generate_batch(model, origin_inputs, config)[0]
 
-        # Call a single inference with input size of (bs, 1)
-        logits = model.predict(input_id, current_index, init, batch_valid_length)
-    # Return valid outputs out of padded outputs
-    return np.array(outputs)
+
+def generate_increment(model, origin_inputs, config):
+    """
+    Text generation for incremental inference
+
+    Inputs:
+        model: the model for inferencing
+        origin_inputs: the original inputs based on which the model will continue writing
+        config: inference configurations
+
+    Returns:
+        outputs: the ids for the generated text
+    """
+    return generate_increment_batch(model, origin_inputs, config)[0]
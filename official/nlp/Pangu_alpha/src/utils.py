@@ -303,6 +303,10 @@ def add_inference_params(opt):
                      type=int,
                      default=9,
                      help="the token id for <end of document>")
+    opt.add_argument("--predict_batch_size",
+                     type=int,
+                     default=1,
+                     help="the number of prompts decoded together in predict")
     opt.add_argument("--use_pynative_op",
                      type=int,
                      default=0,
@@ -21,7 +21,7 @@ from mindspore import context
 from mindspore.train.model import Model
 from mindspore.train.serialization import load_checkpoint, load_param_into_net
 
-from src.deepfm import ModelBuilder, AUCMetric
+from src.deepfm import ModelBuilder, AUCMetric, StreamingAUCMetric
 from src.dataset import create_dataset, DataType
 
 from src.model_utils.config import config
@@ -52,7 +52,7 @@ def eval_deepfm():
     train_net, eval_net = model_builder.get_train_eval_net()
     train_net.set_train()
     eval_net.set_train(False)
-    auc_metric = AUCMetric()
+    auc_metric = StreamingAUCMetric(config.auc_bins) if config.auc_bins > 0 else AUCMetric()
     model = Model(train_net, eval_network=eval_net, metrics={"auc": auc_metric})
     param_dict = load_checkpoint(config.checkpoint_path)
     load_param_into_net(eval_net, param_dict)
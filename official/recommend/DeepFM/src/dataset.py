@@ -16,6 +16,7 @@
 Create train or eval dataset.
 """
 import os
+import re
 import math
 from enum import Enum
 
@@ -33,6 +34,7 @@ class DataType(Enum):
     MINDRECORD = 1
     TFRECORD = 2
     H5 = 3
+    BIN = 4
 
 
 class H5Dataset():
@@ -176,6 +178,164 @@ def _get_h5_dataset(directory, train_mode=True, epochs=1, batch_size=1000):
     return data_set
 
 
+# header of a bin part: magic, format version, rows, fields per row. The header is followed by the ids
+# (rows, fields) int32, the weights (rows, fields) float32 and the labels (rows,) float32
+BIN_HEADER = np.dtype([('magic', 'S8'), ('version', '<i8'), ('rows', '<i8'), ('fields', '<i8')])
+BIN_MAGIC = b'CRITEOBN'
+
+
+def write_bin_part(path, ids, weights, labels):
+    """
+    Write a bin part.
+
+    Args:
+        path (str): Part file.
+        ids (numpy.ndarray): Ids of shape (rows, fields).
+        weights (numpy.ndarray): Weights of shape (rows, fields).
+        labels (numpy.ndarray): Labels of the rows.
+    """
+    ids = np.ascontiguousarray(ids, dtype='<i4')
+    weights = np.ascontiguousarray(weights, dtype='<f4')
+    labels = np.ascontiguousarray(labels, dtype='<f4').reshape(-1)
+    assert ids.shape == weights.shape and ids.shape[0] == labels.shape[0]
+    header = np.array([(BIN_MAGIC, 1, ids.shape[0], ids.shape[1])], dtype=BIN_HEADER)
+    with open(path + '.tmp', 'wb') as f:
+        for array in (header, ids, weights, labels):
+            f.write(array.tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def read_bin_part(path):
+    """
+    Memory map a bin part.
+
+    Returns:
+        The ids and weights of shape (rows, fields) and the labels of shape (rows, 1).
+    """
+    header = np.fromfile(path, dtype=BIN_HEADER, count=1)
+    if header.size != 1 or header['magic'][0] != BIN_MAGIC:
+        raise ValueError(f'{path} is not a bin dataset part')
+    rows, fields = int(header['rows'][0]), int(header['fields'][0])
+    offset = BIN_HEADER.itemsize
+    ids = np.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(rows, fields))
+    offset += ids.nbytes
+    weights = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(rows, fields))
+    offset += weights.nbytes
+    labels = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(rows, 1))
+    return ids, weights, labels
+
+
+class BinDataset():
+    """
+    Create dataset with the bin parts {prefix}_part_{n}.bin, a memory mapped H5Dataset.
+
+    Only the headers are read to count the rows and the batches are slices of the page cache. Without
+    random_sample a batch is a slice of a part and is not copied. With random_sample the part is split into
+    blocks of shuffle_batches batches visited in random order, and the rows of a block are visited in random
+    order, so a batch is gathered from a small region of the file.
+
+    Args:
+        data_path (str): Dataset directory.
+        train_mode (bool): Whether dataset is used for train or eval (default=True).
+        shuffle_batches (int): The number of batches of a shuffled block (default=64).
+    """
+
+    def __init__(self, data_path, train_mode=True, shuffle_batches=64):
+        self._data_dir = data_path
+        self._file_prefix = 'train' if train_mode else 'test'
+        self._shuffle_batches = shuffle_batches
+        pattern = re.compile(rf'^{self._file_prefix}_part_(\d+)\.bin$')
+        names = [name for name in os.listdir(data_path) if pattern.match(name)]
+        if not names:
+            raise ValueError(f'no {self._file_prefix}_part_*.bin in {data_path}')
+        names.sort(key=lambda name: int(pattern.match(name).group(1)))
+        self._parts = [read_bin_part(os.path.join(data_path, name)) for name in names]
+        self.data_size = sum(labels.shape[0] for _, _, labels in self._parts)
+        print("data_size: {}".format(self.data_size))
+
+    def _part_batches(self, part, batch_size, random_sample):
+        ids, weights, labels = self._parts[part]
+        rows = labels.shape[0]
+        if not random_sample:
+            for start in range(0, rows, batch_size):
+                yield ids[start:start + batch_size], weights[start:start + batch_size], \
+                      labels[start:start + batch_size]
+            return
+        block_rows = batch_size * self._shuffle_batches
+        for block in np.random.permutation(math.ceil(rows / block_rows)):
+            start = block * block_rows
+            index = start + np.random.permutation(min(block_rows, rows - start))
+            for i in range(0, index.size, batch_size):
+                # sorted rows read the block in file order, the rows of a batch are unordered anyway
+                batch_index = np.sort(index[i:i + batch_size])
+                yield ids[batch_index], weights[batch_index], labels[batch_index]
+
+    def batch_generator(self, batch_size=1000, random_sample=False, shuffle_block=False):
+        """
+        :param batch_size
+        :param random_sample: if True, shuffle the rows of every part
+        :param shuffle_block: shuffle the parts at every round
+        :return: ids, weights, labels of a batch, the data stream never stops
+        """
+        parts = np.arange(len(self._parts))
+        while True:
+            if shuffle_block:
+                np.random.shuffle(parts)
+            for part in parts:
+                yield from self._part_batches(part, batch_size, random_sample)
+
+
+def convert_h5_to_bin(directory, output_directory, train_num_of_parts=config.train_num_of_parts,
+                      test_num_of_parts=config.test_num_of_parts):
+    """
+    Convert the h5 parts of H5Dataset into the bin parts of BinDataset.
+
+    Args:
+        directory (str): Directory of the h5 parts.
+        output_directory (str): Directory of the bin parts.
+        train_num_of_parts (int): The number of train data file (default=21).
+        test_num_of_parts (int): The number of test data file (default=3).
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    for prefix, num_of_parts in (('train', train_num_of_parts), ('test', test_num_of_parts)):
+        for part in range(num_of_parts):
+            X = pd.read_hdf(os.path.join(directory, f'{prefix}_input_part_{str(part)}.h5')).values
+            y = pd.read_hdf(os.path.join(directory, f'{prefix}_output_part_{str(part)}.h5')).values
+            write_bin_part(os.path.join(output_directory, f'{prefix}_part_{str(part)}.bin'),
+                           X[:, :H5Dataset.max_length], X[:, H5Dataset.max_length:], y)
+
+
+def _get_bin_dataset(directory, train_mode=True, epochs=1, batch_size=1000):
+    """
+    Get dataset with bin format.
+
+    Args:
+        directory (str): Dataset directory.
+        train_mode (bool): Whether dataset is use for train or eval (default=True).
+        epochs (int): Dataset epoch size (default=1).
+        batch_size (int): Dataset batch size (default=1000)
+
+    Returns:
+        Dataset.
+    """
+    data_para = {'batch_size': batch_size}
+    if train_mode:
+        data_para['random_sample'] = True
+        data_para['shuffle_block'] = True
+
+    bin_dataset = BinDataset(data_path=directory, train_mode=train_mode)
+    numbers_of_batch = math.ceil(bin_dataset.data_size / batch_size)
+
+    def _iter_bin_data():
+        train_eval_gen = bin_dataset.batch_generator(**data_para)
+        for _ in range(0, numbers_of_batch, 1):
+            yield train_eval_gen.__next__()
+
+    data_set = ds.GeneratorDataset(_iter_bin_data, ["ids", "weights", "labels"])
+    data_set = data_set.repeat(epochs)
+    return data_set
+
+
 def _get_mindrecord_dataset(directory, train_mode=True, epochs=1, batch_size=1000,
                             line_per_sample=1000, rank_size=None, rank_id=None):
     """
@@ -274,7 +434,7 @@ def create_dataset(directory, train_mode=True, epochs=1, batch_size=1000,
         train_mode (bool): Whether dataset is use for train or eval (default=True).
         epochs (int): Dataset epoch size (default=1).
         batch_size (int): Dataset batch size (default=1000).
-        data_type (DataType): The type of dataset which is one of H5, TFRECORE, MINDRECORD (default=TFRECORD).
+        data_type (DataType): The type of dataset which is one of H5, TFRECORE, MINDRECORD, BIN (default=TFRECORD).
         line_per_sample (int): The number of sample per line (default=1000).
         rank_size (int): The number of device, not necessary for single device (default=None).
         rank_id (int): Id of device, not necessary for single device (default=None).
@@ -292,4 +452,6 @@ def create_dataset(directory, train_mode=True, epochs=1, batch_size=1000,
 
     if rank_size is not None and rank_size > 1:
         raise ValueError('Please use mindrecord dataset.')
+    if data_type == DataType.BIN:
+        return _get_bin_dataset(directory, train_mode, epochs, batch_size)
     return _get_h5_dataset(directory, train_mode, epochs, batch_size)
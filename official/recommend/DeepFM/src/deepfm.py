@@ -26,6 +26,7 @@ from mindspore.nn import Dropout
 from mindspore.nn.optim import Adam
 from mindspore.nn.metrics import Metric
 from mindspore import nn, Tensor, ParameterTuple, Parameter
+from mindspore import log as logger
 from mindspore.common.initializer import Uniform, initializer
 from mindspore.train.callback import ModelCheckpoint, CheckpointConfig
 from mindspore.context import ParallelMode, get_auto_parallel_context
@@ -64,6 +65,66 @@ class AUCMetric(Metric):
         return auc
 
 
+class StreamingAUCMetric(Metric):
+    """
+    AUC, logloss and accuracy in bounded memory.
+
+    The predictions are counted in num_bins bins of equal width in logit space for each label, so the memory does
+    not grow with the eval dataset. Pairs of a positive and a negative in the same bin count as ties, which bounds
+    the error of the AUC by half their fraction of all pairs. Logloss and accuracy are exact.
+
+    Args:
+        num_bins (int): Bins of the histograms, rounded up to an even number so that 0.5 starts a bin.
+            Default: 100000.
+        logit_range (float): Logits out of [-logit_range, logit_range] fall in the first or the last bin.
+            Default: 16.0.
+    """
+    def __init__(self, num_bins=100000, logit_range=16.0):
+        super(StreamingAUCMetric, self).__init__()
+        self.num_bins = num_bins + num_bins % 2
+        self.logit_range = logit_range
+        self.eps = 1e-7
+        self.clear()
+
+    def clear(self):
+        """Clear the internal evaluation result."""
+        self.pos = np.zeros(self.num_bins, np.int64)
+        self.neg = np.zeros(self.num_bins, np.int64)
+        self.loss_sum = 0.0
+        self.auc_error = None
+
+    def update(self, *inputs):
+        batch_predict = self._convert_data(inputs[1]).astype(np.float64).ravel()
+        batch_label = self._convert_data(inputs[2]).ravel() > 0.5
+        batch_predict = np.clip(batch_predict, self.eps, 1 - self.eps)
+        self.loss_sum -= np.sum(np.log(np.where(batch_label, batch_predict, 1 - batch_predict)))
+        logit = np.log(batch_predict) - np.log1p(-batch_predict)
+        bins = np.floor((logit + self.logit_range) * (self.num_bins / (2 * self.logit_range)))
+        bins = np.clip(bins, 0, self.num_bins - 1).astype(np.int64)
+        self.pos += np.bincount(bins[batch_label], minlength=self.num_bins)
+        self.neg += np.bincount(bins[~batch_label], minlength=self.num_bins)
+
+    def eval(self):
+        pos, neg = self.pos, self.neg
+        num_pos, num_neg = int(np.sum(pos)), int(np.sum(neg))
+        if not num_pos + num_neg:
+            raise RuntimeError('StreamingAUCMetric must have at least one sample before calling eval()')
+        half = self.num_bins // 2
+        self.logloss = self.loss_sum / (num_pos + num_neg)
+        self.accuracy = (np.sum(pos[half:]) + np.sum(neg[:half])) / (num_pos + num_neg)
+        if num_pos and num_neg:
+            pairs = float(num_pos) * num_neg
+            ties = np.dot(pos.astype(np.float64), neg)
+            auc = (np.dot(pos.astype(np.float64), np.cumsum(neg) - neg) + 0.5 * ties) / pairs
+            self.auc_error = 0.5 * ties / pairs
+        else:
+            auc = None
+            self.auc_error = None
+            logger.warning('Only one class present in the labels, auc is not defined')
+        logger.info(f'auc: {auc} (+/- {self.auc_error}), logloss: {self.logloss}, accuracy: {self.accuracy}')
+        return auc
+
+
 def init_method(method, shape, name, max_val=1.0):
     if method in ['uniform']:
         params = Parameter(initializer(Uniform(max_val), shape, ms_type), name=name)
@@ -345,7 +406,8 @@ class ModelBuilder():
             if eval_dataset is None:
                 raise RuntimeError("train_config.eval_callback is {}; get_callback_list() args eval_dataset is {}".
                                    format(self.train_config.eval_callback, eval_dataset))
-            auc_metric = AUCMetric()
+            auc_metric = StreamingAUCMetric(self.train_config.auc_bins) if self.train_config.auc_bins > 0 \
+                else AUCMetric()
             eval_callback = EvalCallBack(model, eval_dataset, auc_metric,
                                          eval_file_path=os.path.join(self.train_config.output_path,
                                                                      self.train_config.eval_file_name))
@@ -14,8 +14,10 @@
 # ============================================================================
 """Download raw data and preprocessed data."""
 import os
+import copy
 import pickle
 import collections
+from multiprocessing import Pool
 import numpy as np
 from mindspore.mindrecord import FileWriter
 from model_utils.config import config
@@ -43,6 +45,7 @@ class StatsDict():
         self.cat2id_dict.update({col: i for i, col in enumerate(self.val_cols)})
         self.cat2id_dict.update(
             {self.oov_prefix + col: i + len(self.val_cols) for i, col in enumerate(self.cat_cols)})
+        self.cat2id_arrays = {}
 
     def stats_vals(self, val_list):
         """Handling weights column"""
@@ -92,8 +95,14 @@ class StatsDict():
     def get_cat2id(self, threshold=100):
         for key, cat_count_d in self.cat_count_dict.items():
             new_cat_count_d = dict(filter(lambda x: x[1] > threshold, cat_count_d.items()))
+            start_id = len(self.cat2id_dict)
             for cat_str, _ in new_cat_count_d.items():
                 self.cat2id_dict[key + "_" + cat_str] = len(self.cat2id_dict)
+            # sorted categories of the column and their ids, for map_cat_column
+            cats = np.array([cat_str.encode("utf-8") for cat_str in new_cat_count_d], dtype=bytes)
+            cat_ids = np.arange(start_id, start_id + len(cats), dtype=np.int64)
+            order = np.argsort(cats, kind="mergesort")
+            self.cat2id_arrays[key] = (cats[order], cat_ids[order])
         print("cat2id_dict.size:{}".format(len(self.cat2id_dict)))
         print("cat2id.dict.items()[:50]:{}".format(list(self.cat2id_dict.items())[:50]))
 
@@ -131,58 +140,270 @@ class StatsDict():
             weight_list.append(1.0)
         return id_list, weight_list
 
+    def map_cat_column(self, col, cats):
+        """Ids of a column of categories, given as bytes, like map_cat2id"""
+        kept, kept_ids = self.cat2id_arrays.get(col, (np.zeros(0, "S1"), np.zeros(0, np.int64)))
+        ids = np.full(cats.size, self.cat2id_dict[self.oov_prefix + col], np.int64)
+        if kept.size and cats.size:
+            dtype = "S{}".format(max(kept.dtype.itemsize, cats.dtype.itemsize))
+            kept_keys, cat_keys = _sort_key(kept.astype(dtype)), _sort_key(cats.astype(dtype))
+            index = np.minimum(np.searchsorted(kept_keys, cat_keys), kept.size - 1)
+            found = kept_keys[index] == cat_keys
+            if self.skip_id_convert is True:
+                ids[found] = cats[found].astype(np.int64)
+            else:
+                ids[found] = kept_ids[index[found]]
+        return ids
+
 
 def mkdir_path(file_path):
     if not os.path.exists(file_path):
         os.makedirs(file_path)
 
 
-def statsdata(file_path, dict_output_path, recommendation_dataset_stats_dict, dense_dim=13, slot_dim=26):
+def file_blocks(file_path, block_size):
+    """Byte ranges of about block_size bytes of a text file, split at line ends."""
+    file_size = os.path.getsize(file_path)
+    bounds = [0]
+    with open(file_path, "rb") as file_in:
+        while bounds[-1] < file_size:
+            file_in.seek(min(bounds[-1] + block_size, file_size))
+            file_in.readline()
+            bounds.append(min(file_in.tell(), file_size))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+_BYTE_MASKS = np.array([(1 << (8 * n)) - 1 for n in range(9)], np.uint64)
+
+
+def _read_block(file_path, start, end):
+    """bytes of a block, ending with a line end and followed by 8 zero bytes for _field_chars"""
+    with open(file_path, "rb") as file_in:
+        file_in.seek(start)
+        data = file_in.read(end - start)
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    return np.frombuffer(data + bytes(8), dtype=np.uint8)
+
+
+def _field_chars(buf, starts, lengths):
+    """Characters of one field of every line, as a (lines, max length) array padded with 0."""
+    width = max(int(lengths.max()) if lengths.size else 0, 1)
+    if width <= 8:
+        # the 8 bytes from every field start read as one little endian integer, the bytes past the field masked
+        windows = np.ndarray((buf.size - 7,), "<u8", buf, strides=(1,))
+        words = windows[starts] & _BYTE_MASKS[lengths]
+        return words.view(np.uint8).reshape(-1, 8)[:, :width]
+    index = np.minimum(starts[:, None] + np.arange(width), buf.size - 1)
+    return np.where(np.arange(width) < lengths[:, None], buf[index], 0).astype(np.uint8)
+
+
+def _parse_numbers(buf, starts, lengths):
+    """float of one field of every line, 0 for empty fields."""
+    chars = _field_chars(buf, starts, lengths)
+    valid = np.arange(chars.shape[1]) < lengths[:, None]
+    digits = chars - ord("0")
+    is_digit = (digits < 10) & valid
+    negative = chars[:, 0] == ord("-")
+    if np.all(is_digit[:, 1:] | ~valid[:, 1:]) and np.all(is_digit[:, 0] | negative | ~valid[:, 0]):
+        # integers, exact in float64 up to 15 digits
+        power = 10.0 ** np.maximum(lengths[:, None] - 1 - np.arange(chars.shape[1]), 0)
+        values = np.sum(np.where(is_digit, digits * power, 0.), axis=1)
+        return np.where(negative, -values, values)
+    strings = np.ascontiguousarray(chars).view("S{}".format(chars.shape[1])).ravel()
+    return np.where(lengths > 0, np.where(lengths > 0, strings, b"0").astype(np.float64), 0.)
+
+
+def _parse_strings(buf, starts, lengths):
+    """bytes of one field of every line."""
+    chars = _field_chars(buf, starts, lengths)
+    return np.ascontiguousarray(chars).view("S{}".format(chars.shape[1])).ravel()
+
+
+def parse_block(buf, num_fields):
+    """
+    Split a block of tab separated lines into fields.
+
+    Returns:
+        (lines, good, starts, lengths), the number of lines, the indices of the lines with num_fields fields, and
+        the start and length of every field of these lines of shape (num_fields, len(good)).
+    """
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    tabs = np.flatnonzero(buf == ord("\t"))
+    tab_line = np.searchsorted(line_ends, tabs)
+    good_mask = np.bincount(tab_line, minlength=line_ends.size) == num_fields - 1
+    good = np.flatnonzero(good_mask)
+    good_tabs = tabs[good_mask[tab_line]].reshape(-1, num_fields - 1)
+    # field major, so that the fields of a column are contiguous
+    starts = np.concatenate((line_starts[None, good], good_tabs.T + 1))
+    ends = np.concatenate((good_tabs.T, line_ends[None, good]))
+    return line_ends.size, good, starts, ends - starts
+
+
+def _bad_lines(buf, lines, good):
+    """index, number of fields and text of the lines without the expected number of fields"""
+    bad = np.setdiff1d(np.arange(lines), good)
+    if not bad.size:
+        return []
+    text = buf.tobytes().split(b"\n")
+    return [(int(i), len(text[i].split(b"\t")), text[i].decode("utf-8", "replace")) for i in bad]
+
+
+def _sort_key(values):
+    """
+    Big endian integer of bytes of at most 8 characters, which compares and sorts like the bytes, only faster.
+    """
+    if values.dtype.itemsize <= 8:
+        return np.ascontiguousarray(values.astype("S8")).view(">u8").astype(np.uint64)
+    return values
+
+
+def count_values(values, first, counts=None):
+    """
+    Distinct values with their count and first position.
+
+    Args:
+        values (numpy.ndarray): bytes, possibly repeated.
+        first (numpy.ndarray): position of every value.
+        counts (numpy.ndarray): count of every value, 1 if None.
+    """
+    if counts is None:
+        counts = np.ones(values.size, np.int64)
+    keys = _sort_key(values)
+    order = np.argsort(keys, kind="mergesort")
+    keys, first, counts = keys[order], first[order], counts[order]
+    if not keys.size:
+        return values, first, counts
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return values[order[starts]], np.minimum.reduceat(first, starts), np.add.reduceat(counts, starts)
+
+
+def _merge_counts(left, right):
+    return [count_values(np.concatenate((a[0], b[0])), np.concatenate((a[1], b[1])), np.concatenate((a[2], b[2])))
+            for a, b in zip(left, right)]
+
+
+def _imap(func, tasks, workers, initializer=None, initargs=()):
+    """results of func over tasks in order, from a pool of workers processes, or in this process for 1 worker"""
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(func, tasks)
+        return
+    with Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        yield from pool.imap(func, tasks)
+
+
+def _stats_block(task):
+    """min, max of the dense columns and distinct values of the category columns of a block"""
+    file_path, start, end, dense_dim, slot_dim = task
+    buf = _read_block(file_path, start, end)
+    lines, good, starts, lengths = parse_block(buf, 1 + dense_dim + slot_dim)
+    val_min = np.zeros(dense_dim)
+    val_max = np.zeros(dense_dim)
+    for i in range(dense_dim):
+        column = 1 + i
+        values = _parse_numbers(buf, starts[column], lengths[column])[lengths[column] > 0]
+        if values.size:
+            val_min[i] = min(values.min(), 0.)
+            val_max[i] = max(values.max(), 0.)
+    cat_counts = []
+    for i in range(slot_dim):
+        column = 1 + dense_dim + i
+        cat_counts.append(count_values(_parse_strings(buf, starts[column], lengths[column]), good))
+    return lines, _bad_lines(buf, lines, good), val_min, val_max, cat_counts
+
+
+def statsdata(file_path, dict_output_path, recommendation_dataset_stats_dict, dense_dim=13, slot_dim=26,
+              workers=1, block_size=32 << 20):
     """Preprocess data and save data"""
-    with open(file_path, encoding="utf-8") as file_in:
-        errorline_list = []
-        count = 0
-        for line in file_in:
-            count += 1
-            line = line.strip("\n")
-            items = line.split("\t")
-            if len(items) != (dense_dim + slot_dim + 1):
-                errorline_list.append(count)
-                print("Found line length: {}, suppose to be {}, the line is {}".format(len(items),
-                                                                                       dense_dim + slot_dim + 1, line))
-                continue
-            if count % 1000000 == 0:
-                print("Have handled {}w lines.".format(count // 10000))
-            values = items[1: dense_dim + 1]
-            cats = items[dense_dim + 1:]
-
-            assert len(values) == dense_dim, "values.size: {}".format(len(values))
-            assert len(cats) == slot_dim, "cats.size: {}".format(len(cats))
-            recommendation_dataset_stats_dict.stats_vals(values)
-            recommendation_dataset_stats_dict.stats_cats(cats)
-    recommendation_dataset_stats_dict.save_dict(dict_output_path)
+    tasks = [(file_path, start, end, dense_dim, slot_dim) for start, end in file_blocks(file_path, block_size)]
+    val_min = np.zeros(dense_dim)
+    val_max = np.zeros(dense_dim)
+    # distinct values of every block are merged pairwise, like a binary counter, to bound the sorting work
+    merge_stack = []
+    count = 0
+    for lines, bad_lines, block_min, block_max, cat_counts in _imap(_stats_block, tasks, workers):
+        for i, num_fields, line in bad_lines:
+            print("Found line length: {}, suppose to be {}, the line is {}".format(
+                num_fields, dense_dim + slot_dim + 1, line))
+        val_min = np.minimum(val_min, block_min)
+        val_max = np.maximum(val_max, block_max)
+        cat_counts = [(values, first + count, counts) for values, first, counts in cat_counts]
+        level = 0
+        while merge_stack and merge_stack[-1][0] == level:
+            cat_counts = _merge_counts(merge_stack.pop()[1], cat_counts)
+            level += 1
+        merge_stack.append((level, cat_counts))
+        count += lines
+        print("Have handled {}w lines.".format(count // 10000))
+    cat_counts = merge_stack.pop()[1] if merge_stack else [(np.zeros(0, "S1"),) * 3] * slot_dim
+    while merge_stack:
+        cat_counts = _merge_counts(merge_stack.pop()[1], cat_counts)
+
+    stats = recommendation_dataset_stats_dict
+    stats.val_min_dict = {col: float(val_min[i]) for i, col in enumerate(stats.val_cols)}
+    stats.val_max_dict = {col: float(val_max[i]) for i, col in enumerate(stats.val_cols)}
+    for col, (values, first, counts) in zip(stats.cat_cols, cat_counts):
+        # categories in the order of their first line, as counted line by line
+        order = np.argsort(first, kind="mergesort")
+        stats.cat_count_dict[col] = collections.defaultdict(
+            int, zip([value.decode("utf-8") for value in values[order].tolist()], counts[order].tolist()))
+    stats.save_dict(dict_output_path)
+
+
+_map_stats = None
+
+
+def _init_map_worker(stats):
+    global _map_stats
+    _map_stats = stats
+
+
+def _map_block(task):
+    """ids, weights and labels of the lines of a block"""
+    file_path, start, end = task
+    stats = _map_stats
+    dense_dim, slot_dim = stats.dense_dim, stats.slot_dim
+    buf = _read_block(file_path, start, end)
+    lines, good, starts, lengths = parse_block(buf, 1 + dense_dim + slot_dim)
+    labels = _parse_numbers(buf, starts[0], lengths[0])
+    ids = np.zeros((good.size, dense_dim + slot_dim), np.int64)
+    wts = np.ones((good.size, dense_dim + slot_dim), np.float64)
+    val_max = np.array([float(stats.val_max_dict[col]) for col in stats.val_cols])
+    for i in range(dense_dim):
+        column = 1 + i
+        ids[:, i] = stats.cat2id_dict[stats.val_cols[i]]
+        wts[:, i] = np.where(lengths[column] > 0,
+                             _parse_numbers(buf, starts[column], lengths[column]) * 1.0 / val_max[i], 0)
+    for i, col in enumerate(stats.cat_cols):
+        column = 1 + dense_dim + i
+        ids[:, dense_dim + i] = stats.map_cat_column(col, _parse_strings(buf, starts[column], lengths[column]))
+    return lines, good, ids.astype(np.int32), wts.astype(np.float32), labels.astype(np.float32), \
+        [i for i, _, _ in _bad_lines(buf, lines, good)]
 
 
 def random_split_trans2mindrecord(input_file_path, output_file_path, recommendation_dataset_stats_dict,
                                   part_rows=2000000, line_per_sample=1000, train_line_count=None,
-                                  test_size=0.1, seed=2020, dense_dim=13, slot_dim=26):
+                                  test_size=0.1, seed=2020, dense_dim=13, slot_dim=26, workers=1,
+                                  block_size=32 << 20):
     """Random split data and save mindrecord"""
     if train_line_count is None:
         raise ValueError("Please provide training file line count")
     test_size = int(train_line_count * test_size)
-    all_indices = [i for i in range(train_line_count)]
+    all_indices = np.arange(train_line_count)
     np.random.seed(seed)
     np.random.shuffle(all_indices)
     print("all_indices.size:{}".format(len(all_indices)))
-    test_indices_set = set(all_indices[:test_size])
-    print("test_indices_set.size:{}".format(len(test_indices_set)))
+    test_mask = np.zeros(train_line_count, bool)
+    test_mask[all_indices[:test_size]] = True
+    del all_indices
+    print("test_indices_set.size:{}".format(int(test_mask.sum())))
     print("-----------------------" * 10 + "\n" * 2)
 
     train_data_list = []
     test_data_list = []
-    ids_list = []
-    wts_list = []
-    label_list = []
 
     writer_train = FileWriter(os.path.join(output_file_path, "train_input_part.mindrecord"), 21)
     writer_test = FileWriter(os.path.join(output_file_path, "test_input_part.mindrecord"), 3)
@@ -192,62 +413,50 @@ def random_split_trans2mindrecord(input_file_path, output_file_path, recommendat
     writer_train.add_schema(schema, "CRITEO_TRAIN")
     writer_test.add_schema(schema, "CRITEO_TEST")
 
-    with open(input_file_path, encoding="utf-8") as file_in:
-        items_error_size_lineCount = []
-        count = 0
-        train_part_number = 0
-        test_part_number = 0
-        for i, line in enumerate(file_in):
-            count += 1
-            if count % 1000000 == 0:
-                print("Have handle {}w lines.".format(count // 10000))
-            line = line.strip("\n")
-            items = line.split("\t")
-            if len(items) != (1 + dense_dim + slot_dim):
-                items_error_size_lineCount.append(i)
-                continue
-            label = float(items[0])
-            values = items[1:1 + dense_dim]
-            cats = items[1 + dense_dim:]
-
-            assert len(values) == dense_dim, "values.size: {}".format(len(values))
-            assert len(cats) == slot_dim, "cats.size: {}".format(len(cats))
-
-            ids, wts = recommendation_dataset_stats_dict.map_cat2id(values, cats)
-
-            ids_list.extend(ids)
-            wts_list.extend(wts)
-            label_list.append(label)
-
-            if count % line_per_sample == 0:
-                if i not in test_indices_set:
-                    train_data_list.append({"feat_ids": np.array(ids_list, dtype=np.int32),
-                                            "feat_vals": np.array(wts_list, dtype=np.float32),
-                                            "label": np.array(label_list, dtype=np.float32)
-                                            })
-                else:
-                    test_data_list.append({"feat_ids": np.array(ids_list, dtype=np.int32),
-                                           "feat_vals": np.array(wts_list, dtype=np.float32),
-                                           "label": np.array(label_list, dtype=np.float32)
-                                           })
-                if train_data_list and len(train_data_list) % part_rows == 0:
-                    writer_train.write_raw_data(train_data_list)
-                    train_data_list.clear()
-                    train_part_number += 1
-
-                if test_data_list and len(test_data_list) % part_rows == 0:
-                    writer_test.write_raw_data(test_data_list)
-                    test_data_list.clear()
-                    test_part_number += 1
-
-                ids_list.clear()
-                wts_list.clear()
-                label_list.clear()
-
-        if train_data_list:
-            writer_train.write_raw_data(train_data_list)
-        if test_data_list:
-            writer_test.write_raw_data(test_data_list)
+    # the workers only need the ids of the dense columns and of the OOV categories besides cat2id_arrays
+    map_stats = copy.copy(recommendation_dataset_stats_dict)
+    map_stats.cat_count_dict = {}
+    map_stats.cat2id_dict = {key: recommendation_dataset_stats_dict.cat2id_dict[key] for key in
+                             map_stats.val_cols + [map_stats.oov_prefix + col for col in map_stats.cat_cols]}
+    tasks = [(input_file_path, start, end) for start, end in file_blocks(input_file_path, block_size)]
+    items_error_size_lineCount = []
+    count = 0
+    # ids, weights and labels of the lines of the sample being collected
+    pending = []
+    results = _imap(_map_block, tasks, workers, _init_map_worker, (map_stats,))
+    for lines, good, ids, wts, labels, bad_lines in results:
+        items_error_size_lineCount.extend(i + count for i in bad_lines)
+        line_index = good + count
+        # a sample ends at every line_per_sample-th line, if that line is valid
+        sample_ends = np.flatnonzero((line_index + 1) % line_per_sample == 0) + 1
+        start = 0
+        for end in sample_ends:
+            pending.append((ids[start:end], wts[start:end], labels[start:end]))
+            data = {"feat_ids": np.concatenate([x[0] for x in pending]).ravel(),
+                    "feat_vals": np.concatenate([x[1] for x in pending]).ravel(),
+                    "label": np.concatenate([x[2] for x in pending])}
+            pending = []
+            i = line_index[end - 1]
+            if i < train_line_count and test_mask[i]:
+                test_data_list.append(data)
+            else:
+                train_data_list.append(data)
+            if train_data_list and len(train_data_list) % part_rows == 0:
+                writer_train.write_raw_data(train_data_list)
+                train_data_list.clear()
+            if test_data_list and len(test_data_list) % part_rows == 0:
+                writer_test.write_raw_data(test_data_list)
+                test_data_list.clear()
+            start = end
+        if start < good.size:
+            pending.append((ids[start:], wts[start:], labels[start:]))
+        count += lines
+        print("Have handle {}w lines.".format(count // 10000))
+
+    if train_data_list:
+        writer_train.write_raw_data(train_data_list)
+    if test_data_list:
+        writer_test.write_raw_data(test_data_list)
     writer_train.commit()
     writer_test.commit()
 
@@ -258,6 +467,7 @@ def random_split_trans2mindrecord(input_file_path, output_file_path, recommendat
 
 
 if __name__ == '__main__':
+
     data_path = config.data_path
 
     target_field_size = config.dense_dim + config.slot_dim
@@ -266,7 +476,8 @@ if __name__ == '__main__':
     data_file_path = data_path + "origin_data/train.txt"
     stats_output_path = data_path + "stats_dict/"
     mkdir_path(stats_output_path)
-    statsdata(data_file_path, stats_output_path, stats, dense_dim=config.dense_dim, slot_dim=config.slot_dim)
+    statsdata(data_file_path, stats_output_path, stats, dense_dim=config.dense_dim, slot_dim=config.slot_dim,
+              workers=config.preprocess_workers, block_size=config.preprocess_block_mb << 20)
 
     stats.load_dict(dict_path=stats_output_path, prefix="")
     stats.get_cat2id(threshold=config.threshold)
@@ -276,4 +487,5 @@ if __name__ == '__main__':
     mkdir_path(output_path)
     random_split_trans2mindrecord(in_file_path, output_path, stats, part_rows=2000000,
                                   train_line_count=config.train_line_count, line_per_sample=1000,
-                                  test_size=0.1, seed=2020, dense_dim=config.dense_dim, slot_dim=config.slot_dim)
+                                  test_size=0.1, seed=2020, dense_dim=config.dense_dim, slot_dim=config.slot_dim,
+                                  workers=config.preprocess_workers, block_size=config.preprocess_block_mb << 20)
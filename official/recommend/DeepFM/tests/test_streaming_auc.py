@@ -0,0 +1,87 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""StreamingAUCMetric of src/deepfm.py against the exact auc, logloss and accuracy"""
+import os
+import sys
+
+import numpy as np
+import pytest
+from sklearn.metrics import roc_auc_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.deepfm import StreamingAUCMetric  # pylint: disable=wrong-import-position
+
+NUM_BINS = 100000
+LOGIT_RANGE = 16.0
+
+
+def bin_center_data(num_samples, seed=0):
+    """labels and predictions at the centers of distinct bins, so there is no tie"""
+    rng = np.random.RandomState(seed)
+    bins = rng.choice(NUM_BINS, num_samples, replace=False)
+    logit = (bins + 0.5) * (2 * LOGIT_RANGE / NUM_BINS) - LOGIT_RANGE
+    label = (rng.rand(num_samples) < 1 / (1 + np.exp(-logit))).astype(np.float32)
+    return 1 / (1 + np.exp(-logit)), label
+
+
+def random_data(num_samples, seed=0):
+    rng = np.random.RandomState(seed)
+    label = (rng.rand(num_samples) < 0.3).astype(np.float32)
+    predict = 1 / (1 + np.exp(-(2 * label - 1 + rng.randn(num_samples))))
+    return predict.astype(np.float32), label
+
+
+def exact_logloss(predict, label):
+    predict = np.clip(predict.astype(np.float64), 1e-7, 1 - 1e-7)
+    return -np.mean(label * np.log(predict) + (1 - label) * np.log(1 - predict))
+
+
+def update(metric, predict, label, batch_size=256):
+    for start in range(0, len(label), batch_size):
+        metric.update(None, predict[start:start + batch_size], label[start:start + batch_size])
+
+
+def test_exact_without_ties():
+    predict, label = bin_center_data(5000)
+    metric = StreamingAUCMetric(NUM_BINS, logit_range=LOGIT_RANGE)
+    update(metric, predict, label)
+    auc = metric.eval()
+    assert metric.auc_error == 0
+    assert auc == pytest.approx(roc_auc_score(label, predict), abs=1e-12)
+    assert metric.logloss == pytest.approx(exact_logloss(predict, label), rel=1e-9)
+    assert metric.accuracy == pytest.approx(np.mean((predict >= 0.5) == (label > 0.5)))
+
+
+def test_error_within_bound():
+    predict, label = random_data(20000)
+    exact = roc_auc_score(label, predict)
+    for num_bins in (10, 100, 1000):
+        metric = StreamingAUCMetric(num_bins)
+        update(metric, predict, label)
+        auc = metric.eval()
+        assert metric.auc_error > 0
+        assert abs(auc - exact) <= metric.auc_error + 1e-12
+
+
+def test_single_class():
+    metric = StreamingAUCMetric(1000)
+    metric.update(None, np.array([0.2, 0.7, 0.9]), np.array([1, 1, 1]))
+    assert metric.eval() is None
+    assert metric.auc_error is None
+    assert metric.accuracy == pytest.approx(2 / 3)
+    metric.clear()
+    with pytest.raises(RuntimeError):
+        metric.eval()
@@ -23,7 +23,7 @@ from mindspore.train.model import Model
 from mindspore.train.callback import ModelCheckpoint, CheckpointConfig, TimeMonitor
 from mindspore.common import set_seed
 
-from src.deepfm import ModelBuilder, AUCMetric
+from src.deepfm import ModelBuilder, AUCMetric, StreamingAUCMetric
 from src.dataset import create_dataset, DataType
 from src.callback import EvalCallBack, LossCallBack
 from src.model_utils.config import config
@@ -92,7 +92,7 @@ def train_deepfm():
         config.convert_dtype = config.device_target != "CPU"
     model_builder = ModelBuilder(config, config)
     train_net, eval_net = model_builder.get_train_eval_net()
-    auc_metric = AUCMetric()
+    auc_metric = StreamingAUCMetric(config.auc_bins) if config.auc_bins > 0 else AUCMetric()
     model = Model(train_net, eval_network=eval_net, metrics={"auc": auc_metric})
 
     time_callback = TimeMonitor(data_size=ds_train.get_dataset_size())
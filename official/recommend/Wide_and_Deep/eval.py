@@ -24,7 +24,7 @@ from mindspore.train.serialization import load_checkpoint, load_param_into_net,\
 from src.wide_and_deep import PredictWithSigmoid, TrainStepWrap, NetWithLossClass, WideDeepModel
 from src.callbacks import LossCallBack
 from src.datasets import create_dataset, DataType
-from src.metrics import AUCMetric
+from src.metrics import create_auc_metric
 from src.model_utils.config import config as cfg
 from src.model_utils.moxing_adapter import moxing_wrapper
 
@@ -75,6 +75,8 @@ def test_eval(config):
         dataset_type = DataType.TFRECORD
     elif config.dataset_type == "mindrecord":
         dataset_type = DataType.MINDRECORD
+    elif config.dataset_type == "bin":
+        dataset_type = DataType.BIN
     else:
         dataset_type = DataType.H5
     ds_eval = create_dataset(data_path, train_mode=False,
@@ -107,7 +109,7 @@ def test_eval(config):
         param_dict = load_checkpoint(ckpt_path)
     load_param_into_net(eval_net, param_dict)
 
-    auc_metric = AUCMetric()
+    auc_metric = create_auc_metric(config)
     model = Model(train_net, eval_network=eval_net, metrics={"auc": auc_metric})
 
     model.eval(ds_eval)
@@ -26,6 +26,8 @@ def generate_bin():
         dataset_type = DataType.TFRECORD
     elif config.dataset_type == "mindrecord":
         dataset_type = DataType.MINDRECORD
+    elif config.dataset_type == "bin":
+        dataset_type = DataType.BIN
     else:
         dataset_type = DataType.H5
     ds = create_dataset(data_path, train_mode=False,
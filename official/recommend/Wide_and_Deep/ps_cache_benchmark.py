@@ -0,0 +1,125 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Hit rate, parameter server traffic and step time of the worker side embedding cache, with a local parameter
+server stand-in.
+
+Workers take turns to train a logistic model on the embeddings of their batches, every lookup and update going
+through their cache (or straight to the parameter server without cache), on the bin parts of src/datasets.py or
+on synthetic Zipf distributed ids.
+
+Usage: python ps_cache_benchmark.py --data_path ./data/bin/ --capacity 100000 --staleness 10
+"""
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+
+from src.embedding_cache import HotEmbeddingCache, LocalParameterServer
+
+parser = argparse.ArgumentParser(description='Wide&Deep parameter server embedding cache benchmark')
+parser.add_argument('--data_path', type=str, default='', help='Directory of the bin parts, "" for synthetic ids')
+parser.add_argument('--vocab_size', type=int, default=200000, help='Rows of the embedding table')
+parser.add_argument('--field_size', type=int, default=39, help='Ids of a sample, for synthetic ids')
+parser.add_argument('--zipf', type=float, default=1.2, help='Zipf exponent of the synthetic ids')
+parser.add_argument('--emb_dim', type=int, default=80, help='Embedding size')
+parser.add_argument('--batch_size', type=int, default=1000, help='Batch size of every worker')
+parser.add_argument('--steps', type=int, default=200, help='Steps of every worker')
+parser.add_argument('--workers', type=int, default=1, help='Simulated workers sharing the parameter server')
+parser.add_argument('--capacity', type=int, default=50000, help='Cached rows of every worker')
+parser.add_argument('--admit_threshold', type=int, default=2, help='Times an id is seen before it is cached')
+parser.add_argument('--policy', type=str, default='lfu', choices=('lru', 'lfu'), help='Eviction policy')
+parser.add_argument('--staleness', type=str, default='0,10,100',
+                    help='Comma separated steps after which a cached row is synchronized')
+parser.add_argument('--learning_rate', type=float, default=0.05, help='Learning rate')
+parser.add_argument('--request_latency_ms', type=float, default=1.0, help='Latency of a parameter server request')
+parser.add_argument('--row_latency_us', type=float, default=1.0, help='Latency of a pulled or pushed row')
+args = parser.parse_args()
+
+
+def bin_batches(data_path, batch_size):
+    """(ids, weights, labels) batches of the train parts, the ids folded into vocab_size"""
+    from src.datasets import read_bin_part
+    pattern = re.compile(r'^train_part_(\d+)\.bin$')
+    names = sorted((name for name in os.listdir(data_path) if pattern.match(name)),
+                   key=lambda name: int(pattern.match(name).group(1)))
+    while True:
+        for name in names:
+            ids, weights, labels = read_bin_part(os.path.join(data_path, name))
+            for start in range(0, labels.shape[0] - batch_size + 1, batch_size):
+                yield np.asarray(ids[start:start + batch_size], np.int64) % args.vocab_size, \
+                      np.asarray(weights[start:start + batch_size]), np.asarray(labels[start:start + batch_size, 0])
+
+
+def synthetic_batches(batch_size, seed):
+    """Zipf distributed ids, every field with its own range of the vocabulary"""
+    rng = np.random.RandomState(seed)
+    field_vocab = args.vocab_size // args.field_size
+    offsets = np.arange(args.field_size) * field_vocab
+    while True:
+        ids = (rng.zipf(args.zipf, (batch_size, args.field_size)) - 1) % field_vocab + offsets
+        # clicks depend on the hottest id of the first field
+        labels = ((ids[:, 0] % 7 == 0) ^ (rng.rand(batch_size) < 0.2)).astype(np.float32)
+        yield ids, np.ones(ids.shape, np.float32), labels
+
+
+def train(capacity, staleness):
+    """loss, hit rate, traffic and step time of the workers"""
+    ps = LocalParameterServer(args.vocab_size, args.emb_dim, request_latency=args.request_latency_ms / 1e3,
+                              row_latency=args.row_latency_us / 1e6)
+    caches = [HotEmbeddingCache(ps, args.vocab_size, capacity, args.admit_threshold, args.policy, staleness)
+              for _ in range(args.workers)]
+    if args.data_path:
+        batches = bin_batches(args.data_path, args.batch_size)
+        worker_batches = [batches] * args.workers
+    else:
+        worker_batches = [synthetic_batches(args.batch_size, seed) for seed in range(args.workers)]
+    direction = np.random.RandomState(1).randn(args.emb_dim).astype(np.float32) / np.sqrt(args.emb_dim)
+    losses = []
+    start = time.time()
+    for _ in range(args.steps):
+        for cache, batches in zip(caches, worker_batches):
+            ids, weights, labels = next(batches)
+            embeddings = cache.lookup(ids)
+            logits = np.einsum('bf,bfd,d->b', weights, embeddings, direction) * 10
+            probs = 1 / (1 + np.exp(-logits))
+            losses.append(-np.mean(labels * np.log(probs + 1e-7) + (1 - labels) * np.log(1 - probs + 1e-7)))
+            grads = ((probs - labels)[:, None, None] * weights[:, :, None]) * direction * (10 / len(labels))
+            cache.update(ids, grads, args.learning_rate)
+    for cache in caches:
+        cache.flush()
+    step_time = (time.time() - start) / (args.steps * args.workers)
+    hits = sum(cache.hits for cache in caches)
+    lookups = sum(cache.lookups for cache in caches)
+    last = losses[-len(losses) // 10:]
+    return float(np.mean(last)), hits / max(lookups, 1), ps.pulled_rows + ps.pushed_rows, ps.requests, step_time
+
+
+if __name__ == '__main__':
+    print('{} workers, batch size {}, {} steps, {} {:.1f}ms + {:.1f}us per row'.format(
+        args.workers, args.batch_size, args.steps, 'bin parts' if args.data_path else 'synthetic ids',
+        args.request_latency_ms, args.row_latency_us))
+    print('{:>9} {:>9} {:>9} {:>9} {:>12} {:>8} {:>10} {:>12}'.format(
+        'capacity', 'staleness', 'loss', 'hit rate', 'PS rows', 'saved', 'requests', 'step (ms)'))
+    base_loss, _, base_rows, base_requests, base_time = train(0, 0)
+    print('{:>9} {:>9} {:>9.4f} {:>9} {:>12} {:>8} {:>10} {:>12.2f}'.format(
+        0, '-', base_loss, '-', base_rows, '-', base_requests, base_time * 1e3))
+    for staleness in [int(x) for x in args.staleness.split(',')]:
+        loss, hit_rate, rows, requests, step_time = train(args.capacity, staleness)
+        print('{:>9} {:>9} {:>9.4f} {:>9.3f} {:>12} {:>7.1f}% {:>10} {:>12.2f}  {:.2f}x'.format(
+            args.capacity, staleness, loss, hit_rate, rows, 100 * (1 - rows / base_rows), requests,
+            step_time * 1e3, base_time / step_time))
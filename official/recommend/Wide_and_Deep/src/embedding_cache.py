@@ -0,0 +1,227 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Worker side cache of the hot rows of a parameter server embedding table.
+
+The ids of a batch are looked up in the cache first and only the missing rows are pulled from the parameter
+server. An id is admitted once it has been seen admit_threshold times, and a full cache evicts its least
+recently (lru) or least frequently (lfu) used rows. The updates of cached rows are applied locally and written
+back to the parameter server when a row is evicted or synchronized: a cached row is pushed and pulled again
+after staleness steps, which bounds how old its view of the updates of the other workers can be.
+"""
+import time
+
+import numpy as np
+
+
+class LocalParameterServer():
+    """
+    Parameter server stand-in, an embedding table with the traffic counters of a remote one
+
+    Args:
+        vocab_size (int): rows of the table.
+        emb_dim (int): embedding size.
+        init_range (float): rows are initialized uniformly in [-init_range, init_range]. Default: 0.01.
+        seed (int): seed of the initialization. Default: 0.
+        request_latency (float): seconds waited by every pull or push. Default: 0.
+        row_latency (float): seconds waited for every pulled or pushed row. Default: 0.
+    """
+
+    def __init__(self, vocab_size, emb_dim, init_range=0.01, seed=0, request_latency=0., row_latency=0.):
+        self.table = np.random.RandomState(seed).uniform(
+            -init_range, init_range, (vocab_size, emb_dim)).astype(np.float32)
+        self.request_latency = request_latency
+        self.row_latency = row_latency
+        self.requests = 0
+        self.pulled_rows = 0
+        self.pushed_rows = 0
+
+    def _transfer(self, rows):
+        self.requests += 1
+        delay = self.request_latency + self.row_latency * rows
+        if delay > 0:
+            time.sleep(delay)
+
+    def pull(self, ids):
+        """rows of the unique ids"""
+        self.pulled_rows += ids.size
+        self._transfer(ids.size)
+        return self.table[ids]
+
+    def push(self, ids, deltas):
+        """add deltas to the rows of the unique ids"""
+        self.pushed_rows += ids.size
+        self._transfer(ids.size)
+        self.table[ids] += deltas
+
+
+class HotEmbeddingCache():
+    """
+    HotEmbeddingCache, a capacity of 0 looks up and updates every id on the parameter server
+
+    Args:
+        ps (LocalParameterServer): parameter server, with pull(ids) and push(ids, deltas).
+        vocab_size (int): rows of the embedding table.
+        capacity (int): cached rows.
+        admit_threshold (int): times an id is seen before it is cached. Default: 2.
+        policy (str): eviction policy, 'lru' or 'lfu'. Default: 'lfu'.
+        staleness (int): steps after which a cached row is written back and pulled again. Default: 100.
+    """
+
+    def __init__(self, ps, vocab_size, capacity, admit_threshold=2, policy='lfu', staleness=100):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("policy should be 'lru' or 'lfu', but got {}".format(policy))
+        self.ps = ps
+        self.capacity = capacity
+        self.admit_threshold = admit_threshold
+        self.policy = policy
+        self.staleness = staleness
+        emb_dim = ps.table.shape[1]
+        self.values = np.zeros((capacity, emb_dim), np.float32)
+        # updates of the cached rows not pushed to the parameter server yet
+        self.deltas = np.zeros((capacity, emb_dim), np.float32)
+        self.slot_ids = np.full(capacity, -1, np.int64)
+        self.last_used = np.zeros(capacity, np.int64)
+        self.synced = np.zeros(capacity, np.int64)
+        self.slot_of = np.full(vocab_size, -1, np.int64)
+        self.freq = np.zeros(vocab_size, np.int64)
+        self.filled = 0
+        self.step = 0
+        self.lookups = 0
+        self.hits = 0
+        # (ids, deltas) of the rows evicted by the last lookup, pushed with the updates of its step
+        self.evicted = []
+
+    def _dirty(self, slots):
+        """the slots with updates, and their ids and updates, which are cleared"""
+        dirty = slots[np.any(self.deltas[slots] != 0, axis=1)]
+        ids, deltas = self.slot_ids[dirty], self.deltas[dirty]
+        self.deltas[dirty] = 0
+        return ids, deltas
+
+    def _push(self, parts):
+        parts = [(ids, deltas) for ids, deltas in parts if ids.size]
+        if parts:
+            self.ps.push(np.concatenate([ids for ids, _ in parts]), np.concatenate([deltas for _, deltas in parts]))
+
+    def _admit(self, ids, rows):
+        """cache the rows of the missing ids seen admit_threshold times, evicting rows of former steps"""
+        admit = self.freq[ids] >= self.admit_threshold
+        ids, rows = ids[admit], rows[admit]
+        if not ids.size or not self.capacity:
+            return
+        # most frequent first
+        order = np.argsort(-self.freq[ids], kind='stable')
+        ids, rows = ids[order], rows[order]
+        free = np.arange(self.filled, min(self.filled + ids.size, self.capacity))
+        self.filled += free.size
+        slots = free
+        if ids.size > free.size:
+            score = (self.last_used if self.policy == 'lru' else self.freq[self.slot_ids]).astype(np.float64)
+            # rows of this step stay, they are updated after the lookup
+            score[self.last_used == self.step] = np.inf
+            score[free] = np.inf
+            num_victims = min(ids.size - free.size, int(np.sum(np.isfinite(score))))
+            victims = np.argpartition(score, num_victims - 1)[:num_victims] if num_victims else free[:0]
+            victims = victims[np.argsort(score[victims], kind='stable')]
+            if self.policy == 'lfu':
+                # an lfu row is only replaced by a more frequent id
+                candidates = ids[free.size:free.size + victims.size]
+                victims = victims[self.freq[candidates] > score[victims]]
+            self.evicted.append(self._dirty(victims))
+            self.slot_of[self.slot_ids[victims]] = -1
+            slots = np.concatenate((free, victims))
+        ids, rows = ids[:slots.size], rows[:slots.size]
+        self.slot_ids[slots] = ids
+        self.slot_of[ids] = slots
+        self.values[slots] = rows
+        self.deltas[slots] = 0
+        self.synced[slots] = self.step
+        self.last_used[slots] = self.step
+
+    def lookup(self, ids):
+        """
+        embeddings of ids
+
+        Args:
+            ids (numpy.ndarray): ids of any shape.
+
+        Returns:
+            numpy.ndarray, embeddings of shape ids.shape + (emb_dim,).
+        """
+        self.step += 1
+        # lookup without update
+        self._push(self.evicted)
+        self.evicted = []
+        unique_ids, inverse, occurrences = np.unique(ids.ravel(), return_inverse=True, return_counts=True)
+        self.freq[unique_ids] += occurrences
+        slots = self.slot_of[unique_ids]
+        hit = slots >= 0
+        stale = hit.copy()
+        stale[hit] = self.step - self.synced[slots[hit]] > self.staleness
+        # the updates of stale rows not written back by the last update
+        self._push([self._dirty(slots[stale])])
+        hit &= ~stale
+        rows = np.empty((unique_ids.size, self.values.shape[1]), np.float32)
+        rows[hit] = self.values[slots[hit]]
+        self.last_used[slots[hit]] = self.step
+        missing = ~hit
+        if np.any(missing):
+            # one request for the missing and the stale rows
+            rows[missing] = self.ps.pull(unique_ids[missing])
+            self.values[slots[stale]] = rows[stale]
+            self.synced[slots[stale]] = self.step
+            self.last_used[slots[stale]] = self.step
+            new = missing & ~stale
+            self._admit(unique_ids[new], rows[new])
+        self.lookups += unique_ids.size
+        self.hits += int(np.sum(hit))
+        return rows[inverse].reshape(ids.shape + (-1,))
+
+    def update(self, ids, grads, learning_rate):
+        """
+        sparse SGD update of the rows of ids, applied to the cached rows and pushed for the others
+
+        Args:
+            ids (numpy.ndarray): ids of any shape, as given to lookup.
+            grads (numpy.ndarray): gradients of the embeddings, of shape ids.shape + (emb_dim,).
+            learning_rate (float): learning rate.
+        """
+        unique_ids, inverse = np.unique(ids.ravel(), return_inverse=True)
+        emb_dim = grads.shape[-1]
+        # gradients summed per id, one bincount over the (id, dimension) pairs
+        index = (inverse[:, None] * emb_dim + np.arange(emb_dim)).ravel()
+        deltas = np.bincount(index, weights=grads.ravel(), minlength=unique_ids.size * emb_dim)
+        deltas = (deltas * -learning_rate).astype(np.float32).reshape(unique_ids.size, emb_dim)
+        slots = self.slot_of[unique_ids]
+        cached = slots >= 0
+        self.values[slots[cached]] += deltas[cached]
+        self.deltas[slots[cached]] += deltas[cached]
+        # the updates of the rows synchronized by the next lookup and of the evicted rows are written back with
+        # the updates of the missing rows, in one request, so the parameter server sees every update of this
+        # worker at most staleness steps late
+        filled = np.arange(self.filled)
+        due = filled[self.step + 1 - self.synced[filled] > self.staleness]
+        self._push([(unique_ids[~cached], deltas[~cached]), self._dirty(due)] + self.evicted)
+        self.evicted = []
+
+    def flush(self):
+        """write back the updates of all cached rows"""
+        self._push([self._dirty(np.arange(self.filled))] + self.evicted)
+        self.evicted = []
+
+    def hit_rate(self):
+        """fraction of the unique ids of the lookups served by the cache"""
+        return self.hits / max(self.lookups, 1)
@@ -17,9 +17,12 @@
 Area under cure metric
 """
 
+import numpy as np
 from sklearn.metrics import roc_auc_score
 from mindspore.nn.metrics import Metric
 from mindspore import log as logger
+from mindspore import Tensor
+from mindspore.ops import operations as P
 
 class AUCMetric(Metric):
     """
@@ -56,3 +59,95 @@ class AUCMetric(Metric):
         print("====" * 20 + " auc_metric  end")
         print("====" * 20 + " auc: {}".format(auc))
         return auc
+
+
+class StreamingAUCMetric(Metric):
+    """
+    Area under cure, logloss and accuracy metric in bounded memory
+
+    The predictions are counted in num_bins bins of equal width in logit space, for the positive and the negative
+    labels, so the memory does not grow with the eval dataset and the counts of the ranks can be summed. The pairs
+    of a positive and a negative in the same bin are counted as ties, which bounds the error of the auc by half
+    their fraction of all pairs. Logloss and accuracy are exact.
+
+    Args:
+        num_bins (int): bins of the histograms, rounded up to an even number so that a prediction of 0.5 starts a
+            bin. Default: 100000.
+        all_reduce (bool): sum the histograms and the loss of all ranks in eval, for an eval dataset sharded over
+            the ranks. Default: False.
+        logit_range (float): logits out of [-logit_range, logit_range] are counted in the first or the last bin.
+            Default: 16.0.
+    """
+
+    def __init__(self, num_bins=100000, all_reduce=False, logit_range=16.0):
+        super(StreamingAUCMetric, self).__init__()
+        self.num_bins = num_bins + num_bins % 2
+        self.all_reduce = all_reduce
+        self.logit_range = logit_range
+        self.eps = 1e-7
+        self.clear()
+
+    def clear(self):
+        """Clear the internal evaluation result."""
+        self.pos = np.zeros(self.num_bins, np.int64)
+        self.neg = np.zeros(self.num_bins, np.int64)
+        self.loss_sum = 0.0
+        self.auc_error = None
+
+    def update(self, *inputs):
+        """Update the histograms and the loss with a batch of predicts and labels."""
+        predict = self._convert_data(inputs[1]).astype(np.float64).ravel()
+        label = self._convert_data(inputs[2]).ravel() > 0.5
+        predict = np.clip(predict, self.eps, 1 - self.eps)
+        self.loss_sum -= np.sum(np.log(np.where(label, predict, 1 - predict)))
+        logit = np.log(predict) - np.log1p(-predict)
+        bins = np.floor((logit + self.logit_range) * (self.num_bins / (2 * self.logit_range)))
+        bins = np.clip(bins, 0, self.num_bins - 1).astype(np.int64)
+        self.pos += np.bincount(bins[label], minlength=self.num_bins)
+        self.neg += np.bincount(bins[~label], minlength=self.num_bins)
+
+    def merge(self, other):
+        """Add the histograms and the loss of another StreamingAUCMetric with the same bins."""
+        if other.num_bins != self.num_bins:
+            raise ValueError("num_bins {} is not equal to {}".format(other.num_bins, self.num_bins))
+        self.pos += other.pos
+        self.neg += other.neg
+        self.loss_sum += other.loss_sum
+
+    def _all_reduce(self):
+        """sums of the histograms and the loss over the ranks"""
+        all_reduce = P.AllReduce()
+        counts = all_reduce(Tensor(np.concatenate((self.pos, self.neg)).astype(np.int32))).asnumpy()
+        loss_sum = all_reduce(Tensor(np.array([self.loss_sum], np.float32))).asnumpy()
+        return counts[:self.num_bins].astype(np.int64), counts[self.num_bins:].astype(np.int64), float(loss_sum[0])
+
+    def eval(self):
+        pos, neg, loss_sum = self._all_reduce() if self.all_reduce else (self.pos, self.neg, self.loss_sum)
+        num_pos, num_neg = int(np.sum(pos)), int(np.sum(neg))
+        if not num_pos + num_neg:
+            raise RuntimeError('StreamingAUCMetric must have at least one sample before calling eval()')
+        half = self.num_bins // 2
+        self.logloss = loss_sum / (num_pos + num_neg)
+        self.accuracy = (np.sum(pos[half:]) + np.sum(neg[:half])) / (num_pos + num_neg)
+        if num_pos and num_neg:
+            pairs = float(num_pos) * num_neg
+            lower_neg = np.cumsum(neg) - neg
+            ties = np.dot(pos.astype(np.float64), neg)
+            auc = (np.dot(pos.astype(np.float64), lower_neg) + 0.5 * ties) / pairs
+            self.auc_error = 0.5 * ties / pairs
+        else:
+            auc = None
+            self.auc_error = None
+            logger.warning('Only one class present in the labels, auc is not defined')
+
+        print("====" * 20 + " auc_metric  end")
+        print("====" * 20 + " auc: {} (+/- {}), logloss: {}, accuracy: {}".format(
+            auc, self.auc_error, self.logloss, self.accuracy))
+        return auc
+
+
+def create_auc_metric(config, all_reduce=False):
+    """StreamingAUCMetric of config.auc_bins bins, or AUCMetric if auc_bins is 0"""
+    if config.auc_bins > 0:
+        return StreamingAUCMetric(config.auc_bins, all_reduce=all_reduce)
+    return AUCMetric()
@@ -23,6 +23,7 @@ import collections
 import numpy as np
 import pandas as pd
 
+from .datasets import write_bin_part
 from .model_utils.config import config
 
 TRAIN_LINE_COUNT = 45840617
@@ -158,8 +159,8 @@ def add_write(file_path, wr_str):
 
 
 def random_split_trans2h5(in_file_path, output_path, recommendation_dataset_stats,
-                          part_rows=2000000, test_size=0.1, seed=2020):
-    """random split trans2h5"""
+                          part_rows=2000000, test_size=0.1, seed=2020, data_format="h5"):
+    """random split trans2h5, data_format "bin" writes the parts of datasets.BinDataset instead of h5"""
     test_size = int(TRAIN_LINE_COUNT * test_size)
     all_indices = [i for i in range(TRAIN_LINE_COUNT)]
     np.random.seed(seed)
@@ -169,10 +170,18 @@ def random_split_trans2h5(in_file_path, output_path, recommendation_dataset_stat
     print("test_indices_set.size: {}".format(len(test_indices_set)))
     print("------" * 10 + "\n" * 2)
 
-    train_feature_file_name = os.path.join(output_path, "train_input_part_{}.h5")
-    train_label_file_name = os.path.join(output_path, "train_output_part_{}.h5")
-    test_feature_file_name = os.path.join(output_path, "test_input_part_{}.h5")
-    test_label_file_name = os.path.join(output_path, "test_input_part_{}.h5")
+    def write_part(prefix, part_number, feature_list, label_list):
+        if data_format == "bin":
+            features = np.asarray(feature_list)
+            field_size = recommendation_dataset_stats.field_size
+            write_bin_part(os.path.join(output_path, "{}_part_{}.bin".format(prefix, part_number)),
+                           features[:, :field_size], features[:, field_size:], label_list)
+            return
+        pd.DataFrame(np.asarray(feature_list)).to_hdf(
+            os.path.join(output_path, "{}_input_part_{}.h5".format(prefix, part_number)), key="fixed")
+        pd.DataFrame(np.asarray(label_list)).to_hdf(
+            os.path.join(output_path, "{}_output_part_{}.h5".format(prefix, part_number)), key="fixed")
+
     train_feature_list = []
     train_label_list = []
     test_feature_list = []
@@ -202,32 +211,20 @@ def random_split_trans2h5(in_file_path, output_path, recommendation_dataset_stat
                 test_feature_list.append(ids + wts)
                 test_label_list.append(label)
             if train_label_list and (len(train_label_list) % part_rows == 0):
-                pd.DataFrame(np.asarray(train_feature_list)).to_hdf(train_feature_file_name.format(train_part_number),
-                                                                    key="fixed")
-                pd.DataFrame(np.asarray(train_label_list)).to_hdf(train_label_file_name.format(train_part_number),
-                                                                  key="fixed")
+                write_part("train", train_part_number, train_feature_list, train_label_list)
                 train_feature_list = []
                 train_label_list = []
                 train_part_number += 1
             if test_label_list and (len(test_label_list) % part_rows == 0):
-                pd.DataFrame(np.asarray(test_feature_list)).to_hdf(test_feature_file_name.format(test_part_number),
-                                                                   key="fixed")
-                pd.DataFrame(np.asarray(test_label_list)).to_hdf(test_label_file_name.format(test_part_number),
-                                                                 key="fixed")
+                write_part("test", test_part_number, test_feature_list, test_label_list)
                 test_feature_list = []
                 test_label_list = []
                 test_part_number += 1
 
         if train_label_list:
-            pd.DataFrame(np.asarray(train_feature_list)).to_hdf(train_feature_file_name.format(train_part_number),
-                                                                key="fixed")
-            pd.DataFrame(np.asarray(train_label_list)).to_hdf(train_label_file_name.format(train_part_number),
-                                                              key="fixed")
+            write_part("train", train_part_number, train_feature_list, train_label_list)
         if test_label_list:
-            pd.DataFrame(np.asarray(test_feature_list)).to_hdf(test_feature_file_name.format(test_part_number),
-                                                               key="fixed")
-            pd.DataFrame(np.asarray(test_label_list)).to_hdf(test_label_file_name.format(test_part_number),
-                                                             key="fixed")
+            write_part("test", test_part_number, test_feature_list, test_label_list)
 
 
 
@@ -246,4 +243,5 @@ if __name__ == "__main__":
     infile_path = base_path + "train_small.txt"
     mkdir_path(config.output_path)
     random_split_trans2h5(infile_path, config.output_path, recommendation_dataset_stat,
-                          part_rows=2000000, test_size=0.1, seed=2020)
+                          part_rows=2000000, test_size=0.1, seed=2020,
+                          data_format="bin" if config.dataset_type == "bin" else "h5")
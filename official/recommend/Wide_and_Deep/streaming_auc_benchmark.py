@@ -0,0 +1,90 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""
+Exact against streaming auc, logloss and accuracy of src/metrics.py.
+
+Predictions of a click model are drawn for imbalanced labels, split into batches over simulated ranks, and
+evaluated by sklearn and by StreamingAUCMetric, whose histograms of the ranks are merged. The script fails if the
+error of the streaming auc exceeds its bound or logloss and accuracy differ.
+
+Usage: python streaming_auc_benchmark.py --samples 2000000 --bins 1000,10000,100000
+"""
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics import log_loss, roc_auc_score
+
+from src.metrics import StreamingAUCMetric
+
+parser = argparse.ArgumentParser(description='Wide&Deep streaming auc benchmark')
+parser.add_argument('--samples', type=int, default=2000000, help='Eval samples')
+parser.add_argument('--batch_size', type=int, default=16000, help='Batch size')
+parser.add_argument('--ranks', type=int, default=8, help='Simulated ranks sharing the eval dataset')
+parser.add_argument('--ctr', type=float, default=0.03, help='Fraction of positive labels')
+parser.add_argument('--bins', type=str, default='1000,10000,100000', help='Comma separated bins of the histograms')
+parser.add_argument('--seed', type=int, default=1, help='Random seed')
+args = parser.parse_args()
+
+
+def click_model(samples, seed):
+    """predictions and labels, the labels drawn from the predictions of a model about as good as Wide&Deep"""
+    rng = np.random.RandomState(seed)
+    logits = rng.normal(np.log(args.ctr / (1 - args.ctr)), 1.2, samples)
+    labels = (rng.rand(samples) < 1 / (1 + np.exp(-logits))).astype(np.float32)
+    # the model sees the true logits with noise, in float32 as the eval network
+    predicts = 1 / (1 + np.exp(-(logits + rng.normal(0, 0.5, samples))))
+    return predicts.astype(np.float32), labels
+
+
+def streaming(predicts, labels, num_bins):
+    """StreamingAUCMetric of every rank updated batch by batch, merged into the first"""
+    metrics = [StreamingAUCMetric(num_bins) for _ in range(args.ranks)]
+    for rank, metric in enumerate(metrics):
+        for start in range(rank * args.batch_size, len(labels), args.ranks * args.batch_size):
+            end = start + args.batch_size
+            metric.update(None, predicts[start:end, None], labels[start:end, None])
+    for metric in metrics[1:]:
+        metrics[0].merge(metric)
+    return metrics[0].eval(), metrics[0]
+
+
+if __name__ == '__main__':
+    predicts, labels = click_model(args.samples, args.seed)
+    start = time.time()
+    exact_auc = roc_auc_score(labels, predicts)
+    exact_logloss = log_loss(labels, np.clip(predicts.astype(np.float64), 1e-7, 1 - 1e-7))
+    exact_accuracy = np.mean((predicts >= 0.5) == (labels > 0.5))
+    exact_time = time.time() - start
+    print('{} samples, ctr {:.4f}, {} ranks, batch size {}'.format(
+        args.samples, np.mean(labels), args.ranks, args.batch_size))
+    print('exact auc {:.6f}, logloss {:.6f}, accuracy {:.6f}, {:.2f}s, {:.1f} MB of predictions and labels'.format(
+        exact_auc, exact_logloss, exact_accuracy, exact_time, (predicts.nbytes + labels.nbytes) / 2 ** 20))
+    print('{:>8} {:>10} {:>10} {:>10} {:>12} {:>12} {:>8} {:>9}'.format(
+        'bins', 'auc', 'error', 'bound', 'logloss err', 'acc err', 'time', 'MB/rank'))
+    failed = False
+    for num_bins in [int(x) for x in args.bins.split(',')]:
+        start = time.time()
+        auc, metric = streaming(predicts, labels, num_bins)
+        elapsed = time.time() - start
+        error = abs(auc - exact_auc)
+        logloss_error = abs(metric.logloss - exact_logloss)
+        accuracy_error = abs(metric.accuracy - exact_accuracy)
+        print('{:>8} {:>10.6f} {:>10.2e} {:>10.2e} {:>12.2e} {:>12.2e} {:>7.2f}s {:>9.2f}'.format(
+            metric.num_bins, auc, error, metric.auc_error, logloss_error, accuracy_error, elapsed,
+            (metric.pos.nbytes + metric.neg.nbytes) / 2 ** 20))
+        failed |= error > metric.auc_error + 1e-9 or logloss_error > 1e-6 or accuracy_error > 1e-6
+    if failed:
+        raise RuntimeError('streaming metric out of its bound')
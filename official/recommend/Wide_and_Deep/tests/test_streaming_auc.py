@@ -0,0 +1,126 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+"""StreamingAUCMetric of src/metrics.py against the exact auc, logloss and accuracy"""
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+from sklearn.metrics import roc_auc_score
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import metrics  # pylint: disable=wrong-import-position
+from src.metrics import StreamingAUCMetric  # pylint: disable=wrong-import-position
+
+NUM_BINS = 100000
+LOGIT_RANGE = 16.0
+
+
+def bin_center_data(num_samples, seed=0):
+    """labels and predictions at the centers of distinct bins, so there is no tie"""
+    rng = np.random.RandomState(seed)
+    bins = rng.choice(NUM_BINS, num_samples, replace=False)
+    logit = (bins + 0.5) * (2 * LOGIT_RANGE / NUM_BINS) - LOGIT_RANGE
+    label = (rng.rand(num_samples) < 1 / (1 + np.exp(-logit))).astype(np.float32)
+    return 1 / (1 + np.exp(-logit)), label
+
+
+def random_data(num_samples, seed=0):
+    rng = np.random.RandomState(seed)
+    label = (rng.rand(num_samples) < 0.3).astype(np.float32)
+    predict = 1 / (1 + np.exp(-(2 * label - 1 + rng.randn(num_samples))))
+    return predict.astype(np.float32), label
+
+
+def exact_logloss(predict, label):
+    predict = np.clip(predict.astype(np.float64), 1e-7, 1 - 1e-7)
+    return -np.mean(label * np.log(predict) + (1 - label) * np.log(1 - predict))
+
+
+def update(metric, predict, label, batch_size=256):
+    for start in range(0, len(label), batch_size):
+        metric.update(None, predict[start:start + batch_size], label[start:start + batch_size])
+
+
+def test_exact_without_ties():
+    predict, label = bin_center_data(5000)
+    metric = StreamingAUCMetric(NUM_BINS, logit_range=LOGIT_RANGE)
+    update(metric, predict, label)
+    auc = metric.eval()
+    assert metric.auc_error == 0
+    assert auc == pytest.approx(roc_auc_score(label, predict), abs=1e-12)
+    assert metric.logloss == pytest.approx(exact_logloss(predict, label), rel=1e-9)
+    assert metric.accuracy == pytest.approx(np.mean((predict >= 0.5) == (label > 0.5)))
+
+
+def test_error_within_bound():
+    predict, label = random_data(20000)
+    exact = roc_auc_score(label, predict)
+    for num_bins in (10, 100, 1000):
+        metric = StreamingAUCMetric(num_bins)
+        update(metric, predict, label)
+        auc = metric.eval()
+        assert metric.auc_error > 0
+        assert abs(auc - exact) <= metric.auc_error + 1e-12
+
+
+def test_batches_and_merge_match_one_update():
+    predict, label = random_data(10000)
+    whole = StreamingAUCMetric(1000)
+    whole.update(None, predict, label)
+    parts = [StreamingAUCMetric(1000) for _ in range(3)]
+    for index, part in enumerate(parts):
+        update(part, predict[index::3], label[index::3], batch_size=97)
+    parts[0].merge(parts[1])
+    parts[0].merge(parts[2])
+    assert np.array_equal(parts[0].pos, whole.pos)
+    assert np.array_equal(parts[0].neg, whole.neg)
+    assert parts[0].eval() == pytest.approx(whole.eval(), abs=1e-12)
+    assert parts[0].logloss == pytest.approx(whole.logloss, rel=1e-9)
+    with pytest.raises(ValueError):
+        parts[0].merge(StreamingAUCMetric(100))
+
+
+def test_all_reduce_sums_the_ranks(monkeypatch):
+    predict, label = bin_center_data(6000, seed=1)
+    ranks = [StreamingAUCMetric(NUM_BINS, all_reduce=True, logit_range=LOGIT_RANGE) for _ in range(4)]
+    for index, rank in enumerate(ranks):
+        update(rank, predict[index::4], label[index::4])
+
+    class AllReduce:
+        """the sum over the simulated ranks of the tensor each of them gives"""
+        def __call__(self, tensor):
+            if tensor.asnumpy().size == 1:
+                return metrics.Tensor(np.array([sum(rank.loss_sum for rank in ranks)], np.float32))
+            return metrics.Tensor(sum(np.concatenate((rank.pos, rank.neg)).astype(np.int32) for rank in ranks))
+
+    monkeypatch.setattr(metrics, 'P', types.SimpleNamespace(AllReduce=AllReduce))
+    exact = roc_auc_score(label, predict)
+    for rank in ranks:
+        assert rank.eval() == pytest.approx(exact, abs=1e-12)
+        assert rank.logloss == pytest.approx(exact_logloss(predict, label), rel=1e-6)
+
+
+def test_single_class():
+    metric = StreamingAUCMetric(1000)
+    metric.update(None, np.array([0.2, 0.7, 0.9]), np.array([1, 1, 1]))
+    assert metric.eval() is None
+    assert metric.auc_error is None
+    assert metric.accuracy == pytest.approx(2 / 3)
+    metric.clear()
+    with pytest.raises(RuntimeError):
+        metric.eval()
@@ -26,7 +26,7 @@ from mindspore.common import set_seed
 from src.wide_and_deep import PredictWithSigmoid, TrainStepWrap, NetWithLossClass, WideDeepModel
 from src.callbacks import LossCallBack, EvalCallBack
 from src.datasets import create_dataset, DataType
-from src.metrics import AUCMetric
+from src.metrics import create_auc_metric
 from src.model_utils.config import config as cfg
 from src.model_utils.moxing_adapter import moxing_wrapper
 
@@ -79,6 +79,8 @@ def train_and_eval(config):
         dataset_type = DataType.TFRECORD
     elif config.dataset_type == "mindrecord":
         dataset_type = DataType.MINDRECORD
+    elif config.dataset_type == "bin":
+        dataset_type = DataType.BIN
     else:
         dataset_type = DataType.H5
     print("epochs is {}".format(epochs))
@@ -95,7 +97,7 @@ def train_and_eval(config):
 
     train_net, eval_net = net_builder.get_net(config)
     train_net.set_train()
-    auc_metric = AUCMetric()
+    auc_metric = create_auc_metric(config, all_reduce=True)
 
     model = Model(train_net, eval_network=eval_net, metrics={"auc": auc_metric})
 
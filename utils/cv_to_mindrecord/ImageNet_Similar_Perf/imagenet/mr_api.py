@@ -20,10 +20,12 @@ Two API must be implemented,
   2. mindrecord_dict_data(task_id)
        # Yield data for one task
        # task_id is 0..N-1, if N is return value of mindrecord_task_number()
+One API is optional,
+  3. mindrecord_init(arg_list)
+       # Parse the command line arguments writer.py does not know, called once in every process
 """
 import argparse
 import os
-import pickle
 
 ######## mindrecord_schema begin ##########
 mindrecord_schema = {"label": {"type": "int32"},
@@ -31,19 +33,13 @@ mindrecord_schema = {"label": {"type": "int32"},
                      "file_name": {"type": "string"}}
 ######## mindrecord_schema end ##########
 
-######## Frozen code begin ##########
-with open('mr_argument.pickle', 'rb') as mindrecord_argument_file_handle:
-    ARG_LIST = pickle.load(mindrecord_argument_file_handle)
-######## Frozen code end ##########
-
 parser = argparse.ArgumentParser(description='Mind record imagenet example')
 parser.add_argument('--label_file', type=str, default="", help='label file')
 parser.add_argument('--image_dir', type=str, default="", help='images directory')
 
-######## Frozen code begin ##########
-args = parser.parse_args(ARG_LIST)
-print(args)
-######## Frozen code end ##########
+args = None
+dir_list_global = []
+dir_paths_global = {}
 
 
 def _user_defined_private_func():
@@ -82,7 +78,15 @@ def _user_defined_private_func():
     return dir_list, dir_paths
 
 
-dir_list_global, dir_paths_global = _user_defined_private_func()
+def mindrecord_init(arg_list):
+    """
+    Parse arguments and list the image directories.
+    """
+    global args, dir_list_global, dir_paths_global
+    args = parser.parse_args(arg_list)
+    print(args)
+    dir_list_global, dir_paths_global = _user_defined_private_func()
+
 
 def mindrecord_task_number():
     """
@@ -1,6 +1,5 @@
 #!/bin/bash
-rm /tmp/template/*
+mkdir -p /tmp/template
 
 python writer.py --mindrecord_script template \
---mindrecord_file "/tmp/template/m" \
---mindrecord_partitions 4
+--mindrecord_file "/tmp/template/m"
@@ -20,21 +20,29 @@ Two API must be implemented,
   2. mindrecord_dict_data(task_id)
        # Yield data for one task
        # task_id is 0..N-1, if N is return value of mindrecord_task_number()
+One API is optional,
+  3. mindrecord_init(arg_list)
+       # Parse the command line arguments writer.py does not know, called once in every process
 """
 import argparse
-import pickle
 
 # ## Parse argument
 
-with open('mr_argument.pickle', 'rb') as mindrecord_argument_file_handle:  # Do NOT change this line
-    ARG_LIST = pickle.load(mindrecord_argument_file_handle)                # Do NOT change this line
 parser = argparse.ArgumentParser(description='Mind record api template')   # Do NOT change this line
 
 # ## Your arguments below
 # parser.add_argument(...)
 
-args = parser.parse_args(ARG_LIST)  # Do NOT change this line
-print(args)                         # Do NOT change this line
+args = None
+
+
+def mindrecord_init(arg_list):
+    """
+    Parse arguments, called before any task runs.
+    """
+    global args
+    args = parser.parse_args(arg_list)  # Do NOT change this line
+    print(args)                         # Do NOT change this line
 
 
 # ## Default mindrecord vars. Comment them unless default value has to be changed.
@@ -16,137 +16,278 @@
 ######################## write mindrecord example ########################
 Write mindrecord by data dictionary:
 python writer.py --mindrecord_script /YourScriptPath ...
+
+The tasks are spread over at most --mindrecord_shards MindRecord shards "<mindrecord_file>_<shard_id>", shard K
+writing the tasks K, K + S, K + 2S ... for S shards. A shard is recorded in the manifest
+"<mindrecord_file>_manifest.jsonl" once it is committed, so a rerun only writes the shards missing from it.
 """
 import argparse
+import json
 import os
-import pickle
+import queue
+import threading
 import time
 from importlib import import_module
 from multiprocessing import Pool
 
 from mindspore.mindrecord import FileWriter
 
+MB = 1024 * 1024
+
+# set in every process by _init_worker
+mr_api = None
+args = None
+
 
-def _exec_task(task_id, parallel_writer=True):
+def _init_worker(cli_args, other_args):
     """
-    Execute task with specified task id
+    Import the user script and pass it the arguments writer.py does not know
     """
-    print("exec task {}, parallel: {} ...".format(task_id, parallel_writer))
-    imagenet_iter = mindrecord_dict_data(task_id)
-    batch_size = 2048
-    transform_count = 0
-    while True:
-        data_list = []
-        try:
-            for _ in range(batch_size):
-                data_list.append(imagenet_iter.__next__())
-                transform_count += 1
-            writer.write_raw_data(data_list, parallel_writer=parallel_writer)
-            print("transformed {} record...".format(transform_count))
-        except StopIteration:
-            if data_list:
-                writer.write_raw_data(data_list, parallel_writer=parallel_writer)
-                print("transformed {} record...".format(transform_count))
-            break
+    global mr_api, args
+    args = cli_args
+    try:
+        mr_api = import_module(args.mindrecord_script + '.mr_api')
+    except ModuleNotFoundError:
+        raise RuntimeError("Unknown module path: {}".format(args.mindrecord_script + '.mr_api'))
+    if hasattr(mr_api, 'mindrecord_init'):
+        mr_api.mindrecord_init(other_args)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Mind record writer')
-    parser.add_argument('--mindrecord_script', type=str, default="template",
-                        help='path where script is saved')
+def _shard_file(shard_id):
+    return "{}_{:05d}".format(args.mindrecord_file, shard_id)
 
-    parser.add_argument('--mindrecord_file', type=str, default="/tmp/mindrecord",
-                        help='written file name prefix')
 
-    parser.add_argument('--mindrecord_partitions', type=int, default=1,
-                        help='number of written files')
+def _shard_tasks(task_count, shard_count):
+    return [list(range(shard, task_count, shard_count)) for shard in range(shard_count)]
 
-    parser.add_argument('--mindrecord_workers', type=int, default=8,
-                        help='number of parallel workers')
 
-    args = parser.parse_known_args()
+def _remove_shard(file_name):
+    for path in (file_name, file_name + ".db"):
+        if os.path.exists(path):
+            os.remove(path)
 
-    args, other_args = parser.parse_known_args()
 
-    print(args)
-    print(other_args)
+def _create_writer(file_name):
+    """
+    Create the writer of one shard with the header, page size, schema and index of mr_api
+    """
+    writer = FileWriter(file_name, 1)
 
-    with open('mr_argument.pickle', 'wb') as file_handle:
-        pickle.dump(other_args, file_handle)
+    # set the header size
+    if hasattr(mr_api, 'mindrecord_header_size'):
+        writer.set_header_size(mr_api.mindrecord_header_size)
 
-    try:
-        mr_api = import_module(args.mindrecord_script + '.mr_api')
-    except ModuleNotFoundError:
-        raise RuntimeError("Unknown module path: {}".format(args.mindrecord_script + '.mr_api'))
+    # set the page size
+    if hasattr(mr_api, 'mindrecord_page_size'):
+        writer.set_page_size(mr_api.mindrecord_page_size)
 
-    num_tasks = mr_api.mindrecord_task_number()
+    # create the schema
+    if not hasattr(mr_api, 'mindrecord_schema'):
+        raise RuntimeError("mindrecord_schema is not defined in mr_api.py.")
+    writer.add_schema(mr_api.mindrecord_schema, "mindrecord_schema")
 
-    print("Write mindrecord ...")
+    # add the index
+    if hasattr(mr_api, 'mindrecord_index_fields'):
+        writer.add_index(mr_api.mindrecord_index_fields)
+    return writer
 
-    mindrecord_dict_data = mr_api.mindrecord_dict_data
 
-    # get number of files
-    writer = FileWriter(args.mindrecord_file, args.mindrecord_partitions)
+def _put(batch_queue, item, stop):
+    """
+    Put an item into the bounded queue, giving up once the writer has stopped
+    """
+    while not stop.is_set():
+        try:
+            batch_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
-    start_time = time.time()
 
-    # set the header size
+def _read_tasks(task_ids, batch_queue, stop, stats):
+    """
+    Reader thread: run the user generator of every task and put batches of rows into the bounded queue
+    """
     try:
-        header_size = mr_api.mindrecord_header_size
-        writer.set_header_size(header_size)
-    except AttributeError:
-        print("Default header size: {}".format(1 << 24))
+        data_list = []
+        data_bytes = 0
+        start_time = time.time()
+        for task_id in task_ids:
+            for data in mr_api.mindrecord_dict_data(task_id):
+                data_list.append(data)
+                data_bytes += sum(len(value) for value in data.values() if isinstance(value, bytes))
+                if len(data_list) == args.mindrecord_batch_size:
+                    stats['read_time'] += time.time() - start_time
+                    if not _put(batch_queue, (data_list, data_bytes), stop):
+                        return
+                    data_list = []
+                    data_bytes = 0
+                    start_time = time.time()
+        stats['read_time'] += time.time() - start_time
+        if data_list and not _put(batch_queue, (data_list, data_bytes), stop):
+            return
+        _put(batch_queue, None, stop)
+    except Exception as e:  # pylint: disable=broad-except
+        _put(batch_queue, e, stop)
+
+
+def _exec_shard(shard_id, task_ids, parallel_writer=True):
+    """
+    Write the tasks of a shard, reading in a thread and encoding in the calling process
+    """
+    start_time = time.time()
+    file_name = _shard_file(shard_id)
+    _remove_shard(file_name)
+    writer = _create_writer(file_name)
+    writer.open_and_set_header()
 
-    # set the page size
+    stats = {'shard_id': shard_id, 'tasks': task_ids, 'file': file_name, 'rows': 0, 'bytes': 0,
+             'read_time': 0., 'write_time': 0.}
+    batch_queue = queue.Queue(maxsize=args.mindrecord_queue_size)
+    stop = threading.Event()
+    reader = threading.Thread(target=_read_tasks, args=(task_ids, batch_queue, stop, stats), daemon=True)
+    reader.start()
     try:
-        page_size = mr_api.mindrecord_page_size
-        writer.set_page_size(page_size)
-    except AttributeError:
-        print("Default page size: {}".format(1 << 25))
+        while True:
+            item = batch_queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            data_list, data_bytes = item
+            write_start = time.time()
+            writer.write_raw_data(data_list, parallel_writer=parallel_writer)
+            stats['write_time'] += time.time() - write_start
+            stats['rows'] += len(data_list)
+            stats['bytes'] += data_bytes
+    finally:
+        # on an error of the writer, the reader blocked on the full queue stops at its next put
+        stop.set()
+        reader.join()
+    writer.commit()
+    stats['total_time'] = time.time() - start_time
+    return stats
 
-    # get schema
-    try:
-        mindrecord_schema = mr_api.mindrecord_schema
-    except AttributeError:
-        raise RuntimeError("mindrecord_schema is not defined in mr_api.py.")
 
-    # create the schema
-    writer.add_schema(mindrecord_schema, "mindrecord_schema")
+def _exec_shard_in_pool(shard):
+    return _exec_shard(*shard, parallel_writer=True)
 
-    # add the index
-    try:
-        index_fields = mr_api.mindrecord_index_fields
-        writer.add_index(index_fields)
-    except AttributeError:
-        print("Default index fields: all simple fields are indexes.")
 
-    writer.open_and_set_header()
+def _rate(count, seconds):
+    return count / seconds if seconds > 0 else 0.
 
-    task_list = list(range(num_tasks))
 
-    # set number of workers
-    num_workers = args.mindrecord_workers
+def _load_manifest(manifest_file, shard_tasks):
+    """
+    Load the committed shards holding the same tasks as now, a line cut by a crash is ignored
+    """
+    done = {}
+    if not os.path.exists(manifest_file):
+        return done
+    with open(manifest_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                continue
+            shard_id = record.get('shard_id', -1)
+            if not 0 <= shard_id < len(shard_tasks) or record.get('tasks') != shard_tasks[shard_id]:
+                continue
+            if os.path.exists(record['file']) and os.path.exists(record['file'] + ".db"):
+                done[shard_id] = record
+    return done
+
+
+def _print_stats(stats):
+    print("shard {} done: {} records, {:.1f} MB, read {:.1f} records/s {:.1f} MB/s, "
+          "write {:.1f} records/s {:.1f} MB/s, total {:.1f}s".format(
+              stats['shard_id'], stats['rows'], stats['bytes'] / MB,
+              _rate(stats['rows'], stats['read_time']), _rate(stats['bytes'] / MB, stats['read_time']),
+              _rate(stats['rows'], stats['write_time']), _rate(stats['bytes'] / MB, stats['write_time']),
+              stats['total_time']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mind record writer')
+    parser.add_argument('--mindrecord_script', type=str, default="template",
+                        help='path where script is saved')
 
+    parser.add_argument('--mindrecord_file', type=str, default="/tmp/mindrecord",
+                        help='written file name prefix')
+
+    parser.add_argument('--mindrecord_workers', type=int, default=8,
+                        help='number of parallel workers')
+
+    parser.add_argument('--mindrecord_shards', type=int, default=32,
+                        help='maximum number of written files, every file holds one or more tasks')
+
+    parser.add_argument('--mindrecord_batch_size', type=int, default=2048,
+                        help='number of records written at once')
+
+    parser.add_argument('--mindrecord_queue_size', type=int, default=4,
+                        help='number of read batches buffered for every worker')
+
+    parser.add_argument('--mindrecord_resume', type=int, default=1,
+                        help='1 to skip the shards recorded in the manifest, 0 to write all shards again')
+
+    args, other_args = parser.parse_known_args()
+
+    print(args)
+    print(other_args)
+
+    _init_worker(args, other_args)
+
+    num_tasks = mr_api.mindrecord_task_number()
     if num_tasks < 1:
         num_tasks = 1
 
-    if num_workers > num_tasks:
-        num_workers = num_tasks
-
-    if os.name == 'nt':
-        for window_task_id in task_list:
-            _exec_task(window_task_id, False)
-    elif num_tasks > 1:
-        with Pool(num_workers) as p:
-            p.map(_exec_task, task_list)
-    else:
-        _exec_task(0, False)
+    output_dir = os.path.dirname(os.path.abspath(args.mindrecord_file))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    manifest_file = args.mindrecord_file + "_manifest.jsonl"
+    if not args.mindrecord_resume and os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    num_shards = max(min(args.mindrecord_shards, num_tasks), 1)
+    tasks_of_shards = _shard_tasks(num_tasks, num_shards)
+    done_shards = _load_manifest(manifest_file, tasks_of_shards)
+    shard_list = [(shard_id, task_ids) for shard_id, task_ids in enumerate(tasks_of_shards)
+                  if shard_id not in done_shards]
+    print("Write mindrecord: {} tasks in {} shards, {} already in {}".format(
+        num_tasks, num_shards, len(done_shards), manifest_file))
 
-    ret = writer.commit()
+    # set number of workers
+    num_workers = min(args.mindrecord_workers, max(len(shard_list), 1))
 
-    os.remove("{}".format("mr_argument.pickle"))
+    start_time = time.time()
+    total = {'rows': 0, 'bytes': 0, 'read_time': 0., 'write_time': 0.}
+    with open(manifest_file, 'a') as manifest:
+        def _commit(shard_stats):
+            _print_stats(shard_stats)
+            manifest.write(json.dumps({'shard_id': shard_stats['shard_id'], 'tasks': shard_stats['tasks'],
+                                       'file': shard_stats['file'], 'rows': shard_stats['rows'],
+                                       'bytes': shard_stats['bytes']}) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            for key in total:
+                total[key] += shard_stats[key]
+
+        if os.name == 'nt' or num_workers == 1:
+            for pending in shard_list:
+                _commit(_exec_shard(*pending, parallel_writer=False))
+        else:
+            with Pool(num_workers, initializer=_init_worker, initargs=(args, other_args)) as p:
+                for result in p.imap_unordered(_exec_shard_in_pool, shard_list):
+                    _commit(result)
 
     end_time = time.time()
+    elapsed = end_time - start_time
     print("--------------------------------------------")
+    print("Records: {}, {:.1f} MB, {:.1f} records/s, {:.1f} MB/s".format(
+        total['rows'], total['bytes'] / MB, _rate(total['rows'], elapsed), _rate(total['bytes'] / MB, elapsed)))
+    print("Per worker, read: {:.1f} records/s {:.1f} MB/s, write: {:.1f} records/s {:.1f} MB/s".format(
+        _rate(total['rows'], total['read_time']), _rate(total['bytes'] / MB, total['read_time']),
+        _rate(total['rows'], total['write_time']), _rate(total['bytes'] / MB, total['write_time'])))
+    print("Shards are listed in {}".format(manifest_file))
     print("END. Total time: {}".format(end_time - start_time))
     print("--------------------------------------------")
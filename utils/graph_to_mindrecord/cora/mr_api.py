@@ -15,6 +15,7 @@
 """
 User-defined API for MindRecord GNN writer.
 """
+import itertools
 import os
 
 import pickle as pkl
@@ -31,6 +32,9 @@ dataset_str = 'cora'
 node_profile = (2, ["float32", "int32"], [[-1], [-1]])
 edge_profile = (0, [], [])
 
+# rows per chunk of the columnar api
+CHUNK_SIZE = 1 << 16
+
 
 def _normalize_cora_features(features):
     row_sum = np.array(features.sum(1))
@@ -49,15 +53,8 @@ def _parse_index_file(filename):
     return index
 
 
-def yield_nodes(task_id=0):
-    """
-    Generate node data
-
-    Yields:
-        data (dict): data row which is dict.
-    """
-    print("Node task is {}".format(task_id))
-
+def _load_nodes():
+    """Load normalized features and label ids of all nodes."""
     names = ['tx', 'ty', 'allx', 'ally']
     objects = []
     for name in names:
@@ -75,11 +72,34 @@ def yield_nodes(task_id=0):
 
     labels = np.vstack((ally, ty))
     labels[test_idx_reorder, :] = labels[test_idx_range, :]
+    # position of the first 1 in every one-hot label
+    return features, np.argmax(labels == 1, axis=1)
+
+
+def _load_edges():
+    """Load source and destination ids of all edges, in the order of the graph dict."""
+    with open("{}/ind.{}.graph".format(CORA_PATH, dataset_str), 'rb') as f:
+        graph = pkl.load(f, encoding='latin1')
+    src_ids = np.repeat(np.fromiter(graph.keys(), dtype=np.int64, count=len(graph)),
+                        [len(dst_ids) for dst_ids in graph.values()])
+    dst_ids = np.fromiter(itertools.chain.from_iterable(graph.values()), dtype=np.int64, count=src_ids.size)
+    return src_ids, dst_ids
+
+
+def yield_nodes(task_id=0):
+    """
+    Generate node data
+
+    Yields:
+        data (dict): data row which is dict.
+    """
+    print("Node task is {}".format(task_id))
+    features, labels = _load_nodes()
 
     line_count = 0
-    for i, label in enumerate(labels):
+    for i, label in enumerate(labels.tolist()):
         node = {'id': i, 'type': 0, 'feature_1': features[i].tolist(),
-                'feature_2': label.tolist().index(1)}
+                'feature_2': label}
         line_count += 1
         yield node
     print('Processed {} lines for nodes.'.format(line_count))
@@ -93,13 +113,43 @@ def yield_edges(task_id=0):
         data (dict): data row which is dict.
     """
     print("Edge task is {}".format(task_id))
-    with open("{}/ind.{}.graph".format(CORA_PATH, dataset_str), 'rb') as f:
-        graph = pkl.load(f, encoding='latin1')
-        line_count = 0
-        for i in graph:
-            for dst_id in graph[i]:
-                edge = {'id': line_count,
-                        'src_id': i, 'dst_id': dst_id, 'type': 0}
-                line_count += 1
-                yield edge
-        print('Processed {} lines for edges.'.format(line_count))
+    src_ids, dst_ids = _load_edges()
+    line_count = 0
+    for src_id, dst_id in zip(src_ids.tolist(), dst_ids.tolist()):
+        edge = {'id': line_count,
+                'src_id': src_id, 'dst_id': dst_id, 'type': 0}
+        line_count += 1
+        yield edge
+    print('Processed {} lines for edges.'.format(line_count))
+
+
+def yield_node_chunks(task_id=0, num_tasks=1):
+    """
+    Generate node data in columns, task_id handles its contiguous part of the nodes
+
+    Yields:
+        data (dict): columns of CHUNK_SIZE nodes at most.
+    """
+    print("Node task is {}".format(task_id))
+    features, labels = _load_nodes()
+    task_ids = np.array_split(np.arange(labels.shape[0]), num_tasks)[task_id]
+    for start in range(0, task_ids.size, CHUNK_SIZE):
+        ids = task_ids[start:start + CHUNK_SIZE]
+        yield {'id': ids, 'type': 0, 'feature_1': features[ids], 'feature_2': labels[ids]}
+    print('Processed {} lines for nodes.'.format(task_ids.size))
+
+
+def yield_edge_chunks(task_id=0, num_tasks=1):
+    """
+    Generate edge data in columns, task_id handles its contiguous part of the edges
+
+    Yields:
+        data (dict): columns of CHUNK_SIZE edges at most.
+    """
+    print("Edge task is {}".format(task_id))
+    src_ids, dst_ids = _load_edges()
+    task_ids = np.array_split(np.arange(src_ids.size), num_tasks)[task_id]
+    for start in range(0, task_ids.size, CHUNK_SIZE):
+        ids = task_ids[start:start + CHUNK_SIZE]
+        yield {'id': ids, 'src_id': src_ids[ids], 'dst_id': dst_ids[ids], 'type': 0}
+    print('Processed {} lines for edges.'.format(task_ids.size))
@@ -162,3 +162,82 @@ class GraphMapSchema:
             graph_field_type = self.union_schema_in_mindrecord[graph_field_key]["type"]
             edge_graph[graph_field_key] = np.array([0], dtype=graph_field_type)
         return edge_graph
+
+    def _transform_chunk(self, chunk, columns, fixed, own_kind, own_count, other_kind, other_count):
+        """
+        Build union format rows from a chunk of columns.
+
+        Fields shared by every row (missing features, feature indexes) are created once and referenced
+        by all rows, the others are converted with one numpy call per column.
+        """
+        num_rows = len(columns["first_id"])
+        fixed["weight"] = 1.0
+        columns["type"] = np.broadcast_to(np.asarray(chunk["type"], dtype="int32"), [num_rows]).tolist()
+        if "weight" in chunk:
+            columns["weight"] = np.broadcast_to(np.asarray(chunk["weight"], dtype="float32"), [num_rows]).tolist()
+
+        feature_index = []
+        for i in range(own_count):
+            k = i + 1
+            chunk_field_key = 'feature_' + str(k)
+            graph_field_key = own_kind + '_feature_' + str(k)
+            graph_field_type = self.union_schema_in_mindrecord[graph_field_key]["type"]
+            if chunk_field_key in chunk:
+                feature_index.append(k)
+                feature = np.asarray(chunk[chunk_field_key], dtype=graph_field_type)
+                columns[graph_field_key] = list(np.reshape(feature, [num_rows, -1]))
+            else:
+                fixed[graph_field_key] = np.reshape(np.array([0], dtype=graph_field_type), [-1])
+        fixed[own_kind + "_feature_index"] = np.array(feature_index if feature_index else [-1], dtype="int32")
+
+        fixed[other_kind + "_feature_index"] = np.array([-1], dtype="int32")
+        for i in range(other_count):
+            graph_field_key = other_kind + '_feature_' + str(i + 1)
+            graph_field_type = self.union_schema_in_mindrecord[graph_field_key]["type"]
+            fixed[graph_field_key] = np.array([0], dtype=graph_field_type)
+
+        keys = list(columns)
+        rows = []
+        for values in zip(*columns.values()):
+            row = dict(fixed)
+            row.update(zip(keys, values))
+            rows.append(row)
+        return rows
+
+    def transform_nodes(self, nodes):
+        """
+        Executes transformation from a chunk of node columns to union format, same as transform_node per row.
+        Args:
+            nodes(dict): 'id' array of shape [N], 'type' and 'weight' arrays of shape [N] or scalars,
+                'feature_k' arrays of shape [N, ...]
+        Returns:
+            list of graph data with union schema
+        """
+        if nodes is None:
+            logger.info("nodes cannot be None.")
+            raise ValueError("nodes cannot be None.")
+
+        columns = {"first_id": np.reshape(np.asarray(nodes["id"], dtype="int64"), [-1]).tolist()}
+        fixed = {"second_id": 0, "third_id": 0, "attribute": 'n'}
+        return self._transform_chunk(nodes, columns, fixed, 'node', self.num_node_features,
+                                     'edge', self.num_edge_features)
+
+    def transform_edges(self, edges):
+        """
+        Executes transformation from a chunk of edge columns to union format, same as transform_edge per row.
+        Args:
+            edges(dict): 'id', 'src_id' and 'dst_id' arrays of shape [N], 'type' and 'weight' arrays of
+                shape [N] or scalars, 'feature_k' arrays of shape [N, ...]
+        Returns:
+            list of graph data with union schema
+        """
+        if edges is None:
+            logger.info("edges cannot be None.")
+            raise ValueError("edges cannot be None.")
+
+        columns = {"first_id": np.reshape(np.asarray(edges["id"], dtype="int64"), [-1]).tolist(),
+                   "second_id": np.reshape(np.asarray(edges["src_id"], dtype="int64"), [-1]).tolist(),
+                   "third_id": np.reshape(np.asarray(edges["dst_id"], dtype="int64"), [-1]).tolist()}
+        fixed = {"attribute": 'e'}
+        return self._transform_chunk(edges, columns, fixed, 'edge', self.num_edge_features,
+                                     'node', self.num_node_features)
@@ -82,3 +82,32 @@ def yield_edges(task_id=0):
             'dst_id': undirected_edge[0],
             'type': 1}
         yield edge
+
+
+def yield_node_chunks(task_id=0, num_tasks=1):
+    """
+    Generate node data in columns, task_id handles its contiguous part of the nodes
+
+    Yields:
+        data (dict): columns of the nodes.
+    """
+    print("Node task is {}".format(task_id))
+    node_ids = np.array_split(np.unique(social_data), num_tasks)[task_id]
+    yield {'id': node_ids, 'type': 1,
+           'feature_1': np.ones((node_ids.size, 5), dtype=np.int64),
+           'feature_2': np.ones((node_ids.size, 10), dtype=np.int32)}
+
+
+def yield_edge_chunks(task_id=0, num_tasks=1):
+    """
+    Generate edge data in columns, task_id handles its contiguous part of the edges
+
+    Yields:
+        data (dict): columns of the edges, both directions of every undirected edge.
+    """
+    print("Edge task is {}".format(task_id))
+    undirected_edges = np.array(social_data, dtype=np.int64)
+    src_ids = undirected_edges.reshape(-1)
+    dst_ids = undirected_edges[:, ::-1].reshape(-1)
+    task_ids = np.array_split(np.arange(src_ids.size), num_tasks)[task_id]
+    yield {'id': task_ids + 1, 'src_id': src_ids[task_ids], 'dst_id': dst_ids[task_ids], 'type': 1}
@@ -26,12 +26,23 @@ from multiprocessing import Pool
 from mindspore.mindrecord import FileWriter
 from graph_map_schema import GraphMapSchema
 
+# set by the main script before the node and the edge tasks run, and inherited by the forked workers
+args = None
+writer = None
+graph_map_schema = None
+mindrecord_dict_data = None
+mindrecord_chunk_data = None
+mindrecord_num_tasks = 1
+
 
 def exec_task(task_id, parallel_writer=True):
     """
     Execute task with specified task id
     """
     print("exec task {}, parallel: {} ...".format(task_id, parallel_writer))
+    if mindrecord_chunk_data is not None:
+        exec_chunk_task(task_id, parallel_writer)
+        return
     imagenet_iter = mindrecord_dict_data(task_id)
     batch_size = 512
     transform_count = 0
@@ -55,6 +66,23 @@ def exec_task(task_id, parallel_writer=True):
             break
 
 
+def exec_chunk_task(task_id, parallel_writer=True):
+    """
+    Execute task with specified task id on the columnar api, each chunk is transformed at once
+    """
+    batch_size = args.mindrecord_batch_size
+    transform_count = 0
+    for chunk in mindrecord_chunk_data(task_id, mindrecord_num_tasks):
+        if 'dst_id' in chunk:
+            data_list = graph_map_schema.transform_edges(chunk)
+        else:
+            data_list = graph_map_schema.transform_nodes(chunk)
+        for start in range(0, len(data_list), batch_size):
+            writer.write_raw_data(data_list[start:start + batch_size], parallel_writer=parallel_writer)
+        transform_count += len(data_list)
+        print("task {} transformed {} record...".format(task_id, transform_count))
+
+
 def read_args():
     """
     read args
@@ -78,6 +106,9 @@ def read_args():
     parser.add_argument('--mindrecord_workers', type=int, default=8,
                         help='number of parallel workers')
 
+    parser.add_argument('--mindrecord_batch_size', type=int, default=4096,
+                        help='number of records written at once by the columnar api')
+
     parser.add_argument('--num_node_tasks', type=int, default=1,
                         help='number of node tasks')
 
@@ -168,12 +199,16 @@ if __name__ == "__main__":
     # init writer
     writer = init_writer(graph_schema)
 
-    # write nodes data
-    mindrecord_dict_data = mr_api.yield_nodes
+    # write nodes data, the columnar api is used if mr_api provides it
+    mindrecord_dict_data = getattr(mr_api, 'yield_nodes', None)
+    mindrecord_chunk_data = getattr(mr_api, 'yield_node_chunks', None)
+    mindrecord_num_tasks = args.num_node_tasks
     run_parallel_workers(args.num_node_tasks)
 
-    # write edges data
-    mindrecord_dict_data = mr_api.yield_edges
+    # write edges data, the tasks split the input only, all of them write to the same writer
+    mindrecord_dict_data = getattr(mr_api, 'yield_edges', None)
+    mindrecord_chunk_data = getattr(mr_api, 'yield_edge_chunks', None)
+    mindrecord_num_tasks = args.num_edge_tasks
     run_parallel_workers(args.num_edge_tasks)
 
     # writer wrap up